@@ -1,6 +1,5 @@
 import time as ttime
 from datetime import datetime, date, time
-import csv
 
 from django.contrib.auth.models import User
 from django.core.files.storage import default_storage
@@ -11,6 +10,17 @@ from tendenci.apps.articles.models import Article
 from tendenci.apps.emails.models import Email
 from tendenci.apps.site_settings.utils import get_setting
 from tendenci.apps.base.utils import escape_csv
+from tendenci.apps.exports.utils import ExportPlan, write_csv
+
+
+def format_export_value(field_name, item):
+    if isinstance(item, datetime):
+        return item.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(item, date):
+        return item.strftime('%Y-%m-%d')
+    elif isinstance(item, time):
+        return item.strftime('%H:%M:%S')
+    return escape_csv(item)
 
 
 def process_export(identifier, user_id):
@@ -44,25 +54,9 @@ def process_export(identifier, user_id):
     file_name_temp = 'export/articles/%s_temp.csv' % (identifier)
 
     with default_storage.open(file_name_temp, 'w') as csvfile:
-        csv_writer = csv.DictWriter(csvfile, fieldnames=field_list)
-
         articles = Article.objects.filter(status_detail='active')
-
-        for article in articles:
-            row_dict = {}
-            for field_name in field_list:
-                item = getattr(article, field_name)
-
-                if isinstance(item, datetime):
-                    item = item.strftime('%Y-%m-%d %H:%M:%S')
-                elif isinstance(item, date):
-                    item = item.strftime('%Y-%m-%d')
-                elif isinstance(item, time):
-                    item = item.strftime('%H:%M:%S')
-                else:
-                    item = escape_csv(item)
-                row_dict[field_name] = item
-            csv_writer.writerow(row_dict)
+        plan = ExportPlan(Article, field_list, formatter=format_export_value)
+        write_csv(csvfile, None, plan.rows(articles))
 
     # rename the file name
     file_name = 'export/articles/%s.csv' % identifier
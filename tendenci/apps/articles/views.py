@@ -13,7 +13,7 @@ from django.contrib import messages
 from django.db.models import Q, Count
 from django.shortcuts import get_object_or_404, Http404
 
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, FileResponse
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.utils.translation import gettext_lazy as _
@@ -471,7 +471,7 @@ def export_download(request, identifier):
     if not default_storage.exists(file_path):
         raise Http404
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="articles_export_%s"' % file_name
-    response.content = default_storage.open(file_path).read()
-    return response
+    return FileResponse(default_storage.open(file_path, 'rb'),
+                        as_attachment=True,
+                        filename='articles_export_%s' % file_name,
+                        content_type='text/csv')
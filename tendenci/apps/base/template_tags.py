@@ -220,8 +220,6 @@ class ListNode(Node):
         else:
             filters = get_query_filters(user, self.perms)
             items = self.model.objects.filter(filters)
-            if user.is_authenticated:
-                items = items.distinct()
 
             if tags:  # tags is a comma delimited list
                 tag_query = reduce(or_, self.build_tag_queries(tags))
@@ -10,37 +10,61 @@ class Command(BaseCommand):
 
     Usage: python manage.py clean_corporate_memberships
     """
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=500,
+            help='Number of individual memberships expired per transaction')
+
+    def handle(self, *args, **options):
         from datetime import datetime
         from dateutil.relativedelta import relativedelta
+        from django.db.models import Q
         from tendenci.apps.corporate_memberships.models import (
-                            CorpMembership, CorporateMembershipType)
+                            CorpMembership, CorpProfile, CorporateMembershipType)
+        from tendenci.apps.directories.models import Directory
         from tendenci.apps.memberships.models import MembershipDefault
+        from tendenci.apps.memberships.expiry import expire_memberships
+        from tendenci.apps.search.utils import enqueue_items
 
         [admin] = User.objects.filter(is_superuser=True).order_by('id')[:1] or [None]
-        for corp_membership_type in CorporateMembershipType.objects.all():
-            membership_type = corp_membership_type.membership_type
-            grace_period = membership_type.expiration_grace_period
-            date_to_expire = datetime.now() - relativedelta(days=grace_period)
-
-            corp_memberships = CorpMembership.objects.filter(
-                corporate_membership_type=corp_membership_type,
-                expiration_dt__lt=date_to_expire,
-                status_detail='active',
-                status=True)
-            for corp_membership in corp_memberships:
-                corp_membership.status_detail = 'expired'
-                corp_membership.save()
-
-                # Check directory and set to inactive
-                corp_profile = corp_membership.corp_profile
-                if corp_profile.directory:
-                    corp_profile.directory.status_detail = 'inactive'
-                    corp_profile.directory.save()
-
-                # individual memberships under this corporate
-                memberships = MembershipDefault.objects.filter(
-                            corporate_membership_id=corp_membership.id
-                                )
-                for membership in memberships:
-                    membership.expire(admin)
+        now = datetime.now()
+        expired_q = Q()
+        for corp_membership_type_id, grace_period in CorporateMembershipType.objects.values_list(
+                'pk', 'membership_type__expiration_grace_period'):
+            expired_q |= Q(corporate_membership_type_id=corp_membership_type_id,
+                           expiration_dt__lt=now - relativedelta(days=grace_period or 0))
+        if not expired_q:
+            return
+
+        corp_memberships = CorpMembership.objects.filter(
+            expired_q, status_detail='active', status=True)
+        corp_ids = list(corp_memberships.values_list('pk', flat=True))
+        corp_profile_ids = set(corp_memberships.values_list('corp_profile_id', flat=True))
+        if not corp_ids:
+            return
+
+        CorpMembership.objects.filter(pk__in=corp_ids).update(status_detail='expired')
+        enqueue_items(CorpMembership, corp_ids)
+
+        # Check directory and set to inactive
+        directory_ids = list(CorpProfile.objects.filter(
+            pk__in=corp_profile_ids, directory__isnull=False).values_list('directory_id', flat=True))
+        Directory.objects.filter(pk__in=directory_ids).update(status_detail='inactive')
+        enqueue_items(Directory, directory_ids)
+
+        # the status change of a corporate membership syncs
+        # the groups of its representatives
+        for corp_profile in CorpProfile.objects.filter(pk__in=corp_profile_ids):
+            corp_profile.sync_type_reps_groups()
+
+        # individual memberships under these corporates
+        memberships = MembershipDefault.objects.filter(corporate_membership_id__in=corp_ids)
+        # expired the way MembershipDefault.expire does, which
+        # leaves the directories of the members alone
+        report = expire_memberships(memberships, request_user=admin, action_taken=True,
+                                    deactivate_directories=False,
+                                    batch_size=options['batch_size'])
+
+        if options['verbosity'] > 0:
+            print('%s corporate memberships expired.' % len(corp_ids))
+            print('%(expired)s memberships expired, %(groups_removed)s group memberships removed, '
+                  '%(directories)s directories deactivated, %(profiles)s profiles updated.' % report)
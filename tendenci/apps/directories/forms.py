@@ -76,6 +76,8 @@ class DirectorySearchForm(FormControlWidgetMixin, forms.Form):
     q = forms.CharField(required=False)
     search_method = forms.ChoiceField(choices=SEARCH_METHOD_CHOICES,
                                         required=False, initial='exact')
+    near = forms.CharField(label=_('Near'), max_length=100, required=False)
+    radius = forms.IntegerField(label=_('Within (miles)'), min_value=1, required=False)
 
     def __init__(self, *args, **kwargs):
         is_superuser = kwargs.pop('is_superuser', None)
@@ -3,7 +3,6 @@ from datetime import datetime, date, time
 from io import BytesIO
 from PIL import Image
 import time as ttime
-import csv
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
@@ -21,6 +20,7 @@ from tendenci.apps.payments.models import Payment
 from tendenci.apps.site_settings.utils import get_setting
 from tendenci.libs.storage import get_default_storage
 from tendenci.apps.base.utils import escape_csv
+from tendenci.apps.exports.utils import ExportPlan, write_csv
 
 
 def resize_s3_image(image_path, width=200, height=200):
@@ -166,6 +166,24 @@ def is_free_listing(user, pricing_id, list_type):
     return False
 
 
+def format_export_value(field_name, item):
+    if item is None:
+        item = ''
+    if item:
+        if isinstance(item, datetime):
+            item = item.strftime('%Y-%m-%d %H:%M:%S')
+        elif isinstance(item, date):
+            item = item.strftime('%Y-%m-%d')
+        elif isinstance(item, time):
+            item = item.strftime('%H:%M:%S')
+        elif field_name == 'invoice':
+            # display total vs balance
+            item = 'Total: %d / Balance: %d' % (item.total, item.balance)
+        elif isinstance(item, str):
+            item = escape_csv(item)
+    return item
+
+
 def process_export(export_fields='all_fields', export_status_detail='',
                    identifier=u'', user_id=0):
     from tendenci.apps.perms.models import TendenciBaseModel
@@ -221,31 +239,11 @@ def process_export(export_fields='all_fields', export_status_detail='',
     file_name_temp = 'export/directories/%s_temp.csv' % identifier
 
     with default_storage.open(file_name_temp, 'w') as csvfile:
-        csv_writer = csv.DictWriter(csvfile, fieldnames=field_list)
-        csv_writer.writeheader()
         directories = Directory.objects.all()
         if export_status_detail:
             directories = directories.filter(status_detail__icontains=export_status_detail)
-        for directory in directories:
-            row_dict = {}
-            for field_name in field_list:
-                item = getattr(directory, field_name)
-                if item is None:
-                    item = ''
-                if item:
-                    if isinstance(item, datetime):
-                        item = item.strftime('%Y-%m-%d %H:%M:%S')
-                    elif isinstance(item, date):
-                        item = item.strftime('%Y-%m-%d')
-                    elif isinstance(item, time):
-                        item = item.strftime('%H:%M:%S')
-                    elif field_name == 'invoice':
-                        # display total vs balance
-                        item = 'Total: %d / Balance: %d' % (item.total, item.balance)
-                    elif isinstance(item, str):
-                        item = escape_csv(item)
-                row_dict[field_name] = item
-            csv_writer.writerow(row_dict)
+        plan = ExportPlan(Directory, field_list, formatter=format_export_value)
+        write_csv(csvfile, field_list, plan.rows(directories))
 
     # rename the file name
     file_name = 'export/directories/%s.csv' % identifier
@@ -6,7 +6,7 @@ import json
 
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponseRedirect, HttpResponse, Http404
+from django.http import HttpResponseRedirect, HttpResponse, Http404, FileResponse
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.urls import reverse
@@ -38,6 +38,7 @@ from tendenci.apps.directories.forms import (DirectoryForm, DirectoryPricingForm
 from tendenci.apps.directories.utils import directory_set_inv_payment, is_free_listing
 from tendenci.apps.notifications import models as notification
 from tendenci.apps.directories.forms import DirectorySearchForm
+from tendenci.apps.locations.geo import filter_by_radius
 
 
 @is_enabled('directories')
@@ -113,6 +114,11 @@ def search(request, my_directories_only=False, template_name="directories/search
         if region:
             directories = directories.filter(region=region)
 
+        near = form.cleaned_data.get('near')
+        radius = form.cleaned_data.get('radius')
+        if near and radius:
+            directories = filter_by_radius(directories, 'zip_code', near, radius)
+
         if query and 'tag:' in query:
             tag = query.strip('tag:')
             directories = directories.filter(tags__icontains=tag)
@@ -753,7 +759,7 @@ def directory_export_download(request, identifier):
     if not default_storage.exists(file_path):
         raise Http404
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="directory_export_%s"' % file_name
-    response.content = default_storage.open(file_path).read()
-    return response
+    return FileResponse(default_storage.open(file_path, 'rb'),
+                        as_attachment=True,
+                        filename='directory_export_%s' % file_name,
+                        content_type='text/csv')
@@ -0,0 +1,69 @@
+import time
+import atexit
+import logging
+from threading import Lock
+
+from django.conf import settings
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+class EventLogBuffer(object):
+    """
+    Bounded in-process buffer for event log rows.
+
+    Rows are written with a single ``bulk_create`` when the buffer is full,
+    when ``flush_interval`` seconds have passed since the last flush, or
+    when ``flush()`` is called explicitly (the ``EventLogMiddleware`` does
+    so at the end of every request).
+    """
+    def __init__(self, max_size=100, flush_interval=5):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._lock = Lock()
+        self._last_flush = time.monotonic()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, event_log):
+        with self._lock:
+            self._rows.append(event_log)
+            should_flush = (len(self._rows) >= self.max_size or
+                            time.monotonic() - self._last_flush >= self.flush_interval)
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._last_flush = time.monotonic()
+        if not rows:
+            return 0
+
+        model = rows[0].__class__
+        try:
+            model.objects.bulk_create(rows, batch_size=self.max_size)
+        except DatabaseError as e:
+            # keep what fits back in the buffer so a transient db error
+            # doesn't lose the batch, but never grow past max_size
+            logger.error('Unable to flush %s event logs: %s' % (len(rows), e))
+            with self._lock:
+                self._rows = (rows + self._rows)[-self.max_size:]
+            return 0
+        return len(rows)
+
+
+event_log_buffer = EventLogBuffer(
+    max_size=getattr(settings, 'EVENT_LOG_BUFFER_SIZE', 100),
+    flush_interval=getattr(settings, 'EVENT_LOG_FLUSH_INTERVAL', 5))
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        event_log_buffer.flush()
+    except Exception:
+        pass
@@ -0,0 +1,67 @@
+import time
+import inspect
+from socket import gethostbyname, gethostname
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+
+class Command(BaseCommand):
+    """
+    Measures the per-call cost of EventLog.objects.log.
+
+    Three paths are timed against the same request:
+        legacy   - the old per-call overhead (inspect.stack() and a
+                   hostname lookup) followed by a synchronous INSERT
+        sync     - the current path with defer=False
+        buffered - the current path with rows written by bulk_create
+
+    Everything runs inside a transaction that is rolled back.
+
+    Usage:
+        python manage.py benchmark_event_log --calls 1000
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--calls',
+            type=int,
+            dest='calls',
+            default=1000,
+            help='Number of event logs to write per path')
+
+    def handle(self, *args, **options):
+        from django.contrib.auth.models import AnonymousUser
+        from tendenci.apps.event_logs.models import EventLog
+        from tendenci.apps.event_logs.buffer import event_log_buffer
+
+        calls = options['calls']
+        request = RequestFactory().get('/benchmark/', HTTP_USER_AGENT='Mozilla/5.0',
+                                       REMOTE_ADDR='127.0.0.1')
+        request.user = AnonymousUser()
+        log_kwargs = {'request': request, 'application': 'event_logs', 'action': 'benchmark'}
+
+        def legacy():
+            inspect.stack()
+            gethostbyname(gethostname())
+            EventLog.objects.log(defer=False, **log_kwargs)
+
+        def sync():
+            EventLog.objects.log(defer=False, **log_kwargs)
+
+        def buffered():
+            EventLog.objects.log(defer=True, **log_kwargs)
+
+        results = []
+        with transaction.atomic():
+            for name, func in (('legacy', legacy), ('sync', sync), ('buffered', buffered)):
+                start = time.perf_counter()
+                for i in range(calls):
+                    func()
+                event_log_buffer.flush()
+                elapsed = time.perf_counter() - start
+                results.append((name, elapsed))
+            transaction.set_rollback(True)
+
+        for name, elapsed in results:
+            self.stdout.write('%-10s %8.3fs total %10.1f us/call' % (
+                name, elapsed, elapsed * 1000000 / calls))
@@ -8,15 +8,22 @@ class Command(BaseCommand):
     then delete all event_logs_eventlog records older than 
     'KEEP_EVENT_LOG_FOR_DAYS' days
 
+    When the table is partitioned, the monthly partitions that are entirely
+    older than the cutoff are dropped, and only the rows of the partition
+    straddling the cutoff are deleted.
+
     Usage: python manage.py prune_event_log_records
     """
 
     def handle(self, *args, **options):
         from tendenci.apps.event_logs.models import EventLog
+        from tendenci.apps.event_logs.partitions import drop_partitions_before
         from datetime import datetime, timedelta
 
         if settings.KEEP_EVENT_LOG_FOR_DAYS > 0:
             cutoff_date = datetime.now() - timedelta(days = settings.KEEP_EVENT_LOG_FOR_DAYS)
+            for name in drop_partitions_before(cutoff_date):
+                print("Dropped EventLog partition {}".format(name))
             deleted_count = EventLog.objects.filter(create_dt__lte=cutoff_date).delete()[0]
             if deleted_count > 0:
                 print("{} EventLog records were deleted as they were older than {}".format(deleted_count, cutoff_date.strftime("%d %b %Y %H:%M:%S")))
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Summarizes the event logs of each complete day that hasn't been
+    summarized yet into EventLogDailySummary, and creates the upcoming
+    monthly partitions of the event log table. Meant to run nightly.
+
+    Usage:
+        python manage.py update_event_log_summaries
+
+        to rebuild the summaries of a date range:
+        python manage.py update_event_log_summaries --start 2024-01-01
+                                                    --end 2024-12-31
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--start',
+            dest='start',
+            default='',
+            help='First day to summarize (YYYY-MM-DD)')
+        parser.add_argument('--end',
+            dest='end',
+            default='',
+            help='Last day to summarize (YYYY-MM-DD), yesterday by default')
+        parser.add_argument('--months-ahead',
+            type=int,
+            dest='months_ahead',
+            default=3,
+            help='Number of monthly partitions to keep ahead of the current month')
+
+    def handle(self, *args, **options):
+        from tendenci.apps.event_logs.models import EventLogDailySummary
+        from tendenci.apps.event_logs.partitions import ensure_partitions
+
+        verbosity = int(options.get('verbosity', 1))
+
+        for name in ensure_partitions(months_ahead=options['months_ahead']):
+            if verbosity > 1:
+                print('Created partition %s' % name)
+
+        start_day = end_day = None
+        if options['start']:
+            start_day = datetime.strptime(options['start'], '%Y-%m-%d').date()
+        if options['end']:
+            end_day = datetime.strptime(options['end'], '%Y-%m-%d').date()
+
+        written = EventLogDailySummary.objects.update_summaries(start_day=start_day, end_day=end_day)
+        if verbosity > 0:
+            print('%d event log summary rows written' % written)
@@ -1,11 +1,12 @@
 from builtins import str
-import inspect
-from datetime import datetime, timedelta
+import uuid
+from datetime import date, datetime, timedelta
 from operator import and_
-from socket import gethostbyname, gethostname
 from functools import reduce
 
-from django.db.models import Manager
+from django.db import transaction
+from django.db.models import Manager, Count, Sum, Min, Max
+from django.db.models.functions import TruncDate
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import AnonymousUser
 from django.db.models import Q
@@ -13,6 +14,9 @@ from django.conf import settings
 from django.utils.encoding import smart_bytes
 
 from tendenci.apps.robots.models import Robot
+from tendenci.apps.event_logs.buffer import event_log_buffer
+from tendenci.apps.event_logs.middleware import get_log_context
+from tendenci.apps.event_logs.utils import get_server_ip_address, remove_list
 
 
 default_keyword_args = (
@@ -27,9 +31,37 @@ default_keyword_args = (
     'description',
     'entity',
     'source',
+    'application',
+    'action',
+    'defer',
 )
 
 
+def normalize_application(module_name):
+    """
+    Turns a module path into an application name,
+    e.g. 'tendenci.apps.articles.views' -> 'articles'.
+    """
+    application = [item for item in module_name.split('.') if item not in remove_list]
+    # Join on the chance that we are left with more than one item
+    application = ".".join(application)
+    if application == "base":
+        application = "homepage"
+    return application
+
+
+def _resolved_view(request):
+    """
+    Returns the (module, name) of the view the request resolved to.
+    """
+    match = getattr(request, 'resolver_match', None)
+    func = getattr(match, 'func', None)
+    if func is None:
+        return '', ''
+    view = getattr(func, 'view_class', func)
+    return getattr(view, '__module__', '') or '', getattr(view, '__name__', '') or ''
+
+
 class EventLogManager(Manager):
     def search(self, query=None, *args, **kwargs):
         """
@@ -87,37 +119,35 @@ class EventLogManager(Manager):
 
             EventLog.objects.log(instance=obj_local_var)
 
+        The request, application and action can be passed explicitly;
+        otherwise they are taken from the context that EventLogMiddleware
+        sets up for the current request.
+
+        Unless EVENT_LOG_DEFER_WRITES is off (or defer=False is passed),
+        the event log is added to the in-process buffer and written in bulk
+        at the end of the request, so it has no pk when returned. Pass
+        defer=False if the caller needs the saved row. Inside an atomic
+        block it is only buffered once the block commits, so a rolled back
+        block leaves no event log, as a saved row would be rolled back.
         """
         request, user, instance = None, None, None
-
-        stack = inspect.stack()
-
-        # If the request is not present in the kwargs, we try to find it
-        # by inspecting the stack. We dive 3 levels if necessary. - JMO 2012-05-14
-        if 'request' in kwargs:
-            request = kwargs['request']
-        else:
-            if 'request' in inspect.getargvalues(stack[1][0]).locals:
-                request = inspect.getargvalues(stack[1][0]).locals['request']
-            elif 'request' in inspect.getargvalues(stack[2][0]).locals:
-                request = inspect.getargvalues(stack[2][0]).locals['request']
-            elif 'request' in inspect.getargvalues(stack[3][0]).locals:
-                request = inspect.getargvalues(stack[3][0]).locals['request']
-            elif len(stack) >= 5 and 'request' in inspect.getargvalues(stack[4][0]).locals:
-                request = inspect.getargvalues(stack[4][0]).locals['request']
+        context = get_log_context() or {}
 
         # If this eventlog is being triggered by something without a request, we
         # do not want to log it. This is usually some other form of logging
         # like Contributions or perhaps Versions in the future. - JMO 2012-05-14
+        request = kwargs.get('request') or context.get('request')
         if not request:
             return None
 
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+
         # skip if pingdom
-        if 'pingdom.com' in request.META.get('HTTP_USER_AGENT', ''):
+        if 'pingdom.com' in user_agent:
             return None
 
         # skip if aws ELB-HealthChecker
-        if 'ELB-HealthChecker' in request.META.get('HTTP_USER_AGENT', ''):
+        if 'ELB-HealthChecker' in user_agent:
             return None
 
         event_log = self.model()
@@ -151,64 +181,27 @@ class EventLogManager(Manager):
         if 'description' in kwargs:
             event_log.description = kwargs['description']
 
-        # Application is the name of the app that the event is coming from
-        #
-        # We get the app name via inspecting. Due to our update_perms_and_save util
-        # we must filter out perms as an actual source. This is ok since there are
-        # no views within perms. - JMO 2012-05-14
+        # Application is the name of the app that the event is coming from.
+        # Without an instance or an explicit application, it is the module
+        # of the view handling the request.
         if 'application' in kwargs:
             event_log.application = kwargs['application']
 
         if not event_log.application:
-            event_log.application = inspect.getmodule(stack[1][0]).__name__
-            if "perms" in event_log.application.split('.'):
-                event_log.application = inspect.getmodule(stack[2][0]).__name__
-                if "perms" in event_log.application.split('.'):
-                    event_log.application = inspect.getmodule(stack[3][0]).__name__
-
-        event_log.application = event_log.application.split('.')
-        remove_list = ['tendenci',
-                        'models',
-                        'views',
-                        'addons',
-                        'core',
-                        'apps',
-                        'contrib']
-
-        for item in remove_list:
-            if item in event_log.application:
-                event_log.application.remove(item)
-
-        # Join on the chance that we are left with more than one item
-        # in the list that we created
-        event_log.application = ".".join(event_log.application)
+            event_log.application = context.get('application') or _resolved_view(request)[0]
+
+        event_log.application = normalize_application(event_log.application)
 
         # Action is the name of the view that is being called
-        #
-        # We get it via the stack, but we filter out stacks that are named
-        # 'save' or 'update_perms_and_save' to avoid getting the incorrect
-        # view. We don't want to miss on a save method override or our own
-        # updating. - JMO 2012-05-14
         if 'action' in kwargs:
             event_log.action = kwargs['action']
         else:
-            event_log.action = stack[1][3]
-            if stack[1][3] == "save":
-                if stack[2][3] == "save" or stack[2][3] == "update_perms_and_save":
-                    if stack[3][3] == "update_perms_and_save":
-                        event_log.action = stack[4][3]
-                    else:
-                        event_log.action = stack[3][3]
-                else:
-                    event_log.action = stack[2][3]
-
-        if event_log.application == "base":
-            event_log.application = "homepage"
+            event_log.action = context.get('action') or _resolved_view(request)[1]
 
         if 'user' in kwargs:
             user = kwargs['user']
         else:
-            user = request.user
+            user = getattr(request, 'user', None)
 
         # set up the user information
         if user:
@@ -220,46 +213,140 @@ class EventLogManager(Manager):
                 event_log.email = user.email
 
         # setup request meta information
-        if request:
-            if hasattr(request, 'COOKIES'):
-                event_log.session_id = request.COOKIES.get('sessionid', '')
-
-            if hasattr(request, 'META'):
-                # Check for HTTP_X_REAL_IP first in case we are
-                # behind a load balancer
-                event_log.user_ip_address = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR', ''))
-                if "," in event_log.user_ip_address:
-                    event_log.user_ip_address = event_log.user_ip_address.split(",")[-1].replace(" ", "")
-                if len(event_log.user_ip_address) > 39: # max length for IPv6 address is 39
-                    event_log.user_ip_address = '' # set it to '' as truncating an IP would yield an invalid IP address
-                event_log.http_referrer = smart_bytes(request.META.get('HTTP_REFERER', ''), errors='replace').decode()
-                event_log.http_user_agent = smart_bytes(request.META.get('HTTP_USER_AGENT', ''), errors='replace').decode()
-                event_log.request_method = request.META.get('REQUEST_METHOD', '')
-                event_log.query_string = request.META.get('QUERY_STRING', '')
-
-                # take care of robots
-                robot = Robot.objects.get_by_agent(event_log.http_user_agent)
-                if robot:
-                    event_log.robot = robot
-
-            try:
-                event_log.server_ip_address = gethostbyname(gethostname())
-            except:
-                try:
-                    event_log.server_ip_address = settings.INTERNAL_IPS[0]
-                except:
-                    event_log.server_ip_address = '0.0.0.0'
-            if hasattr(request, 'path'):
-                event_log.url = request.path or ''
+        if hasattr(request, 'COOKIES'):
+            event_log.session_id = request.COOKIES.get('sessionid', '')
+
+        if hasattr(request, 'META'):
+            # Check for HTTP_X_REAL_IP first in case we are
+            # behind a load balancer
+            event_log.user_ip_address = request.META.get('HTTP_X_FORWARDED_FOR', request.META.get('REMOTE_ADDR', ''))
+            if "," in event_log.user_ip_address:
+                event_log.user_ip_address = event_log.user_ip_address.split(",")[-1].replace(" ", "")
+            if len(event_log.user_ip_address) > 39: # max length for IPv6 address is 39
+                event_log.user_ip_address = '' # set it to '' as truncating an IP would yield an invalid IP address
+            event_log.http_referrer = smart_bytes(request.META.get('HTTP_REFERER', ''), errors='replace').decode()
+            event_log.http_user_agent = smart_bytes(user_agent, errors='replace').decode()
+            event_log.request_method = request.META.get('REQUEST_METHOD', '')
+            event_log.query_string = request.META.get('QUERY_STRING', '')
+
+            # take care of robots
+            robot = Robot.objects.get_by_agent(event_log.http_user_agent)
+            if robot:
+                event_log.robot = robot
+
+        event_log.server_ip_address = get_server_ip_address()
+        if hasattr(request, 'path'):
+            event_log.url = request.path or ''
 
         # If we have an IP address, save the event_log
         # IPv6 address are represented in 8 groups of 16 bits each,
         # and the groups are separated by colons :
         if "." in event_log.user_ip_address or ":" in event_log.user_ip_address:
-            event_log.save()
+            defer = kwargs.get('defer')
+            if defer is None:
+                defer = getattr(settings, 'EVENT_LOG_DEFER_WRITES', False)
+            if defer:
+                # bulk_create skips save(), so prepare the row here
+                if not event_log.uuid:
+                    event_log.uuid = str(uuid.uuid4())
+                event_log.verifydata()
+                transaction.on_commit(lambda: event_log_buffer.add(event_log))
+            else:
+                event_log.save()
             return event_log
         else:
             return None
 
     def delete(self, *args, **kwargs):
         pass
+
+
+summary_fields = (
+    'application',
+    'source',
+    'action',
+    'event_id',
+    'description',
+)
+
+
+class EventLogDailySummaryManager(Manager):
+    def summarized_through(self):
+        """
+        Returns the last day that has been summarized.
+        """
+        return self.aggregate(last_day=Max('day'))['last_day']
+
+    def update_summaries(self, start_day=None, end_day=None):
+        """
+        Rebuilds the summaries of start_day through end_day, one day per
+        query. By default, picks up after the last summarized day and stops
+        at yesterday so that only complete days are summarized.
+
+        Returns the number of summary rows written.
+        """
+        EventLog = self.model._meta.apps.get_model('event_logs', 'EventLog')
+        end_day = end_day or date.today() - timedelta(days=1)
+        if not start_day:
+            last_day = self.summarized_through()
+            if last_day:
+                start_day = last_day + timedelta(days=1)
+            else:
+                first_dt = EventLog.objects.aggregate(first_dt=Min('create_dt'))['first_dt']
+                if not first_dt:
+                    return 0
+                start_day = first_dt.date()
+
+        written = 0
+        day = start_day
+        while day <= end_day:
+            next_day = day + timedelta(days=1)
+            rows = EventLog.objects.filter(create_dt__gte=day, create_dt__lt=next_day)\
+                        .values(*summary_fields)\
+                        .annotate(count=Count('pk'))\
+                        .order_by()
+            with transaction.atomic():
+                self.filter(day=day).delete()
+                written += len(self.bulk_create([self.model(day=day, **row) for row in rows],
+                                                batch_size=1000))
+            day = next_day
+        return written
+
+    def counts(self, fields, from_date, to_date, queryset=None, **filters):
+        """
+        Returns the number of event logs between from_date and to_date
+        (inclusive) grouped by fields, which may include 'day', as a list
+        of dicts ordered by day and descending count.
+
+        Summarized days are read from the summaries and the remaining days
+        from the event logs. If an event log queryset is passed, counts
+        come from it alone.
+        """
+        EventLog = self.model._meta.apps.get_model('event_logs', 'EventLog')
+        querysets = []
+        if queryset is None:
+            last_day = self.summarized_through()
+            if last_day and from_date <= last_day:
+                querysets.append(self.filter(day__gte=from_date, day__lte=min(to_date, last_day), **filters)
+                                     .values(*fields)
+                                     .annotate(total=Sum('count')))
+                from_date = last_day + timedelta(days=1)
+            queryset = EventLog.objects.filter(**filters)
+
+        if from_date <= to_date:
+            queryset = queryset.filter(create_dt__gte=from_date, create_dt__lt=to_date + timedelta(days=1))
+            if 'day' in fields:
+                queryset = queryset.annotate(day=TruncDate('create_dt'))
+            querysets.append(queryset.values(*fields).annotate(total=Count('pk')))
+
+        totals = {}
+        for qs in querysets:
+            for row in qs.order_by():
+                key = tuple(row[field] for field in fields)
+                totals[key] = totals.get(key, 0) + row['total']
+
+        rows = [dict(zip(fields, key), count=count) for key, count in totals.items()]
+        rows.sort(key=lambda row: -row['count'])
+        if 'day' in fields:
+            rows.sort(key=lambda row: row['day'])
+        return rows
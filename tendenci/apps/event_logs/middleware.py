@@ -0,0 +1,39 @@
+from threading import local
+
+from django.utils.deprecation import MiddlewareMixin
+
+from tendenci.apps.event_logs.buffer import event_log_buffer
+
+_thread_locals = local()
+
+
+def get_log_context():
+    """
+    Returns the event log context of the current request, a dict with
+    the ``request`` and, once the view is resolved, the ``application``
+    and ``action`` (module and name of the view being called).
+    """
+    return getattr(_thread_locals, 'context', None)
+
+
+class EventLogMiddleware(MiddlewareMixin):
+    """
+    Records the current request for EventLog.objects.log so that it
+    doesn't have to look for it on the stack, and flushes the buffered
+    event logs at the end of the request.
+    """
+    def process_request(self, request):
+        _thread_locals.context = {'request': request}
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        context = get_log_context()
+        if context is not None:
+            # class-based views expose the class on the as_view() function
+            view = getattr(view_func, 'view_class', view_func)
+            context['application'] = getattr(view, '__module__', '') or ''
+            context['action'] = getattr(view, '__name__', '') or ''
+
+    def process_response(self, request, response):
+        _thread_locals.context = None
+        event_log_buffer.flush()
+        return response
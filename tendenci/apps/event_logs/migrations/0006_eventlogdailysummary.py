@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_logs', '0005_auto_20200206_1418'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventLogDailySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('application', models.CharField(max_length=50)),
+                ('source', models.CharField(max_length=50, null=True)),
+                ('action', models.CharField(max_length=50)),
+                ('event_id', models.IntegerField()),
+                ('description', models.CharField(max_length=120, null=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['application', 'day'], name='event_logs__applica_6d5b0c_idx'),
+                            models.Index(fields=['source', 'day'], name='event_logs__source_2b1f3e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,110 @@
+from datetime import date
+
+from django.db import migrations
+
+
+TABLE = 'event_logs_eventlog'
+LEGACY = 'event_logs_eventlog_legacy'
+DEFAULT = 'event_logs_eventlog_default'
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_eventlog(apps, schema_editor):
+    """
+    Turns event_logs_eventlog into a table partitioned by month on create_dt.
+
+    The existing table is kept, without copying any rows, as the partition
+    for everything up to the end of the current month. Monthly partitions
+    are created from then on (see event_logs.partitions.ensure_partitions).
+
+    Rows without a create_dt can't go into a range partition; they are
+    dated 1970-01-01, which keeps them in the legacy partition.
+
+    Not reversible: turning the partitioned table back into a plain one
+    would mean copying every row.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [TABLE])
+        if cursor.fetchone():
+            return
+
+        cursor.execute("SELECT is_identity FROM information_schema.columns "
+                       "WHERE table_name = %s AND column_name = 'id'", [TABLE])
+        is_identity = cursor.fetchone()[0] == 'YES'
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence = cursor.fetchone()[0]
+        if is_identity:
+            # identity sequences belong to their column, so swap it for a
+            # plain sequence that the partitioned table can share
+            cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM "%s"' % TABLE)
+            next_id = cursor.fetchone()[0]
+            cursor.execute('ALTER TABLE "%s" ALTER COLUMN id DROP IDENTITY' % TABLE)
+            sequence = '%s_id_seq' % TABLE
+            cursor.execute('CREATE SEQUENCE "%s" START WITH %d' % (sequence, next_id))
+
+        cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                       "WHERE conrelid = to_regclass(%s) AND contype = 'f'", [TABLE])
+        foreign_keys = cursor.fetchall()
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s "
+                       "AND indexname NOT IN (SELECT conname FROM pg_constraint "
+                       "WHERE conrelid = to_regclass(%s) AND contype = 'p')", [TABLE, TABLE])
+        indexes = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("SELECT conname FROM pg_constraint "
+                       "WHERE conrelid = to_regclass(%s) AND contype = 'p'", [TABLE])
+        primary_key = cursor.fetchone()
+
+        cursor.execute('UPDATE "%s" SET create_dt = %%s WHERE create_dt IS NULL' % TABLE,
+                       [date(1970, 1, 1)])
+        cursor.execute('ALTER TABLE "%s" RENAME TO "%s"' % (TABLE, LEGACY))
+        # a partition can't keep a primary key of its own, it gets the one
+        # of the partitioned table, which includes the partition key; the
+        # partitioned table adopts this index instead of building another
+        if primary_key:
+            cursor.execute('ALTER TABLE "%s" DROP CONSTRAINT "%s"' % (LEGACY, primary_key[0]))
+        cursor.execute('ALTER TABLE "%s" ADD CONSTRAINT "%s_pkey" PRIMARY KEY (id, create_dt)' % (
+            LEGACY, LEGACY))
+        cursor.execute('CREATE TABLE "%s" (LIKE "%s" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                       'PARTITION BY RANGE (create_dt)' % (TABLE, LEGACY))
+        cursor.execute('ALTER TABLE "%s" ALTER COLUMN id SET DEFAULT nextval(\'%s\')' % (TABLE, sequence))
+        cursor.execute('ALTER SEQUENCE %s OWNED BY "%s".id' % (sequence, TABLE))
+        upper = add_months(date.today(), 1)
+        cursor.execute('ALTER TABLE "%s" ATTACH PARTITION "%s" FOR VALUES FROM (MINVALUE) TO (%%s)' % (TABLE, LEGACY),
+                       [upper])
+
+        # the partition key has to be part of the primary key
+        cursor.execute('ALTER TABLE "%s" ADD PRIMARY KEY (id, create_dt)' % TABLE)
+        for name, definition in foreign_keys:
+            cursor.execute('ALTER TABLE "%s" ADD CONSTRAINT "%s_p" %s' % (TABLE, name[:60], definition))
+        for definition in indexes:
+            # the definitions were read before the rename, so they already
+            # point at the partitioned table; postgres attaches the matching
+            # indexes of the legacy partition instead of building new ones
+            index_name = definition.split(' ON ')[0].split()[-1]
+            cursor.execute(definition.replace(index_name, '%s_p' % index_name[:60], 1))
+
+        for i in range(4):
+            lower = add_months(upper, i)
+            cursor.execute('CREATE TABLE "%s_p%d_%02d" PARTITION OF "%s" FOR VALUES FROM (%%s) TO (%%s)' % (
+                TABLE, lower.year, lower.month, TABLE), [lower, add_months(lower, 1)])
+        cursor.execute('CREATE TABLE "%s" PARTITION OF "%s" DEFAULT' % (DEFAULT, TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event_logs', '0006_eventlogdailysummary'),
+    ]
+
+    operations = [
+        # irreversible, see partition_eventlog
+        migrations.RunPython(partition_eventlog),
+    ]
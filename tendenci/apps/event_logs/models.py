@@ -6,7 +6,7 @@ from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import validate_comma_separated_integer_list
 
-from tendenci.apps.event_logs.managers import EventLogManager
+from tendenci.apps.event_logs.managers import EventLogManager, EventLogDailySummaryManager
 from tendenci.apps.entities.models import Entity
 from tendenci.apps.robots.models import Robot
 from tendenci.apps.event_logs.colors import get_color
@@ -80,6 +80,30 @@ class EventLog(models.Model):
         pass
 
 
+class EventLogDailySummary(models.Model):
+    """
+    Number of event logs per day and application/source/action/event_id,
+    maintained by the update_event_log_summaries command for the reports.
+    """
+    day = models.DateField(db_index=True)
+    application = models.CharField(max_length=50)
+    source = models.CharField(max_length=50, null=True)
+    action = models.CharField(max_length=50)
+    event_id = models.IntegerField()
+    description = models.CharField(max_length=120, null=True)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = EventLogDailySummaryManager()
+
+    class Meta:
+        app_label = "event_logs"
+        indexes = [models.Index(fields=['application', 'day'], name='event_logs__applica_6d5b0c_idx'),
+                   models.Index(fields=['source', 'day'], name='event_logs__source_2b1f3e_idx')]
+
+    def __str__(self):
+        return '%s %s %s' % (self.day, self.application, self.count)
+
+
 class CachedColorModel(models.Model):
     "Cache to avoid re-looking up eventlog color objects all over the place."
     class Meta:
@@ -0,0 +1,119 @@
+"""
+Monthly range partitions of the event_logs_eventlog table (PostgreSQL only).
+
+Migration 0007 turns the table into a table partitioned by create_dt, keeping
+the existing rows in a single "legacy" partition. New rows go to one partition
+per month (event_logs_eventlog_pYYYY_MM), so pruning old event logs is a
+partition drop instead of a DELETE.
+"""
+import re
+from datetime import date, datetime
+
+from django.db import connection, transaction
+
+TABLE = 'event_logs_eventlog'
+LEGACY_PARTITION = '%s_legacy' % TABLE
+DEFAULT_PARTITION = '%s_default' % TABLE
+
+_bound_re = re.compile(r"FROM \((?:'([^']+)'|MINVALUE)\) TO \('([^']+)'\)")
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return '%s_p%d_%02d' % (TABLE, month.year, month.month)
+
+
+def get_partitions():
+    """
+    Returns a list of (name, lower, upper) for the range partitions,
+    ordered by their upper bound. lower is None for the legacy partition.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)""", [TABLE])
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = _bound_re.search(bound or '')
+        if not match:
+            # the default partition
+            continue
+        lower, upper = match.groups()
+        partitions.append((name,
+                           _parse_bound(lower) if lower else None,
+                           _parse_bound(upper)))
+    return sorted(partitions, key=lambda p: p[2])
+
+
+def _parse_bound(value):
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def ensure_partitions(months_ahead=3, today=None):
+    """
+    Creates the monthly partitions from the current month through
+    months_ahead months from now. Returns the names of the new partitions.
+    """
+    if not is_partitioned():
+        return []
+
+    today = today or date.today()
+    existing = get_partitions()
+    covered_until = existing[-1][2] if existing else None
+    created = []
+    # start where the existing partitions end so that no month is skipped
+    month = covered_until or month_start(today)
+    last_month = add_months(month_start(today), months_ahead)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        while month <= last_month:
+            name = partition_name(month)
+            bounds = [month, add_months(month, 1)]
+            # rows that landed in the default partition for this month have
+            # to move out of it before the month's partition can be attached
+            cursor.execute('CREATE TABLE "%s" (LIKE "%s" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' % (name, TABLE))
+            cursor.execute(
+                'WITH moved AS (DELETE FROM "%s" WHERE create_dt >= %%s AND create_dt < %%s RETURNING *) '
+                'INSERT INTO "%s" SELECT * FROM moved' % (DEFAULT_PARTITION, name), bounds)
+            cursor.execute(
+                'ALTER TABLE "%s" ATTACH PARTITION "%s" FOR VALUES FROM (%%s) TO (%%s)' % (TABLE, name), bounds)
+            created.append(name)
+            month = add_months(month, 1)
+    return created
+
+
+def drop_partitions_before(cutoff):
+    """
+    Drops the partitions that only hold rows older than cutoff.
+    Returns the names of the dropped partitions.
+    """
+    if not is_partitioned():
+        return []
+
+    cutoff = cutoff.date() if isinstance(cutoff, datetime) else cutoff
+    dropped = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name, lower, upper in get_partitions():
+            if upper <= cutoff:
+                cursor.execute('DROP TABLE "%s"' % name)
+                dropped.append(name)
+    return dropped
@@ -1,5 +1,7 @@
 from datetime import date, timedelta
 from collections import OrderedDict
+from functools import lru_cache
+from socket import gethostbyname, gethostname
 from django.conf import settings
 
 app_exclude_list = [
@@ -47,6 +49,18 @@ remove_list = [
         'contrib'
         ]
 
+@lru_cache(maxsize=None)
+def get_server_ip_address():
+    "Resolves the ip address of this server once per process"
+    try:
+        return gethostbyname(gethostname())
+    except Exception:
+        try:
+            return settings.INTERNAL_IPS[0]
+        except Exception:
+            return '0.0.0.0'
+
+
 def month_days(year, month):
     "Returns iterator for days in selected month"
     day = date(year, month, 1)
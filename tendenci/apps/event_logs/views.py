@@ -9,7 +9,6 @@ from django.shortcuts import get_object_or_404
 from django.http import HttpResponseRedirect, HttpResponse
 from django.urls import reverse
 from django.conf import settings
-from django.db.models import Count
 
 from tendenci.apps.theme.shortcuts import themed_response as render_to_resp
 from tendenci.apps.base.http import Http403
@@ -18,7 +17,7 @@ from tendenci.apps.perms.decorators import superuser_required
 from tendenci.apps.registry.sites import site
 
 from tendenci.apps.event_logs.utils import day_bars, request_month_range
-from tendenci.apps.event_logs.models import EventLog, EventLogBaseColor
+from tendenci.apps.event_logs.models import EventLog, EventLogBaseColor, EventLogDailySummary
 from tendenci.apps.event_logs.forms import EventLogSearchForm, EventsFilterForm
 from tendenci.apps.event_logs.colors import non_model_event_logs, get_color
 
@@ -157,28 +156,30 @@ def action_colors(data):
         item['color'] = get_color(str(item['action']))
 
 
+def _event_counts(form, fields, from_date, to_date, **filters):
+    """
+    Event log counts for the summary reports. The daily summaries don't
+    keep the ip, user or session, so filtering on those reads the event logs.
+    """
+    if form.is_valid():
+        cd = form.cleaned_data
+        if cd['ip'] or cd['user_id'] or cd['session_id']:
+            queryset = form.process_filter(EventLog.objects.filter(**filters))
+            return EventLogDailySummary.objects.counts(fields, from_date, to_date, queryset=queryset)
+        if cd['event_id']:
+            filters['event_id'] = cd['event_id']
+    return EventLogDailySummary.objects.counts(fields, from_date, to_date, **filters)
+
+
 @superuser_required
 def event_summary_report(request):
-    queryset = EventLog.objects.all()
     form = EventsFilterForm(request.GET)
-    if form.is_valid():
-        queryset = form.process_filter(queryset)
-
     from_date, to_date = request_month_range(request)
-    next_day = to_date+timedelta(days=1)
-    queryset = queryset.filter(create_dt__gte=from_date, create_dt__lte=next_day)
-
-    chart_data = queryset\
-                .extra(select={'day': 'DATE(create_dt)'})\
-                .values('day', 'application')\
-                .annotate(count=Count('pk'))\
-                .order_by('day', '-count')
+
+    chart_data = _event_counts(form, ('day', 'application'), from_date, to_date)
     chart_data = day_bars(chart_data, from_date.year, from_date.month, 300, application_colors)
 
-    summary_data = queryset\
-                .values('application')\
-                .annotate(count=Count('pk'))\
-                .order_by('-count')
+    summary_data = _event_counts(form, ('application',), from_date, to_date)
     application_colors(summary_data)
     m = 1 + round(len(summary_data)/3)
     mm = 2 * m
@@ -192,26 +193,13 @@ def event_summary_report(request):
 
 @superuser_required
 def event_application_summary_report(request, application):
-    queryset = EventLog.objects.filter(application=application)
     form = EventsFilterForm(request.GET)
-    if form.is_valid():
-        queryset = form.process_filter(queryset)
-
     from_date, to_date = request_month_range(request)
-    next_day = to_date+timedelta(days=1)
-    queryset = queryset.filter(create_dt__gte=from_date, create_dt__lte=next_day)
-
-    chart_data = queryset\
-                .extra(select={'day': 'DATE(create_dt)'})\
-                .values('day', 'action')\
-                .annotate(count=Count('pk'))\
-                .order_by('day', '-count')
+
+    chart_data = _event_counts(form, ('day', 'action'), from_date, to_date, application=application)
     chart_data = day_bars(chart_data, from_date.year, from_date.month, 300, action_colors)
 
-    summary_data = queryset\
-                .values('action', 'description')\
-                .annotate(count=Count('pk'))\
-                .order_by('-count')
+    summary_data = _event_counts(form, ('action', 'description'), from_date, to_date, application=application)
     action_colors(summary_data)
 
     return render_to_resp(
@@ -226,26 +214,13 @@ def event_summary_historical_report(request):
     """
     This report queries based on source for historical reporting purposes
     """
-    queryset = EventLog.objects.all()
     form = EventsFilterForm(request.GET)
-    if form.is_valid():
-        queryset = form.process_filter(queryset)
-
     from_date, to_date = request_month_range(request)
-    next_day = to_date+timedelta(days=1)
-    queryset = queryset.filter(create_dt__gte=from_date, create_dt__lte=next_day)
-
-    chart_data = queryset\
-                .extra(select={'day': 'DATE(create_dt)'})\
-                .values('day', 'source')\
-                .annotate(count=Count('pk'))\
-                .order_by('day', '-count')
+
+    chart_data = _event_counts(form, ('day', 'source'), from_date, to_date)
     chart_data = day_bars(chart_data, from_date.year, from_date.month, 300, source_colors)
 
-    summary_data = queryset\
-                .values('source')\
-                .annotate(count=Count('pk'))\
-                .order_by('-count')
+    summary_data = _event_counts(form, ('source',), from_date, to_date)
     source_colors(summary_data)
 
     m = 1 + round(len(summary_data)/3)
@@ -260,26 +235,13 @@ def event_summary_historical_report(request):
 
 @superuser_required
 def event_source_summary_report(request, source):
-    queryset = EventLog.objects.filter(source=source)
     form = EventsFilterForm(request.GET)
-    if form.is_valid():
-        queryset = form.process_filter(queryset)
-
     from_date, to_date = request_month_range(request)
-    next_day = to_date+timedelta(days=1)
-    queryset = queryset.filter(create_dt__gte=from_date, create_dt__lte=next_day)
-
-    chart_data = queryset\
-                .extra(select={'day': 'DATE(create_dt)'})\
-                .values('day', 'event_id')\
-                .annotate(count=Count('pk'))\
-                .order_by('day', '-count')
+
+    chart_data = _event_counts(form, ('day', 'event_id'), from_date, to_date, source=source)
     chart_data = day_bars(chart_data, from_date.year, from_date.month, 300, event_colors)
 
-    summary_data = queryset\
-                .values('event_id', 'description')\
-                .annotate(count=Count('pk'))\
-                .order_by('-count')
+    summary_data = _event_counts(form, ('event_id', 'description'), from_date, to_date, source=source)
     event_colors(summary_data)
 
     return render_to_resp(
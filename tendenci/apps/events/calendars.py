@@ -0,0 +1,218 @@
+"""
+Calendar views of the events.
+
+The events a user can see over the displayed date range (the month grid,
+a week or a day) are loaded with one permission-filtered query, the parent
+events flagged in the same query, and bucketed into days in Python, so the
+event_list tag doesn't query the events once per day cell.
+
+The buckets are cached per visibility class of the user, date range and
+filters. Saving or deleting an event or an event type invalidates them.
+"""
+from datetime import date, datetime, timedelta
+from hashlib import md5
+from time import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Exists, OuterRef, Q
+
+from tendenci.apps.events.forms import EventSimpleSearchForm
+from tendenci.apps.events.models import Event, Type
+from tendenci.apps.perms.utils import get_query_filters, get_visibility_context
+from tendenci.apps.site_settings.utils import get_setting
+
+# the events of a day are the events that start before this time
+# of the day and end after its midnight
+DAY_BOUND = timedelta(hours=23, minutes=59)
+
+VERSION_KEY = '.'.join([settings.CACHE_PRE_KEY, 'events', 'calendar', 'version'])
+
+
+def get_cache_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # not 1, so that the calendars cached before the version
+        # was evicted are not picked up again
+        version = int(time())
+        cache.add(VERSION_KEY, version, None)
+    return version
+
+
+def invalidate_calendars(**kwargs):
+    """
+    Signal handler, drops all the cached calendars.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time()), None)
+
+
+def get_visibility_class(user):
+    """
+    The users that see the same events in the calendars share a class.
+    Authenticated users also see the events they created or own,
+    so each of them is a class of its own.
+    """
+    if not isinstance(user, User) or user.is_anonymous:
+        return 'anon'
+    if get_visibility_context(user).is_superuser:
+        return 'admin'
+    return 'user%s' % user.pk
+
+
+def get_search_category(request):
+    """
+    The category and query of the EventSimpleSearchForm in the request.
+    """
+    form = EventSimpleSearchForm(request.GET if request else None)
+    if form.is_valid():
+        return form.cleaned_data.get('search_category', None), form.cleaned_data.get('q', None)
+    return None, ''
+
+
+def as_date(day):
+    return date(day.year, day.month, day.day)
+
+
+class EventCalendar(object):
+    """
+    The events of a date range, by day.
+
+    Example:
+        event_calendar = EventCalendar.for_request(request, first_day, last_day, type_slug=type)
+        events = event_calendar.events_for(day)
+    """
+    def __init__(self, user, first_day, last_day, type_slug=None, group=None,
+                 search_text='', cat=None, query=''):
+        self.user = user
+        self.first_day = as_date(first_day)
+        self.last_day = as_date(last_day)
+        self.type_slug = type_slug or None
+        self.group = group or None
+        self.search_text = search_text or ''
+        self.cat = cat
+        self.query = query or ''
+        self.nested_events = bool(get_setting('module', 'events', 'nested_events'))
+        self._days = None
+
+    @classmethod
+    def for_request(cls, request, first_day, last_day, **kwargs):
+        cat, query = get_search_category(request)
+        return cls(request.user, first_day, last_day, cat=cat, query=query, **kwargs)
+
+    def matches(self, day, type_slug=None, group=None, search_text=''):
+        """
+        Whether the events of day with these filters are in this calendar.
+        """
+        return (self.first_day <= as_date(day) <= self.last_day and
+                (type_slug or None) == self.type_slug and
+                str(group or '') == str(self.group or '') and
+                (search_text or '') == self.search_text)
+
+    def get_cache_key(self):
+        filters = repr((self.type_slug, str(self.group or ''), self.search_text,
+                        self.cat, self.query, self.nested_events))
+        return '.'.join([settings.CACHE_PRE_KEY, 'events', 'calendar',
+                         str(get_cache_version()),
+                         get_visibility_class(self.user),
+                         self.first_day.isoformat(),
+                         self.last_day.isoformat(),
+                         md5(filters.encode('utf-8')).hexdigest()])
+
+    def get_queryset(self):
+        start_dt = datetime(self.first_day.year, self.first_day.month, self.first_day.day)
+        end_dt = datetime(self.last_day.year, self.last_day.month, self.last_day.day) + DAY_BOUND
+
+        visible = Event.objects.filter(get_query_filters(self.user, 'events.view_event'))
+        visible = visible.filter(start_dt__lte=end_dt, end_dt__gte=start_dt, enable_private_slug=False)
+
+        if self.type_slug:
+            [type] = Type.objects.filter(slug=self.type_slug)[:1] or [None]
+            if type:
+                visible = visible.filter(type=type)
+
+        if self.group:
+            visible = visible.filter(groups__in=[self.group])
+
+        if self.search_text:
+            visible = visible.filter(Q(title__icontains=self.search_text) |
+                                     Q(description__icontains=self.search_text))
+
+        if self.cat == 'priority':
+            visible = visible.filter(**{self.cat: True})
+        elif self.query and self.cat:
+            visible = visible.filter(**{self.cat: self.query})
+
+        # the permission and group joins can repeat rows, selecting by pk
+        # avoids a DISTINCT over all the columns of the events
+        events = Event.objects.filter(pk__in=visible.values('pk')).select_related(
+            'type__color_set', 'parent').annotate(
+            has_children=Exists(Event.objects.filter(parent_id=OuterRef('pk'))))
+
+        if self.nested_events:
+            # parent events are shown through their child events
+            events = events.filter(has_children=False)
+        return events
+
+    def bucket(self, events):
+        """
+        Returns a dict of date -> list of events, ordered
+        by priority and then time of day.
+        """
+        days = {}
+        for event in events:
+            day = max(self.first_day, event.start_dt.date())
+            last_day = min(self.last_day, event.end_dt.date())
+            while day <= last_day:
+                midnight = datetime(day.year, day.month, day.day)
+                if (event.start_dt <= midnight + DAY_BOUND and event.end_dt >= midnight and
+                        (day.weekday() < 5 or event.on_weekend)):
+                    days.setdefault(day, []).append(event)
+                day += timedelta(days=1)
+
+        for day_events in days.values():
+            day_events.sort(key=lambda e: (not e.priority, e.start_dt.hour, e.start_dt.minute))
+        return days
+
+    def get_days(self):
+        if self._days is None:
+            key = self.get_cache_key()
+            days = cache.get(key)
+            if days is None:
+                days = self.bucket(self.get_queryset())
+                cache.set(key, days, getattr(settings, 'EVENTS_CALENDAR_CACHE_TIMEOUT', 60*5))
+            self._days = days
+        return self._days
+
+    def has_events(self):
+        return bool(self.get_days())
+
+    def events_for(self, day, ordering='single_day'):
+        """
+        The events of day, in the ordering of the event_list tag: 'single_day'
+        (priority, then time of day), None (priority, then start date and
+        time) or the name of an Event field, prefixed with - for descending.
+
+        Returns None for an ordering it can't sort by.
+        """
+        events = list(self.get_days().get(as_date(day), []))
+        if ordering == 'single_day':
+            return events
+        if not ordering:
+            events.sort(key=lambda e: (not e.priority, e.start_dt))
+            return events
+
+        field_name = ordering.lstrip('-')
+        try:
+            field = Event._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            return None
+        if field.is_relation:
+            return None
+        events.sort(key=lambda e: (getattr(e, field.attname) is None, getattr(e, field.attname)),
+                    reverse=ordering.startswith('-'))
+        return events
@@ -1,48 +1,82 @@
 from builtins import str
-import re
 import subprocess
 import os
+from glob import glob
+from hashlib import md5
+from tempfile import NamedTemporaryFile
 from django.conf import settings
+from django.db.models import Count, Max
 from tendenci.libs.utils import python_executable
-from tendenci.apps.site_settings.utils import get_setting
 from tendenci.apps.events.ics.models import ICS
+from tendenci.apps.events.utils import get_calendar_data, get_ical_events, iter_ics
+
+ICS_DIRECTORY = 'files/ics'
+
+
+def get_feed_name(user):
+    if user is None or not user.is_authenticated:
+        return 'ics-anonymous'
+    return 'ics-%s' % user.pk
+
+
+def get_feed_etag(user, d):
+    """
+    The ETag of the ics feed of user. It changes when an event of the feed
+    is added, updated or removed, or when an event ends.
+    """
+    summary = get_ical_events(user).aggregate(count=Count('pk', distinct=True),
+                                              update_dt=Max('update_dt'))
+    signature = '%s|%s|%s|%s' % (get_feed_name(user), summary['count'],
+                                 summary['update_dt'], d['site_url'])
+    return md5(signature.encode('utf-8')).hexdigest()
+
+
+def write_feed(user, d, etag):
+    """
+    Writes the ics feed of user to MEDIA_ROOT/files/ics, unless the file
+    for etag is already there, and returns its path. The files of the
+    older versions of the feed are removed.
+    """
+    absolute_directory = os.path.join(settings.MEDIA_ROOT, ICS_DIRECTORY)
+    feed_name = get_feed_name(user)
+    file_path = os.path.join(absolute_directory, '%s.%s.ics' % (feed_name, etag))
+    if os.path.isfile(file_path):
+        return file_path
+
+    if not os.path.exists(absolute_directory):
+        os.makedirs(absolute_directory)
+
+    # written to a temporary file first, so that a feed
+    # being downloaded is never half written
+    with NamedTemporaryFile(mode='w', dir=absolute_directory, suffix='.tmp',
+                            newline='', encoding='utf-8', delete=False) as temp_file:
+        for chunk in iter_ics(user, d):
+            temp_file.write(chunk)
+    os.replace(temp_file.name, file_path)
+
+    for old_path in glob(os.path.join(absolute_directory, '%s.*.ics' % feed_name)):
+        if old_path != file_path:
+            try:
+                os.unlink(old_path)
+            except OSError:
+                pass
+    return file_path
+
+
+def get_feed(user):
+    """
+    Returns the path and the ETag of the up to date ics feed of user.
+    """
+    d = get_calendar_data()[1]
+    etag = get_feed_etag(user, d)
+    return write_feed(user, d, etag), etag
+
 
 def create_ics(user):
-    try:
-        from tendenci.apps.events.utils import get_vevents
-        p = re.compile(r'http(s)?://(www.)?([^/]+)')
-        d = {}
-        d['site_url'] = get_setting('site', 'global', 'siteurl')
-        match = p.search(d['site_url'])
-        if match:
-            d['domain_name'] = match.group(3)
-        else:
-            d['domain_name'] = ""
-
-        absolute_directory = os.path.join(settings.MEDIA_ROOT, 'files/ics')
-        if not os.path.exists(absolute_directory):
-            os.makedirs(absolute_directory)
-
-        #Create ics file for user
-        ics_str = "BEGIN:VCALENDAR\n"
-        ics_str += "PRODID:-//Tendenci/Tendenci Codebase MIMEDIR//EN\n"
-        ics_str += "VERSION:2.0\n"
-        ics_str += "METHOD:PUBLISH\n"
-
-        # function get_vevents in events.utils
-        ics_str += get_vevents(user, d)
-
-        ics_str += "END:VCALENDAR\n"
-
-        file_name = 'ics-%s.ics' % (user.pk)
-        file_path = os.path.join(absolute_directory, file_name)
-        destination = open(file_path, 'wb+')
-        destination.write(ics_str.encode())
-        destination.close()
-
-        return ics_str
-    except ImportError:
-        pass
+    """
+    Builds the ics feed of user if it changed, returns its path.
+    """
+    return get_feed(user)[0]
 
 
 def run_precreate_ics(app_label, model_name, user):
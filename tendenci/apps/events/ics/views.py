@@ -1,10 +1,13 @@
+import os
 from datetime import datetime
+from django.http import FileResponse
 from django.shortcuts import redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 
 from tendenci.apps.theme.shortcuts import themed_response as render_to_resp
 from tendenci.apps.base.http import Http403
 from tendenci.apps.events.ics.models import ICS
+from tendenci.apps.events.ics.utils import create_ics
 
 
 @login_required
@@ -33,7 +36,16 @@ def download(request, ics_id):
     ics = get_object_or_404(ICS, pk=ics_id)
 
     if ics.status == "completed":
-        response = ics.result
-        return response
+        result = ics.result
+        if isinstance(result, dict) and 'file_path' in result:
+            file_path = result['file_path']
+            if not os.path.isfile(file_path):
+                # replaced by a newer version of the feed since
+                file_path = create_ics(ics.user)
+            return FileResponse(open(file_path, 'rb'),
+                                as_attachment=True,
+                                filename=result['file_name'],
+                                content_type='text/calendar')
+        return result
 
     return redirect("ics.status", ics_id)
@@ -1,47 +1,32 @@
-
-import re
 from django.core.management.base import BaseCommand
 
 
 class Command(BaseCommand):
     """
-    Create ics file for all users
+    Create the ics feed files of the anonymous visitors and the users,
+    so that they are up to date before calendar clients request them.
+    A feed whose events haven't changed is not written again.
+
+    Usage: ./manage.py precreate_ics
+    Example: ./manage.py precreate_ics --user_id=1
     """
+    def add_arguments(self, parser):
+        parser.add_argument('--user_id',
+            dest='user_id',
+            default=None,
+            help='The id of the user to create the ics feed for')
+
     def handle(self, *args, **options):
-        import os
-        from django.conf import settings
-        from site_settings.utils import get_setting
-        from events.utils import get_vevents
-        from django.contrib.auth.models import User
+        from django.contrib.auth.models import AnonymousUser, User
+        from tendenci.apps.events.ics.utils import create_ics
 
-        p = re.compile(r'http(s)?://(www.)?([^/]+)')
-        d = {}
-        d['site_url'] = get_setting('site', 'global', 'siteurl')
-        match = p.search(d['site_url'])
-        if match:
-            d['domain_name'] = match.group(3)
+        users = User.objects.filter(is_active=True)
+        if options['user_id']:
+            users = users.filter(pk=options['user_id'])
         else:
-            d['domain_name'] = ""
-
-        absolute_directory = os.path.join(settings.MEDIA_ROOT, 'files/ics')
-        if not os.path.exists(absolute_directory):
-            os.makedirs(absolute_directory)
-
-        # Create ics file for every user
-        users = User.objects.all()
-        for user in users:
-            ics_str = "BEGIN:VCALENDAR\n"
-            ics_str += "PRODID:-//Tendenci//Tendenci Codebase 11.0 MIMEDIR//EN\n"
-            ics_str += "VERSION:2.0\n"
-            ics_str += "METHOD:PUBLISH\n"
-
-            # function get_vevents in events.utils
-            ics_str += get_vevents(user, d)
+            create_ics(AnonymousUser())
+            print('Created ics for anonymous users')
 
-            ics_str += "END:VCALENDAR\n"
-            file_name = 'ics-%s.ics' % (user.pk)
-            file_path = os.path.join(absolute_directory, file_name)
-            destination = open(file_path, 'wb+')
-            destination.write(ics_str.encode())
-            destination.close()
+        for user in users.select_related('profile').iterator():
+            create_ics(user)
             print('Created ics for user %s pk=%s' % (user, user.pk))
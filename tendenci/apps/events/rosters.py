@@ -0,0 +1,458 @@
+"""
+Registrant rosters and exports of an event.
+
+The data of a roster (registrants, registrations, invoices, pricings,
+addons and the custom registration form fields) is read in a fixed number
+of queries, whatever the number of registrants, and turned into compact
+row tuples. The roster page paginates over the rows and the exports
+write them as they are read.
+"""
+import csv
+import re
+from collections import namedtuple, OrderedDict
+from decimal import Decimal
+
+from django.db.models import Case, IntegerField, Q, Sum, Value, When
+from django.http import StreamingHttpResponse
+
+from tendenci.apps.base.utils import Echo, escape_csv
+from tendenci.apps.discounts.models import Discount
+from tendenci.apps.events.models import (CustomRegField, CustomRegFieldEntry,
+    CustomRegForm, CustomRegFormEntry, RegAddon, RegConfPricing, Registrant,
+    Registration)
+from tendenci.apps.events.utils import render_registrant_excel
+
+ROSTER_SORT_ORDERS = ('first_name', 'last_name', 'company_name')
+
+# the fields of the custom registration forms that
+# are shown in the columns of the roster already
+ROSTER_MAPPED_FIELDS = ('first_name', 'last_name', 'email', 'phone',
+                        'position_title', 'company_name')
+
+RosterRow = namedtuple('RosterRow', [
+    'pk', 'id', 'user_id', 'username', 'memberid', 'name', 'first_name',
+    'last_name', 'lastname_firstname', 'email', 'phone', 'company_name',
+    'position_title', 'comments', 'registration_id', 'is_primary', 'amount',
+    'discount_amount', 'checked_in', 'checked_in_dt', 'checked_out',
+    'checked_out_dt', 'price_title', 'invoice_dict', 'roster_field_list',
+    'additionals', 'addons', 'addons_amount'])
+
+# page is the page of the roster the registrant is on
+AdditionalRegistrant = namedtuple('AdditionalRegistrant', ['pk', 'lastname_firstname', 'email', 'page'])
+
+ROSTER_LOOKUPS = (
+    'pk', 'user_id', 'user__username', 'memberid', 'name', 'first_name',
+    'last_name', 'email', 'phone', 'company_name', 'position_title',
+    'comments', 'registration_id', 'is_primary', 'amount', 'discount_amount',
+    'checked_in', 'checked_in_dt', 'checked_out', 'checked_out_dt',
+    'custom_reg_form_entry_id', 'pricing_id', 'registration__reg_conf_price_id',
+    'registration__canceled', 'registration__invoice_id',
+    'registration__invoice__total', 'registration__invoice__balance',
+    'registration__invoice__admin_notes', 'registration__invoice__tender_date',
+    'registration__invoice__discount_code')
+
+
+def lastname_firstname(first_name, last_name):
+    """
+    Same as Registrant.lastname_firstname.
+    """
+    fn = first_name or None
+    ln = last_name or None
+    if fn and ln:
+        return ', '.join([ln, fn])
+    return fn or ln
+
+
+def get_roster_registrations(event, roster_view='total'):
+    registrations = Registration.objects.filter(event=event, canceled=False)
+    if roster_view == 'paid':
+        registrations = registrations.filter(Q(invoice__balance__lte=0) | Q(invoice__isnull=True))
+    elif roster_view == 'non-paid':
+        registrations = registrations.filter(invoice__balance__gt=0)
+    return registrations
+
+
+class RegistrantRoster(object):
+    """
+    The registrant roster of an event.
+
+    roster_view is 'total', 'paid' or 'non-paid'. The registrants are
+    ordered by sort_order, with the registrants without names at the bottom.
+    With per_page, the links to additional registrants know the page of
+    the paginated roster they are on.
+    """
+    def __init__(self, event, roster_view='total', sort_order='last_name',
+                 sort_type='asc', checked_in_only=False, per_page=None):
+        self.event = event
+        self.per_page = per_page
+        self.roster_view = roster_view
+        self.sort_order = sort_order if sort_order in ROSTER_SORT_ORDERS else 'last_name'
+        self.sort_type = sort_type if sort_type in ('asc', 'desc') else 'asc'
+        self.checked_in_only = checked_in_only
+        self._rows = None
+
+    def get_registrations(self):
+        return get_roster_registrations(self.event, self.roster_view)
+
+    def get_queryset(self):
+        registrants = Registrant.objects.filter(registration__event=self.event, cancel_dt=None)
+        if self.roster_view in ('paid', 'non-paid'):
+            registrants = registrants.filter(registration__in=self.get_registrations())
+        if self.checked_in_only:
+            registrants = registrants.filter(checked_in=True)
+
+        sort_field = self.sort_order
+        if self.sort_type == 'desc':
+            sort_field = '-%s' % sort_field
+
+        if self.sort_order in ('first_name', 'last_name'):
+            # let registrants without names sink down to the bottom
+            registrants = registrants.annotate(noname=Case(
+                When(first_name='', last_name='', then=Value(1)),
+                default=Value(0), output_field=IntegerField()))
+            return registrants.order_by('noname', sort_field, 'pk')
+        return registrants.order_by(sort_field, 'pk')
+
+    def get_pricing_titles(self):
+        return dict(RegConfPricing.objects.filter(
+            reg_conf=self.event.registration_configuration).values_list('id', 'title'))
+
+    def get_roster_fields(self, registrants):
+        """
+        The custom registration form fields to show on the roster,
+        a dict of entry id -> list of {'label', 'value'}.
+        """
+        roster_fields = {}
+        field_entries = CustomRegFieldEntry.objects.filter(
+            entry__in=registrants.values('custom_reg_form_entry'),
+            field__display_on_roster=1
+        ).exclude(field__map_to_field__in=ROSTER_MAPPED_FIELDS).values_list(
+            'entry_id', 'field__label', 'value').order_by('field__position')
+        for entry_id, label, value in field_entries:
+            roster_fields.setdefault(entry_id, []).append({'label': label, 'value': value})
+        return roster_fields
+
+    def get_addons(self):
+        """
+        The addons of the registrations of the event,
+        a dict of registration id -> (titles, amount).
+        """
+        addons = {}
+        reg_addons = RegAddon.objects.filter(registration__event=self.event).select_related(
+            'addon').prefetch_related('regaddonoption_set__option').order_by('registration_id', 'pk')
+        for reg_addon in reg_addons:
+            addon_title = reg_addon.addon.title
+            # the first option, as RegAddon.get_option
+            options = sorted(reg_addon.regaddonoption_set.all(), key=lambda o: o.pk)
+            if options:
+                addon_title += f'({options[0].option.title})'
+            titles, amount = addons.get(reg_addon.registration_id, ([], 0))
+            titles.append(addon_title)
+            addons[reg_addon.registration_id] = (titles, amount + reg_addon.amount)
+        return dict((registration_id, (', '.join(titles), amount))
+                    for registration_id, (titles, amount) in addons.items())
+
+    def get_discount_urls(self, discount_codes):
+        discount_codes = set(code for code in discount_codes if code)
+        if not discount_codes:
+            return {}
+        return dict((discount.discount_code, discount.get_absolute_url())
+                    for discount in Discount.objects.filter(discount_code__in=discount_codes))
+
+    def rows(self):
+        """
+        The RosterRow of each registrant.
+        """
+        if self._rows is not None:
+            return self._rows
+
+        registrants = self.get_queryset()
+        values = [dict(zip(ROSTER_LOOKUPS, row)) for row in registrants.values_list(*ROSTER_LOOKUPS)]
+
+        pricing_titles = self.get_pricing_titles()
+        roster_fields = self.get_roster_fields(registrants) if values else {}
+        addons = self.get_addons() if values and self.event.has_addons else {}
+        discount_urls = self.get_discount_urls(
+            v['registration__invoice__discount_code'] for v in values)
+
+        # registration to registrants mapping, for the additional registrants
+        registration_registrants = OrderedDict()
+        for index, v in enumerate(values):
+            page = index // self.per_page + 1 if self.per_page else 1
+            registration_registrants.setdefault(v['registration_id'], []).append(
+                AdditionalRegistrant(v['pk'], lastname_firstname(v['first_name'], v['last_name']),
+                                     v['email'], page))
+
+        rows = []
+        for v in values:
+            # the pricing of the registrant, or else of the registration
+            price_title = pricing_titles.get(v['pricing_id'],
+                            pricing_titles.get(v['registration__reg_conf_price_id'], 'Untitled'))
+
+            invoice_dict = None
+            if not v['registration__canceled']:
+                if v['registration__invoice_id'] is None:
+                    invoice_dict = {'id': 0, 'total': 0, 'balance': 0,
+                                    'admin_notes': '', 'tender_date': ''}
+                else:
+                    invoice_dict = {'id': v['registration__invoice_id'],
+                                    'total': v['registration__invoice__total'],
+                                    'balance': v['registration__invoice__balance'],
+                                    'admin_notes': v['registration__invoice__admin_notes'],
+                                    'tender_date': v['registration__invoice__tender_date']}
+                discount_code = v['registration__invoice__discount_code'] or ''
+                invoice_dict['discount_code'] = discount_code
+                invoice_dict['discount_url'] = discount_urls.get(discount_code, '')
+
+            if v['is_primary']:
+                registrant_addons, addons_amount = addons.get(v['registration_id'], ('', 0))
+            else:
+                registrant_addons, addons_amount = '', 0
+
+            rows.append(RosterRow(
+                pk=v['pk'],
+                id=v['pk'],
+                user_id=v['user_id'],
+                username=v['user__username'],
+                memberid=v['memberid'],
+                name=v['name'],
+                first_name=v['first_name'],
+                last_name=v['last_name'],
+                lastname_firstname=lastname_firstname(v['first_name'], v['last_name']),
+                email=v['email'],
+                phone=v['phone'],
+                company_name=v['company_name'],
+                position_title=v['position_title'],
+                comments=v['comments'],
+                registration_id=v['registration_id'],
+                is_primary=v['is_primary'],
+                amount=v['amount'],
+                discount_amount=v['discount_amount'],
+                checked_in=v['checked_in'],
+                checked_in_dt=v['checked_in_dt'],
+                checked_out=v['checked_out'],
+                checked_out_dt=v['checked_out_dt'],
+                price_title=price_title,
+                invoice_dict=invoice_dict,
+                roster_field_list=roster_fields.get(v['custom_reg_form_entry_id'], []),
+                additionals=[r for r in registration_registrants[v['registration_id']] if r.pk != v['pk']],
+                addons=registrant_addons,
+                addons_amount=addons_amount,
+            ))
+
+        self._rows = rows
+        return rows
+
+    def summary(self):
+        """
+        The totals of the roster.
+        """
+        rows = self.rows()
+        totals = self.get_registrations().aggregate(
+            total_sum=Sum('invoice__total'), balance_sum=Sum('invoice__balance'))
+        paid = [row.invoice_dict['balance'] <= 0 for row in rows if row.invoice_dict]
+        return {
+            'total_sum': totals['total_sum'],
+            'balance_sum': totals['balance_sum'],
+            'addon_total_sum': sum((row.addons_amount for row in rows if row.addons_amount), Decimal('0')),
+            'num_registrants_who_paid': paid.count(True),
+            'num_registrants_who_owe': paid.count(False),
+            'total_checked_in': len([row for row in rows if row.checked_in]),
+        }
+
+
+# The column of the export, and the registrant lookup it's read from.
+EXPORT_MAPPINGS = OrderedDict([
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name'),
+    ('phone', 'phone'),
+    ('email', 'email'),
+    ('position_title', 'position_title'),
+    ('company', 'company_name'),
+    ('address', 'address'),
+    ('city', 'city'),
+    ('state', 'state'),
+    ('zip', 'zip'),
+    ('country', 'country'),
+    ('meal_option', 'meal_option'),
+    ('comments', 'comments'),
+    ('date', 'create_dt'),
+    ('registration_id', 'registration__pk'),
+    ('addons', 'registration__addons_added'),
+    ('is_primary', 'is_primary'),
+    ('amount', 'amount'),
+    ('price type', 'pricing__title'),
+    ('invoice_id', 'registration__invoice__pk'),
+    ('registration price', 'registration__invoice__total'),
+    ('payment method', 'registration__payment_method__machine_name'),
+    ('balance', 'registration__invoice__balance'),
+])
+
+# the registrant address falls back to the profile address
+PROFILE_LOOKUPS = OrderedDict([
+    ('address', 'user__profile__address'),
+    ('city', 'user__profile__city'),
+    ('state', 'user__profile__state'),
+    ('zip', 'user__profile__zipcode'),
+    ('country', 'user__profile__country'),
+])
+
+# stored in the field entries of the custom registration forms
+CUSTOM_FORM_EXCLUDED_COLUMNS = ('first_name', 'last_name', 'phone', 'email',
+                                'company', 'address', 'city', 'state', 'zip',
+                                'country', 'comments')
+
+
+class RegistrantExport(object):
+    """
+    The registrants of an event, for the registrant exports: the registrants
+    with the regular registration form, then the registrants of each custom
+    registration form with the fields of the form.
+
+    sections() yields (rows, balance_index) for each part. The rows are
+    read chunk_size registrants at a time, with the related data of the
+    chunk in a fixed number of queries.
+    """
+    def __init__(self, event, roster_view='', chunk_size=1000):
+        self.event = event
+        self.roster_view = roster_view
+        self.chunk_size = chunk_size
+
+    def get_file_name(self, extension='xls'):
+        file_name = self.event.title.strip().replace(' ', '-')
+        file_name = re.sub(r'[^a-zA-Z0-9._]+', '', file_name)
+        label = {'non-paid': 'Non-Paid', 'paid': 'Paid'}.get(self.roster_view, 'Total')
+        return 'Event-%s-%s.%s' % (file_name, label, extension)
+
+    def get_registrants(self):
+        if self.roster_view == 'non-paid':
+            return self.event.registrants(with_balance=True)
+        if self.roster_view == 'paid':
+            return self.event.registrants(with_balance=False)
+        return self.event.registrants()
+
+    def get_mappings(self, registrants):
+        mappings = OrderedDict(EXPORT_MAPPINGS)
+        if not registrants.exclude(meal_option='').exists():
+            # remove meal_option if the field is empty for every registrant
+            del mappings['meal_option']
+        return mappings
+
+    def get_primary_names(self):
+        """
+        The name of the primary registrant of each registration of the event,
+        as Registration.registrant.
+        """
+        primaries = Registrant.objects.filter(registration__event=self.event).order_by(
+            'registration_id', '-is_primary', 'pk').distinct('registration_id').values_list(
+            'registration_id', 'first_name', 'last_name')
+        return dict((registration_id, '%s %s' % (first_name, last_name))
+                    for registration_id, first_name, last_name in primaries)
+
+    def sections(self):
+        registrants = self.get_registrants()
+        mappings = self.get_mappings(registrants)
+
+        regular = registrants.filter(custom_reg_form_entry=None)
+        if regular.exists():
+            yield self.regular_rows(regular, mappings), list(mappings.keys()).index('balance')
+
+        custom_registrants = registrants.exclude(custom_reg_form_entry=None)
+        form_ids = list(CustomRegFormEntry.objects.filter(
+            pk__in=custom_registrants.values('custom_reg_form_entry')
+        ).order_by('form_id').values_list('form_id', flat=True).distinct())
+        if form_ids:
+            custom_mappings = OrderedDict((column, lookup) for column, lookup in mappings.items()
+                                          if column not in CUSTOM_FORM_EXCLUDED_COLUMNS)
+            for custom_reg_form in CustomRegForm.objects.filter(pk__in=form_ids).order_by('pk'):
+                fields = OrderedDict(CustomRegField.objects.filter(
+                    form=custom_reg_form).order_by('position').values_list('id', 'label'))
+                form_registrants = custom_registrants.filter(custom_reg_form_entry__form=custom_reg_form)
+                balance_index = len(fields) + list(custom_mappings.keys()).index('balance')
+                yield (self.custom_form_rows(custom_reg_form, fields, form_registrants, custom_mappings),
+                       balance_index)
+
+    def iter_values(self, registrants, lookups):
+        """
+        Yields the values of the registrants, chunk_size at a time.
+        The registrants are keyed by pk so that they can be read in chunks.
+        """
+        registrants = registrants.order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(registrants.filter(pk__gt=last_pk).values('pk', *lookups)[:self.chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1]['pk']
+            yield chunk
+
+    def regular_rows(self, registrants, mappings):
+        yield list(mappings.keys()) + ['is_paid', 'primary_registrant']
+
+        primary_names = self.get_primary_names()
+        lookups = list(mappings.values()) + list(PROFILE_LOOKUPS.values())
+        for chunk in self.iter_values(registrants, lookups):
+            for values in chunk:
+                for column, profile_lookup in PROFILE_LOOKUPS.items():
+                    lookup = mappings[column]
+                    values[lookup] = values[lookup] or values[profile_lookup] or values[lookup]
+
+                is_paid = False
+                primary_registrant = u'-- N/A ---'
+                if not values['is_primary']:
+                    is_paid = (values['registration__invoice__balance'] == 0)
+                    primary_registrant = primary_names.get(values['registration__pk'], primary_registrant)
+                    values['registration__invoice__total'] = 0
+                    values['registration__invoice__balance'] = 0
+
+                yield [values[lookup] for lookup in mappings.values()] + [is_paid, primary_registrant]
+
+    def custom_form_rows(self, custom_reg_form, fields, registrants, mappings):
+        yield [custom_reg_form.name]
+        yield list(fields.values()) + list(mappings.keys())
+
+        lookups = list(mappings.values()) + ['custom_reg_form_entry']
+        for chunk in self.iter_values(registrants, lookups):
+            field_values = {}
+            for entry_id, field_id, value in CustomRegFieldEntry.objects.filter(
+                    entry_id__in=[values['custom_reg_form_entry'] for values in chunk],
+                    field_id__in=list(fields)).values_list('entry_id', 'field_id', 'value'):
+                field_values[(entry_id, field_id)] = value
+
+            for values in chunk:
+                entry_id = values['custom_reg_form_entry']
+                if not values['is_primary']:
+                    values['registration__invoice__total'] = 0
+                    values['registration__invoice__balance'] = 0
+                yield ([field_values.get((entry_id, field_id), '') for field_id in fields] +
+                       [values[lookup] for lookup in mappings.values()])
+
+
+def render_registrant_xls(registrant_export, sheet, styles):
+    """
+    Writes the sections of a RegistrantExport to an xlwt sheet.
+    """
+    start_row = 0
+    for rows, balance_index in registrant_export.sections():
+        start_row += render_registrant_excel(sheet, rows, balance_index, styles, start=start_row)
+        sheet.write(start_row, 0, '\n')
+        start_row += 1
+
+
+def stream_registrant_csv(registrant_export):
+    """
+    Returns a StreamingHttpResponse with the sections of a
+    RegistrantExport as csv, rendered as the response is sent.
+    """
+    csv_writer = csv.writer(Echo())
+
+    def content():
+        for rows, balance_index in registrant_export.sections():
+            for row in rows:
+                yield csv_writer.writerow([escape_csv(val) if isinstance(val, str) else val
+                                           for val in row])
+            yield csv_writer.writerow([])
+
+    response = StreamingHttpResponse(content(), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % registrant_export.get_file_name('csv')
+    return response
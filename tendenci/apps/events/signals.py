@@ -1,8 +1,9 @@
 from django.utils.translation import gettext_noop as _
 
 from tendenci.apps.notifications import models as notification
-from django.db.models.signals import post_save
-from tendenci.apps.events.models import Event, Registrant, Registration
+from django.db.models.signals import post_save, post_delete
+from tendenci.apps.events.models import Event, Registrant, Registration, Type
+from tendenci.apps.events.calendars import invalidate_calendars
 from tendenci.apps.invoices.models import Invoice
 from tendenci.apps.contributions.signals import save_contribution
 
@@ -78,3 +79,6 @@ def create_notice_types(sender, **kwargs):
 
 def init_signals():
     post_save.connect(save_contribution, sender=Event, weak=False)
+    for sender in (Event, Type):
+        post_save.connect(invalidate_calendars, sender=sender, weak=False)
+        post_delete.connect(invalidate_calendars, sender=sender, weak=False)
@@ -1,7 +1,6 @@
 from builtins import str
 import os
 from django.db.models import Max, Count
-from django.http import HttpResponse
 import celery
 from tendenci.apps.events.ics.utils import create_ics
 from tendenci.apps.exports.utils import full_model_to_dict, render_csv
@@ -204,8 +203,6 @@ class EventsICSTask(celery.Task):
     def run(self, **kwargs):
         if kwargs.get('ics'):
             ics = kwargs.get('ics')
-            ics_str = create_ics(ics.user)
-            response = HttpResponse(ics_str)
-            response['Content-Type'] = 'text/calendar'
-            response['Content-Disposition'] = 'attachment; filename="ics-%s.ics"' % (ics.user.pk)
-            return response
+            # the download view streams the feed file
+            return {'file_path': create_ics(ics.user),
+                    'file_name': 'ics-%s.ics' % (ics.user.pk)}
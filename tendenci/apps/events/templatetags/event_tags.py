@@ -241,15 +241,6 @@ class EventListNode(Node):
 
         request = context.get('request', None)
 
-        # make sure data in query and cat are valid
-        form = EventSimpleSearchForm(request.GET)
-        if form.is_valid():
-            cat = form.cleaned_data.get('search_category', None)
-            query = form.cleaned_data.get('q', None)
-        else:
-            cat = None
-            query = ''
-
         day = self.day.resolve(context)
         type_slug = self.type_slug.resolve(context)
         if self.search_text:
@@ -261,6 +252,23 @@ class EventListNode(Node):
         else:
             group = None
 
+        # the calendar views load the events of all their days at once
+        event_calendar = context.get('event_calendar', None)
+        if event_calendar and event_calendar.matches(day, type_slug, group, search_text):
+            events = event_calendar.events_for(day, self.ordering)
+            if events is not None:
+                context[self.context_var] = events
+                return ''
+
+        # make sure data in query and cat are valid
+        form = EventSimpleSearchForm(request.GET)
+        if form.is_valid():
+            cat = form.cleaned_data.get('search_category', None)
+            query = form.cleaned_data.get('q', None)
+        else:
+            cat = None
+            query = ''
+
         types = Type.objects.filter(slug=type_slug)
 
         type = None
@@ -9,11 +9,14 @@ import time as ttime
 from datetime import datetime, timedelta
 from datetime import date
 import csv
+from collections import OrderedDict
+from hashlib import md5
 from dateutil.rrule import rrule, DAILY, WEEKLY, MONTHLY, YEARLY
 from decimal import Decimal
 import dateutil.parser as dparser
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.storage import default_storage
 from django.conf import settings
@@ -381,6 +384,11 @@ def get_ACRF_queryset(event=None):
     return queryset
 
 def render_registrant_excel(sheet, rows_list, balance_index, styles, start=0):
+    """
+    Writes the rows to the sheet from row start.
+    Returns the number of rows written.
+    """
+    row = -1
     for row, row_data in enumerate(rows_list):
         for col, val in enumerate(row_data):
             # styles the date/time fields
@@ -402,6 +410,7 @@ def render_registrant_excel(sheet, rows_list, balance_index, styles, start=0):
                     style = styles['balance_owed_style']
 
             sheet.write(row+start, col, val, style=style)
+    return row + 1
 
 
 def get_calendar_data():
@@ -507,73 +516,127 @@ def get_ievent(request, d, event_id):
     return e_str
 
 
-def get_vevents(user, d):
-    site_url = get_setting('site', 'global', 'siteurl')
-
-    e_str = ""
-    # load both upcoming and ongoing events
+def get_ical_events(user):
+    """
+    The upcoming and ongoing events of the site-wide ics feed of user.
+    """
     filters = get_query_filters(user, 'events.view_event')
-    events = Event.objects.filter(filters).filter(end_dt__gte=datetime.now())
-    events = events.order_by('start_dt')
-    
-    dtstamp = adjust_datetime_to_timezone(datetime.now(), settings.TIME_ZONE, 'UTC').strftime('%Y%m%dT%H%M%SZ')
+    return Event.objects.filter(filters).filter(end_dt__gte=datetime.now())
 
-    for event in events:
-        e_str += "BEGIN:VEVENT\r\n"
-        e_str += "DTSTAMP:{}\r\n".format(dtstamp)
-
-        # organizer
-        organizers = event.organizer_set.all()
-        if organizers:
-            organizer_name_list = [organizer.name for organizer in organizers]
-            e_str += foldline("ORGANIZER:%s" % (', '.join(organizer_name_list)))
-            e_str += "\r\n"
-
-        # date time
-        time_zone = event.timezone
-        if not time_zone:
-            time_zone = settings.TIME_ZONE
-
-        if event.start_dt:
-            start_dt = adjust_datetime_to_timezone(event.start_dt, time_zone, 'GMT')
-            start_dt = start_dt.strftime('%Y%m%dT%H%M%SZ')
-            e_str += "DTSTART:%s\r\n" % (start_dt)
-        if event.end_dt:
-            end_dt = adjust_datetime_to_timezone(event.end_dt, time_zone, 'GMT')
-            end_dt = end_dt.strftime('%Y%m%dT%H%M%SZ')
-            e_str += "DTEND:%s\r\n" % (end_dt)
 
-        # location
-        if event.place:
-            e_str += foldline("LOCATION:%s" % (event.place.name))
-            e_str += "\r\n"
+def get_vevent_cache_key(event_id, update_dt, d, organizers=()):
+    """
+    The cache key of the VEVENT of an event. Saving the organizers of an
+    event doesn't change its update_dt, so their (pk, name) are part of it.
+    """
+    site_key = md5(d['site_url'].encode('utf-8')).hexdigest()
+    update_key = update_dt.strftime('%Y%m%d%H%M%S%f') if update_dt else ''
+    organizers_key = md5(repr(sorted(organizers)).encode('utf-8')).hexdigest()
+    return '.'.join([settings.CACHE_PRE_KEY, 'events', 'vevent', str(event_id),
+                     update_key, organizers_key, site_key])
 
-        e_str += "TRANSP:OPAQUE\r\n"
-        e_str += "SEQUENCE:0\r\n"
 
-        # uid
-        e_str += "UID:uid%d@%s\r\n" % (event.pk, d['domain_name'])
+def build_vevent(event, d):
+    """
+    The VEVENT of an event, without its BEGIN and DTSTAMP lines,
+    which are added by iter_vevents.
+    """
+    lines = []
 
-        event_url = "%s%s" % (site_url, reverse('event', args=[event.pk]))
-        d['event_url'] = event_url
+    # organizer
+    organizer_name_list = [organizer.name for organizer in event.organizer_set.all()]
+    if organizer_name_list:
+        lines.append(foldline("ORGANIZER:%s" % (', '.join(organizer_name_list))))
 
-        # text description
-        e_str += foldline("DESCRIPTION:%s" % (build_ical_text(event,d)))
-        e_str += "\r\n"
-        #  html description
-        #e_str += "X-ALT-DESC;FMTTYPE=text/html:%s\n" % (build_ical_html(event,d))
-
-        e_str += "SUMMARY:%s\r\n" % strip_tags(event.title)
-        e_str += "PRIORITY:5\r\n"
-        e_str += "CLASS:PUBLIC\r\n"
-        e_str += "BEGIN:VALARM\r\n"
-        e_str += "TRIGGER:-PT30M\r\n"
-        e_str += "ACTION:DISPLAY\r\n"
-        e_str += "DESCRIPTION:Reminder\r\n"
-        e_str += "END:VALARM\r\n"
-        e_str += "END:VEVENT\r\n"
+    # date time
+    time_zone = event.timezone
+    if not time_zone:
+        time_zone = settings.TIME_ZONE
 
-    return e_str
+    if event.start_dt:
+        start_dt = adjust_datetime_to_timezone(event.start_dt, time_zone, 'GMT')
+        lines.append("DTSTART:%s" % start_dt.strftime('%Y%m%dT%H%M%SZ'))
+    if event.end_dt:
+        end_dt = adjust_datetime_to_timezone(event.end_dt, time_zone, 'GMT')
+        lines.append("DTEND:%s" % end_dt.strftime('%Y%m%dT%H%M%SZ'))
+
+    # location
+    if event.place:
+        lines.append(foldline("LOCATION:%s" % (event.place.name)))
+
+    lines.append("TRANSP:OPAQUE")
+    lines.append("SEQUENCE:0")
+
+    # uid
+    lines.append("UID:uid%d@%s" % (event.pk, d['domain_name']))
+
+    d = dict(d, event_url="%s%s" % (d['site_url'], reverse('event', args=[event.pk])))
+
+    # text description
+    lines.append(foldline("DESCRIPTION:%s" % (build_ical_text(event, d))))
+    #  html description
+    #lines.append("X-ALT-DESC;FMTTYPE=text/html:%s" % (build_ical_html(event,d)))
+
+    lines.append("SUMMARY:%s" % strip_tags(event.title))
+    lines.append("PRIORITY:5")
+    lines.append("CLASS:PUBLIC")
+    lines.append("BEGIN:VALARM")
+    lines.append("TRIGGER:-PT30M")
+    lines.append("ACTION:DISPLAY")
+    lines.append("DESCRIPTION:Reminder")
+    lines.append("END:VALARM")
+    lines.append("END:VEVENT")
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def iter_vevents(user, d, chunk_size=200):
+    """
+    Yields the VEVENTs of the events of the ics feed of user.
+
+    The events are read chunk_size at a time with their place, organizers
+    and speakers prefetched. The VEVENT of each event is cached until the
+    event or its organizers are updated, so only the events changed since
+    the last feed are rendered again.
+    """
+    dtstamp = adjust_datetime_to_timezone(datetime.now(), settings.TIME_ZONE, 'UTC').strftime('%Y%m%dT%H%M%SZ')
+    header = "BEGIN:VEVENT\r\nDTSTAMP:{}\r\n".format(dtstamp)
+    timeout = getattr(settings, 'EVENTS_ICS_CACHE_TIMEOUT', 60*60*24)
+
+    # the permission joins can repeat an event
+    rows = list(OrderedDict(get_ical_events(user).order_by('start_dt').values_list('pk', 'update_dt')).items())
+
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        organizers = {}
+        for event_id, organizer_id, name in Organizer.objects.filter(
+                event__in=[pk for pk, update_dt in chunk]).values_list('event', 'pk', 'name'):
+            organizers.setdefault(event_id, []).append((organizer_id, name))
+        keys = [(pk, get_vevent_cache_key(pk, update_dt, d, organizers.get(pk, ())))
+                for pk, update_dt in chunk]
+        vevents = cache.get_many([key for pk, key in keys])
+
+        missing = dict((pk, key) for pk, key in keys if key not in vevents)
+        if missing:
+            events = Event.objects.filter(pk__in=missing.keys()).select_related(
+                'place').prefetch_related('organizer_set', 'speaker_set')
+            built = dict((missing[event.pk], build_vevent(event, d)) for event in events)
+            cache.set_many(built, timeout)
+            vevents.update(built)
+
+        for pk, key in keys:
+            if key in vevents:
+                yield header
+                yield vevents[key]
+
+
+def iter_ics(user, d):
+    """
+    Yields the site-wide ics feed of user.
+    """
+    yield get_ics_defaults()
+    for vevent in iter_vevents(user, d):
+        yield vevent
+    yield "END:VCALENDAR\r\n"
 
 
 def build_ical_text(event, d):
@@ -6,8 +6,6 @@ from builtins import str
 
 import re
 import calendar
-import itertools
-import os
 import subprocess
 import time
 import xlwt
@@ -27,7 +25,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.shortcuts import get_object_or_404, redirect
-from django.http import HttpResponseRedirect, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.http import HttpResponseRedirect, Http404, HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse
 from django.http import QueryDict
 from django.urls import reverse
 from django.contrib import messages
@@ -37,6 +35,8 @@ from django.template.defaultfilters import slugify
 from django.forms.formsets import formset_factory
 from django.forms.models import BaseModelFormSet, modelformset_factory
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.db import connection
 from django.db.models import F
 from django.contrib.auth.models import User
@@ -67,7 +67,7 @@ from tendenci.apps.base.http import HttpCustomResponseRedirect
 
 from tendenci.apps.discounts.models import Discount
 from tendenci.apps.notifications import models as notification
-from tendenci.apps.events.ics.utils import run_precreate_ics
+from tendenci.apps.events.ics.utils import run_precreate_ics, get_feed_etag, write_feed
 from tendenci.apps.user_groups.models import Group
 
 from tendenci.apps.events.models import (
@@ -87,8 +87,6 @@ from tendenci.apps.events.models import (
     AddonOption,
     CustomRegForm,
     CustomRegFormEntry,
-    CustomRegField,
-    CustomRegFieldEntry,
     RegAddonOption,
     RegistrationConfiguration,
     EventPhoto,
@@ -151,14 +149,13 @@ from tendenci.apps.events.utils import (
     get_calendar_data,
     get_ics_defaults,
     get_ievent,
-    get_vevents,
+    iter_ics,
     copy_event,
     email_admins,
     get_active_days,
     get_ACRF_queryset,
     get_custom_registrants_initials,
     handle_registration_payment,
-    render_registrant_excel,
     event_import_process,
     create_member_registration,
     get_recurrence_dates,
@@ -167,6 +164,9 @@ from tendenci.apps.events.utils import (
     get_prev_month,
     iter_child_event_registrants,
     replace_qr_code)
+from tendenci.apps.events.calendars import EventCalendar
+from tendenci.apps.events.rosters import (ROSTER_SORT_ORDERS, RegistrantRoster,
+    RegistrantExport, render_registrant_xls, stream_registrant_csv)
 from tendenci.apps.events.addons.forms import RegAddonForm
 from tendenci.apps.events.addons.formsets import RegAddonBaseFormSet
 from tendenci.apps.events.addons.utils import get_available_addons
@@ -552,32 +552,23 @@ def templates_list(request, template_name="events/templates_list.html"):
         })
 
 def icalendar(request):
-    ics_str = ''
-    existing_file_name = ''
     file_name, d = get_calendar_data()
 
-    if request.user.is_authenticated:
-        existing_file_name = 'ics-%s.ics' % (request.user.pk)
-
-    absolute_directory = os.path.join(settings.MEDIA_ROOT, 'files/ics')
-    if not os.path.exists(absolute_directory):
-        os.makedirs(absolute_directory)
-
-    if existing_file_name:
-        file_path = os.path.join(absolute_directory, existing_file_name)
-        # Check if ics file exists
-        if os.path.isfile(file_path):
-            ics = open(file_path, 'r+')
-            ics_str = ics.read()
-            ics.close()
-    if not ics_str:
-        ics_str = get_ics_defaults()
-        ics_str += get_vevents(request.user, d)
-        ics_str += "END:VCALENDAR\r\n"
+    # calendar clients poll the feed, answer with a 304
+    # while the events in it haven't changed
+    etag = get_feed_etag(request.user, d)
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is not None:
+        return response
 
-    response = HttpResponse(ics_str)
+    try:
+        response = FileResponse(open(write_feed(request.user, d, etag), 'rb'))
+    except OSError:
+        # the feed can't be saved, generate it on the fly
+        response = StreamingHttpResponse(iter_ics(request.user, d))
     response['Content-Type'] = 'text/calendar'
     response['Content-Disposition'] = 'attachment; filename="%s"' % (file_name)
+    response['ETag'] = quote_etag(etag)
     return response
 
 
@@ -1945,7 +1936,7 @@ def delete(request, id, template_name="events/delete.html"):
     if has_perm(request.user, 'events.delete_event'):
         if request.method == "POST":
             parent_event = event.parent
-            eventlog = EventLog.objects.log(instance=event)
+            eventlog = EventLog.objects.log(instance=event, defer=False)
             if eventlog:
                 eventlog_url = reverse('event_log', args=[eventlog.pk])
             else:
@@ -2000,7 +1991,7 @@ def delete_recurring(request, id, template_name="events/delete_recurring.html"):
     if request.method == "POST":
         recurring_manager = event.recurring_event
         for event in event_list:
-            eventlog = EventLog.objects.log(instance=event)
+            eventlog = EventLog.objects.log(instance=event, defer=False)
             # send email to admins
             recipients = get_notice_recipients('site', 'global', 'allnoticerecipients')
             if recipients and notification:
@@ -3765,6 +3756,11 @@ def month_view(request, year=None, month=None, type=None, template_name='events/
 
     types = Type.objects.all().order_by('name')
 
+    # the events of the whole grid, for the event_list tag of each day
+    event_calendar = EventCalendar.for_request(request, cal[0][0], cal[-1][-1],
+                                               type_slug=type, group=group,
+                                               search_text=search_text)
+
     EventLog.objects.log()
 
     return render_to_resp(request=request, template_name=template_name,
@@ -3781,7 +3777,8 @@ def month_view(request, year=None, month=None, type=None, template_name='events/
         'type':type,
         'group': group,
         'search_text': search_text,
-        'form': form
+        'form': form,
+        'event_calendar': event_calendar,
         })
 
 
@@ -3864,6 +3861,8 @@ def week_view(request, year=None, month=None, day=None, type=None, template_name
 
     types = Type.objects.all().order_by('name')
 
+    event_calendar = EventCalendar.for_request(request, week_dates[0], week_dates[6], type_slug=type)
+
     EventLog.objects.log()
 
     return render_to_resp(request=request, template_name=template_name,
@@ -3876,6 +3875,7 @@ def week_view(request, year=None, month=None, day=None, type=None, template_name
         'today':date.today(),
         'types':types,
         'type':type,
+        'event_calendar': event_calendar,
         })
 
 
@@ -3938,6 +3938,8 @@ def day_view(request, year=None, month=None, day=None, template_name='events/day
                     messages.add_message(request, messages.INFO, _(msg_string))
                     return HttpResponseRedirect(reverse('event.day', args=[latest_year, latest_month, latest_day]))
 
+    event_calendar = EventCalendar(request.user, day_date, day_date, cat=cat, query=query)
+
     EventLog.objects.log()
 
     return render_to_resp(request=request, template_name=template_name, context={
@@ -3949,6 +3951,7 @@ def day_view(request, year=None, month=None, day=None, template_name='events/day
         'yesterday_url': yesterday_url,
         'tomorrow_url': tomorrow_url,
         'form': form,
+        'event_calendar': event_calendar,
     })
 
 
@@ -4126,7 +4129,6 @@ def registrant_search(request, event_id=0, template_name='events/registrants/sea
 @login_required
 def registrant_roster(request, event_id=0, roster_view='', template_name='events/registrants/roster.html'):
     # roster_view in ['total', 'paid', 'non-paid']
-    from django.db.models import Sum
     event = get_object_or_404(Event, pk=event_id)
     has_addons = event.has_addons
     discount_available = event.registration_configuration.discount_eligible
@@ -4138,13 +4140,10 @@ def registrant_roster(request, event_id=0, roster_view='', template_name='events
     sort_type = request.GET.get('sort_type', 'asc')
     checked_in_only = request.GET.get('checked_in_only', False)
 
-    if sort_order not in ('first_name', 'last_name', 'company_name'):
+    if sort_order not in ROSTER_SORT_ORDERS:
         sort_order = 'last_name'
     if sort_type not in ('asc', 'desc'):
         sort_type = 'asc'
-    sort_field = sort_order
-    if sort_type == 'desc':
-        sort_field = '-%s' % sort_field
 
     payment_required = event.registration_configuration.payment_required
     if payment_required:
@@ -4154,194 +4153,33 @@ def registrant_roster(request, event_id=0, roster_view='', template_name='events
     if not roster_view:  # default to total page
         roster_view = 'total'
 
-    # paid or non-paid or total
-    registrations = Registration.objects.filter(event=event, canceled=False)
-
-    if roster_view == 'paid':
-        registrations = registrations.filter(Q(invoice__balance__lte=0) | Q(invoice__isnull=True))
-    elif roster_view == 'non-paid':
-        registrations = registrations.filter(invoice__balance__gt=0)
-
-    # Collect the info for custom reg form fields
-    # and store the values in roster_fields_dict.
-    # The key of roster_fields_dict is the entry.id.
-    # The map of entry.id and registrant.id is in the
-    # dictionary reg_form_entries_dict.
-    # This is to reduce the # of database queries.
-    roster_fields_dict = {}
-    # [(110, 11), (111, 10),...]
-    reg_form_entries = Registrant.objects.filter(
-        registration__event=event,
-        cancel_dt=None).values_list('id', 'custom_reg_form_entry')
-
-    # a dictionary of registrant.id as key and entry as value
-    reg_form_entries_dict = dict(reg_form_entries)
-
-    if reg_form_entries:
-        reg_form_field_entries = CustomRegFieldEntry.objects.filter(
-            entry__in=[entry[1] for entry in reg_form_entries if entry[1] is not None],
-            field__display_on_roster=1
-        ).exclude(field__map_to_field__in=[
-            'first_name',
-            'last_name',
-            'email',
-            'phone',
-            'position_title',
-            'company_name'
-        ]).select_related().values_list(
-            'entry__id',
-            'field__label',
-            'value'
-        ).order_by('field__position')
-
-        if reg_form_field_entries:
-            for field_entry in reg_form_field_entries:
-                key = str(field_entry[0])
-                if key not in roster_fields_dict:
-                    roster_fields_dict[key] = []
-                roster_fields_dict[key].append({'label': field_entry[1], 'value': field_entry[2]})
-
-    registrants = Registrant.objects.filter(
-        registration__event=event, cancel_dt=None)
-
-    if roster_view in ('paid', 'non-paid'):
-        registrants = registrants.filter(registration__in=registrations)
-
-    if checked_in_only:
-        registrants = registrants.filter(checked_in=True)
-        total_checked_in = registrants.count()
-    else:
-        # get the total checked in
-        total_checked_in = registrants.filter(checked_in=True).count()
-
-    # Pricing title - store with the registrant to improve the performance.
-    pricing_titles = RegConfPricing.objects.filter(
-        reg_conf=event.registration_configuration).values_list('id', 'title')
-    pricing_titles_dict = dict(pricing_titles)
-
-    # Store the price and invoice info with registrants to reduce the # of queries.
-    # need 4 mappings:
-    #    1) registrant_ids to pricing_ids
-    #    2) registration_ids to pricings_ids
-    #    3) registrant_ids to registration_ids
-    #    4) registration_ids to invoices
-    reg7n_pricing_reg8n = registrants.values_list('id', 'pricing__id', 'registration__id')
-    reg7n_to_pricing_dict = dict([(item[0], item[1]) for item in reg7n_pricing_reg8n])
-    reg8n_to_pricing_dict = dict(registrations.values_list('id', 'reg_conf_price__id'))
-    reg7n_to_reg8n_dict = dict([(item[0], item[2]) for item in reg7n_pricing_reg8n])
-    reg8n_to_invoice_objs = registrations.values_list(
-        'id',
-        'invoice__id',
-        'invoice__total',
-        'invoice__balance',
-        'invoice__admin_notes',
-        'invoice__tender_date')
-
-    reg8n_to_invoice_dict = {}
-    invoice_fields = ('id', 'total', 'balance', 'admin_notes', 'tender_date')
-    for item in reg8n_to_invoice_objs:
-        if item[1] is None:
-            reg8n_to_invoice_dict[item[0]] = dict(zip(invoice_fields, (0, 0, 0, '', '')))
-        else:
-            reg8n_to_invoice_dict[item[0]] = dict(zip(invoice_fields, item[1:]))
-
-    # registration to list of registrants mapping
-    reg8n_to_reg7n_dict = {}
-    for k, v in reg7n_to_reg8n_dict.items():
-        reg8n_to_reg7n_dict.setdefault(v, []).append(k)
-
-    if sort_field in ('first_name', 'last_name'):
-        # let registrants without names sink dowm to the bottom
-        regisrants_noname = registrants.filter(
-            last_name='', first_name='').select_related('user').order_by('id')
-
-        registrants_withname = registrants.exclude(
-            last_name='', first_name='').select_related('user').order_by(sort_field)
-
-        c = itertools.chain(registrants_withname, regisrants_noname)
-        registrants = [r for r in c]
-    else:
-        registrants = registrants.order_by(sort_field).select_related('user')
-
-    if roster_fields_dict:
-        for registrant in registrants:
-            # assign custom form roster_field_list (if any) to registrants
-            key = str(reg_form_entries_dict[registrant.id])
-            if key in roster_fields_dict:
-                registrant.roster_field_list = roster_fields_dict[key]
-
-    num_registrants_who_paid = 0
-    num_registrants_who_owe = 0
-
-    for registrant in registrants:
-        # assign pricing title to the registrants
-        key = reg7n_to_pricing_dict[registrant.id]
-        if key not in pricing_titles_dict:
-            if reg7n_to_reg8n_dict[registrant.id] in reg8n_to_pricing_dict:
-                key = reg8n_to_pricing_dict[reg7n_to_reg8n_dict[registrant.id]]
-        if key in pricing_titles_dict:
-            registrant.price_title = pricing_titles_dict[key]
-        else:
-            registrant.price_title = 'Untitled'
-
-        # assign invoice dict
-        key = reg7n_to_reg8n_dict[registrant.id]
-        if key in reg8n_to_invoice_dict:
-            registrant.invoice_dict = reg8n_to_invoice_dict[key]
-            if registrant.invoice_dict['balance'] <= 0:
-                num_registrants_who_paid += 1
-            else:
-                num_registrants_who_owe += 1
-
-    for registrant in registrants:
-        # assign additional registrants
-        registrant.additionals = []
-        key = reg7n_to_reg8n_dict[registrant.id]
-        if reg8n_to_reg7n_dict[key]:
-            additional_ids = [id for id in reg8n_to_reg7n_dict[key]]
-            additional_ids.remove(registrant.id)
-            if additional_ids:
-                for r in registrants:
-                    if r.id in additional_ids:
-                        registrant.additionals.append(r)
-
-    # assign addons
-    addon_total_sum = Decimal('0')
-    if has_addons:
-        for registrant in registrants:
-            if registrant.is_primary:
-                registrant.addons, registrant.addons_amount = registrant.registration.get_addons_with_amount()
-                if registrant.addons_amount:
-                    addon_total_sum += registrant.addons_amount
-
-    total_sum = float(0)
-    balance_sum = float(0)
-
-    # Get the total_sum and balance_sum.
-    totals_d = registrations.aggregate(
-        total_sum=Sum('invoice__total'), balance_sum=Sum('invoice__balance'))
-    total_sum = totals_d['total_sum']
-    balance_sum = totals_d['balance_sum']
+    # the rows of all the registrants are read in a fixed number of queries,
+    # the template paginates over them
+    roster_per_page = getattr(settings, 'EVENTS_ROSTER_PER_PAGE', 500)
+    roster = RegistrantRoster(event, roster_view=roster_view, sort_order=sort_order,
+                              sort_type=sort_type, checked_in_only=checked_in_only,
+                              per_page=roster_per_page)
+    registrants = roster.rows()
 
     EventLog.objects.log(instance=event)
 
-    return render_to_resp(request=request, template_name=template_name, context={
+    context = {
         'event': event,
         'use_badges': settings.USE_BADGES,
         'registrants': registrants,
-        'balance_sum': balance_sum,
-        'total_sum': total_sum,
-        'num_registrants_who_paid': num_registrants_who_paid,
-        'num_registrants_who_owe': num_registrants_who_owe,
+        'roster_per_page': roster_per_page,
         'roster_view': roster_view,
         'sort_order': sort_order,
         'sort_type': sort_type,
         'has_addons': has_addons,
         'discount_available': discount_available,
-        'addon_total_sum': addon_total_sum,
-        'total_checked_in': total_checked_in,
         'payment_required': payment_required,
-        'checked_in_only': checked_in_only})
+        'checked_in_only': checked_in_only}
+    # balance_sum, total_sum, addon_total_sum, total_checked_in and
+    # the numbers of registrants who paid and owe
+    context.update(roster.summary())
+
+    return render_to_resp(request=request, template_name=template_name, context=context)
 
 
 @is_enabled('events')
@@ -4891,119 +4729,6 @@ def edit_email(request, event_id, form_class=EmailForm, template_name='events/ed
         })
 
 
-@is_enabled('events')
-def registrant_export(request, event_id, roster_view=''):
-    """
-    Export all registration for a specific event
-    """
-    event = get_object_or_404(Event, pk=event_id)
-
-    # if they can edit it, they can export it
-    if not has_perm(request.user,'events.change_event',event):
-        raise Http403
-
-    import xlwt
-    from collections import OrderedDict
-    from decimal import Decimal
-
-    # create the excel book and sheet
-    book = xlwt.Workbook(encoding='utf8')
-    sheet = book.add_sheet('Registrants')
-
-    if roster_view == 'non-paid':
-        registrants = event.registrants(with_balance=True)
-        file_name = event.title.strip().replace(' ','-')
-        file_name = 'Event-%s-Non-Paid.xls' % re.sub(r'[^a-zA-Z0-9._]+', '', file_name)
-    elif roster_view == 'paid':
-        registrants = event.registrants(with_balance=False)
-        file_name = event.title.strip().replace(' ','-')
-        file_name = 'Event-%s-Paid.xls' % re.sub(r'[^a-zA-Z0-9._]+', '', file_name)
-    else:
-        registrants = event.registrants()
-        file_name = event.title.strip().replace(' ','-')
-        file_name = 'Event-%s-Total.xls' % re.sub(r'[^a-zA-Z0-9._]+', '', file_name)
-
-    # the key is what the column will be in the
-    # excel sheet. the value is the database lookup
-    # Used OrderedDict to maintain the column order
-    registrant_mappings = OrderedDict([
-        ('first_name', 'first_name'),
-        ('last_name', 'last_name'),
-        ('phone', 'phone'),
-        ('email', 'email'),
-        ('position_title', 'position_title'),
-        ('registration_id', 'registration__pk'),
-        ('price type', 'registration__reg_conf_price__title'),
-        ('invoice_id', 'registration__invoice__pk'),
-        ('registration price', 'registration__amount_paid'),
-        ('payment method', 'registration__payment_method__machine_name'),
-        ('balance', 'registration__invoice__balance'),
-        ('company', 'company_name'),
-        ('address', 'address'),
-        ('city', 'city'),
-        ('state', 'state'),
-        ('zip', 'zip'),
-        ('country', 'country'),
-        ('date', 'create_dt'),
-    ])
-    registrant_lookups = list(registrant_mappings.values())
-
-    # Append the heading to the list of values that will
-    # go into the excel sheet
-    values_list = []
-    values_list.insert(0, list(registrant_mappings.keys()))
-
-    # excel date styles
-    balance_owed_style = xlwt.easyxf('font: color-index red, bold on')
-    default_style = xlwt.Style.default_style
-    datetime_style = xlwt.easyxf(num_format_str='mm/dd/yyyy hh:mm')
-    date_style = xlwt.easyxf(num_format_str='mm/dd/yyyy')
-
-#    if registrations:
-#        # bulk of the work happens here
-#        # loop through all the registrations and append the output
-#        # of values_list django method to the values_list list
-#        for registration in registrations:
-#            registrants = registration.registrant_set.all()
-#            registrants = registrants.exclude(cancel_dt__isnull=False)
-#            registrants = registrants.values_list(*registrant_lookups)
-#            for registrant in registrants:
-#                values_list.append(registrant)
-
-    for registrant in registrants.values_list(*registrant_lookups):
-        values_list.append(registrant)
-
-    # Write the data enumerated to the excel sheet
-    for row, row_data in enumerate(values_list):
-        for col, val in enumerate(row_data):
-            # styles the date/time fields
-            if isinstance(val, datetime):
-                style = datetime_style
-            elif isinstance(val, date):
-                style = date_style
-            else:
-                style = default_style
-
-            # style the invoice balance column
-            if col == 7:
-                balance = val
-                if not val:
-                    balance = 0
-                if val is None:
-                    balance = 0
-                if isinstance(balance,Decimal) and balance > 0:
-                    style = balance_owed_style
-
-            sheet.write(row, col, val, style=style)
-
-    EventLog.objects.log(instance=event)
-
-    response = HttpResponse(content_type='application/vnd.ms-excel')
-    response['Content-Disposition'] = 'attachment; filename="%s"' % file_name
-    book.save(response)
-    return response
-
-
 @is_enabled('events')
 def registrant_export_with_custom(request, event_id, roster_view=''):
     """
@@ -5016,6 +4741,14 @@ def registrant_export_with_custom(request, event_id, roster_view=''):
              has_perm(request.user, 'events.change_event', event)):
         raise Http403
 
+    registrant_export = RegistrantExport(event, roster_view=roster_view)
+
+    EventLog.objects.log(instance=event)
+
+    if request.GET.get('export_format') == 'csv':
+        # written as it is sent
+        return stream_registrant_csv(registrant_export)
+
     # create the excel book and sheet
     book = xlwt.Workbook(encoding='utf8')
     sheet = book.add_sheet('Registrants')
@@ -5028,210 +4761,10 @@ def registrant_export_with_custom(request, event_id, roster_view=''):
         'date_style': xlwt.easyxf(num_format_str='mm/dd/yyyy')
     }
 
-    if roster_view == 'non-paid':
-        registrants = event.registrants(with_balance=True)
-        file_name = event.title.strip().replace(' ', '-')
-        file_name = 'Event-%s-Non-Paid.xls' % re.sub(r'[^a-zA-Z0-9._]+', '', file_name)
-    elif roster_view == 'paid':
-        registrants = event.registrants(with_balance=False)
-        file_name = event.title.strip().replace(' ', '-')
-        file_name = 'Event-%s-Paid.xls' % re.sub(r'[^a-zA-Z0-9._]+', '', file_name)
-    else:
-        registrants = event.registrants()
-        file_name = event.title.strip().replace(' ', '-')
-        file_name = 'Event-%s-Total.xls' % re.sub(r'[^a-zA-Z0-9._]+', '', file_name)
-
-    from collections import namedtuple
-
-    # the key is what the column will be in the
-    # excel sheet. the value is the database lookup
-    # Used OrderedDict to maintain the column order
-    registrant_mappings = OrderedDict([
-        ('first_name', 'first_name'),
-        ('last_name', 'last_name'),
-        ('phone', 'phone'),
-        ('email', 'email'),
-        ('position_title', 'position_title'),
-        ('company', 'company_name'),
-        ('address', 'address'),
-        ('city', 'city'),
-        ('state', 'state'),
-        ('zip', 'zip'),
-        ('country', 'country'),
-        ('meal_option', 'meal_option'),
-        ('comments', 'comments'),
-        ('date', 'create_dt'),
-        ('registration_id', 'registration__pk'),
-        ('addons', 'registration__addons_added'),
-        ('is_primary', 'is_primary'),
-        ('amount', 'amount'),
-        ('price type', 'pricing__title'),
-        ('invoice_id', 'registration__invoice__pk'),
-        ('registration price', 'registration__invoice__total'),
-        ('payment method', 'registration__payment_method__machine_name'),
-        ('balance', 'registration__invoice__balance'),
-    ])
-
-    if not registrants.exclude(meal_option='').exists():
-        # remove meal_option if the field is empty for every registrant
-        del registrant_mappings['meal_option']
-
-    RegistrantTuple = namedtuple('Registrant', list(registrant_mappings.values()))
-
-    registrant_lookups = list(registrant_mappings.values())
-
-    # Append the heading to the list of values that will
-    # go into the excel sheet
-    values_list = []
-
-    # registrants with regular reg form
-    non_custom_registrants = registrants.filter(custom_reg_form_entry=None)
-    non_custom_registrants = non_custom_registrants.values('pk', 'user_id', *registrant_lookups)
-    if non_custom_registrants:
-        values_list.insert(0, list(registrant_mappings.keys()) + ['is_paid', 'primary_registrant'])
-
-        for registrant_dict in non_custom_registrants:
-            if registrant_dict['user_id']:
-                user = User.objects.get(id=registrant_dict['user_id'])
-                if hasattr(user, 'profile'):
-                    profile = user.profile
-                    registrant_dict['address'] = registrant_dict['address'] or profile.address
-                    registrant_dict['city'] = registrant_dict['city'] or profile.city
-                    registrant_dict['state'] = registrant_dict['state'] or profile.state
-                    registrant_dict['zip'] = registrant_dict['zip'] or profile.zipcode
-                    registrant_dict['country'] = registrant_dict['country'] or profile.country
-
-
-            is_paid = False
-            primary_registrant = u'-- N/A ---'
-
-            # update registrant values
-            if not registrant_dict['is_primary']:
-
-                is_paid = (registrant_dict['registration__invoice__balance'] == 0)
-                primary_registrant = Registrant.objects.get(pk=registrant_dict['pk'])
-
-                registrant = Registrant.objects.get(pk=registrant_dict['pk'])
-                primary_registrant = registrant.registration.registrant
-
-                if primary_registrant:
-                    primary_registrant = '%s %s' % (primary_registrant.first_name, primary_registrant.last_name)
-
-                registrant_dict['registration__invoice__total'] = 0
-                registrant_dict['registration__invoice__balance'] = 0
-
-            del registrant_dict['pk']
-            del registrant_dict['user_id']
-
-            # keeps order of values
-            registrant_tuple = RegistrantTuple(**registrant_dict)
-
-            values_list.append(tuple(registrant_tuple) + (is_paid, primary_registrant))
-
-        values_list.append(['\n'])
-
-    # Write the data enumerated to the excel sheet
-    balance_index = 17
-    start_row = 0
-    render_registrant_excel(sheet, values_list, balance_index, styles, start=start_row)
-    start_row += len(values_list)
-
-    # ***now check for the custom registration forms***
-    custom_reg_exists = Registrant.objects.filter(
-        registration__event=event).exclude(custom_reg_form_entry=None).exists()
-
-    if custom_reg_exists:
-        # get a list of custom registration forms
-        sql = """
-            SELECT form_id
-            FROM events_customregformentry
-            WHERE id IN (
-                SELECT custom_reg_form_entry_id
-                FROM events_registrant
-                WHERE (custom_reg_form_entry_id is not NULL)
-                AND registration_id IN (
-                    SELECT id FROM events_registration
-                    WHERE event_id=%d))
-            ORDER BY id
-        """  % event.id
-        cursor = connection.cursor()
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        # list of form ids
-        form_ids = list(set([row[0] for row in rows]))
-
-        # remove some fields from registrant_mappings because they are
-        # stored in the field entries
-        fields_to_remove = ['first_name', 'last_name', 'phone',
-                            'email', 'company', 'address', 'city',
-                            'state', 'zip', 'country', 'comments']
-        for field in fields_to_remove:
-            del registrant_mappings[field]
-
-        registrant_lookups = list(registrant_mappings.values())
-        registrant_lookups.append('custom_reg_form_entry')
-
-        CustomRegistrantTuple = namedtuple('CustomRegistrant', list(registrant_mappings.values()))
-
-        # loop through all custom registration forms
-        for form_id in form_ids:
-            rows_list = []
-            custom_reg_form = CustomRegForm.objects.get(id=form_id)
-
-            # get a list of fields in the type (id, label) and store in
-            # an ordered dict
-            fields = CustomRegField.objects.filter(
-                form=custom_reg_form).order_by('position').values_list('id', 'label')
-
-            fields_dict = OrderedDict(fields)
-            # field header row - all the field labels in the form + registrant_mappings.keys
-            labels = list(fields_dict.values())
-            labels.extend(list(registrant_mappings.keys()))
-
-            rows_list.append([custom_reg_form.name])
-            rows_list.append(labels)
-
-            # get the registrants for this form
-            custom_registrants = registrants.filter(custom_reg_form_entry__form=custom_reg_form)
-            custom_registrants = custom_registrants.values(*registrant_lookups)
-            for registrant in custom_registrants:
-                entry_id = registrant.pop('custom_reg_form_entry')
-
-                if not registrant['is_primary']:
-                    registrant['registration__invoice__total'] = 0
-                    registrant['registration__invoice__balance'] = 0
-
-                # keep the order of the values in the registrant dict
-                registrant_tuple = CustomRegistrantTuple(**registrant)
-
-                sql = """
-                        SELECT field_id, value
-                        FROM events_customregfieldentry
-                        WHERE field_id IN (%s)
-                        AND entry_id=%d
-                    """ % (','.join([str(id) for id in fields_dict]), entry_id)
-                cursor.execute(sql)
-                entry_rows = cursor.fetchall()
-                values_dict = dict(entry_rows)
-
-                custom_values_list = []
-                for field_id in fields_dict:
-                    custom_values_list.append(values_dict.get(field_id, ''))
-                custom_values_list.extend(registrant_tuple)
-
-                rows_list.append(custom_values_list)
-            rows_list.append(['\n'])
-
-            balance_index = len(fields_dict) + len(registrant_lookups) - 1
-
-            # write to spread sheet
-            render_registrant_excel(sheet, rows_list, balance_index, styles, start=start_row)
-            start_row += len(rows_list)
-
-    EventLog.objects.log(instance=event)
+    render_registrant_xls(registrant_export, sheet, styles)
 
     response = HttpResponse(content_type='application/vnd.ms-excel')
-    response['Content-Disposition'] = 'attachment; filename="%s"' % file_name
+    response['Content-Disposition'] = 'attachment; filename="%s"' % registrant_export.get_file_name()
     book.save(response)
     return response
 
@@ -68,7 +68,7 @@ class Command(BaseCommand):
             elif export.app_label == 'pages' and export.model_name == 'page':
                 from tendenci.apps.pages.tasks import PagesExportTask
                 result = PagesExportTask()
-                response = result.run()
+                response = result.run(identifier=export.pk)
             elif export.app_label == 'profiles' and export.model_name == 'profile':
                 from tendenci.apps.profiles.tasks import ExportProfilesTask
                 result = ExportProfilesTask()
@@ -77,6 +77,7 @@ class Command(BaseCommand):
                 model = apps.get_model(export.app_label, export.model_name)
                 result = TendenciExportTask()
                 file_name = export.app_label + '.csv'
+                kwargs['identifier'] = export.pk
                 response = result.run(model, fields, file_name, **kwargs)
 
             export.status = "completed"
@@ -2,8 +2,17 @@ from builtins import str
 import subprocess
 import datetime
 import csv
+from os import unlink
+from tempfile import NamedTemporaryFile
 from django.http import HttpResponse
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models.fields.related import ManyToManyField, ForeignKey
+from django.contrib.contenttypes.fields import GenericRelation
+from tendenci.apps.base.utils import escape_csv
 from tendenci.libs.utils import python_executable
 from tendenci.apps.exports.models import Export
 
@@ -61,6 +70,224 @@ def render_csv(filename, title_list, data_list):
     return response
 
 
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def format_export_value(field_name, value):
+    """
+    Formats a column value the way TendenciExportTask always has.
+    """
+    if value:
+        if isinstance(value, datetime.datetime):
+            value = value.strftime("%Y-%m-%d %H:%M")
+        elif isinstance(value, datetime.date):
+            value = value.strftime("%Y-%m-%d")
+        elif isinstance(value, datetime.time):
+            value = value.strftime('%H:%M:%S')
+    return escape_csv(str(value).rstrip())
+
+
+class ExportPlan(object):
+    """
+    The columns of a model export, resolved once for the whole export.
+
+    Every column gets a getter for its kind of field, and the ForeignKey,
+    ManyToMany and generic relation columns add the select_related and
+    prefetch_related lookups they need, so the rows are read in chunks
+    with a fixed number of queries per chunk.
+
+    formatter(field_name, value) turns a column value into its csv value.
+
+    A field can follow one-to-one and foreign key relations, as in
+    'user__profile__company'; the relations are selected with the rows.
+    columns maps the names of computed columns to their getters,
+    prefetch_related adds lookups (Prefetch objects for instance) for
+    them, and prepare_chunk(items) is called with each chunk of objects
+    before its rows are built, to look up what can't be prefetched.
+    """
+    def __init__(self, model, fields, formatter=None, columns=None,
+                 prefetch_related=None, prepare_chunk=None):
+        self.model = model
+        self.fields = list(fields)
+        self.formatter = formatter or format_export_value
+        self.prepare_chunk = prepare_chunk
+        self.select_related = []
+        self.prefetch_related = list(prefetch_related or [])
+
+        columns = columns or {}
+        self.getters = []
+        for name in self.fields:
+            if name in columns:
+                self.getters.append(columns[name])
+            elif '__' in name:
+                self.getters.append(self._path_getter(name))
+            else:
+                self.getters.append(self._getter(name, self._get_fields(model).get(name)))
+
+    def _get_fields(self, model):
+        model_fields = {}
+        for f in model._meta.get_fields():
+            model_fields.setdefault(f.name, f)
+        return model_fields
+
+    def _path_getter(self, name):
+        relations = name.split('__')
+        name = relations.pop()
+        model = self.model
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        self.select_related.append('__'.join(relations))
+        f = self._get_fields(model).get(name)
+        if isinstance(f, ForeignKey):
+            self.select_related.append('__'.join(relations + [name]))
+            getter = lambda obj: getattr(obj, name)
+        elif f is not None and f.concrete and not isinstance(f, ManyToManyField):
+            getter = f.value_from_object
+        else:
+            getter = lambda obj: getattr(obj, name, '')
+
+        def get(item):
+            obj = item
+            for relation in relations:
+                try:
+                    obj = getattr(obj, relation)
+                except ObjectDoesNotExist:
+                    return None
+                if obj is None:
+                    return None
+            return getter(obj)
+
+        return get
+
+    def _getter(self, name, f):
+        if isinstance(f, ManyToManyField):
+            self.prefetch_related.append(name)
+            return lambda item: ["%s" % obj for obj in getattr(item, name).all()]
+        if isinstance(f, ForeignKey):
+            self.select_related.append(name)
+            return lambda item: getattr(item, name)
+        if isinstance(f, GenericRelation):
+            self.prefetch_related.append(name)
+            return lambda item: ', '.join(["%s" % obj for obj in getattr(item, name).all() if obj != ''])
+        if f is not None and f.concrete:
+            return f.value_from_object
+        # properties and reverse relations
+        return lambda item: getattr(item, name, '')
+
+    def queryset(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(set(self.select_related)))
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset
+
+    def chunks(self, queryset, chunk_size=EXPORT_CHUNK_SIZE):
+        """
+        Yields the objects of queryset in lists of chunk_size, read with
+        a server-side cursor; the prefetches are done chunk by chunk.
+        """
+        chunk = []
+        for item in self.queryset(queryset).iterator(chunk_size=chunk_size):
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def rows(self, queryset, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+        """
+        Yields the csv row of each object of queryset.
+        progress(count) is called after each chunk of count rows.
+        """
+        formatter = self.formatter
+        columns = list(zip(self.fields, self.getters))
+        for chunk in self.chunks(queryset, chunk_size=chunk_size):
+            if self.prepare_chunk:
+                self.prepare_chunk(chunk)
+            for item in chunk:
+                yield [formatter(name, getter(item)) for name, getter in columns]
+            if progress:
+                progress(len(chunk))
+
+
+class ExportProgress(object):
+    """
+    The progress of an export writing to file_path, kept in the cache
+    for the export status pages (see get_export_progress).
+    Called with the number of rows written since the last call.
+    """
+    def __init__(self, file_path, total):
+        self.key = get_export_progress_key(file_path)
+        self.total = total
+        self.done = 0
+        self(0)
+
+    def __call__(self, count):
+        self.done += count
+        cache.set(self.key, {'done': self.done, 'total': self.total},
+                  getattr(settings, 'EXPORT_PROGRESS_TIMEOUT', 60 * 60 * 24))
+
+
+def get_export_progress_key(file_path):
+    return '.'.join([settings.CACHE_PRE_KEY, 'export_progress', file_path])
+
+
+def get_export_progress(file_path):
+    """
+    The progress of the export writing to file_path: a dict with the
+    number of rows done, the total and the percent done, or None.
+    """
+    progress = cache.get(get_export_progress_key(file_path))
+    if progress is None:
+        return None
+    if progress['total']:
+        progress['percent'] = min(100, int(100 * progress['done'] / progress['total']))
+    else:
+        progress['percent'] = 100
+    return progress
+
+
+def write_csv(csvfile, title_list, rows):
+    """
+    Writes the rows to an open file, with a header row if title_list is given.
+    """
+    csv_writer = csv.writer(csvfile)
+    if title_list:
+        csv_writer.writerow(title_list)
+    for row in rows:
+        csv_writer.writerow(row)
+
+
+def save_csv(file_path, title_list, rows):
+    """
+    Writes the rows to a local temporary file, then saves it to
+    default_storage at file_path. Returns the name it was saved as.
+    """
+    temp_csv = NamedTemporaryFile(mode='w', newline='', delete=False)
+    try:
+        write_csv(temp_csv, title_list, rows)
+        temp_csv.close()
+        if default_storage.exists(file_path):
+            default_storage.delete(file_path)
+        with open(temp_csv.name, 'rb') as f:
+            return default_storage.save(file_path, File(f))
+    finally:
+        temp_csv.close()
+        unlink(temp_csv.name)
+
+
+def export_result(file_path, file_name, content_type='text/csv'):
+    """
+    The result kept on an Export for a file saved in default_storage.
+    The download view streams the file instead of keeping it pickled
+    in the database.
+    """
+    return {'file_path': file_path,
+            'file_name': file_name,
+            'content_type': content_type}
+
+
 def run_export_task(app_label, model_name, fields, **kwargs):
     export = Export.objects.create(
         app_label=app_label,
@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404
 from django.shortcuts import redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 
@@ -38,7 +40,15 @@ def download(request, export_id):
     EventLog.objects.log(instance=export)
 
     if export.status == "completed":
-        response = export.result
-        return response
+        result = export.result
+        if isinstance(result, dict) and 'file_path' in result:
+            # the file is streamed from storage
+            if not default_storage.exists(result['file_path']):
+                raise Http404
+            return FileResponse(default_storage.open(result['file_path'], 'rb'),
+                                as_attachment=True,
+                                filename=result['file_name'],
+                                content_type=result['content_type'])
+        return result
 
     return redirect("export.status", export_id)
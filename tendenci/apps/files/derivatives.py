@@ -0,0 +1,344 @@
+"""
+Derivative image store.
+
+Resized versions of the images of public files and photos are rendered
+once, written to the default storage under a content-addressed name (a hash
+of the original image and the rendering parameters) and served from there;
+the cache only records which names are stored. The default storage is
+public, so the resized versions of private images are never written to it,
+they are kept in the cache instead (see get_derivative_binary).
+
+Rendering happens in a bounded pool of IMAGE_DERIVATIVE_WORKERS processes.
+JPEG originals are decoded at a reduced scale with Image.draft, which is
+much cheaper than decoding the full image and resizing it down. Requests
+for a derivative being rendered wait for that rendering instead of
+starting their own: within a process through a shared future, across
+processes through a cache lock.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import sha1
+from io import BytesIO
+from math import ceil
+
+from PIL import Image
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.shortcuts import Http404
+
+from tendenci.apps.base.utils import ORIENTATION_EXIF_TAG_KEY, apply_orientation, image_rescale
+
+DERIVATIVE_DIRECTORY = 'cached/derivatives'
+
+# the resize is done in two steps above this factor, a fast reduce()
+# and then the LANCZOS filter, with results indistinguishable from
+# a LANCZOS resize of the whole image
+REDUCING_GAP = 3.0
+
+_pool = None
+_pool_lock = threading.Lock()
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def get_workers():
+    return getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+
+
+def get_source(file):
+    """
+    Where a worker process reads the original image of file from.
+    """
+    if settings.USE_S3_STORAGE:
+        return ('storage', file.name)
+    if hasattr(file, 'path'):
+        return ('path', file.path)
+    raise Http404
+
+
+def open_source(source):
+    kind, name = source
+    try:
+        if kind == 'storage':
+            if not default_storage.exists(name):
+                raise Http404
+            return Image.open(default_storage.open(name))
+        if not os.path.exists(name):
+            raise Http404
+        return Image.open(name)
+    except (IOError, Image.DecompressionBombError):
+        raise Http404
+
+
+def get_draft_size(image_size, size, crop):
+    """
+    The smallest size the original can be decoded at and still be
+    resized (or cropped and resized) to size without upscaling.
+    """
+    src_width, src_height = image_size
+    width, height = size
+    if not crop:
+        return width, height
+    scale = max(float(width) / src_width, float(height) / src_height)
+    return int(ceil(src_width * scale)), int(ceil(src_height * scale))
+
+
+def open_draft(source, sizes, crop=False):
+    """
+    Opens the original image of source. JPEG originals are decoded at
+    1/2, 1/4 or 1/8 of the scale when that is still at least each of sizes.
+    sizes are those of the oriented image, so they are swapped for originals
+    whose EXIF orientation turns them by 90 or 270 degrees.
+    """
+    image = open_source(source)
+    if image.format == 'JPEG':
+        if image.getexif().get(ORIENTATION_EXIF_TAG_KEY, 1) in (5, 6, 7, 8):
+            sizes = [(size[1], size[0]) for size in sizes]
+        draft_sizes = [get_draft_size(image.size, size, crop) for size in sizes]
+        image.draft('RGB', (max(size[0] for size in draft_sizes),
+                            max(size[1] for size in draft_sizes)))
+    return image
+
+
+def render_image(image, size, crop=False, quality=90, format=None):
+    """
+    Renders image at size, the way files.utils.build_image always did,
+    and returns the encoded binary. With format, the derivative is encoded
+    in that format instead of the format of the original.
+    """
+    size = tuple(size)
+    original_format = image.format
+    image = apply_orientation(image)
+
+    image_options = {'quality': quality}
+    if original_format == 'GIF':
+        image_options['transparency'] = 0
+
+    if original_format in ('GIF', 'PNG'):
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+    elif original_format == 'JPEG':
+        # IOError: cannot write mode P as JPEG
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+    image.format = original_format
+
+    if crop:
+        image = image_rescale(image, size)
+    elif image.size != size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+    image.format = original_format
+
+    format = format or image.format or 'JPEG'
+    if format == 'JPEG':
+        image_options.pop('transparency', None)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+    if format.lower() == 'tiff':
+        image_options.pop('quality', None)
+
+    output = BytesIO()
+    image.save(output, format, **image_options)
+    return output.getvalue()
+
+
+def render_derivative(source, size, crop=False, quality=90, format=None):
+    """
+    Renders the original image of source at size (see render_image).
+
+    Module level, so that it can be run in the worker processes.
+    """
+    return render_image(open_draft(source, [size], crop), size,
+                        crop=crop, quality=quality, format=format)
+
+
+def _init_worker():
+    # the workers are started with fork on linux, where django
+    # is already set up; other start methods need to set it up
+    import django
+    django.setup()
+
+
+def get_pool():
+    """
+    The process pool the derivatives are rendered in, or None when
+    IMAGE_DERIVATIVE_WORKERS is 0 and they are rendered in the request.
+    """
+    global _pool
+    workers = get_workers()
+    if not workers:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        return _pool
+
+
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+
+
+def render(source, size, crop=False, quality=90, format=None):
+    """
+    Renders a derivative in the worker pool and waits for it.
+    """
+    args = (source, tuple(size), crop, quality, format)
+    pool = get_pool()
+    if pool is None:
+        return render_derivative(*args)
+    try:
+        return pool.submit(render_derivative, *args).result()
+    except BrokenProcessPool:
+        # a worker died (out of memory on a huge image for instance),
+        # start a new pool for the next requests and render this one here
+        reset_pool()
+        return render_derivative(*args)
+
+
+def get_derivative_name(file, size, crop=False, quality=90, constrain=False, format=None):
+    """
+    The content-addressed name of a derivative of file: the same original
+    and parameters always give the same name, a changed original a new one.
+    """
+    try:
+        file_size = file.size
+    except (IOError, OSError):
+        raise Http404
+    signature = '|'.join([str(file.name), str(file_size), 'x'.join(str(s) for s in size),
+                          str(bool(crop)), str(quality), str(bool(constrain)), str(format)])
+    digest = sha1(signature.encode('utf-8')).hexdigest()
+
+    if format:
+        ext = '.jpg' if format == 'JPEG' else '.%s' % format.lower()
+    else:
+        ext = os.path.splitext(file.name)[1].lower() or '.jpg'
+    return '/'.join([DERIVATIVE_DIRECTORY, digest[:2], digest[2:4], digest + ext])
+
+
+def get_derivative_key(name):
+    return '.'.join([settings.CACHE_PRE_KEY, 'derivative', os.path.basename(name)])
+
+
+def wait_for_derivative(name, timeout):
+    """
+    Waits for another process to write name, returns whether it did.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(0.1)
+        if default_storage.exists(name):
+            return True
+    return False
+
+
+def mark_stored(name):
+    cache.set(get_derivative_key(name), True,
+              getattr(settings, 'IMAGE_DERIVATIVE_CACHE_TIMEOUT', 60 * 60 * 24 * 30))
+
+
+def store_derivative(name, binary):
+    """
+    Writes a rendered derivative under name, unless it is already there.
+    """
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(binary))
+    mark_stored(name)
+
+
+def is_stored(name):
+    return bool(cache.get(get_derivative_key(name))) or default_storage.exists(name)
+
+
+def _store_derivative(file, name, size, crop, quality, format):
+    lock_key = get_derivative_key(name) + '.lock'
+    timeout = getattr(settings, 'IMAGE_DERIVATIVE_LOCK_TIMEOUT', 60)
+
+    if default_storage.exists(name):
+        mark_stored(name)
+        return name
+
+    locked = cache.add(lock_key, True, timeout)
+    try:
+        if not locked and wait_for_derivative(name, timeout):
+            mark_stored(name)
+            return name
+        store_derivative(name, render(get_source(file), size, crop=crop, quality=quality, format=format))
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return name
+
+
+def clean_quality(quality):
+    try:
+        return int(quality)
+    except (TypeError, ValueError):
+        return 90
+
+
+def get_derivative(file, size, crop=False, quality=90, constrain=False, format=None):
+    """
+    Returns the storage name of the derivative of file at size,
+    rendering and storing it first if needed. The storage is public,
+    only use it for the images of public files and photos.
+
+    Raises Http404 if the original can't be read.
+    """
+    quality = clean_quality(quality)
+    name = get_derivative_name(file, size, crop, quality, constrain, format)
+    if cache.get(get_derivative_key(name)):
+        return name
+
+    with _in_flight_lock:
+        future = _in_flight.get(name)
+        owner = future is None
+        if owner:
+            future = Future()
+            _in_flight[name] = future
+    if not owner:
+        return future.result()
+
+    try:
+        future.set_result(_store_derivative(file, name, size, crop, quality, format))
+    except Exception as e:
+        future.set_exception(e)
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(name, None)
+    return future.result()
+
+
+def read_derivative(name):
+    with default_storage.open(name) as f:
+        return f.read()
+
+
+def get_derivative_binary(file, size, crop=False, quality=90, constrain=False, format=None, public=False):
+    """
+    Returns the derivative of file at size. Public derivatives come from
+    the storage (see get_derivative); private ones are never written to it,
+    they are rendered and kept in the cache.
+
+    Raises Http404 if the original can't be read.
+    """
+    if public:
+        return read_derivative(get_derivative(file, size, crop=crop, quality=quality,
+                                              constrain=constrain, format=format))
+
+    quality = clean_quality(quality)
+    name = get_derivative_name(file, size, crop, quality, constrain, format)
+    key = get_derivative_key(name) + '.private'
+    binary = cache.get(key)
+    if binary is None:
+        binary = render(get_source(file), size, crop=crop, quality=quality, format=format)
+        cache.set(key, binary, getattr(settings, 'IMAGE_DERIVATIVE_CACHE_TIMEOUT', 60 * 60 * 24 * 30))
+    return binary
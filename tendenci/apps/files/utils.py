@@ -1,5 +1,4 @@
 from PIL import Image
-from os.path import exists
 from io import BytesIO
 import os
 from http import client as http_client
@@ -12,9 +11,7 @@ from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
-from django.shortcuts import Http404
-from django.core.cache import cache as django_cache
-from tendenci.apps.base.utils import image_rescale, apply_orientation
+from tendenci.apps.files.derivatives import get_derivative_binary, get_source, render_derivative
 from tendenci.libs.boto_s3.utils import read_media_file_from_s3
 
 from tendenci.apps.files.models import File as TFile
@@ -25,7 +22,7 @@ MEMCACHE_MAX_KEY_LENGTH = 247
 
 def get_image(file, size, pre_key, crop=False, quality=90, cache=False, unique_key=None, constrain=False):
     """
-    Gets resized-image-object from cache or rebuilds
+    Gets resized-image-object from the derivative store or rebuilds
     the resized-image-object using the original image-file.
     *pre_key is either:
         from tendenci.apps.photos.cache import PHOTO_PRE_KEY
@@ -33,21 +30,15 @@ def get_image(file, size, pre_key, crop=False, quality=90, cache=False, unique_k
     """
 
     size = validate_image_size(size)  # make sure it's not too big
-    binary = None
 
-    if cache:
-        key = generate_image_cache_key(file, size, pre_key, crop, unique_key, quality, constrain)
-        binary = django_cache.get(key)  # check if key exists
-
-    if not binary:
-        kwargs = {
-            'crop': crop,
-            'cache': cache,
-            'quality': quality,
-            'unique_key': unique_key,
-            'constrain': constrain,
-        }
-        binary = build_image(file, size, pre_key, **kwargs)
+    kwargs = {
+        'crop': crop,
+        'cache': cache,
+        'quality': quality,
+        'unique_key': unique_key,
+        'constrain': constrain,
+    }
+    binary = build_image(file, size, pre_key, **kwargs)
 
     try:
         return Image.open(BytesIO(binary))
@@ -62,60 +53,18 @@ def get_image_from_path(path):
 def build_image(file, size, pre_key, crop=False, quality=90, cache=False, unique_key=None, constrain=False):
     """
     Builds a resized image based off of the original image.
+    With cache, the resized image is rendered once and kept
+    in the cache (see files.derivatives.get_derivative_binary).
     """
     try:
         quality = int(quality)
     except TypeError:
         quality = 90
 
-    if settings.USE_S3_STORAGE:
-        if not default_storage.exists(file.name):
-            raise Http404
-        image = Image.open(default_storage.open(file.name))
-    else:
-        if hasattr(file, 'path') and exists(file.path):
-            try:
-                image = Image.open(file.path)  # get image
-            except Image.DecompressionBombError:
-                raise Http404
-        else:
-            raise Http404
-        
-    image = apply_orientation(image)
-
-    image_options = {'quality': quality}
-    if image.format == 'GIF':
-        image_options['transparency'] = 0
-
-    format = image.format
-    if image.format in ('GIF', 'PNG'):
-        if image.mode != "RGBA":
-            image = image.convert("RGBA")
-        image.format = format  # this is lost in conversion
-
-    elif image.format == 'JPEG':
-        # handle infamous error
-        # IOError: cannot write mode P as JPEG
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-
-    if crop:
-        image = image_rescale(image, size)  # thumbnail image
-    else:
-        format = image.format
-        image = image.resize(size, Image.LANCZOS)  # resize image
-        image.format = format
-
-    binary = get_image_binary(image, **image_options)
-
     if cache:
-        key = generate_image_cache_key(file, size, pre_key, crop, unique_key, quality, constrain)
-        try:
-            django_cache.add(key, binary, 60 * 60 * 24 * 30)  # cache for 30 days #issue/134
-        except:
-            pass
+        return get_derivative_binary(file, size, crop=crop, quality=quality, constrain=constrain)
 
-    return binary
+    return render_derivative(get_source(file), size, crop=crop, quality=quality)
 
 
 def get_image_binary(image, **options):
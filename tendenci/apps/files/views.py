@@ -22,7 +22,6 @@ from django.forms.models import modelformset_factory
 from django.conf import settings
 from django.core.cache import cache
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
 from django.core.paginator import Paginator
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
@@ -45,7 +44,8 @@ from tendenci.apps.event_logs.models import EventLog
 from tendenci.apps.theme.shortcuts import themed_response as render_to_resp
 from tendenci.apps.files.cache import FILE_IMAGE_PRE_KEY
 from tendenci.apps.files.models import File, FilesCategory
-from tendenci.apps.files.utils import get_image, aspect_ratio, generate_image_cache_key, get_max_file_upload_size, get_allowed_upload_file_exts
+from tendenci.apps.files.derivatives import get_derivative, get_derivative_binary, read_derivative
+from tendenci.apps.files.utils import aspect_ratio, generate_image_cache_key, get_max_file_upload_size, get_allowed_upload_file_exts, validate_image_size
 from tendenci.apps.files.forms import FileForm, MostViewedForm, FileSearchForm, FileSearchMinForm, TinymceUploadForm
 
 
@@ -92,13 +92,6 @@ def details(request, id, size=None, crop=False, quality=90, download=False, cons
     if isinstance(quality, str) and quality.isdigit():
         quality = int(quality)
 
-    # get image binary
-    try:
-        data = file.file.read()
-        file.file.close()
-    except IOError:  # no such file or directory
-        raise Http404
-
     if download:  # log download
         attachment = u'attachment;'
         EventLog.objects.log(**{
@@ -135,29 +128,24 @@ def details(request, id, size=None, crop=False, quality=90, download=False, cons
         if not all(size):
             raise Http404
 
-        # gets resized image from cache or rebuilds
-        image = get_image(file.file, size, FILE_IMAGE_PRE_KEY, cache=True, crop=crop, quality=quality, unique_key=None)
-        response = HttpResponse(content_type=file.mime_type())
+        # the resized image is rendered once, into the derivative store if
+        # the file is public and into the cache if not; later requests read it from there
+        is_public = file.is_public_file()
+        if is_public:
+            derivative = get_derivative(file.file, validate_image_size(size), crop=crop,
+                                        quality=quality, constrain=constrain)
+            binary = read_derivative(derivative)
+        else:
+            binary = get_derivative_binary(file.file, validate_image_size(size), crop=crop,
+                                           quality=quality, constrain=constrain)
+        response = HttpResponse(binary, content_type=file.mime_type())
         response['Content-Disposition'] = '%s filename="%s"' % (attachment, file.get_name())
 
-        params = {'quality': quality}
-        if image.format == 'GIF':
-            params['transparency'] = 0
-
-        try:
-            image.save(response, image.format, **params)
-        except AttributeError:
-            return response
-
-        if file.is_public_file():
-            file_name = file.get_name()
-            file_path = 'cached%s%s' % (request.path, file_name)
-            if not default_storage.exists(file_path):
-                default_storage.save(file_path, ContentFile(response.content))
+        if is_public:
             if settings.USE_S3_STORAGE:
-                cache.set(cache_key, file_path)
+                cache.set(cache_key, derivative)
             else:
-                full_file_path = "%s%s" % (settings.MEDIA_URL, file_path)
+                full_file_path = "%s%s" % (settings.MEDIA_URL, derivative)
                 cache.set(cache_key, full_file_path)
             cache_group_key = "files_cache_set.%s" % file.pk
             cache_group_list = cache.get(cache_group_key)
@@ -170,6 +158,13 @@ def details(request, id, size=None, crop=False, quality=90, download=False, cons
 
         return response
 
+    # get file binary
+    try:
+        data = file.file.read()
+        file.file.close()
+    except IOError:  # no such file or directory
+        raise Http404
+
     if file.is_public_file():
         cache.set(cache_key, file.get_file_public_url())
         set_s3_file_permission(file.file, public=True)
@@ -16,8 +16,8 @@ from django.template.defaultfilters import yesno
 from django.core.files.storage import default_storage
 import celery
 
-from tendenci.apps.exports.utils import full_model_to_dict, render_csv
-from tendenci.apps.forms_builder.forms.models import Form
+from tendenci.apps.exports.utils import EXPORT_CHUNK_SIZE, full_model_to_dict, render_csv
+from tendenci.apps.forms_builder.forms.models import Form, FieldEntry
 from tendenci.apps.forms_builder.forms.utils import form_entries_to_csv_writer
 from tendenci.apps.base.utils import escape_csv
 
@@ -153,23 +153,25 @@ class FormEntriesExportTask(celery.Task):
         form_entries_to_csv_writer(csv_writer, form_instance)
 
         # handle files
-        for entry in entries:
-            for field in entry.fields.all().order_by('field__position', 'id'):
-                if has_files and field.field.field_type == 'FileField':
-                    archive_name = join('files',field.value)
-                    if hasattr(settings, 'USE_S3_STORAGE') and settings.USE_S3_STORAGE:
-                        file_path = field.value
-                        try:
-                            # TODO: for large files, we may need to copy down
-                            # the files before adding them to the zip file.
-                            zip.writestr(archive_name, default_storage.open(file_path).read())
-                        except IOError:
-                            pass
-                    else:
-                        file_path = join(settings.MEDIA_ROOT,field.value)
-                        if default_storage.exists(file_path):
-                            zip.write(file_path, archive_name, zipfile.ZIP_DEFLATED)
-
+        if has_files:
+            file_values = FieldEntry.objects.filter(entry__in=entries,
+                                                    field__field_type='FileField'
+                                                    ).order_by('entry_id', 'field__position', 'pk'
+                                                    ).values_list('value', flat=True)
+            for value in file_values.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                archive_name = join('files', value)
+                if hasattr(settings, 'USE_S3_STORAGE') and settings.USE_S3_STORAGE:
+                    file_path = value
+                    try:
+                        # TODO: for large files, we may need to copy down
+                        # the files before adding them to the zip file.
+                        zip.writestr(archive_name, default_storage.open(file_path).read())
+                    except IOError:
+                        pass
+                else:
+                    file_path = join(settings.MEDIA_ROOT, value)
+                    if default_storage.exists(file_path):
+                        zip.write(file_path, archive_name, zipfile.ZIP_DEFLATED)
 
         # add the csv file to the zip, close it, and set the response
         if has_files:
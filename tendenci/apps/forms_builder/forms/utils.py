@@ -10,6 +10,7 @@ from tendenci.apps.invoices.models import Invoice
 from tendenci.apps.site_settings.utils import get_setting
 from tendenci.apps.forms_builder.forms.models import FormEntry, FieldEntry
 from tendenci.apps.base.utils import escape_csv, Echo
+from tendenci.apps.exports.utils import EXPORT_CHUNK_SIZE
 
 def generate_admin_email_body(entry, form_for_form, user=None):
     """
@@ -153,34 +154,46 @@ def update_invoice_for_entry(invoice, form):
     inv.save()
 
 
-def form_entries_to_csv_writer(csv_writer, form):
+def get_entry_columns(form):
     """
-    Write form entries to csv_writer.
+    The column names of the entries export of form, and the index
+    of the column of each field against its ID.
     """
     columns = []
     field_indexes = {}
-    file_field_ids = []
-    site_url = get_setting('site', 'global', 'siteurl')
     entry_time_name = FormEntry._meta.get_field("entry_time").verbose_name
     columns.append(str(entry_time_name))
     for field in form.fields.all().order_by('position', 'id'):
         if not field.field_type.split('.')[-1] in ['Description', 'Header']:
             columns.append(field.label)
-            field_indexes[field.id] = 1+len(field_indexes)
-            if field.field_type == "FileField":
-                file_field_ids.append(field.id)
+            field_indexes[field.id] = len(columns) - 1
     if form.custom_payment:
         columns.append(str("Pricing"))
         columns.append(str("Price"))
         columns.append(str("Payment Method"))
-    csv_writer.writerow(columns)
-    # Loop through each field value order by entry, building up each
-    # entry as a row.
-    entries = FormEntry.objects.filter(form=form).order_by('pk')
-    for entry in entries:
-        values = FieldEntry.objects.filter(entry=entry)
+    return columns, field_indexes
+
+
+def iter_form_entry_rows(form):
+    """
+    Yields the column names, then a row for each entry of form.
+
+    The field values of all the entries are read in one query ordered
+    by entry, in step with the entries, and each value is put in the
+    column of its field.
+    """
+    columns, field_indexes = get_entry_columns(form)
+    yield columns
+
+    entries = FormEntry.objects.filter(form=form).select_related(
+        'pricing', 'payment_method').order_by('pk')
+    values = FieldEntry.objects.filter(entry__form=form).order_by(
+        'entry_id', 'pk').values_list('entry_id', 'field_id', 'value').iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    value = next(values, None)
+
+    for entry in entries.iterator(chunk_size=EXPORT_CHUNK_SIZE):
         row = [""] * len(columns)
-        entry_time = entry.entry_time.strftime("%Y-%m-%d %H:%M:%S")
+        row[0] = entry.entry_time.strftime("%Y-%m-%d %H:%M:%S")
 
         if form.custom_payment:
             if entry.pricing:
@@ -191,84 +204,28 @@ def form_entries_to_csv_writer(csv_writer, form):
                     row[-2] = entry.pricing.price
             row[-1] = entry.payment_method
 
-        row[0] = entry_time
-
-        for field_entry in values:
-            if not field_entry.field.field_type.split('.')[-1] in ['Description', 'Header']:
-                value = escape_csv(field_entry.value)
-                # Create download URL for file fields.
-                # if field_entry.field_id in file_field_ids:
-                #     url = reverse("admin:forms_form_file", args=(field_entry.id,))
-                #     value = '{site_url}{url}'.format(site_url=site_url, url=url)
-                # Only use values for fields that currently exist for the form.
-                try:
-                    row[field_indexes[field_entry.field_id]] = value
-                except KeyError:
-                    pass
-        # Write out the row.
-        csv_writer.writerow(row)
+        while value is not None and value[0] <= entry.pk:
+            entry_id, field_id, field_value = value
+            # Only use values for fields that currently exist for the form.
+            if entry_id == entry.pk and field_id in field_indexes:
+                row[field_indexes[field_id]] = escape_csv(field_value)
+            value = next(values, None)
 
+        yield row
 
-def iter_form_entries(form):
+
+def form_entries_to_csv_writer(csv_writer, form):
     """
     Write form entries to csv_writer.
-    
-    Write out the column names and store the index of each field
-    against its ID for building each entry row. Also store the IDs of
-    fields with a type of FileField for converting their field values
     """
-    columns = []
-    field_indexes = {}
-    file_field_ids = []
-    entry_time_name = FormEntry._meta.get_field("entry_time").verbose_name
-    columns.append(str(entry_time_name))
-    for field in form.fields.all().order_by('position', 'id'):
-        if not field.field_type.split('.')[-1] in ['Description', 'Header']:
-            columns.append(field.label)
-            field_indexes[field.id] = 1+len(field_indexes)
-            if field.field_type == "FileField":
-                file_field_ids.append(field.id)
-    if form.custom_payment:
-        columns.append(str("Pricing"))
-        field_indexes[-3] = ''
-        columns.append(str("Price"))
-        field_indexes[-2] = ''
-        columns.append(str("Payment Method"))
-        field_indexes[-1] = ''
-
-    field_indexes[0] = 0
-    writer = csv.DictWriter(Echo(), fieldnames=field_indexes)
-    yield writer.writerow(dict(zip(field_indexes, columns)))
-    # Loop through each field value order by entry, building up each
-    # entry as a row.
-    entries = FormEntry.objects.filter(form=form).order_by('pk')
-    for entry in entries:
-        values = FieldEntry.objects.filter(entry=entry)
-        row = [""] * len(columns)
-        entry_time = entry.entry_time.strftime("%Y-%m-%d %H:%M:%S")
+    for row in iter_form_entry_rows(form):
+        csv_writer.writerow(row)
 
-        if form.custom_payment:
-            if entry.pricing:
-                row[-3] = entry.pricing.label
-                if not entry.pricing.price:
-                    row[-2] = entry.custom_price
-                else:
-                    row[-2] = entry.pricing.price
-            row[-1] = entry.payment_method
 
-        row[0] = entry_time
-
-        for field_entry in values:
-            if not field_entry.field.field_type.split('.')[-1] in ['Description', 'Header']:
-                value = escape_csv(field_entry.value)
-                # Create download URL for file fields.
-                # if field_entry.field_id in file_field_ids:
-                #     url = reverse("admin:forms_form_file", args=(field_entry.id,))
-                #     value = '{site_url}{url}'.format(site_url=site_url, url=url)
-                # Only use values for fields that currently exist for the form.
-                try:
-                    row[field_indexes[field_entry.field_id]] = value
-                except KeyError:
-                    pass
-        # Write out the row.
-        yield writer.writerow(dict(zip(field_indexes, row)))
+def iter_form_entries(form):
+    """
+    Yields the csv lines of the form entries, for a StreamingHttpResponse.
+    """
+    writer = csv.writer(Echo())
+    for row in iter_form_entry_rows(form):
+        yield writer.writerow(row)
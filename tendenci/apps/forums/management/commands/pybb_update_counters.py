@@ -4,17 +4,15 @@
 
 
 from django.core.management.base import BaseCommand
-from tendenci.apps.forums.models import Topic, Forum
+from tendenci.apps.forums.models import Topic, Forum, update_forum_counters, update_topic_counters
 
 class Command(BaseCommand):
-    help = 'Recalc post counters for forums and topics'
+    help = 'Recalc post counters and last posts for forums and topics'
 
     def handle(self, *args, **options):
 
-        for topic in Topic.objects.all():
-            topic.update_counters()
-            self.stdout.write('Successfully updated topic "%s"\n' % topic)
+        count = update_topic_counters(Topic.objects.all())
+        self.stdout.write('Successfully updated %d topics\n' % count)
 
-        for forum in Forum.objects.all():
-            forum.update_counters()
-            self.stdout.write('Successfully updated forum "%s"\n' % forum)
+        count = update_forum_counters(Forum.objects.all())
+        self.stdout.write('Successfully updated %d forums\n' % count)
@@ -0,0 +1,59 @@
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_counters(apps, schema_editor):
+    """
+    Fills in the last post pointers and recomputes the counters,
+    as update_topic_counters and update_forum_counters do.
+    """
+    Forum = apps.get_model("forums", "Forum")
+    Topic = apps.get_model("forums", "Topic")
+    Post = apps.get_model("forums", "Post")
+
+    posts = Post.objects.filter(topic=OuterRef('pk'))
+    last_posts = posts.order_by('-created', '-id')
+    Topic.objects.update(
+        last_post=Subquery(last_posts.values('pk')[:1]),
+        updated=Coalesce(Subquery(last_posts.annotate(
+            last_updated=Coalesce('updated', 'created')).values('last_updated')[:1]), F('updated')),
+        post_count=Coalesce(Subquery(posts.order_by().values('topic').annotate(
+            count=Count('pk')).values('count')), 0))
+
+    posts = Post.objects.filter(topic__forum=OuterRef('pk'))
+    last_posts = posts.order_by('-created', '-id')
+    Forum.objects.update(
+        last_post=Subquery(last_posts.values('pk')[:1]),
+        updated=Coalesce(Subquery(last_posts.annotate(
+            last_updated=Coalesce('updated', 'created')).values('last_updated')[:1]), F('updated')),
+        topic_count=Coalesce(Subquery(Topic.objects.filter(forum=OuterRef('pk')).order_by(
+            ).values('forum').annotate(count=Count('pk')).values('count')), 0),
+        post_count=Coalesce(Subquery(posts.order_by().values('topic__forum').annotate(
+            count=Count('pk')).values('count')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0011_forumsubscription_digest_type_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forum',
+            name='last_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forums.post', verbose_name='Last post'),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='last_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forums.post', verbose_name='Last post'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['topic', 'created', 'id'], name='forums_post_topic_created_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -11,7 +11,8 @@ from django.utils.html import strip_tags
 from django.utils.translation import gettext_lazy as _
 from django.utils.timezone import now as tznow
 from django.contrib.contenttypes.fields import GenericRelation
-from django.db.models import OneToOneField
+from django.db.models import Count, F, OneToOneField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.template.loader import render_to_string
 
 from tendenci.apps.perms.object_perms import ObjectPermission
@@ -62,6 +63,20 @@ class Category(TendenciBaseModel):
         return Post.objects.filter(topic__forum__category=self).select_related()
 
 
+# kept up to date with UPDATEs by the posts, so saving an instance
+# loaded earlier doesn't overwrite them (see get_update_fields)
+COUNTER_FIELDS = ('post_count', 'last_post', 'updated')
+
+
+def get_update_fields(instance, exclude):
+    """
+    The fields saving an existing instance writes: all but
+    the counters in exclude.
+    """
+    return [field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in exclude]
+
+
 class Forum(models.Model):
     category = models.ForeignKey(Category, related_name='forums', verbose_name=_('Category'), on_delete=models.CASCADE)
     parent = models.ForeignKey('self', related_name='child_forums', verbose_name=_('Parent forum'),
@@ -73,6 +88,8 @@ class Forum(models.Model):
     updated = models.DateTimeField(_('Updated'), blank=True, null=True)
     post_count = models.IntegerField(_('Post count'), blank=True, default=0)
     topic_count = models.IntegerField(_('Topic count'), blank=True, default=0)
+    last_post = models.ForeignKey('Post', related_name='+', verbose_name=_('Last post'),
+                                  blank=True, null=True, editable=False, on_delete=models.SET_NULL)
     hidden = models.BooleanField(_('Hidden'), blank=False, null=False, default=False)
     readed_by = models.ManyToManyField(get_user_model_path(), through='ForumReadTracker', related_name='readed_forums')
     headline = models.TextField(_('Headline'), blank=True, null=True)
@@ -87,20 +104,14 @@ class Forum(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self.pk is not None and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = get_update_fields(self, COUNTER_FIELDS + ('topic_count',))
+        super(Forum, self).save(*args, **kwargs)
+
     def update_counters(self):
-        self.topic_count = Topic.objects.filter(forum=self).count()
-        if self.topic_count:
-            posts = Post.objects.filter(topic__forum_id=self.id)
-            self.post_count = posts.count()
-            if self.post_count:
-                try:
-                    last_post = posts.order_by('-created', '-id')[0]
-                    self.updated = last_post.updated or last_post.created
-                except IndexError:
-                    pass
-        else:
-            self.post_count = 0
-        self.save()
+        update_forum_counters(Forum.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['topic_count', 'post_count', 'last_post', 'updated'])
 
     def get_absolute_url(self):
         if defaults.PYBB_NICE_URL:
@@ -111,13 +122,6 @@ class Forum(models.Model):
     def posts(self):
         return Post.objects.filter(topic__forum=self).select_related()
 
-    @cached_property
-    def last_post(self):
-        try:
-            return self.posts.order_by('-created', '-id')[0]
-        except IndexError:
-            return None
-
     def get_parents(self):
         """
         Used in templates for breadcrumb building
@@ -285,6 +289,8 @@ class Topic(models.Model):
     subscribers = models.ManyToManyField(get_user_model_path(), related_name='subscriptions',
                                          verbose_name=_('Subscribers'), blank=True)
     post_count = models.IntegerField(_('Post count'), blank=True, default=0)
+    last_post = models.ForeignKey('Post', related_name='+', verbose_name=_('Last post'),
+                                  blank=True, null=True, editable=False, on_delete=models.SET_NULL)
     readed_by = models.ManyToManyField(get_user_model_path(), through='TopicReadTracker', related_name='readed_topics')
     on_moderation = models.BooleanField(_('On moderation'), default=False)
     poll_type = models.IntegerField(_('Poll type'), choices=POLL_TYPE_CHOICES, default=POLL_TYPE_NONE)
@@ -307,47 +313,48 @@ class Topic(models.Model):
         except IndexError:
             return None
 
-    @cached_property
-    def last_post(self):
-        try:
-            return self.posts.order_by('-created', '-id').select_related('user')[0]
-        except IndexError:
-            return None
-
     def get_absolute_url(self):
         if defaults.PYBB_NICE_URL:
             return reverse('pybb:topic', kwargs={'slug': self.slug, 'forum_slug': self.forum.slug, 'category_slug': self.forum.category.slug})
         return reverse('pybb:topic', kwargs={'pk': self.id})
 
     def save(self, *args, **kwargs):
-        if self.id is None:
+        new = self.id is None
+        if new:
             self.created = self.updated = tznow()
 
         forum_changed = False
         old_topic = None
-        if self.id is not None:
+        if not new:
             old_topic = Topic.objects.get(id=self.id)
-            if self.forum != old_topic.forum:
+            if self.forum_id != old_topic.forum_id:
                 forum_changed = True
+            if not args and kwargs.get('update_fields') is None:
+                exclude = COUNTER_FIELDS
+                # an edit of the head post moves the updated date forward
+                if self.updated and (old_topic.updated is None or self.updated > old_topic.updated):
+                    exclude = ('post_count', 'last_post')
+                kwargs['update_fields'] = get_update_fields(self, exclude)
 
         super(Topic, self).save(*args, **kwargs)
 
-        if forum_changed:
-            old_topic.forum.update_counters()
-            self.forum.update_counters()
+        if new:
+            Forum.objects.filter(pk=self.forum_id).update(topic_count=F('topic_count') + 1)
+        elif forum_changed:
+            update_forum_counters(Forum.objects.filter(pk__in=[old_topic.forum_id, self.forum_id]))
 
     def delete(self, using=None):
+        post_count = self.posts.count()
         super(Topic, self).delete(using)
-        self.forum.update_counters()
+        Forum.objects.filter(pk=self.forum_id).update(topic_count=F('topic_count') - 1,
+                                                      post_count=F('post_count') - post_count)
+        # the last post of the forum may have been deleted with the topic
+        update_forum_counters(Forum.objects.filter(pk=self.forum_id, last_post__isnull=True),
+                              counts=False)
 
     def update_counters(self):
-        self.post_count = self.posts.count()
-        # force cache overwrite to get the real latest updated post
-        if hasattr(self, 'last_post'):
-            del self.last_post
-        if self.last_post:
-            self.updated = self.last_post.updated or self.last_post.created
-        self.save()
+        update_topic_counters(Topic.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['post_count', 'last_post', 'updated'])
 
     def get_parents(self):
         """
@@ -398,6 +405,10 @@ class Post(RenderableItem):
         ordering = ['created']
         verbose_name = _('Post')
         verbose_name_plural = _('Posts')
+        indexes = [
+            # the last post of a topic
+            models.Index(fields=['topic', 'created', 'id'], name='forums_post_topic_created_idx'),
+        ]
 
     def summary(self):
         limit = 50
@@ -427,13 +438,31 @@ class Post(RenderableItem):
         # If post is topic head and moderated, moderate topic too
         if self.topic.head == self and not self.on_moderation and self.topic.on_moderation:
             self.topic.on_moderation = False
+            Topic.objects.filter(pk=self.topic_id).update(on_moderation=False)
 
-        self.topic.update_counters()
-        self.topic.forum.update_counters()
+        if new:
+            self.add_to_counters()
+        elif topic_changed:
+            update_topic_counters(Topic.objects.filter(pk__in=[old_post.topic_id, self.topic_id]))
+            update_forum_counters(Forum.objects.filter(pk__in=[old_post.topic.forum_id, self.topic.forum_id]))
+        else:
+            # an edit changes the updated date of the topic and
+            # forum it is the last post of
+            updated = self.updated or self.created
+            Topic.objects.filter(pk=self.topic_id, last_post=self).update(updated=updated)
+            Forum.objects.filter(pk=self.topic.forum_id, last_post=self).update(updated=updated)
 
-        if topic_changed:
-            old_post.topic.update_counters()
-            old_post.topic.forum.update_counters()
+    def add_to_counters(self):
+        """
+        Counts a new post in its topic and forum, and makes it
+        their last post unless a later one is already.
+        """
+        updated = self.updated or self.created
+        later = Q(last_post__created__gt=self.created)
+        Topic.objects.filter(pk=self.topic_id).update(post_count=F('post_count') + 1)
+        Topic.objects.filter(pk=self.topic_id).exclude(later).update(last_post=self, updated=updated)
+        Forum.objects.filter(pk=self.topic.forum_id).update(post_count=F('post_count') + 1)
+        Forum.objects.filter(pk=self.topic.forum_id).exclude(later).update(last_post=self, updated=updated)
 
     def get_absolute_url(self):
         return reverse('pybb:post', kwargs={'pk': self.id})
@@ -446,8 +475,13 @@ class Post(RenderableItem):
             self.topic.delete()
         else:
             super(Post, self).delete(*args, **kwargs)
-            self.topic.update_counters()
-            self.topic.forum.update_counters()
+            Topic.objects.filter(pk=self.topic_id).update(post_count=F('post_count') - 1)
+            Forum.objects.filter(pk=self.topic.forum_id).update(post_count=F('post_count') - 1)
+            # the last post pointers to this post were cleared by the delete
+            update_topic_counters(Topic.objects.filter(pk=self.topic_id, last_post__isnull=True),
+                                  post_count=False)
+            update_forum_counters(Forum.objects.filter(pk=self.topic.forum_id, last_post__isnull=True),
+                                  counts=False)
 
     def get_parents(self):
         """
@@ -461,6 +495,47 @@ class Post(RenderableItem):
         return body_html_abs.replace("href=\"/", f"href=\"{site_url}/")
 
 
+def update_topic_counters(topics, post_count=True):
+    """
+    Recomputes the post count, last post and updated date
+    of the topics of a queryset in a single UPDATE.
+    """
+    Post = topics.model._meta.get_field('posts').related_model
+    posts = Post.objects.filter(topic=OuterRef('pk'))
+    last_posts = posts.order_by('-created', '-id')
+    values = {
+        'last_post': Subquery(last_posts.values('pk')[:1]),
+        'updated': Coalesce(Subquery(last_posts.annotate(
+            last_updated=Coalesce('updated', 'created')).values('last_updated')[:1]), F('updated')),
+    }
+    if post_count:
+        values['post_count'] = Coalesce(Subquery(posts.order_by().values('topic').annotate(
+            count=Count('pk')).values('count')), 0)
+    return topics.update(**values)
+
+
+def update_forum_counters(forums, counts=True):
+    """
+    Recomputes the topic and post counts, last post and updated
+    date of the forums of a queryset in a single UPDATE.
+    """
+    Topic = forums.model._meta.get_field('topics').related_model
+    Post = Topic._meta.get_field('posts').related_model
+    posts = Post.objects.filter(topic__forum=OuterRef('pk'))
+    last_posts = posts.order_by('-created', '-id')
+    values = {
+        'last_post': Subquery(last_posts.values('pk')[:1]),
+        'updated': Coalesce(Subquery(last_posts.annotate(
+            last_updated=Coalesce('updated', 'created')).values('last_updated')[:1]), F('updated')),
+    }
+    if counts:
+        values['topic_count'] = Coalesce(Subquery(Topic.objects.filter(forum=OuterRef('pk')).order_by(
+            ).values('forum').annotate(count=Count('pk')).values('count')), 0)
+        values['post_count'] = Coalesce(Subquery(posts.order_by().values('topic__forum').annotate(
+            count=Count('pk')).values('count')), 0)
+    return forums.update(**values)
+
+
 class Profile(PybbProfile):
     """
     Profile class that can be used if you doesn't have
@@ -29,7 +29,8 @@ from .compat import get_atomic_func
 from .forms import (PostForm, AdminPostForm, PollAnswerFormSet,
                     PollForm, ForumSubscriptionForm)
 from .models import (Category, Forum, Topic, Post, TopicReadTracker,
-                     ForumReadTracker, PollAnswerUser, ForumSubscription)
+                     ForumReadTracker, PollAnswerUser, ForumSubscription,
+                     update_forum_counters, update_topic_counters)
 from .permissions import perms
 from .templatetags.pybb_tags import pybb_topic_poll_not_voted
 
@@ -85,7 +86,8 @@ class IndexView(IsEnabledMixin, generic.ListView):
         ctx = super(IndexView, self).get_context_data(**kwargs)
         categories = ctx['categories']
         for category in categories:
-            category.forums_accessed = perms.filter_forums(self.request.user, category.forums.filter(parent=None))
+            category.forums_accessed = perms.filter_forums(self.request.user, category.forums.filter(
+                parent=None).select_related('category').prefetch_related('child_forums'))
         ctx['categories'] = categories
         return ctx
 
@@ -114,7 +116,8 @@ class CategoryView(IsEnabledMixin, RedirectToLoginMixin, generic.DetailView):
 
     def get_context_data(self, **kwargs):
         ctx = super(CategoryView, self).get_context_data(**kwargs)
-        ctx['category'].forums_accessed = perms.filter_forums(self.request.user, ctx['category'].forums.filter(parent=None))
+        ctx['category'].forums_accessed = perms.filter_forums(self.request.user, ctx['category'].forums.filter(
+            parent=None).select_related('category').prefetch_related('child_forums'))
         ctx['categories'] = [ctx['category']]
         return ctx
 
@@ -150,14 +153,16 @@ class ForumView(IsEnabledMixin, RedirectToLoginMixin, PaginatorMixin, generic.Li
                 ctx['subscription'] = None
         else:
             ctx['subscription'] = None
-        ctx['forum'].forums_accessed = perms.filter_forums(self.request.user, self.forum.child_forums.all())
+        ctx['forum'].forums_accessed = perms.filter_forums(self.request.user, self.forum.child_forums.select_related(
+            'category').prefetch_related('child_forums'))
         return ctx
 
     def get_queryset(self):
         if not perms.may_view_forum(self.request.user, self.forum):
             raise PermissionDenied
 
-        qs = self.forum.topics.order_by('-sticky', '-updated', '-id').select_related()
+        qs = self.forum.topics.order_by('-sticky', '-updated', '-id').select_related(
+            'forum__category', 'user')
         qs = perms.filter_topics(self.request.user, qs)
         return qs
 
@@ -854,20 +859,13 @@ def block_user(request, username):
         # individually delete each post and empty topic to fire method
         # with forum/topic counters recalculation
         posts = Post.objects.filter(user=user)
-        topics = posts.values('topic_id').distinct()
-        forums = posts.values('topic__forum_id').distinct()
+        topic_ids = list(posts.order_by().values_list('topic_id', flat=True).distinct())
+        forum_ids = list(posts.order_by().values_list('topic__forum_id', flat=True).distinct())
+        forum_ids += list(Topic.objects.filter(user=user).values_list('forum_id', flat=True))
         posts.delete()
         Topic.objects.filter(user=user).delete()
-        for t in topics:
-            try:
-                Topic.objects.get(id=t['topic_id']).update_counters()
-            except Topic.DoesNotExist:
-                pass
-        for f in forums:
-            try:
-                Forum.objects.get(id=f['topic__forum_id']).update_counters()
-            except Forum.DoesNotExist:
-                pass
+        update_topic_counters(Topic.objects.filter(id__in=topic_ids))
+        update_forum_counters(Forum.objects.filter(id__in=forum_ids))
 
     msg = _('User successfuly blocked')
     messages.success(request, msg, fail_silently=True)
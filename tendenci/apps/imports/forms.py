@@ -15,6 +15,8 @@ class UserImportForm(forms.Form):
     file  = forms.FileField(widget=forms.FileInput(attrs={'size': 35}))
     interactive = forms.CharField(widget=forms.RadioSelect(choices=((True,_('Interactive')),
                                                           (False,_('Not Interactive (no login)')),)), initial=False,)
+    exclude_is_active = forms.BooleanField(initial=False, required=False,
+                                           label=_('Apply the above the Interactive/Non-interactive to new users ONLY.'))
     override = forms.CharField(widget=forms.RadioSelect(choices=((False,_('Blank Fields')),
                                                           (True,_('All Fields (override)')),)), initial=False, )
     key = forms.ChoiceField(initial="email", choices=KEY_CHOICES)
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Imports the users of a user import (imports.Import), streaming its
+    file chunk by chunk. The progress is saved with each chunk, so an
+    import that was interrupted (or failed) resumes where it stopped
+    when the command is run again.
+
+    Usage:
+        python manage.py process_user_import [import_id]
+
+        example:
+        python manage.py process_user_import 12 --chunk-size 1000
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('import_id', type=int)
+        parser.add_argument('--chunk-size',
+            type=int,
+            dest='chunk_size',
+            default=None,
+            help='Number of rows imported at once (IMPORTS_USER_CHUNK_SIZE by default)')
+
+    def handle(self, *args, **options):
+        from tendenci.apps.imports.models import Import
+        from tendenci.apps.imports.utils import process_user_import
+
+        try:
+            import_i = Import.objects.get(pk=options['import_id'])
+        except Import.DoesNotExist:
+            raise CommandError('Import %s does not exist' % options['import_id'])
+
+        if import_i.status == 'completed':
+            print('Import has already been completed.')
+            return
+        if import_i.rows_done:
+            print('Resuming import at row %d of %d' % (import_i.rows_done, import_i.total_rows))
+
+        import_i = process_user_import(import_i, chunk_size=options['chunk_size'])
+
+        print('%s: %d rows, %d inserted, %d updated, %d invalid' % (
+            import_i.get_status_display(), import_i.rows_done, import_i.total_created,
+            import_i.total_updated, import_i.total_invalid))
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('imports', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='import',
+            name='key',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='import',
+            name='override',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='import',
+            name='interactive',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='import',
+            name='group_id',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='import',
+            name='clear_group_membership',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='import',
+            name='creator',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='import',
+            name='total_rows',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='import',
+            name='rows_done',
+            field=models.IntegerField(default=0),
+        ),
+    ]
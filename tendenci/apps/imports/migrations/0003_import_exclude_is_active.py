@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imports', '0002_user_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='import',
+            name='exclude_is_active',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,6 +1,7 @@
 import uuid
 import re
 
+from django.contrib.auth.models import User
 from django.db import models
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -31,6 +32,18 @@ class Import(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     date_done = models.DateTimeField(auto_now=True)
 
+    # settings and progress of the user imports, which are processed
+    # chunk by chunk by the process_user_import command
+    key = models.CharField(max_length=50, blank=True, default='')
+    override = models.BooleanField(default=False)
+    interactive = models.BooleanField(default=False)
+    exclude_is_active = models.BooleanField(default=False)
+    group_id = models.IntegerField(default=0)
+    clear_group_membership = models.BooleanField(default=False)
+    creator = models.ForeignKey(User, null=True, default=None, on_delete=models.SET_NULL)
+    total_rows = models.IntegerField(default=0)
+    rows_done = models.IntegerField(default=0)
+
     def get_absolute_url(self):
         return reverse('import.status', args=[self.app_label, self.model_name])
 
@@ -1,27 +1,39 @@
 from builtins import str
 import os
+import codecs
 import datetime
 import re
 import csv
+import uuid
+from functools import reduce
+from io import StringIO
+from itertools import islice
+from operator import or_
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction, DEFAULT_DB_ALIAS
+from django.db.models.functions import Lower
+from django.db.models.signals import post_save
 from django.http import HttpResponse
-from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError
 from django.db.models.fields import AutoField
 from django.utils.encoding import smart_str
 from tendenci.apps.base.utils import validate_email
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 
 import xlrd3 as xlrd
 from xlwt import Workbook, XFStyle
+from tendenci.apps.imports.models import Import
 from tendenci.apps.user_groups.models import GroupMembership
 from tendenci.apps.profiles.models import Profile
 from tendenci.apps.base.utils import normalize_newline
+from tendenci.apps.site_settings.utils import get_setting
 
 
-# number rows to process per request
-ROWS_TO_PROCESS = 10
+# number of rows shown on the preview page
+PREVIEW_ROWS = 100
 
 # field.__class__.__name__
 # DateTimeField
@@ -41,6 +53,24 @@ field_type_dict.update(dict(zip(profile_field_names, profile_field_types)))
 profile_fields = None
 profile_field_types = None
 
+# the fields a user import sets
+user_import_fields = [field for field in User._meta.fields if field.editable
+                      and not field.__class__ == AutoField
+                      and field.name not in ('password', 'username')]
+profile_import_fields = [field for field in Profile._meta.fields if field.editable
+                         and not field.__class__ == AutoField
+                         and not field.is_relation and field.name != 'guid']
+# the fields saved by bulk_update, including those set by the import itself
+user_update_fields = list(dict.fromkeys([field.name for field in user_import_fields] +
+                                        ['email', 'is_active', 'password']))
+profile_update_fields = list(dict.fromkeys([field.name for field in profile_import_fields] +
+                                           ['allow_anonymous_view', 'allow_user_view',
+                                            'allow_member_view', 'region', 'state',
+                                            'account_id', 'update_dt']))
+
+# the user columns of the recap of a user import
+RECAP_USER_FIELDS = ['username', 'first_name', 'last_name', 'email']
+
 
 def handle_uploaded_file(f, file_path):
     destination = default_storage.open(file_path, 'wb+')
@@ -49,35 +79,6 @@ def handle_uploaded_file(f, file_path):
     destination.close()
 
 
-def get_user_import_settings(request, id):
-    d = {}
-
-    if id not in request.session:
-        return d
-
-    d['file_name'] = (request.session[id]).get('file_name', u'')
-    d['interactive'] = request.session[id].get('interactive', False)
-    d['override'] = request.session[id].get('override', False)
-    d['key'] = request.session[id].get('key', u'')
-    d['group'] = request.session[id].get('group', u'')
-    d['clear_group_membership'] = request.session[id].get(
-                                'clear_group_membership', False
-                                )
-
-    if d['override'] == "False":
-        d['override'] = False
-
-    if d['interactive'] == "False":
-        d['interactive'] = False
-
-    if d['override']:
-        d['str_update'] = 'Override All Fields'
-    else:
-        d['str_update'] = 'Update Blank Fields'
-
-    return d
-
-
 def render_excel(filename, title_list, data_list, file_extension='.xls'):
     if file_extension == '.csv':
         response = HttpResponse(content_type='text/csv')
@@ -156,260 +157,474 @@ def render_excel(filename, title_list, data_list, file_extension='.xls'):
     return response
 
 
-def user_import_process(request, setting_dict, preview=True, id=''):
+def detect_encoding(file_path):
     """
-    This function processes each row and store the data
-    in the user_object_dict. Then it updates the database
-    if preview=False.
+    The encoding of a csv file, detected from its beginning.
     """
-    key_list = setting_dict['key'].split(',')
-    # key(s)- user field(s) or profile fields(s)? that is import to identify
-    key_user_list = [key for key in key_list if key in user_field_names]
-    key_profile_list = [key for key in key_list if key in profile_field_names]
-
-    setting_dict['total'] = request.session[id].get('total',  0)
-    setting_dict['count_insert'] = 0
-    setting_dict['count_update'] = 0
-    setting_dict['count_invalid'] = 0
-
-    data_dict_list = request.session[id].get('data_dict_list',  [])
-    data_dict_list_len = len(data_dict_list)
-
-    user_obj_list = []
-    invalid_list = []
-
-    start = 0
-    if not preview:
-        finish = start + ROWS_TO_PROCESS
-        if finish > data_dict_list_len:
-            finish = data_dict_list_len
-    else:
-        finish = data_dict_list_len
+    import chardet
+    with default_storage.open(file_path, 'rb') as f:
+        char_det = chardet.detect(f.read(65536))
+    encoding = char_det['encoding']
+    if not encoding or char_det['confidence'] < 0.6:
+        encoding = 'utf-8'
+    if encoding.lower() in ('ascii', 'utf-8'):
+        # the beginning of a utf-8 file is often plain ascii;
+        # utf-8-sig also drops the byte order mark excel writes
+        encoding = 'utf-8-sig'
+    return encoding
+
+
+def iter_csv_rows(file_path):
+    """
+    Yields the rows of a csv file as dicts, with their ROW_NUM.
+    The file is read from the storage line by line and never loaded
+    whole; its new lines are normalized once, when it is uploaded
+    (see imports.views.user_upload_add), as codecs.iterdecode only
+    splits lines on line feeds.
+    """
+    import dateutil.parser as dparser
+
+    with default_storage.open(file_path, 'rb') as f:
+        data = csv.reader(codecs.iterdecode(f, detect_encoding(file_path), errors='replace'))
 
-    for r in range(start, finish):
-        user_object_dict = {}
-        if not preview:
-            user_import_dict = {}
-        identity_user_dict = {}  # used to look up the User
-        identity_profile_dict = {}  # used to look up the Profile
-        missing_keys = []
+        # read the column header
+        fields = [smart_str(field) for field in next(data, [])]
 
-        data_dict = data_dict_list[r]
+        for row_num, row in enumerate(data, start=2):
+            if not any(row):
+                continue
+            item = dict(zip(fields, row))
+            for key in item:
+                if field_type_dict.get(key) == 'DateTimeField' and item[key]:
+                    try:
+                        item[key] = dparser.parse(item[key])
+                    except (ValueError, OverflowError):
+                        # left as is, the row is reported invalid
+                        pass
+            item['ROW_NUM'] = row_num
+            yield item
 
-        missing_keys = [key for key in data_dict
-                        if key in key_list
-                        and data_dict[key] == '']
 
-        for key in data_dict:
-            user_object_dict[key] = data_dict[key]
+def iter_user_import_rows(file_path, start=0):
+    """
+    Yields the rows of a user import file, csv or xls, as dicts with
+    their ROW_NUM, skipping the first start rows.
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == '.csv':
+        rows = iter_csv_rows(file_path)
+    elif file_ext == '.xls':
+        rows = iter_xls_rows(file_path)
+    else:
+        raise NameError(
+    "%s is not a valid file type (should be either .csv or .xls)." % file_path
+        )
+    return islice(rows, start, None)
+
 
-            if key in key_list and data_dict[key] != '':
-                if key in key_user_list:
-                    identity_user_dict[key] = data_dict[key]
-                if key in key_profile_list:
-                    identity_profile_dict[key] = data_dict[key]
+def get_key_lookup(key):
+    # the lookup of an identity key on User
+    if key in user_field_names:
+        return key
+    return 'profile__%s' % key
 
-        user_object_dict['ROW_NUM'] = data_dict['ROW_NUM']
 
-        if missing_keys:
-            user_object_dict['ERROR'] = 'Missing key: %s.' % (
-                            ', '.join(missing_keys))
-            user_object_dict['IS_VALID'] = False
-            setting_dict['count_invalid'] += 1
-            if not preview:
-                invalid_list.append({'ROW_NUM': user_object_dict['ROW_NUM'],
-                                     'ERROR': user_object_dict['ERROR']})
-        else:
-            user_object_dict['IS_VALID'] = True
+def get_key_value(user, key):
+    if key in user_field_names:
+        return getattr(user, key)
+    try:
+        return getattr(user.profile, key)
+    except Profile.DoesNotExist:
+        return None
 
-            # the keys could be the fields in both User and Profile tables
-            user = get_user_by_key(identity_user_dict, identity_profile_dict)
-            if user:
-                if preview:
-                    user_object_dict['ACTION'] = 'update'
-                else:
-                    user_import_dict['ACTION'] = 'update'
-                setting_dict['count_update'] += 1
-
-                if preview:
-                    populate_user_dict(user, user_object_dict, setting_dict)
-            else:
-                #user = None
-                if preview:
-                    user_object_dict['ACTION'] = 'insert'
-                else:
-                    user_import_dict['ACTION'] = 'insert'
-                setting_dict['count_insert'] += 1
-
-            if not preview:
-                user = do_user_import(request, user,
-                                      user_object_dict,
-                                      setting_dict)
-                user_import_dict['user'] = user
-                user_import_dict['ROW_NUM'] = user_object_dict['ROW_NUM']
-                user_obj_list.append(user_import_dict)
-
-        if preview:
-            user_obj_list.append(user_object_dict)
-
-    if not preview:
-        if finish < data_dict_list_len:
-            # not finished yet, store some data in the session
-            count_insert = request.session[id].get('count_insert',  0) + \
-            setting_dict['count_insert']
-            count_update = request.session[id].get('count_update',  0) + \
-            setting_dict['count_update']
-
-            setting_dict['is_completed'] = False
-
-            for r in range(start, finish):
-                # remove those already processed rows
-                data_dict_list.remove(data_dict_list[0])
-
-            d = request.session[id]
-            d.update({'is_completed': False,
-                      'count_insert': count_insert,
-                      'count_update': count_update,
-                      'data_dict_list': data_dict_list})
-            request.session[id] = d
-        else:
-            setting_dict['is_completed'] = True
-            setting_dict['count_insert'] += request.session[id].get(
-                                        'count_insert', 0)
-            setting_dict['count_update'] += request.session[id].get(
-                                            'count_update', 0)
-            d = request.session[id]
-            d.update({'is_completed': True})
-            request.session[id] = d
-
-    return user_obj_list, invalid_list
-
-
-def get_user_by_key(identity_user_dict, identity_profile_dict):
-    user = None
-
-    if identity_user_dict and identity_profile_dict:
-        users = User.objects.filter(**identity_user_dict)
-        profiles = Profile.objects.filter(user__in=users).filter(
-                        **identity_profile_dict
-                        )
-        if profiles:
-            user = profiles[0].user
-    elif identity_user_dict:
-        users = User.objects.filter(**identity_user_dict)
-        if users:
-            user = users[0]
-    else:
-        profiles = Profile.objects.filter(**identity_profile_dict)
-        if profiles:
-            user = profiles[0].user
 
-    return user
+def get_row_key(row, key_list):
+    # the identity keys are matched case-insensitively
+    return tuple(str(row[key]).lower() for key in key_list)
 
 
-def do_user_import(request, user, user_object_dict, setting_dict):
+def get_users_by_keys(rows, key_list):
+    """
+    Looks up the existing users matching the identity keys of rows,
+    case-insensitively, with one query. Returns a dict {key values: user};
+    when several users match the same values, the active, then superuser,
+    then staff ones are preferred, like the profiles importer did.
     """
-        the real work is here - do the insert or update
+    if not rows:
+        return {}
+    annotations = dict(('%s_lower' % key, Lower(get_key_lookup(key))) for key in key_list)
+    lookups = dict(('%s_lower__in' % key, set(str(row[key]).lower() for row in rows))
+                   for key in key_list)
+    users = User.objects.annotate(**annotations).filter(**lookups).select_related(
+                'profile').order_by('-is_active', '-is_superuser', '-is_staff', 'pk')
+    users_by_keys = {}
+    for user in users:
+        users_by_keys.setdefault(tuple(str(get_key_value(user, key)).lower() for key in key_list), user)
+    return users_by_keys
+
+
+def get_unique_account_id(account_id, profile, taken_account_ids, chunk_account_ids):
     """
+    The account_id a row gives to profile, with '1' appended as long as it
+    is the account_id of another profile or of an earlier row of the file,
+    as ImportUsers.set_unique_account_id did. taken_account_ids maps the
+    account ids looked up so far to the pk of their profile (None if free).
+    """
+    def is_taken(account_id):
+        if account_id in chunk_account_ids:
+            return True
+        if account_id not in taken_account_ids:
+            taken_account_ids[account_id] = Profile.objects.filter(
+                account_id=account_id).values_list('pk', flat=True).first()
+        owner_pk = taken_account_ids[account_id]
+        return owner_pk is not None and owner_pk != profile.pk
 
-    insert = not bool(user)  # insert or update
-    user = user or User()  # existing or new user
-    override = setting_dict['override']  # update ALL fields
+    while is_taken(account_id):
+        account_id = int('%s1' % account_id)
+    return account_id
 
-    # insert/update user
-    for field in user_field_names:
-        if field == 'password' or field == 'username' or \
-            (not insert and field in setting_dict['key']):
-            continue
-        if field in user_object_dict:
-            if override:
-                setattr(user, field, user_object_dict[field])
-            else:
-                # fill out the blank field only
-                if getattr(user, field) == '':
-                    setattr(user, field, user_object_dict[field])
 
-    if insert:
-        if 'username' in user_object_dict:  # set username
-            user.username = user_object_dict['username']
+def assign_import_values(instance, fields, row, override=True):
+    """
+    Sets the fields of instance from row. Without override, only the
+    blank fields are set. Raises ValidationError for a value that doesn't
+    fit its field.
+    """
+    for field in fields:
+        if field.name not in row:
+            continue
+        value = row[field.name]
+        if value == '' and not isinstance(field, (models.CharField, models.TextField)):
+            # no blank dates or numbers, leave the field alone
+            continue
+        if not override and getattr(instance, field.attname) != '':
+            # fill out the blank field only
+            continue
+        value = field.to_python(value)
+        if field.max_length and isinstance(value, str):
+            value = value[:field.max_length]
+        setattr(instance, field.attname, value)
 
-        # generate if not username
-        user.username = get_unique_username(user)
 
-    if 'password' in user_object_dict and (insert or override):
-        user.set_password(user_object_dict['password'])
+def get_unique_usernames(users):
+    """
+    Assigns a unique username to each of users, new users that are not
+    saved yet, looking up the usernames taken with one query.
+    """
+    bases = [get_username_base(user) for user in users]
+    lookups = [models.Q(username__istartswith=base) for base in set(bases) if base]
+    if not lookups:
+        return
+    taken = set(username.lower() for username in User.objects.filter(
+                reduce(or_, lookups)).values_list('username', flat=True))
+
+    for user, base in zip(users, bases):
+        username = base
+        num = 1
+        while username.lower() in taken:
+            username = '%s%s' % (base, num)
+            num += 1
+        taken.add(username.lower())
+        user.username = username
 
-    if not user.password:
-        user.set_password(User.objects.make_random_password(length=8))
 
-    user.is_active = bool(setting_dict['interactive'])
+def import_user_rows(import_i, rows, preview=False):
+    """
+    Processes a chunk of rows of a user import. The existing users are
+    looked up with one query; unless preview, the new users and profiles
+    are then inserted, and the existing ones updated, in bulk.
 
-    if not bool(validate_email(user.email)):
-        user.email = ''  # if not valid; empty it out
+    Returns a dict per row: a copy of the row with its ACTION (insert,
+    update or skip), IS_VALID and ERROR, and unless preview, its user.
+    """
+    key_list = import_i.key.split(',')
+    results = []
+    valid_rows = []
+    for row in rows:
+        result = dict(row)
+        missing_keys = [key for key in key_list if str(row.get(key, '')) == '']
+        if missing_keys:
+            result.update({'ACTION': 'skip', 'IS_VALID': False,
+                           'ERROR': 'Missing key: %s.' % ', '.join(missing_keys)})
+        else:
+            result.update({'ACTION': 'update', 'IS_VALID': True, 'ERROR': ''})
+            valid_rows.append((row, result))
+        results.append(result)
+
+    existing_users = get_users_by_keys([row for row, result in valid_rows], key_list)
+    # the earlier chunks are committed, so the account ids of the earlier
+    # rows of the file are either in the database or in chunk_account_ids
+    account_ids = set()
+    for row, result in valid_rows:
+        try:
+            account_ids.add(int(row['account_id']))
+        except (KeyError, TypeError, ValueError):
+            pass
+    taken_account_ids = dict.fromkeys(account_ids)
+    taken_account_ids.update(Profile.objects.filter(
+        account_id__in=account_ids).values_list('account_id', 'pk'))
+    chunk_account_ids = set()
+    # the users inserted by this chunk, a later row with the same
+    # keys updates them
+    new_users = {}
+
+    if preview:
+        for row, result in valid_rows:
+            row_key = get_row_key(row, key_list)
+            user = existing_users.get(row_key)
+            if user:
+                populate_user_dict(user, result, {'override': import_i.override})
+            elif row_key not in new_users:
+                new_users[row_key] = None
+                result['ACTION'] = 'insert'
+        return results
+
+    request_user = import_i.creator
+    owner = {'creator': request_user,
+             'creator_username': getattr(request_user, 'username', ''),
+             'owner': request_user,
+             'owner_username': getattr(request_user, 'username', '')}
+    new_user_ids = set()
+    updated_users = {}
+    # the profile of each user, by id() as the new users have no pk yet
+    profiles = {}
+    new_profiles = []
+    for row, result in valid_rows:
+        row_key = get_row_key(row, key_list)
+        user = existing_users.get(row_key) or new_users.get(row_key)
+        insert = user is None
+        if insert:
+            user = User()
+        profile = profiles.get(id(user))
+        if profile is None:
+            try:
+                profile = user.profile
+            except (Profile.DoesNotExist, ValueError):
+                profile = Profile(user=user, guid=str(uuid.uuid4()), **owner)
+        old_account_id = profile.account_id
 
-    # loop through user properties; truncate at max_length
-    for key, value in user.__dict__.items():
-        max_length = 90
         try:
-            max_length = User._meta.get_field(key).max_length
-        except FieldDoesNotExist:
-            max_length = None
-        if max_length:  # truncate per max_length field attribute
-            setattr(user, key, value[:max_length])
+            assign_import_values(user, [field for field in user_import_fields
+                                        if insert or field.name not in key_list],
+                                 row, override=insert or import_i.override)
+            assign_import_values(profile, profile_import_fields, row,
+                                 override=not profile.pk or import_i.override)
+        except ValidationError as e:
+            result.update({'ACTION': 'skip', 'IS_VALID': False, 'ERROR': '; '.join(e.messages)})
+            continue
 
-    # username and email required
-    if user.username and user.email:
+        if not bool(validate_email(user.email)):
+            user.email = ''  # if not valid; empty it out
+        if not user.email:
+            result.update({'ACTION': 'skip', 'IS_VALID': False, 'ERROR': 'Missing email.'})
+            continue
+
+        # an account_id from the file is made unique, unless it is the
+        # profile's own account_id already
+        if profile.account_id is not None and (not profile.pk or profile.account_id != old_account_id):
+            profile.account_id = get_unique_account_id(profile.account_id, profile,
+                                                       taken_account_ids, chunk_account_ids)
+            chunk_account_ids.add(profile.account_id)
 
-        # insert/update record
         if insert:
-            user.save(force_insert=True)
-        else:
-            user.save(force_update=True)
-
-        try:  # get or create
-            profile = user.profile
-        except Profile.DoesNotExist:
-            profile = Profile.objects.create(user=user,
-               creator=request.user,
-               creator_username=request.user.username,
-               owner=request.user,
-               owner_username=request.user.username,
-            )
-
-        for field in profile_field_names:
-            if field in user_object_dict:
-
-                if override:
-                    setattr(profile, field, user_object_dict[field])
-                else:
-                    # fill out the blank field only
-                    if getattr(profile, field) == '':
-                        setattr(profile, field, user_object_dict[field])
-
-        profile.save()
+            user.username = str(row.get('username', ''))
+            new_users[row_key] = user
+            new_user_ids.add(id(user))
+            result['ACTION'] = 'insert'
+        elif id(user) not in new_user_ids:
+            updated_users[id(user)] = user
+        if id(user) not in profiles:
+            profiles[id(user)] = profile
+            if not profile.pk:
+                new_profiles.append(profile)
+
+        if row.get('password') and (insert or import_i.override):
+            user.set_password(row['password'])
+        if not user.password:
+            user.set_password(User.objects.make_random_password(length=8))
+        if insert or not import_i.exclude_is_active:
+            user.is_active = import_i.interactive
+        result['user'] = user
+
+    with transaction.atomic():
+        new_user_list = list(new_users.values())
+        get_unique_usernames(new_user_list)
+        User.objects.bulk_create(new_user_list)
+        for user in new_user_list:
+            # not sent by bulk_create; the helpdesk settings
+            # of new users, for one, are created on it
+            post_save.send(sender=User, instance=user, created=True,
+                           update_fields=None, raw=False, using=DEFAULT_DB_ALIAS)
+        if updated_users:
+            User.objects.bulk_update(list(updated_users.values()), user_update_fields)
+
+        use_account_id = get_setting('module', 'users', 'useaccountid')
+        next_account_id = None
+        now = datetime.datetime.now()
+        for profile in profiles.values():
+            profile.set_derived_fields()
+            profile.update_dt = now
+            if use_account_id and not profile.account_id and profile.is_active:
+                if next_account_id is None:
+                    # past the account ids of the file inserted with this chunk
+                    next_account_id = max([profile.get_next_account_id()] +
+                                          [account_id + 1 for account_id in chunk_account_ids])
+                profile.account_id = next_account_id
+                next_account_id += 1
+        Profile.objects.bulk_create(new_profiles)
+        new_profile_ids = set(id(profile) for profile in new_profiles)
+        updated_profiles = [profile for profile in profiles.values()
+                            if id(profile) not in new_profile_ids]
+        if updated_profiles:
+            Profile.objects.bulk_update(updated_profiles, profile_update_fields)
 
         # add to group
-        if setting_dict['group']:
-            try:
-                gm = GroupMembership.objects.get(group=setting_dict['group'],
-                                                 member=user)
-            except GroupMembership.DoesNotExist:
-                gm = GroupMembership()
-                gm.member = user
-                gm.group = setting_dict['group']
-                gm.creator_id = request.user.id
-                gm.creator_username = request.user.username
-                gm.owner_id = request.user.id
-                gm.owner_username = request.user.username
-                gm.status = 1
-                gm.status_detail = 'active'
-                gm.save()
-
-    return user
-
-
-def get_unique_username(user):
+        if import_i.group_id:
+            user_ids = set(profile.user.pk for profile in profiles.values())
+            members = set(GroupMembership.objects.filter(group_id=import_i.group_id,
+                                                         member_id__in=user_ids
+                                                         ).values_list('member_id', flat=True))
+            GroupMembership.objects.bulk_create([GroupMembership(
+                    group_id=import_i.group_id,
+                    member_id=user_id,
+                    creator_id=getattr(request_user, 'pk', 0),
+                    creator_username=getattr(request_user, 'username', ''),
+                    owner_id=getattr(request_user, 'pk', 0),
+                    owner_username=getattr(request_user, 'username', ''),
+                    status=True,
+                    status_detail='active') for user_id in user_ids - members],
+                ignore_conflicts=True)
+
+    return results
+
+
+def count_import_rows(results):
+    return {'insert': len([r for r in results if r['ACTION'] == 'insert']),
+            'update': len([r for r in results if r['ACTION'] == 'update']),
+            'invalid': len([r for r in results if r['ACTION'] == 'skip'])}
+
+
+def user_import_preview(import_i, limit=PREVIEW_ROWS):
+    """
+    Counts the inserts, updates and invalid rows of a user import, chunk
+    by chunk. Returns the counts and the first limit rows to show.
+    """
+    chunk_size = getattr(settings, 'IMPORTS_USER_CHUNK_SIZE', 500)
+    rows = iter_user_import_rows(import_i.file.name)
+    counts = {'insert': 0, 'update': 0, 'invalid': 0, 'total': 0}
+    users_list = []
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        results = import_user_rows(import_i, chunk, preview=True)
+        for action, count in count_import_rows(results).items():
+            counts[action] += count
+        counts['total'] += len(chunk)
+        users_list.extend(results[:max(limit - len(users_list), 0)])
+    return counts, users_list
+
+
+def get_recap_path(import_i, first_row=None):
+    recap_dir = '%s/recap' % os.path.dirname(import_i.file.name)
+    if first_row is None:
+        return recap_dir
+    return '%s/%08d.csv' % (recap_dir, first_row)
+
+
+def save_recap(import_i, first_row, results):
+    """
+    Writes the recap of a chunk to a file of its own, named after its
+    first row, so that a chunk imported again after a crash replaces it.
+    """
+    output = StringIO()
+    recap_writer = csv.writer(output)
+    for result in results:
+        user = result.get('user') or User(**dict((field, result.get(field, ''))
+                                         for field in RECAP_USER_FIELDS))
+        recap_writer.writerow([result['ACTION'], result['ROW_NUM']] +
+                              [getattr(user, field) for field in RECAP_USER_FIELDS] +
+                              [result['ERROR']])
+    path = get_recap_path(import_i, first_row)
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(output.getvalue().encode('utf-8')))
+
+
+def iter_recap(import_i):
+    """
+    Yields the recap of a user import, csv lines, chunk after chunk.
+    """
+    output = StringIO()
+    csv.writer(output).writerow(['action', 'row'] + RECAP_USER_FIELDS + ['error'])
+    yield output.getvalue().encode('utf-8')
+    try:
+        recap_files = default_storage.listdir(get_recap_path(import_i))[1]
+    except (OSError, NotImplementedError):
+        return
+    for name in sorted(recap_files):
+        with default_storage.open('%s/%s' % (get_recap_path(import_i), name), 'rb') as f:
+            yield f.read()
+
+
+def process_user_import(import_i, chunk_size=None):
+    """
+    Imports the rows of a user import chunk by chunk. Each chunk is
+    committed along with the progress of the import (rows_done and the
+    totals), so an interrupted import resumes after its last committed
+    chunk when it is processed again. The import row is locked while a
+    chunk is imported, two processes never import the same chunk.
 
+    Returns the import.
+    """
+    chunk_size = chunk_size or getattr(settings, 'IMPORTS_USER_CHUNK_SIZE', 500)
+
+    with transaction.atomic():
+        import_i = Import.objects.select_for_update().get(pk=import_i.pk)
+        if import_i.status == 'completed':
+            return import_i
+        if import_i.status == 'pending':
+            #reset group - delete all members in the group
+            if import_i.clear_group_membership and import_i.group_id:
+                GroupMembership.objects.filter(group_id=import_i.group_id).delete()
+        import_i.status = 'processing'
+        import_i.failure_reason = ''
+        import_i.save()
+
+    rows = iter_user_import_rows(import_i.file.name, start=import_i.rows_done)
+    try:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            with transaction.atomic():
+                locked = Import.objects.select_for_update().get(pk=import_i.pk)
+                if locked.rows_done != import_i.rows_done:
+                    # another process is importing it
+                    return locked
+                results = import_user_rows(locked, chunk)
+                save_recap(locked, chunk[0]['ROW_NUM'], results)
+                counts = count_import_rows(results)
+                locked.rows_done += len(chunk)
+                locked.total_created += counts['insert']
+                locked.total_updated += counts['update']
+                locked.total_invalid += counts['invalid']
+                locked.save()
+            import_i = locked
+    except Exception as e:
+        Import.objects.filter(pk=import_i.pk).update(status='failed',
+                                                     failure_reason=str(e)[:250])
+        raise
+
+    import_i.status = 'completed'
+    import_i.save()
+    return import_i
+
+def get_username_base(user):
+    """
+    The username of user, or one made of its email or name,
+    cleaned up and truncated.
+    """
     if not user.username:
         if user.email:
             user.username = user.email
@@ -425,6 +640,12 @@ def get_unique_username(user):
     # truncate to 147 to leave some room to append more if needed.
     if len(user.username) > 147:
         user.username = user.username[:147]
+    return user.username
+
+
+def get_unique_username(user):
+    user.username = get_username_base(user)
+
     # check if this username already exists
     users = User.objects.filter(username__istartswith=user.username)
 
@@ -480,6 +701,8 @@ def get_header_list_from_content(file_content, file_name):
         file_ext = file_name[-4:].lower()
 
         if file_ext == '.csv':
+            if isinstance(file_content, bytes):
+                file_content = file_content.decode('utf-8-sig', 'replace')
             line_return_index = file_content.find('\n')
             header_list = ((file_content[:line_return_index]
                             ).strip('\r')).split(',')
@@ -529,40 +752,49 @@ def extract_from_excel(file_path):
             data_list.append(item)
             r += 1
     else:
-        book = xlrd.open_workbook(file_path)
-        nsheets = book.nsheets
-        nrows = book.sheet_by_index(0).nrows
+        data_list = list(iter_xls_rows(file_path))
 
-        # get the fields from the first row
+    return data_list
+
+
+def iter_xls_rows(file_path):
+    """
+    Yields the rows of an xls file as dicts, with their ROW_NUM.
+    The columns of all the sheets make up a row.
+    """
+    fields = []
+    book = xlrd.open_workbook(file_path)
+    nsheets = book.nsheets
+    nrows = book.sheet_by_index(0).nrows
+
+    # get the fields from the first row
+    for i in range(0, nsheets):
+        sh = book.sheet_by_index(i)
+        for c in range(0, sh.ncols):
+            col_item = sh.cell_value(rowx=0, colx=c)
+            fields.append(smart_str(col_item))
+
+    # get the data - skip the first row
+    for r in  range(1, nrows):
+        row = []
         for i in range(0, nsheets):
             sh = book.sheet_by_index(i)
             for c in range(0, sh.ncols):
-                col_item = sh.cell_value(rowx=0, colx=c)
-                fields.append(smart_str(col_item))
-
-        # get the data - skip the first row
-        for r in  range(1, nrows):
-            row = []
-            for i in range(0, nsheets):
-                sh = book.sheet_by_index(i)
-                for c in range(0, sh.ncols):
-                    cell = sh.cell(r, c)
-                    cell_value = cell.value
-                    if cell.ctype == xlrd.XL_CELL_DATE:
-                        date_tuple = xlrd.xldate_as_tuple(
-                                        cell_value, book.datemode)
-                        cell_value = datetime.date(date_tuple[0],
-                                                   date_tuple[1],
-                                                    date_tuple[2])
-                    elif cell.ctype in (2, 3) \
-                        and int(cell_value) == cell_value:
-                        # so for zipcode 77079,
-                        # we don't end up with 77079.0
-                        cell_value = int(cell_value)
-                    row.append(cell_value)
-
-            item = dict(zip(fields, row))
-            item['ROW_NUM'] = r + 1
-            data_list.append(item)
-
-    return data_list
+                cell = sh.cell(r, c)
+                cell_value = cell.value
+                if cell.ctype == xlrd.XL_CELL_DATE:
+                    date_tuple = xlrd.xldate_as_tuple(
+                                    cell_value, book.datemode)
+                    cell_value = datetime.date(date_tuple[0],
+                                               date_tuple[1],
+                                                date_tuple[2])
+                elif cell.ctype in (2, 3) \
+                    and int(cell_value) == cell_value:
+                    # so for zipcode 77079,
+                    # we don't end up with 77079.0
+                    cell_value = int(cell_value)
+                row.append(cell_value)
+
+        item = dict(zip(fields, row))
+        item['ROW_NUM'] = r + 1
+        yield item
@@ -0,0 +1,126 @@
+"""
+Distance queries on the geography columns.
+
+Locations keep their coordinates in a GiST indexed geography column (geo),
+so the nearest locations and the locations within a radius are found by
+the database through the index. Geocoded addresses are kept in Geocode,
+so an address is sent to Google once. Directories and profiles have no
+coordinates of their own; their radius filter matches their zip codes
+against the geocoded ones.
+"""
+import re
+
+from django.contrib.gis.db.models import PointField
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db import IntegrityError, transaction
+from django.db.models import FloatField, Func, Value
+from django.db.models.functions import Lower, Trim
+
+from tendenci.apps.locations.models import Geocode, Location
+from tendenci.apps.locations.utils import geocode_api
+
+
+class DistanceOrder(Func):
+    """
+    The <-> operator, which orders by distance through the GiST index
+    (ST_Distance can't use it).
+    """
+    arg_joiner = ' <-> '
+    template = '%(expressions)s'
+    output_field = FloatField()
+
+
+def make_point(lat, lng):
+    return Point(float(lng), float(lat), srid=4326)
+
+
+def normalize_address(address):
+    """
+    The key an address is geocoded under: lower case, single spaces,
+    no spaces around commas.
+    """
+    address = re.sub(r'\s+', ' ', (address or '').strip().lower())
+    return re.sub(r'\s*,\s*', ', ', address).strip(', ')[:255]
+
+
+def geocode(address):
+    """
+    Returns the latitude and longitude of address, or (None, None).
+    Google is queried once per normalized address, the results (found
+    or not) are kept in Geocode.
+    """
+    key = normalize_address(address)
+    if not key:
+        return (None, None)
+
+    [cached] = Geocode.objects.filter(address=key)[:1] or [None]
+    if cached:
+        return (cached.latitude, cached.longitude)
+
+    result = geocode_api(address=address)
+    if result['status'] == 'OK':
+        location = result['results'][0]['geometry']['location']
+        lat, lng = location['lat'], location['lng']
+    elif result['status'] == 'ZERO_RESULTS':
+        lat, lng = None, None
+    else:
+        # over the quota, denied... try again next time
+        return (None, None)
+
+    try:
+        with transaction.atomic():
+            Geocode.objects.create(address=key, latitude=lat, longitude=lng,
+                                   geo=make_point(lat, lng) if lat is not None else None)
+    except IntegrityError:
+        # geocoded by another request meanwhile
+        pass
+    return (lat, lng)
+
+
+def nearest_locations(queryset, lat, lng, limit=None, miles=None):
+    """
+    The locations of queryset nearest to lat, lng, nearest first,
+    with their distance. With miles, only the locations within that
+    radius; with limit, only the limit nearest ones.
+
+    Example:
+        locations = nearest_locations(Location.objects.filter(filters), lat, lng, limit=10)
+        locations[0].distance.mi
+    """
+    point = make_point(lat, lng)
+    # the permission joins can repeat rows, selecting by pk
+    # avoids a DISTINCT, which can't be ordered by distance
+    locations = Location.objects.filter(pk__in=queryset.values('pk'), geo__isnull=False)
+    if miles is not None:
+        locations = locations.filter(geo__dwithin=(point, D(mi=miles)))
+    locations = locations.annotate(distance=Distance('geo', point)).order_by(
+        DistanceOrder('geo', Value(point, output_field=PointField(geography=True, srid=4326))))
+    if limit:
+        locations = locations[:limit]
+    return locations
+
+
+def within_radius(queryset, zipcode_field, lat, lng, miles):
+    """
+    Filters queryset (directories, profiles...) to the rows whose zip
+    code, in zipcode_field, was geocoded within miles of lat, lng.
+    Zip codes that were never geocoded don't match; the
+    geocode_zipcodes command geocodes them.
+    """
+    nearby = Geocode.objects.filter(geo__dwithin=(make_point(lat, lng), D(mi=miles)))
+    return queryset.annotate(geocode_key=Lower(Trim(zipcode_field))).filter(
+        geocode_key__in=nearby.values('address'))
+
+
+def filter_by_radius(queryset, zipcode_field, near, miles):
+    """
+    The radius filter of the search forms: the rows of queryset within
+    miles of the address or zip code near. No rows when near can't be
+    geocoded.
+    """
+    lat, lng = geocode(near)
+    if lat is None or lng is None:
+        return queryset.none()
+    return within_radius(queryset, zipcode_field, lat, lng, miles)
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Geocode the zip codes of the directories and the profiles that haven't
+    been geocoded yet, so that the radius filter of the directory and
+    member searches can match them. Each zip code is sent to Google once.
+
+    Usage: ./manage.py geocode_zipcodes
+    Example: ./manage.py geocode_zipcodes --limit=2000
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--limit',
+            dest='limit',
+            type=int,
+            default=None,
+            help='The maximum number of zip codes to geocode (Google has a daily quota)')
+
+    def handle(self, *args, **options):
+        from django.db.models.functions import Lower, Trim
+        from tendenci.apps.directories.models import Directory
+        from tendenci.apps.locations.geo import geocode
+        from tendenci.apps.locations.models import Geocode
+        from tendenci.apps.profiles.models import Profile
+
+        geocoded = set(Geocode.objects.values_list('address', flat=True))
+        zipcodes = set()
+        for queryset, field in ((Directory.objects.all(), 'zip_code'),
+                                (Profile.objects.filter(status=True), 'zipcode')):
+            zipcodes.update(queryset.annotate(key=Lower(Trim(field))).exclude(
+                key='').values_list('key', flat=True).distinct())
+        zipcodes = sorted(zipcodes - geocoded)[:options['limit']]
+
+        found = 0
+        for zipcode in zipcodes:
+            lat, lng = geocode(zipcode)
+            if lat is not None:
+                found += 1
+        print('Geocoded %d zip codes, %d found' % (len(zipcodes), found))
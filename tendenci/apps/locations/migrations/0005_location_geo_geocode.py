@@ -0,0 +1,36 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0004_auto_20200902_1545'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geo',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, geography=True, null=True, srid=4326),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE locations_location
+            SET geo = ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.CreateModel(
+            name='Geocode',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.CharField(max_length=255, unique=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('geo', django.contrib.gis.db.models.fields.PointField(blank=True, geography=True, null=True, srid=4326)),
+                ('create_dt', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -2,6 +2,8 @@ from builtins import str
 import uuid
 
 from django.db import models
+from django.contrib.gis.db.models import PointField
+from django.contrib.gis.geos import Point
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.contrib.contenttypes.fields import GenericRelation
@@ -37,6 +39,9 @@ class Location(TendenciBaseModel):
 
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    # latitude and longitude as a geography, for the distance
+    # queries of locations.geo (GiST indexed)
+    geo = PointField(geography=True, srid=4326, blank=True, null=True, editable=False)
     logo = models.ForeignKey(File, null=True, default=None,
                              help_text=_('Only jpg, gif, or png images.'),
                              on_delete=models.SET_NULL)
@@ -123,6 +128,10 @@ class Location(TendenciBaseModel):
         # update latitude and longitude
         if not all((self.latitude, self.longitude)):
             self.latitude, self.longitude = get_coordinates(self.get_address())
+        if self.latitude is not None and self.longitude is not None:
+            self.geo = Point(self.longitude, self.latitude, srid=4326)
+        else:
+            self.geo = None
 
         photo_upload = kwargs.pop('photo', None)
         super(Location, self).save(*args, **kwargs)
@@ -169,3 +178,22 @@ class Distance(models.Model):
 
     def get_locations(zip_code):
         return Distance.objects.filter(zip_code=zip_code).order_by('distance')
+
+
+class Geocode(models.Model):
+    """
+    The coordinates Google geocoded for an address, kept so that an
+    address is geocoded once (see locations.geo.geocode). Addresses
+    Google found nothing for are kept without coordinates.
+    """
+    address = models.CharField(max_length=255, unique=True)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    geo = PointField(geography=True, srid=4326, blank=True, null=True)
+    create_dt = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        app_label = 'locations'
+
+    def __str__(self):
+        return self.address
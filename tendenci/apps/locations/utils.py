@@ -29,13 +29,10 @@ def get_coordinates(address):
     Get the latitude and longitude for the address parameter.
     Return a 2-tuple with latitude and longitude.
     Else return a 2-tuple with None Type objects.
+    The results are kept, see locations.geo.geocode.
     """
-    result = geocode_api(address=address)
-
-    if result['status'] == 'OK':
-        return list(result['results'][0]['geometry']['location'].values())
-
-    return (None, None)
+    from tendenci.apps.locations.geo import geocode
+    return geocode(address)
 
 def distance_api(*args, **kwargs):
     import simplejson
@@ -22,6 +22,7 @@ from tendenci.apps.files.models import File
 
 from tendenci.apps.locations.models import Location, LocationImport
 from tendenci.apps.locations.forms import LocationForm, LocationFilterForm
+from tendenci.apps.locations.geo import nearest_locations
 from tendenci.apps.locations.utils import get_coordinates
 from tendenci.apps.locations.importer.forms import UploadForm, ImportMapForm
 from tendenci.apps.locations.importer.utils import is_import_valid, parse_locs_from_csv
@@ -79,16 +80,15 @@ def nearest(request, template_name="locations/nearest.html"):
     if query:
         lat, lng = get_coordinates(address=query)
 
-    all_locations = Location.objects.filter(filters).distinct()
-    if not request.user.is_anonymous:
-        all_locations = all_locations.select_related()
-
     if all((lat,lng)):
-        for location in all_locations:
-            location.distance = location.get_distance2(lat, lng)
-            if location.distance is not None:
-                locations.append(location)
-            locations.sort(key=lambda x: x.distance)
+        all_locations = Location.objects.filter(filters)
+        locations = nearest_locations(all_locations, lat, lng)
+        if not request.user.is_anonymous:
+            locations = locations.select_related()
+        locations = list(locations[:getattr(settings, 'LOCATIONS_NEAREST_LIMIT', 100)])
+        for location in locations:
+            # in miles, for the templates
+            location.distance = location.distance.mi
 
     EventLog.objects.log()
 
@@ -0,0 +1,136 @@
+"""
+Batched expiry of memberships.
+
+The memberships are expired with set-based queries, one batch at a time
+inside a transaction: status updates, group membership removals and
+directory deactivation. The member numbers of the affected profiles are
+then recomputed in bulk and the changed objects are queued for indexing
+together, instead of through the save() signals of every row.
+"""
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce
+
+from tendenci.apps.directories.models import Directory
+from tendenci.apps.memberships.models import MembershipDefault
+from tendenci.apps.perms.utils import delete_visibility_caches
+from tendenci.apps.profiles.models import Profile
+from tendenci.apps.search.utils import enqueue_items
+from tendenci.apps.user_groups.models import GroupMembership
+
+
+def refresh_member_numbers(user_ids):
+    """
+    Does what Profile.refresh_member_number does for many users: the
+    profile shows the member number of the user's first active membership,
+    or none. Missing profiles are created.
+
+    Returns the number of profiles changed.
+    """
+    user_ids = set(user_ids)
+    first_active = {}
+    for membership in MembershipDefault.objects.filter(
+            user_id__in=user_ids, status=True,
+            status_detail__iexact='active').order_by('pk').only('pk', 'user_id', 'member_number'):
+        first_active.setdefault(membership.user_id, membership)
+
+    for membership in first_active.values():
+        if not membership.member_number:
+            # rare, numbers are set on approval
+            membership = MembershipDefault.objects.get(pk=membership.pk)
+            membership.set_member_number()
+            membership.save()
+            first_active[membership.user_id] = membership
+
+    profiles = dict((profile.user_id, profile) for profile in Profile.objects.filter(
+        user_id__in=user_ids).only('pk', 'user_id', 'member_number', 'status_detail'))
+    changed = []
+    for user_id in user_ids:
+        profile = profiles.get(user_id)
+        if profile is None:
+            [user] = User.objects.filter(pk=user_id)[:1] or [None]
+            if not user:
+                continue
+            profile = Profile.objects.create_profile(user=user)
+        membership = first_active.get(user_id)
+        member_number = membership.member_number if membership else u''
+        status_detail = 'active' if membership else profile.status_detail
+        if (profile.member_number, profile.status_detail) != (member_number, status_detail):
+            profile.member_number = member_number
+            profile.status_detail = status_detail
+            changed.append(profile)
+
+    Profile.objects.bulk_update(changed, ['member_number', 'status_detail'], batch_size=500)
+    enqueue_items(Profile, [profile.pk for profile in changed])
+    return len(changed)
+
+
+def expire_memberships(memberships, request_user=None, action_taken=False,
+                       deactivate_directories=True, batch_size=500):
+    """
+    Expires the active memberships of a queryset, batch_size at a time:
+        - set status_detail to expired
+        - remove the users from the membership type groups
+        - set the membership directories to inactive, unless
+          deactivate_directories is False
+        - refresh the member numbers on the profiles
+
+    With action_taken, the memberships are marked the way
+    MembershipDefault.expire marks them (action taken by request_user).
+    MembershipDefault.expire leaves the directories alone, so its callers
+    pass deactivate_directories=False.
+
+    Returns a dict with the number of memberships expired, group
+    memberships removed, directories deactivated and profiles changed.
+    """
+    report = {'expired': 0, 'groups_removed': 0, 'directories': 0, 'profiles': 0}
+    rows = list(memberships.filter(status=True, status_detail__iexact='active').values_list(
+        'pk', 'user_id', 'membership_type__group_id', 'directory_id'))
+
+    updates = {'status_detail': 'expired'}
+    if action_taken:
+        updates.update({'action_taken': True,
+                        'action_taken_dt': Coalesce('action_taken_dt', Value(datetime.now()))})
+        if request_user:
+            updates['action_taken_user'] = request_user
+
+    user_ids = set()
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+
+        with transaction.atomic():
+            # rows renewed or expired meanwhile are left alone
+            expired_pks = set(MembershipDefault.objects.filter(
+                pk__in=[row[0] for row in batch], status=True, status_detail__iexact='active'
+            ).select_for_update().values_list('pk', flat=True))
+            batch = [row for row in batch if row[0] in expired_pks]
+            if not batch:
+                continue
+            MembershipDefault.objects.filter(pk__in=expired_pks).update(**updates)
+
+            groups_q = Q()
+            for pk, user_id, group_id, directory_id in batch:
+                if group_id:
+                    groups_q |= Q(member_id=user_id, group_id=group_id)
+            if groups_q:
+                report['groups_removed'] += GroupMembership.objects.filter(groups_q).delete()[0]
+
+            directory_ids = []
+            if deactivate_directories:
+                directory_ids = [directory_id for pk, user_id, group_id, directory_id in batch if directory_id]
+            if directory_ids:
+                report['directories'] += Directory.objects.filter(
+                    pk__in=directory_ids).update(status_detail='inactive')
+
+        report['expired'] += len(batch)
+        batch_user_ids = set(user_id for pk, user_id, group_id, directory_id in batch)
+        user_ids.update(batch_user_ids)
+        delete_visibility_caches(batch_user_ids)
+        enqueue_items(MembershipDefault, expired_pks)
+        enqueue_items(Directory, directory_ids)
+
+    report['profiles'] = refresh_member_numbers(user_ids)
+    return report
@@ -5,45 +5,34 @@ class Command(BaseCommand):
     """
     Set the status detail of the membership to expired.
     Remove the user from the [privileged] group.
-    example: python manage.py remove_expired_memberships
+    example: python manage.py clean_memberships
     """
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=500,
+            help='Number of memberships expired per transaction')
+
+    def handle(self, *args, **options):
         from datetime import datetime
         from dateutil.relativedelta import relativedelta
-        from tendenci.apps.profiles.models import Profile
+        from django.db.models import Q
         from tendenci.apps.memberships.models import MembershipDefault, MembershipType
-        from tendenci.apps.user_groups.models import GroupMembership
-
-        for membership_type in MembershipType.objects.all():
-            grace_period = membership_type.expiration_grace_period
-
-            # get expired memberships out of grace period
-            # we can't move the expiration date, but we can
-            # move todays day back.
-            memberships = MembershipDefault.objects.filter(
-                membership_type=membership_type,
-                expire_dt__lt=datetime.now() - relativedelta(days=grace_period),
-                status=True).filter(status_detail='active')
-
-            for membership in memberships:
-                membership.status_detail = 'expired'
-                membership.save()
-
-                # update profile
-                # added try-except block due to error encountered
-                # on a site that might also be replicated tendenci wide
-                try:
-                    membership.user.profile.refresh_member_number()
-                except Profile.DoesNotExist:
-                    pass
-
-                # remove from group
-                GroupMembership.objects.filter(
-                    member=membership.user,
-                    group=membership.membership_type.group
-                ).delete()
-
-                # Check directory and set to inactive
-                if membership.directory:
-                    membership.directory.status_detail = 'inactive'
-                    membership.directory.save()
+        from tendenci.apps.memberships.expiry import expire_memberships
+
+        # get expired memberships out of grace period
+        # we can't move the expiration date, but we can
+        # move todays day back.
+        now = datetime.now()
+        expired_q = Q()
+        for membership_type_id, grace_period in MembershipType.objects.values_list(
+                'pk', 'expiration_grace_period'):
+            expired_q |= Q(membership_type_id=membership_type_id,
+                           expire_dt__lt=now - relativedelta(days=grace_period or 0))
+        if not expired_q:
+            return
+
+        memberships = MembershipDefault.objects.filter(expired_q, status=True, status_detail='active')
+        report = expire_memberships(memberships, batch_size=options['batch_size'])
+
+        if options['verbosity'] > 0:
+            print('%(expired)s memberships expired, %(groups_removed)s group memberships removed, '
+                  '%(directories)s directories deactivated, %(profiles)s profiles updated.' % report)
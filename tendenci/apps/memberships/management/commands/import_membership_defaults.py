@@ -1,6 +1,7 @@
-
+import time
 from datetime import datetime
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
@@ -10,15 +11,24 @@ class Command(BaseCommand):
     """
     Import MembershipDefault.
 
+    The rows are imported in chunks of MEMBERSHIPS_IMPORT_CHUNK_SIZE rows
+    (or --chunk-size), each with a few bulk queries.
+
     Usage:
         python manage.py import_membership_defaults [mimport_id] [request.user.id]
 
         example:
         python manage.py import_membership_defaults 10 1
+        python manage.py import_membership_defaults 10 1 --chunk-size 1000
     """
     def add_arguments(self, parser):
         parser.add_argument('import_id', type=int)
         parser.add_argument('user_id', type=int)
+        parser.add_argument('--chunk-size',
+            type=int,
+            dest='chunk_size',
+            default=None,
+            help='Number of rows imported at once')
 
     def handle(self, *args,  **options):
         from tendenci.apps.memberships.models import MembershipImport
@@ -27,18 +37,24 @@ class Command(BaseCommand):
 
         import_id = options['import_id']
         user_id = options['user_id']
+        chunk_size = options['chunk_size'] or getattr(settings, 'MEMBERSHIPS_IMPORT_CHUNK_SIZE', 500)
         mimport = get_object_or_404(MembershipImport, pk=import_id)
         request_user = User.objects.get(pk=user_id)
         data_list = MembershipImportData.objects.filter(mimport=mimport).order_by('pk')
         imd = ImportMembDefault(request_user, mimport, dry_run=False)
 
-        for idata in data_list:
-            try:
-                imd.process_default_membership(idata)
-            except Exception as e:
-                print(e)
+        mimport.chunk_size = chunk_size
+        start = time.monotonic()
+        last_pk = 0
+        while True:
+            idata_list = list(data_list.filter(pk__gt=last_pk)[:chunk_size])
+            if not idata_list:
+                break
+            last_pk = idata_list[-1].pk
 
-            mimport.num_processed += 1
+            imd.process_chunk(idata_list)
+
+            mimport.num_processed += len(idata_list)
 
             # save the status -----------------------------------------------
             summary = 'insert:%d,update:%d,update_insert:%d,invalid:%d' % (
@@ -48,11 +64,17 @@ class Command(BaseCommand):
                 imd.summary_d['invalid'],
             )
             mimport.summary = summary
+            mimport.process_seconds = time.monotonic() - start
+            if mimport.process_seconds:
+                mimport.rows_per_second = mimport.num_processed / mimport.process_seconds
             mimport.save()
 
         mimport.status = 'completed'
         mimport.complete_dt = datetime.now()
         mimport.save()
 
+        print('Imported %d rows in chunks of %d in %.1fs (%.1f rows/s)' % (
+            mimport.num_processed, chunk_size, mimport.process_seconds, mimport.rows_per_second))
+
         # generate a recap file
         mimport.generate_recap()
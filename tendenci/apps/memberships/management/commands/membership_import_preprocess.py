@@ -1,7 +1,10 @@
 import os
+from itertools import islice
+
 import chardet
 
 from django.core.management.base import BaseCommand
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
@@ -27,7 +30,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         from tendenci.apps.memberships.models import MembershipImport
         from tendenci.apps.memberships.models import MembershipImportData
-        from tendenci.apps.memberships.utils import memb_import_parse_csv
+        from tendenci.apps.memberships.utils import iter_memb_import_rows, IMPORT_BULK_BATCH_SIZE
 
         import_id = options['import_id']
         mimport = get_object_or_404(MembershipImport,
@@ -65,16 +68,23 @@ class Command(BaseCommand):
                 # dump data to the table membershipimportdata
                 # note that row_num starts with 2 because the first row
                 # is the header row.
-                header_line, data_list = memb_import_parse_csv(mimport)
+                # the file is read and inserted a chunk at a time
+                header_line, data_list = iter_memb_import_rows(mimport)
                 mimport.header_line = ','.join(header_line)
 
-                for i, memb_data in enumerate(data_list):
-
-                    import_data = MembershipImportData(
-                                    mimport=mimport,
-                                    row_data=memb_data,
-                                    row_num=i+2)
-                    import_data.save()
+                chunk_size = getattr(settings, 'MEMBERSHIPS_IMPORT_CHUNK_SIZE', 500)
+                data_list = enumerate(data_list)
+                total_rows = 0
+                while True:
+                    chunk = [MembershipImportData(mimport=mimport,
+                                                  row_data=memb_data,
+                                                  row_num=i+2)
+                             for i, memb_data in islice(data_list, chunk_size)]
+                    if not chunk:
+                        break
+                    MembershipImportData.objects.bulk_create(chunk, batch_size=IMPORT_BULK_BATCH_SIZE)
+                    total_rows += len(chunk)
 
+                mimport.total_rows = total_rows
                 mimport.status = 'preprocess_done'
                 mimport.save()
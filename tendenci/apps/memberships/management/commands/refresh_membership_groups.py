@@ -3,9 +3,26 @@ from django.core.management.base import BaseCommand
 
 class Command(BaseCommand):
     """
-    Loop through users/membership-types
-    and add or remove the user from the group.
+    Add or remove users from the groups of the membership types
+    depending on their active memberships.
+
+    Usage:
+        python manage.py refresh_membership_groups
+
+        example:
+        python manage.py refresh_membership_groups --dry-run
     """
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Report the changes without applying them')
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=1000,
+            help='Number of rows changed per query')
+
+    def handle(self, *args, **options):
         from tendenci.apps.memberships.models import MembershipDefault
-        MembershipDefault.refresh_groups()
+        report = MembershipDefault.refresh_groups(dry_run=options['dry_run'],
+                                                  batch_size=options['batch_size'])
+        if options['verbosity'] > 0:
+            print('%s%s group memberships added, %s removed, %s duplicate active memberships archived.' % (
+                '[dry run] ' if options['dry_run'] else '',
+                report['added'], report['removed'], report['archived']))
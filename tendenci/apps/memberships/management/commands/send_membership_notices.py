@@ -22,10 +22,14 @@ class Command(BaseCommand):
             verbosity = options['verbosity']
 
         from django.conf import settings
+        from django.core.mail import get_connection
+        from django.utils.safestring import mark_safe
         from tendenci.apps.memberships.models import (Notice,
                                                         MembershipDefault,
+                                                        MembershipAppField,
                                                         NoticeLog,
                                                         NoticeDefaultLogRecord)
+        from tendenci.apps.recurring_payments.models import RecurringPayment
         from tendenci.apps.base.utils import fieldify
         from tendenci.apps.notifications import models as notification
         from tendenci.apps.site_settings.utils import get_setting
@@ -112,13 +116,20 @@ class Command(BaseCommand):
                                             ).strip()).split(',')
             return admin_emails
 
-        def process_notice(notice):
-            notice.members_sent = []
-            num_sent = 0
+        def get_day_range(dt):
+            """
+            The half-open datetime range of the day of dt, so that the date
+            columns are compared with a range their index can serve.
+            """
+            day_start = datetime(dt.year, dt.month, dt.day)
+            return day_start, day_start + timedelta(days=1)
+
+        def get_notice_memberships(notice):
             if notice.notice_time == 'before':
                 start_dt = now + timedelta(days=notice.num_days)
             else:
                 start_dt = now - timedelta(days=notice.num_days)
+            day_start, day_end = get_day_range(start_dt)
 
             if notice.notice_type == 'disapprove' or notice.notice_type == 'disapprove_renewal':
                 status_detail_list = ['disapproved']
@@ -130,33 +141,28 @@ class Command(BaseCommand):
                                     )
             if notice.notice_type == 'join':
                 memberships = memberships.filter(
-                                    join_dt__year=start_dt.year,
-                                    join_dt__month=start_dt.month,
-                                    join_dt__day=start_dt.day,
+                                    join_dt__gte=day_start,
+                                    join_dt__lt=day_end,
                                     renewal=False)
             elif notice.notice_type == 'renewal':
                 memberships = memberships.filter(
-                                    renew_dt__year=start_dt.year,
-                                    renew_dt__month=start_dt.month,
-                                    renew_dt__day=start_dt.day,
+                                    renew_dt__gte=day_start,
+                                    renew_dt__lt=day_end,
                                     renewal=True)
             elif notice.notice_type == 'approve' or notice.notice_type == 'approve_renewal':
                 memberships = memberships.filter(
-                                    application_approved_denied_dt__year=start_dt.year,
-                                    application_approved_denied_dt__month=start_dt.month,
-                                    application_approved_denied_dt__day=start_dt.day,
+                                    application_approved_denied_dt__gte=day_start,
+                                    application_approved_denied_dt__lt=day_end,
                                     application_approved=True)
             elif notice.notice_type == 'disapprove' or notice.notice_type == 'disapprove_renewal':
                 memberships = memberships.filter(
-                                    application_approved_denied_dt__year=start_dt.year,
-                                    application_approved_denied_dt__month=start_dt.month,
-                                    application_approved_denied_dt__day=start_dt.day,
+                                    application_approved_denied_dt__gte=day_start,
+                                    application_approved_denied_dt__lt=day_end,
                                     application_approved=False)
             else:  # 'expire'
                 memberships = memberships.filter(
-                                    expire_dt__year=start_dt.year,
-                                    expire_dt__month=start_dt.month,
-                                    expire_dt__day=start_dt.day,
+                                    expire_dt__gte=day_start,
+                                    expire_dt__lt=day_end,
                                     reminder=True)
                 if get_setting('module', 'memberships', 'renewalreminderexcludecorpmembers'):
                     # exclude corp members
@@ -167,6 +173,53 @@ class Command(BaseCommand):
                 memberships = memberships.filter(
                                 membership_type=notice.membership_type)
 
+            return memberships.select_related('user', 'user__profile', 'user__demographics',
+                                              'payment_method', 'directory', 'app')
+
+        def get_batches(memberships, batch_size=500):
+            batch = []
+            for membership in memberships.iterator(chunk_size=batch_size):
+                batch.append(membership)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        def get_auto_renew_user_ids(memberships):
+            """
+            The users of memberships that have an active recurring
+            payment for their membership, the way has_rp checks.
+            """
+            if not get_setting('module', 'recurring_payments', 'enabled'):
+                return set()
+            user_ids = [membership.user_id for membership in memberships if membership.auto_renew]
+            if not user_ids:
+                return set()
+            return set(RecurringPayment.objects.filter(
+                user_id__in=user_ids,
+                status=True,
+                status_detail='active',
+                object_content_type__model='membershipdefault').values_list('user_id', flat=True))
+
+        app_field_names = {}
+
+        def get_app_field_names(app_id):
+            if app_id not in app_field_names:
+                app_field_names[app_id] = list(MembershipAppField.objects.filter(
+                                        membership_app_id=app_id,
+                                        display=True,
+                                        ).exclude(
+                                        field_name=''
+                                        ).values_list('field_name', flat=True))
+            return app_field_names[app_id]
+
+        def process_notice(notice):
+            notice.members_sent = []
+            num_sent = 0
+            start_time = time.monotonic()
+
+            memberships = get_notice_memberships(notice)
             memberships_count = memberships.count()
 
             if memberships_count > 0:
@@ -191,6 +244,15 @@ class Command(BaseCommand):
                                   'password': passwd_str
                                   }
 
+                # the notice templates are compiled once for all its members
+                body = fieldify(notice.email_content)
+                body = body + ' <br /><br />{% include "email_footer.html" %}'
+                templates = {
+                    'body': engines['django'].from_string(body),
+                    'subject': engines['django'].from_string(
+                                    notice.subject.replace('(name)', '{{ notice_recipient_name }}')),
+                }
+
                 # log notice sent
                 notice_log = NoticeLog(notice=notice,
                                        num_sent=0)
@@ -198,40 +260,52 @@ class Command(BaseCommand):
                 notice.log = notice_log
                 notice.err = ''
 
-                for membership in memberships:
-                    if notice.notice_type == 'expiration' and membership.auto_renew and membership.has_rp():
-                        # skip if auto renew is set up for this membership
-                        continue
-
-                    try:
-                        email_member(notice, membership, global_context)
-                        if memberships_count <= 50:
-                            notice.members_sent.append(membership)
-                        num_sent += 1
-
-                        # log record
-                        notice_log_record = NoticeDefaultLogRecord(
+                for memberships_batch in get_batches(memberships):
+                    auto_renew_user_ids = set()
+                    if notice.notice_type == 'expiration':
+                        auto_renew_user_ids = get_auto_renew_user_ids(memberships_batch)
+
+                    log_records = []
+                    for membership in memberships_batch:
+                        if membership.auto_renew and membership.user_id in auto_renew_user_ids:
+                            # skip if auto renew is set up for this membership
+                            continue
+
+                        try:
+                            email_member(notice, membership, global_context, templates)
+                            if memberships_count <= 50:
+                                notice.members_sent.append(membership)
+                            num_sent += 1
+
+                            # log record
+                            log_records.append(NoticeDefaultLogRecord(
                                                 notice_log=notice_log,
-                                                membership=membership)
-                        notice_log_record.save()
-                    except:
-                        # catch the exception and email
-                        notice.err += traceback.format_exc()
-                        print(traceback.format_exc())
+                                                membership=membership))
+                        except:
+                            # catch the exception and email
+                            notice.err += traceback.format_exc()
+                            print(traceback.format_exc())
+
+                    NoticeDefaultLogRecord.objects.bulk_create(log_records)
 
                 if num_sent > 0:
                     notice_log.num_sent = num_sent
                     notice_log.save()
 
+            notice.timing = {'matched': memberships_count,
+                             'sent': num_sent,
+                             'seconds': time.monotonic() - start_time}
             return num_sent
 
-        def email_member(notice, membership, global_context):
+        def email_member(notice, membership, global_context, templates):
             user = membership.user
 
-            body = notice.email_content
-            context = membership.get_field_items()
+            context = membership.get_field_items(
+                field_names=get_app_field_names(membership.app_id))
             context['membership'] = membership
             context.update(global_context)
+            # the name is kept as is, like when it was part of the template
+            context['notice_recipient_name'] = mark_safe(user.get_full_name())
 
             # corporate member corp_replace_str
             if membership.corporate_membership_id:
@@ -258,32 +332,25 @@ class Command(BaseCommand):
                 directory_url = ''
                 directory_edit_url = ''
 
+            membership_url = '%s%s' % (site_url, membership.get_absolute_url())
             context.update({
                 'member_number': membership.member_number,
                 'payment_method': payment_method_name,
                 'referer_url': '%s%s?next=%s' % (site_url, reverse('auth_login'), membership.referer_url),
-                'membership_link': '%s%s' % (site_url, membership.get_absolute_url()),
-                'view_link': '%s%s' % (site_url, membership.get_absolute_url()),
-                'renew_link': '%s%s' % (site_url, membership.get_absolute_url()),
-                'mymembershipslink': '%s%s' % (site_url, membership.get_absolute_url()),
-                'membershiplink': '%s%s' % (site_url, membership.get_absolute_url()),
-                'renewlink': '%s%s' % (site_url, membership.get_absolute_url()),
+                'membership_link': membership_url,
+                'view_link': membership_url,
+                'renew_link': membership_url,
+                'mymembershipslink': membership_url,
+                'membershiplink': membership_url,
+                'renewlink': membership_url,
                 'directory_url': directory_url,
                 'directory_edit_url': directory_edit_url,
             })
 
-            body = fieldify(body)
-
-            body = body + ' <br /><br />{% include "email_footer.html" %}'
-
-            template = engines['django'].from_string(body)
-            body = template.render(context=context)
+            body = templates['body'].render(context=context)
 
             email_recipient = user.email
-            subject = notice.subject.replace('(name)',
-                                        user.get_full_name())
-            template = engines['django'].from_string(subject)
-            subject = template.render(context=context)
+            subject = templates['subject'].render(context=context)
 
             email_context.update({
                 'subject':subject,
@@ -296,7 +363,7 @@ class Command(BaseCommand):
                 email_context.update({'sender_display':notice.sender_display})
 
             notification.send_emails([email_recipient], 'membership_notice_email',
-                                     email_context)
+                                     email_context, connection=connection)
             if verbosity > 1:
                 print('To ', email_recipient, subject)
 
@@ -310,11 +377,21 @@ class Command(BaseCommand):
                 print("Start sending out notices to members:")
             total_notices = 0
             total_sent = 0
-            for notice in notices:
-                total_notices += 1
-                total_sent += process_notice(notice)
-                if hasattr(notice, 'err'):
-                    exception_str += notice.err
+            # one connection for all the notices
+            connection = get_connection()
+            try:
+                connection.open()
+                for notice in notices:
+                    total_notices += 1
+                    total_sent += process_notice(notice)
+                    if hasattr(notice, 'err'):
+                        exception_str += notice.err
+                    if verbosity > 0 and notice.timing['matched']:
+                        print('Notice "%s": %d memberships matched, %d sent in %.2fs' % (
+                            notice.notice_name, notice.timing['matched'],
+                            notice.timing['sent'], notice.timing['seconds']))
+            finally:
+                connection.close()
 
             if total_sent > 0:
                 processed_notices = [notice for notice in notices if hasattr(
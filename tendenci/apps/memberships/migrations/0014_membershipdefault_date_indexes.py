@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memberships', '0013_alter_membershipappfield_field_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='membershipdefault',
+            index=models.Index(fields=['join_dt'], name='memberships_join_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershipdefault',
+            index=models.Index(fields=['renew_dt'], name='memberships_renew_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershipdefault',
+            index=models.Index(fields=['expire_dt'], name='memberships_expire_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershipdefault',
+            index=models.Index(fields=['application_approved_denied_dt'], name='memberships_appr_denied_dt_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memberships', '0014_membershipdefault_date_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='membershipimport',
+            name='chunk_size',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='membershipimport',
+            name='process_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='membershipimport',
+            name='rows_per_second',
+            field=models.FloatField(default=0),
+        ),
+    ]
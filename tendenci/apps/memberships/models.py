@@ -593,6 +593,14 @@ class MembershipDefault(TendenciBaseModel):
         verbose_name_plural = _(u'Memberships')
         permissions = (("approve_membershipdefault", _("Can approve memberships")),)
         app_label = 'memberships'
+        # date ranges queried by send_membership_notices
+        indexes = [
+            models.Index(fields=['join_dt'], name='memberships_join_dt_idx'),
+            models.Index(fields=['renew_dt'], name='memberships_renew_dt_idx'),
+            models.Index(fields=['expire_dt'], name='memberships_expire_dt_idx'),
+            models.Index(fields=['application_approved_denied_dt'],
+                         name='memberships_appr_denied_dt_idx'),
+        ]
 
     def __init__(self, *args, **kwargs):
         super(MembershipDefault, self).__init__(*args, **kwargs)
@@ -741,52 +749,91 @@ class MembershipDefault(TendenciBaseModel):
         return memberships
 
     @classmethod
-    def refresh_groups(cls):
+    def refresh_groups(cls, dry_run=False, batch_size=1000):
         """
         Adds or Removes users from groups
         depending on their membership status_detail.
-        """
-        for membership_type in MembershipType.objects.all():
-            for user in User.objects.all():
-
-                status_details = MembershipDefault.objects.filter(
-                    user=user,
-                    membership_type=membership_type,
-                    status=True,
-                    status_detail__in=['active', 'pending', 'expired'],
-                ).values_list('status_detail', flat=True)
-
-                status_details = list(status_details)
-                if status_details.count('active') > 1:
-                    memberships = MembershipDefault.objects.filter(
-                        user=user,
-                        membership_type=membership_type,
-                        status=True,
-                        status_detail='active'
-                    ).order_by('-pk')[1:]
-
-                    for membership in memberships:
-                        membership.status_detail = 'archive'
-                        membership.save()
-
-                if 'active' in status_details:
-
-                    exists = GroupMembership.objects.filter(
-                        member=user,
-                        group=membership_type.group,
-                    ).exists()
-
-                    if not exists:
-                        GroupMembership.add_to_group(
-                            member=user,
-                            group=membership_type.group,
-                        )
-                else:
-                    # remove from group
-                    GroupMembership.objects.filter(
-                        member=user,
-                        group=membership_type.group,
-                    ).delete()
+
+        A user belongs to the group of a membership type as long as they
+        have an active membership of a type with that group. When a user
+        has more than one active membership of the same type, all but
+        the latest one are archived.
+
+        The desired (user, group) pairs are computed with a few queries
+        and diffed against GroupMembership; the changes are applied in
+        batches. With dry_run nothing is changed.
+
+        Returns a dict with the number of group memberships added and
+        removed and of memberships archived.
+        """
+        from django.db import transaction
+        from django.db.models import Count
+        from tendenci.apps.perms.utils import delete_visibility_caches
+        from tendenci.apps.search.utils import enqueue_items
+
+        active = cls.objects.filter(status=True, status_detail='active')
+
+        # duplicate active memberships of the same type
+        duplicates = active.values('user_id', 'membership_type_id').annotate(
+            count=Count('pk')).filter(count__gt=1).order_by()
+        duplicate_user_ids = set(duplicate['user_id'] for duplicate in duplicates)
+        to_archive = []
+        latest = {}
+        for pk, user_id, membership_type_id in active.filter(
+                user_id__in=duplicate_user_ids).order_by('-pk').values_list(
+                'pk', 'user_id', 'membership_type_id'):
+            if (user_id, membership_type_id) in latest:
+                to_archive.append(pk)
+            else:
+                latest[(user_id, membership_type_id)] = pk
+
+        # desired vs existing (user, group) pairs
+        group_ids = set(MembershipType.objects.exclude(group=None).values_list('group_id', flat=True))
+        desired = set(active.exclude(membership_type__group=None).values_list(
+            'user_id', 'membership_type__group_id').distinct())
+        existing = {}
+        for pk, member_id, group_id in GroupMembership.objects.filter(
+                group_id__in=group_ids).values_list('pk', 'member_id', 'group_id'):
+            existing[(member_id, group_id)] = pk
+        to_add = sorted(desired.difference(existing))
+        to_remove = [pk for pair, pk in existing.items() if pair not in desired]
+
+        report = {'added': len(to_add),
+                  'removed': len(to_remove),
+                  'archived': len(to_archive)}
+        if dry_run:
+            return report
+
+        for i in range(0, len(to_archive), batch_size):
+            pks = to_archive[i:i + batch_size]
+            cls.objects.filter(pk__in=pks).update(status_detail='archive')
+            enqueue_items(cls, pks)
+
+        for i in range(0, len(to_add), batch_size):
+            pairs = to_add[i:i + batch_size]
+            usernames = dict(User.objects.filter(
+                pk__in=[user_id for user_id, group_id in pairs]).values_list('pk', 'username'))
+            with transaction.atomic():
+                GroupMembership.objects.bulk_create([
+                    GroupMembership(group_id=group_id,
+                                    member_id=user_id,
+                                    creator_id=user_id,
+                                    creator_username=usernames.get(user_id, ''),
+                                    owner_id=user_id,
+                                    owner_username=usernames.get(user_id, ''),
+                                    status=True,
+                                    status_detail='active')
+                    for user_id, group_id in pairs], ignore_conflicts=True)
+            delete_visibility_caches(set(user_id for user_id, group_id in pairs))
+
+        removed_user_ids = set(member_id for (member_id, group_id), pk in existing.items()
+                               if (member_id, group_id) not in desired)
+        for i in range(0, len(to_remove), batch_size):
+            with transaction.atomic():
+                GroupMembership.objects.filter(pk__in=to_remove[i:i + batch_size]).delete()
+        delete_visibility_caches(removed_user_ids)
+
+        return report
 
     @classmethod
     def QS_ACTIVE(cls):
@@ -1962,13 +2009,16 @@ class MembershipDefault(TendenciBaseModel):
 
         return all(good)
 
-    def get_field_items(self):
+    def get_field_items(self, field_names=None):
         """
+        field_names can be passed in by callers that already
+        have the displayed field names of the membership app.
         """
         app = self.app
 
         items = {}
-        field_names = MembershipAppField.objects.filter(
+        if field_names is None:
+            field_names = MembershipAppField.objects.filter(
                                         membership_app=app,
                                         display=True,
                                         ).exclude(
@@ -2307,6 +2357,10 @@ class MembershipImport(models.Model):
                               max_length=50,
                               default='not_started')
     complete_dt = models.DateTimeField(null=True)
+    # throughput of the import: rows per chunk, seconds spent processing
+    chunk_size = models.IntegerField(default=0)
+    process_seconds = models.FloatField(default=0)
+    rows_per_second = models.FloatField(default=0)
 
     creator = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
     create_dt = models.DateTimeField(auto_now_add=True)
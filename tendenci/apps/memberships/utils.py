@@ -2,6 +2,7 @@ from builtins import str
 import os
 import csv
 import re
+import uuid
 from decimal import Decimal
 from datetime import datetime, date, timedelta, time
 import dateutil.parser as dparser
@@ -10,6 +11,8 @@ import time as ttime
 import subprocess
 from dateutil.relativedelta import relativedelta
 from ast import literal_eval
+from functools import reduce
+from operator import or_
 
 from django.http import HttpResponseServerError
 from django.conf import settings
@@ -17,7 +20,11 @@ import simplejson
 from django.contrib.auth.models import User
 from django.template import loader
 from django.template.defaultfilters import slugify
-from django.db.models import Q
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Prefetch, Q
+from django.db.models.functions import Lower
+from django.db.models.signals import post_save
 from django.core.files.storage import default_storage
 from django.core import exceptions
 from django.utils.encoding import smart_str
@@ -42,14 +49,23 @@ from tendenci.apps.memberships.models import (MembershipType,
                                                 MembershipApp,
                                                 MembershipAppField,
                                                 MembershipFile,
+                                                MembershipImportData,
                                                 VALID_MEMBERSHIP_STATUS_DETAIL)
 from tendenci.apps.base.utils import normalize_newline
 from tendenci.apps.profiles.models import Profile
-from tendenci.apps.profiles.utils import make_username_unique, spawn_username
+from tendenci.apps.profiles.utils import make_username_unique, spawn_username_base
+from tendenci.apps.search.utils import enqueue_items
+from tendenci.apps.user_groups.models import GroupMembership
 from tendenci.apps.emails.models import Email
 from tendenci.apps.educations.models import Education
 from tendenci.apps.regions.models import Region
 from tendenci.apps.base.utils import escape_csv, Echo
+from tendenci.apps.exports.utils import ExportPlan, ExportProgress, write_csv
+from tendenci.apps.invoices.models import Invoice
+
+
+# the number of rows per query of the bulk writes of the imports
+IMPORT_BULK_BATCH_SIZE = 100
 
 
 def get_membership_field_values(membership, app_fields):
@@ -303,19 +319,11 @@ def run_membership_export(request,
                   '--ids=%s' % ids,])
 
 
-def get_membership_rows(
-        user_field_list,
-        profile_field_list,
-        education_field_list,
-        demographic_field_list,
-        membership_field_list,
-        invoice_field_list,
-        foreign_keys,
+def get_membership_queryset(
         export_type=u'all',
         export_status_detail=u'',
         cp_id=0,
         ids=''):
-
     if ids:
         ids = ids.split(',')
         memberships = MembershipDefault.objects.filter(id__in=ids)
@@ -338,63 +346,110 @@ def get_membership_rows(
     if cp_id:
         memberships = memberships.filter(corp_profile_id=cp_id)
 
-    for membership in memberships:
-        row_dict = {}
-
-        user = membership.user
-        invoice = membership.get_invoice()
-
-        [profile] = Profile.objects.filter(user=user)[:1] or [None]
-        education_list = user.educations.all().order_by('pk')[0:4]
-        [demographic] = MembershipDemographic.objects.filter(user=user)[:1] or [None]
-
-        for field_name in user_field_list:
-            row_dict[field_name] = get_obj_field_value(field_name, user)
-
-        if profile:
-            for field_name in profile_field_list:
-                orig_field_name = field_name
-                if field_name == 'profile_status_detail':
-                    field_name = 'status_detail'
-                elif field_name == 'profile_status':
-                    field_name = 'status'
-                row_dict[orig_field_name] = get_obj_field_value(
-                    field_name, profile, field_name in foreign_keys)
-
-        if education_list:
-            cnt = 0
-            for education in education_list:
-                row_dict[education_field_list[cnt]] = education.school
-                row_dict[education_field_list[cnt+1]] = education.major
-                row_dict[education_field_list[cnt+2]] = education.degree
-                row_dict[education_field_list[cnt+3]] = education.graduation_year
-                cnt += 4
-
-        if demographic:
-            for field_name in demographic_field_list:
-                row_dict[field_name] = get_obj_field_value(
-                    field_name, demographic, field_name in foreign_keys)
-
-        for field_name in membership_field_list:
-            if field_name == 'corp_profile_name':
-                row_dict[field_name] = membership.get_corporate_profile_name()
-            else:
-                row_dict[field_name] = get_obj_field_value(
-                    field_name, membership, field_name in foreign_keys)
-
-        if invoice:
-            for field_name in invoice_field_list:
-                row_dict[field_name] = get_obj_field_value(
-                    field_name, invoice, field_name in foreign_keys)
+    return memberships
 
-        yield row_dict
 
-
-def get_obj_field_value(field_name, obj, is_foreign_key=False):
-    value = getattr(obj, field_name)
-    if value and is_foreign_key and hasattr(value, 'id'):
-        value = value.id
-    return value
+def get_membership_export_plan(
+        user_field_list,
+        profile_field_list,
+        education_field_list,
+        demographic_field_list,
+        membership_field_list,
+        invoice_field_list,
+        foreign_keys,
+        formatter=None):
+    """
+    The ExportPlan of the membership export. The users, profiles,
+    demographics and membership sets are selected with the memberships,
+    the educations are prefetched, and the invoices and corporate
+    profile names are looked up once per chunk.
+    """
+    from tendenci.apps.corporate_memberships.models import CorpProfile
+
+    def column(path, field_name, model):
+        # foreign keys are exported as ids
+        if field_name in foreign_keys and isinstance(
+                model._meta.get_field(field_name), (ForeignKey, OneToOneField)):
+            field_name = model._meta.get_field(field_name).attname
+        return '__'.join(path + [field_name])
+
+    fields = []
+    columns = {}
+    for field_name in user_field_list:
+        fields.append(column(['user'], field_name, User))
+
+    for field_name in profile_field_list:
+        if field_name == 'profile_status_detail':
+            fields.append('user__profile__status_detail')
+        elif field_name == 'profile_status':
+            fields.append('user__profile__status')
+        else:
+            fields.append(column(['user', 'profile'], field_name, Profile))
+
+    def get_education(i, attr):
+        def get(membership):
+            educations = membership.user.export_educations
+            return getattr(educations[i], attr) if i < len(educations) else None
+        return get
+
+    for i, field_name in enumerate(education_field_list):
+        columns[field_name] = get_education(i // 4, ['school', 'major', 'degree', 'graduation_year'][i % 4])
+        fields.append(field_name)
+
+    invoices = {}
+    corp_profile_names = {}
+    for field_name in membership_field_list:
+        if field_name == 'corp_profile_name':
+            columns[field_name] = lambda membership: corp_profile_names.get(membership.corp_profile_id, '')
+            fields.append(field_name)
+        else:
+            fields.append(column([], field_name, MembershipDefault))
+
+    def get_invoice_value(field_name):
+        def get(membership):
+            invoice = invoices.get(membership.pk)
+            return getattr(invoice, field_name) if invoice else None
+        return get
+
+    for field_name in invoice_field_list:
+        columns['invoice__%s' % field_name] = get_invoice_value(field_name)
+        fields.append('invoice__%s' % field_name)
+
+    for field_name in demographic_field_list:
+        fields.append(column(['user', 'demographics'], field_name, MembershipDemographic))
+
+    def prepare_chunk(memberships):
+        if invoice_field_list:
+            invoices.clear()
+            # the invoice of the membership set, or the one bound by content type
+            unbound = []
+            for membership in memberships:
+                if membership.membership_set:
+                    invoices[membership.pk] = membership.membership_set.invoice
+                else:
+                    unbound.append(membership.pk)
+            if unbound:
+                content_type = ContentType.objects.get_for_model(MembershipDefault)
+                for invoice in Invoice.objects.filter(object_type=content_type,
+                                                      object_id__in=unbound).order_by('-pk'):
+                    invoices[invoice.object_id] = invoice
+        if 'corp_profile_name' in membership_field_list:
+            corp_profile_names.clear()
+            corp_profile_names.update(CorpProfile.objects.filter(
+                pk__in=set(membership.corp_profile_id for membership in memberships)
+            ).values_list('pk', 'name'))
+
+    prefetch_related = []
+    if education_field_list:
+        prefetch_related.append(Prefetch('user__educations',
+                                         queryset=Education.objects.order_by('pk'),
+                                         to_attr='export_educations'))
+
+    plan = ExportPlan(MembershipDefault, fields, formatter=formatter, columns=columns,
+                      prefetch_related=prefetch_related, prepare_chunk=prepare_chunk)
+    if invoice_field_list:
+        plan.select_related.append('membership_set__invoice')
+    return plan
 
 
 def process_export(
@@ -554,55 +609,52 @@ def process_export(
 
     identifier = identifier or int(ttime.time())
     file_name_temp = 'export/memberships/%s_%d_temp.csv' % (identifier, cp_id)
+    file_name = 'export/memberships/%s_%d.csv' % (identifier, cp_id)
+
+    def format_value(field_name, item):
+        if item is None:
+            item = ''
+        if item:
+            if isinstance(item, datetime):
+                # strftime will throw an error if year is before 1900
+                if item.year < 1900:
+                    item = '1900-1-1 00:00:00'
+                else:
+                    item = item.strftime('%Y-%m-%d %H:%M:%S')
+            elif isinstance(item, date):
+                item = item.strftime('%Y-%m-%d')
+            elif isinstance(item, time):
+                item = item.strftime('%H:%M:%S')
+            elif field_name == 'membership_type_id' and item in membership_ids_dict:
+                # display membership type name instead of id
+                item = membership_ids_dict[item]
+            elif field_name == 'app_id':
+                # display membership type name instead of id
+                item = app_ids_dict.get(item, '')
+            elif isinstance(item, str):
+                item = escape_csv(item)
+        return item
+
+    memberships = get_membership_queryset(
+        export_type,
+        export_status_detail,
+        cp_id,
+        ids=ids)
+    plan = get_membership_export_plan(
+        user_field_list,
+        profile_field_list,
+        education_field_list,
+        demographic_field_list,
+        membership_field_list,
+        invoice_field_list,
+        fks,
+        formatter=format_value)
+    progress = ExportProgress(file_name, memberships.count())
 
     with default_storage.open(file_name_temp, 'w') as csvfile:
-        csv_writer = csv.DictWriter(csvfile, fieldnames=title_list)
-        csv_writer.writeheader()
-
-        membership_rows = get_membership_rows(
-            user_field_list,
-            profile_field_list,
-            education_field_list,
-            demographic_field_list,
-            membership_field_list,
-            invoice_field_list,
-            fks,
-            export_type,
-            export_status_detail,
-            cp_id,
-            ids=ids)
-
-        for row_dict in membership_rows:
-
-            items_dict = {}
-            for field_name in title_list:
-                item = row_dict.get(field_name)
-                if item is None:
-                    item = ''
-                if item:
-                    if isinstance(item, datetime):
-                        # strftime will throw an error if year is before 1900
-                        if item.year < 1900:
-                            item = '1900-1-1 00:00:00'
-                        else:
-                            item = item.strftime('%Y-%m-%d %H:%M:%S')
-                    elif isinstance(item, date):
-                        item = item.strftime('%Y-%m-%d')
-                    elif isinstance(item, time):
-                        item = item.strftime('%H:%M:%S')
-                    elif field_name == 'membership_type' and item in membership_ids_dict:
-                        # display membership type name instead of id
-                        item = membership_ids_dict[item]
-                    elif field_name == 'app':
-                        # display membership type name instead of id
-                        item = app_ids_dict.get(item, '')
-                    elif isinstance(item, str):
-                        item = escape_csv(item)
-                items_dict[field_name] = item
-            csv_writer.writerow(items_dict)
+        write_csv(csvfile, title_list, plan.rows(memberships, progress=progress))
 
     # rename the file name
-    file_name = 'export/memberships/%s_%d.csv' % (identifier, cp_id)
     default_storage.save(file_name, default_storage.open(file_name_temp, 'rb'))
 
     # delete the temp file
@@ -1046,18 +1098,38 @@ def memb_import_parse_csv(mimport):
     """
     Parse csv data into a dictionary.
     """
+    fieldnames, rows = iter_memb_import_rows(mimport)
+    return fieldnames, list(rows)
+
+
+def iter_memb_import_rows(mimport):
+    """
+    Returns the field names of the csv file of mimport and an iterator
+    of its rows as dictionaries. The rows are read from the file as
+    they are consumed.
+    """
     normalize_newline(mimport.upload_file.name)
-    with default_storage.open(mimport.upload_file.name, "rt") as csvfile:
-        csv_reader = csv.reader(csvfile)
-        fieldnames = next(csv_reader)
-        fieldnames = normalize_field_names(fieldnames)
-    
-        data_list = []
-    
-        for row in csv_reader:
-            data_list.append(dict(zip(fieldnames, row)))
-    
-        return fieldnames, data_list
+    csvfile = default_storage.open(mimport.upload_file.name, "rt")
+    csv_reader = csv.reader(csvfile)
+    try:
+        fieldnames = normalize_field_names(next(csv_reader))
+    except StopIteration:
+        csvfile.close()
+        return [], iter([])
+
+    def rows():
+        with csvfile:
+            for row in csv_reader:
+                yield dict(zip(fieldnames, row))
+
+    return fieldnames, rows()
+
+
+def get_update_fields(model):
+    """
+    The fields bulk_update saves for the rows of model.
+    """
+    return [f.name for f in model._meta.concrete_fields if not f.primary_key]
 
 
 def check_missing_fields(memb_data, key, **kwargs):
@@ -1194,6 +1266,9 @@ class ImportMembDefault(object):
         self.allow_null_fields = ['account_id']
         self.should_handle_demographic = False
         self.should_handle_education = False
+        # the instances the rows refer to, see get_instance
+        self.instance_cache = {}
+        self.corp_profile_ids = {}
         self.membership_fields = dict([(field.name, field)
                             for field in MembershipDefault._meta.fields
                             if field.get_internal_type() != 'AutoField' and
@@ -1572,7 +1647,7 @@ class ImportMembDefault(object):
         # Also, don't update account_id for existing profile if it hasn't
         # been changed.
         account_id = self.memb_data.get('account_id')
-        user = users.first() if users else None
+        user = users[0] if users else None
         existing_account_id = str(user.profile.account_id) if user else None
         if not account_id or (user and account_id == existing_account_id):
             return None
@@ -1599,41 +1674,14 @@ class ImportMembDefault(object):
         """
         Database import here - insert or update
         """
-        from tendenci.apps.corporate_memberships.models import CorpMembership
-
         user = user or User()
-        username_before_assign = user.username
 
         # always remove user column
         if 'user' in self.field_names:
-            self.field_names.remove('user')
-
-        self.assign_import_values_from_dict(user, action_info['user_action'])
-
-        user.username = user.username or spawn_username(
-            fn=memb_data.get('first_name', u''),
-            ln=memb_data.get('last_name', u''),
-            em=memb_data.get('email', u''))
+            del self.field_names['user']
 
-        # clean username
-        user.username = re.sub(r'[^\w+-.@]', u'', user.username)
-
-        # make sure username is unique.
-        if action_info['user_action'] == 'insert':
+        if self.prepare_user(user, memb_data, action_info):
             user.username = make_username_unique(user.username)
-        else:
-            # it's update but a new username is assigned
-            # check if its unique
-            if user.username != username_before_assign:
-                user.username = make_username_unique(user.username)
-
-        # allow import with override of password
-        if 'password' in self.field_names and self.mimport.override and user.password:
-            user.set_password(user.password)
-
-        # is_active; unless forced via import
-        if 'is_active' not in self.field_names:
-            user.is_active = True
 
         user.save()
 
@@ -1649,23 +1697,8 @@ class ImportMembDefault(object):
                 owner_username=self.request_user.username,
                 **self.private_settings)
 
-        self.assign_import_values_from_dict(profile, action_info['user_action'])
+        self.prepare_profile(profile, action_info)
         profile.user = user
-
-        profile.status = True
-
-        if not profile.status_detail:
-            profile.status_detail = 'active'
-        else:
-            profile.status_detail = profile.status_detail.lower()
-
-        # this is membership import - the 'expired' status_detail shouldn't be assigned to profile
-        if profile.status_detail == 'expired':
-            profile.status_detail = 'active'
-
-        if profile.status_detail == 'active' and not profile.status:
-            profile.status = True
-
         profile.save()
 
         # membership_demographic
@@ -1684,32 +1717,121 @@ class ImportMembDefault(object):
             demographic.save()
 
         if self.should_handle_education:
-            educations = user.educations.all().order_by('pk')[0:4]
-            for x in range(1, 5):
-                school = memb_data.get('school%s' % x, '')
-                major = memb_data.get('major%s' % x, '')
-                degree = memb_data.get('degree%s' % x, '')
-                graduation_year = memb_data.get('graduation_year%s' % x, 0)
-                try:
-                    graduation_year = int(graduation_year)
-                except ValueError:
-                    graduation_year = 0
-                if any([school, major, degree, graduation_year]):
-                    try:
-                        education = educations[x-1]
-                    except IndexError:
-                        education = Education(user=user)
-                    education.school =school
-                    education.major = major
-                    education.degree = degree
-                    education.graduation_year = graduation_year
-                    education.save()
+            educations = list(user.educations.all().order_by('pk')[0:4])
+            for education in self.prepare_educations(user, memb_data, educations):
+                education.save()
 
         # membership
         if not memb:
             memb = MembershipDefault(
                     user=user)
 
+        self.prepare_membership(memb, action_info)
+        memb.save()
+
+        memb.is_active = self.is_active(memb)
+
+        # member_number
+        if not memb.member_number:
+            if memb.is_active:
+                memb.member_number = memb.set_member_number()
+                memb.save()
+        if self.sync_member_number(profile, memb):
+            profile.save()
+
+        # add to group only for the active memberships
+        if memb.is_active:
+            # group associated to membership type
+            params = {'creator_id': self.request_user.pk,
+                      'creator_username': self.request_user.username,
+                      'owner_id': self.request_user.pk,
+                      'owner_username': self.request_user.username}
+            memb.membership_type.group.add_user(memb.user, **params)
+
+    def prepare_user(self, user, memb_data, action_info):
+        """
+        Assigns the import values to user, without saving it.
+        Returns whether the username needs to be made unique.
+        """
+        username_before_assign = user.username
+
+        self.assign_import_values_from_dict(user, action_info['user_action'])
+
+        user.username = user.username or spawn_username_base(
+            fn=memb_data.get('first_name', u''),
+            ln=memb_data.get('last_name', u''),
+            em=memb_data.get('email', u''))
+
+        # clean username
+        user.username = re.sub(r'[^\w+-.@]', u'', user.username)
+
+        # allow import with override of password
+        if 'password' in self.field_names and self.mimport.override and user.password:
+            user.set_password(user.password)
+
+        # is_active; unless forced via import
+        if 'is_active' not in self.field_names:
+            user.is_active = True
+
+        # make sure username is unique, for a new user or
+        # when a new username is assigned to an existing user
+        return action_info['user_action'] == 'insert' or \
+            user.username != username_before_assign
+
+    def prepare_profile(self, profile, action_info):
+        """
+        Assigns the import values to profile, without saving it.
+        """
+        self.assign_import_values_from_dict(profile, action_info['user_action'])
+
+        profile.status = True
+
+        if not profile.status_detail:
+            profile.status_detail = 'active'
+        else:
+            profile.status_detail = profile.status_detail.lower()
+
+        # this is membership import - the 'expired' status_detail shouldn't be assigned to profile
+        if profile.status_detail == 'expired':
+            profile.status_detail = 'active'
+
+        if profile.status_detail == 'active' and not profile.status:
+            profile.status = True
+
+    def prepare_educations(self, user, memb_data, educations):
+        """
+        Assigns the up to 4 educations of the import to the existing
+        educations of user, or to new ones. Returns the educations
+        to save.
+        """
+        changed = []
+        for x in range(1, 5):
+            school = memb_data.get('school%s' % x, '')
+            major = memb_data.get('major%s' % x, '')
+            degree = memb_data.get('degree%s' % x, '')
+            graduation_year = memb_data.get('graduation_year%s' % x, 0)
+            try:
+                graduation_year = int(graduation_year)
+            except ValueError:
+                graduation_year = 0
+            if any([school, major, degree, graduation_year]):
+                try:
+                    education = educations[x-1]
+                except IndexError:
+                    education = Education(user=user)
+                education.school =school
+                education.major = major
+                education.degree = degree
+                education.graduation_year = graduation_year
+                changed.append(education)
+        return changed
+
+    def prepare_membership(self, memb, action_info):
+        """
+        Assigns the import values and the defaults to memb, without saving it.
+        """
+        from tendenci.apps.corporate_memberships.models import CorpMembership
+
         self.assign_import_values_from_dict(memb, action_info['memb_action'])
         if not memb.creator:
             memb.creator = self.request_user
@@ -1738,8 +1860,7 @@ class ImportMembDefault(object):
         # membership type
         if not hasattr(memb, "membership_type") or not memb.membership_type:
             # last resort - pick the first available membership type
-            memb.membership_type = MembershipType.objects.all(
-                                            ).order_by('id')[0]
+            memb.membership_type = self.get_first_instance(MembershipType)
 
         # no join_dt - set one
         if not hasattr(memb, 'join_dt') or not memb.join_dt:
@@ -1763,44 +1884,393 @@ class ImportMembDefault(object):
         # check corp_profile_id
         if memb.corporate_membership_id:
             if not memb.corp_profile_id:
-                [corp_profile_id] = CorpMembership.objects.filter(
-                                    id=memb.corporate_membership_id
-                                    ).values_list(
-                                'corp_profile_id',
-                                flat=True)[:1] or [None]
+                if memb.corporate_membership_id not in self.corp_profile_ids:
+                    [self.corp_profile_ids[memb.corporate_membership_id]] = CorpMembership.objects.filter(
+                                        id=memb.corporate_membership_id
+                                        ).values_list(
+                                    'corp_profile_id',
+                                    flat=True)[:1] or [None]
+                corp_profile_id = self.corp_profile_ids[memb.corporate_membership_id]
                 if corp_profile_id:
                     memb.corp_profile_id = corp_profile_id
 
-        memb.save()
-
-        memb.is_active = self.is_active(memb)
-
-        # member_number
-        if not memb.member_number:
-            if memb.is_active:
-                memb.member_number = memb.set_member_number()
-                memb.save()
+    def sync_member_number(self, profile, memb):
+        """
+        Copies the member number of memb to profile.
+        Returns whether the profile changed.
+        """
         if memb.member_number:
-            if not profile.member_number:
+            if profile.member_number != memb.member_number:
                 profile.member_number = memb.member_number
-                profile.save()
+                return True
+        elif profile.member_number:
+            profile.member_number = ''
+            return True
+        return False
+
+    def get_instance(self, model, pk):
+        """
+        The instance of model with pk, or None. The instances are cached
+        for the import, the rows mostly refer to the same few.
+        """
+        key = (model, pk)
+        if key not in self.instance_cache:
+            [self.instance_cache[key]] = model.objects.filter(pk=pk)[:1] or [None]
+        return self.instance_cache[key]
+
+    def get_first_instance(self, model):
+        key = (model, None)
+        if key not in self.instance_cache:
+            [self.instance_cache[key]] = model.objects.all().order_by('id')[:1] or [None]
+        return self.instance_cache[key]
+
+    def prefetch_users(self, data_list):
+        """
+        Looks up the existing users for the emails, usernames and member
+        numbers of a chunk of rows, with a query each, instead of one
+        lookup per row. The users of each value are ordered like
+        get_user_by_email and get_user_by_member_number order them.
+        """
+        emails = set(d['email'].lower() for d in data_list if d.get('email'))
+        usernames = set(d['username'].lower() for d in data_list if d.get('username'))
+        member_numbers = set(d['member_number'] for d in data_list if d.get('member_number'))
+        self.users_by_email = {}
+        self.users_by_username = {}
+        self.users_by_member_number = {}
+        # one instance per user, shared by all the lookups
+        self.users_by_id = {}
+        order_by = ('-is_active', '-is_superuser', '-is_staff')
+
+        if emails:
+            users = User.objects.annotate(email_lower=Lower('email')).filter(
+                        email_lower__in=emails).select_related('profile').order_by(*order_by)
+            for user in users:
+                user = self.users_by_id.setdefault(user.pk, user)
+                self.users_by_email.setdefault(user.email.lower(), []).append(user)
+        if usernames:
+            users = User.objects.annotate(username_lower=Lower('username')).filter(
+                        username_lower__in=usernames).select_related('profile')
+            for user in users:
+                user = self.users_by_id.setdefault(user.pk, user)
+                self.users_by_username.setdefault(user.username.lower(), []).append(user)
+        if member_numbers:
+            profiles = Profile.objects.filter(member_number__in=member_numbers).select_related(
+                        'user').order_by(*['-user__%s' % field[1:] for field in order_by])
+            for profile in profiles:
+                user = self.users_by_id.setdefault(profile.user.pk, profile.user)
+                self.users_by_member_number.setdefault(profile.member_number, []).append(user)
+
+        # the memberships of these users, the most recent first
+        self.membs_by_user_type = {}
+        memberships = MembershipDefault.objects.filter(
+                        user_id__in=list(self.users_by_id)).exclude(
+                        status_detail='archive').order_by('-id')
+        for memb in memberships:
+            memb.user = self.users_by_id[memb.user_id]
+            self.membs_by_user_type.setdefault((id(memb.user), memb.membership_type_id), memb)
+
+    def find_users(self, memb_data):
+        """
+        The users matching memb_data, through the prefetched users,
+        tried in the order of the import key.
+        """
+        lookups = {
+            'email': lambda: self.users_by_email.get((memb_data.get('email') or '').lower()),
+            'username': lambda: self.users_by_username.get((memb_data.get('username') or '').lower()),
+            'member_number': lambda: self.users_by_member_number.get(memb_data.get('member_number')),
+            'fn_ln_phone': lambda: get_user_by_fn_ln_phone(memb_data.get('first_name'),
+                                                           memb_data.get('last_name'),
+                                                           memb_data.get('phone')),
+        }
+        for key in [key for key in self.key.split('/') if key in lookups] or ['email']:
+            users = lookups[key]()
+            if users:
+                return users
+        return None
+
+    def process_chunk(self, idata_list):
+        """
+        Imports a chunk of rows (MembershipImportData) with a few queries:
+        the users and memberships of the whole chunk are looked up at once,
+        then the users, profiles, demographics, educations and memberships
+        are inserted with bulk_create and updated with bulk_update. Signals
+        are sent for the new users and memberships only, and the changed
+        objects are queued for indexing in bulk.
+
+        If the chunk fails, its rows are imported one by one with
+        process_default_membership instead.
+        """
+        summary_d = dict(self.summary_d)
+        account_ids_in_file = list(self.account_ids_in_file)
+        try:
+            with transaction.atomic():
+                self._process_chunk(idata_list)
+        except Exception as e:
+            print('Importing the chunk at row %d failed (%s), importing it row by row' % (
+                idata_list[0].row_num, e))
+            self.summary_d = summary_d
+            self.account_ids_in_file = account_ids_in_file
+            for idata in idata_list:
+                idata.refresh_from_db()
+                idata.action_taken, idata.error = None, ''
+                try:
+                    self.process_default_membership(idata)
+                except Exception as e:
+                    print(e)
+
+    def _process_chunk(self, idata_list):
+        now = datetime.now()
+        rows = []
+        for idata in idata_list:
+            memb_data = idata.row_data
+            is_valid, error_msg = check_missing_fields(memb_data, self.key)
+            if is_valid:
+                self.clean_corporate_membership(memb_data)
+                is_valid, error_msg = self.clean_membership_type(memb_data)
+                if is_valid:
+                    is_valid, error_msg = self.clean_app(memb_data)
+            if not is_valid:
+                self.summary_d['invalid'] += 1
+                idata.action_taken = 'skipped'
+                idata.error = error_msg
+                continue
+            self.clean_username(memb_data)
+            rows.append(idata)
+
+        if rows:
+            self.should_handle_demographic = self.has_demographic_fields(rows[0].row_data)
+            self.should_handle_education = self.has_education_fields(rows[0].row_data)
+        self.prefetch_users([idata.row_data for idata in rows])
+
+        new_users = []
+        unique_usernames = []
+        # (user, profile, memb) of each row
+        imported = []
+        profiles = {}
+        for idata in rows:
+            self.memb_data = memb_data = idata.row_data
+            self.field_names = memb_data
+            if 'user' in self.field_names:
+                del self.field_names['user']
+
+            users = self.find_users(memb_data)
+            self.set_unique_account_id(users)
+            action_info = {'user_action': 'insert', 'memb_action': 'insert'}
+            user = memb = None
+            if users:
+                action_info['user_action'] = 'update'
+                for u in users:
+                    memb = self.membs_by_user_type.get((id(u), memb_data['membership_type']))
+                    if memb:
+                        user = u
+                        break
+                user = user or users[0]
+                if memb:
+                    action_info['memb_action'] = 'update'
+
+            if action_info['user_action'] == 'insert':
+                self.summary_d['insert'] += 1
+                idata.action_taken = 'insert'
+            elif action_info['memb_action'] == 'update':
+                self.summary_d['update'] += 1
+                idata.action_taken = 'update'
             else:
-                if profile.member_number != memb.member_number:
-                    profile.member_number = memb.member_number
-                    profile.save()
-        else:
-            if profile.member_number:
-                profile.member_number = ''
-                profile.save()
+                self.summary_d['update_insert'] += 1
+                idata.action_taken = 'update_insert'
+
+            if user is None:
+                user = User()
+                new_users.append(user)
+                # a later row of the chunk for this user updates it
+                for d, value in ((self.users_by_email, (memb_data.get('email') or '').lower()),
+                                 (self.users_by_username, (memb_data.get('username') or '').lower()),
+                                 (self.users_by_member_number, memb_data.get('member_number'))):
+                    if value:
+                        d.setdefault(value, []).insert(0, user)
+            if self.prepare_user(user, memb_data, action_info):
+                unique_usernames.append(user)
+
+            profile = profiles.get(id(user))
+            if profile is None:
+                try:
+                    profile = user.profile
+                except (Profile.DoesNotExist, ValueError):
+                    profile = Profile(user=user,
+                                      creator=self.request_user,
+                                      creator_username=self.request_user.username,
+                                      owner=self.request_user,
+                                      owner_username=self.request_user.username,
+                                      **self.private_settings)
+                profiles[id(user)] = profile
+            self.prepare_profile(profile, action_info)
+
+            if memb is None:
+                memb = MembershipDefault(user=user)
+                self.membs_by_user_type[(id(user), memb_data['membership_type'])] = memb
+            self.prepare_membership(memb, action_info)
+            imported.append((idata, user, profile, memb, action_info))
+
+        # users
+        self.make_usernames_unique(unique_usernames)
+        User.objects.bulk_create(new_users)
+        new_user_ids = set(id(user) for user in new_users)
+        for user in new_users:
+            # not sent by bulk_create; the helpdesk settings
+            # of new users, for one, are created on it
+            post_save.send(sender=User, instance=user, created=True,
+                           update_fields=None, raw=False, using=DEFAULT_DB_ALIAS)
+        updated_users = dict((id(user), user) for idata, user, profile, memb, action_info in imported
+                             if id(user) not in new_user_ids)
+        User.objects.bulk_update(list(updated_users.values()),
+                                 get_update_fields(User), batch_size=IMPORT_BULK_BATCH_SIZE)
+
+        imported_users = dict((id(user), user) for idata, user, profile, memb, action_info in imported)
+        user_ids = [user.pk for user in imported_users.values()]
+
+        # demographics and educations
+        if self.should_handle_demographic:
+            demographics = dict((d.user_id, d) for d in MembershipDemographic.objects.filter(
+                                user_id__in=user_ids))
+            new_demographics = []
+            for idata, user, profile, memb, action_info in imported:
+                self.memb_data = self.field_names = idata.row_data
+                demographic = demographics.get(user.pk)
+                if demographic is None:
+                    demographic = demographics[user.pk] = MembershipDemographic(user=user)
+                    new_demographics.append(demographic)
+                self.assign_import_values_from_dict(demographic, action_info['user_action'])
+            MembershipDemographic.objects.bulk_create(new_demographics)
+            new_ids = set(id(d) for d in new_demographics)
+            MembershipDemographic.objects.bulk_update(
+                [d for d in demographics.values() if id(d) not in new_ids],
+                get_update_fields(MembershipDemographic), batch_size=IMPORT_BULK_BATCH_SIZE)
+        if self.should_handle_education:
+            educations = {}
+            for education in Education.objects.filter(user_id__in=user_ids).order_by('pk'):
+                educations.setdefault(education.user_id, []).append(education)
+            changed = {}
+            for idata, user, profile, memb, action_info in imported:
+                user_educations = educations.setdefault(user.pk, [])[0:4]
+                for education in self.prepare_educations(user, idata.row_data, user_educations):
+                    if not education.pk and education not in educations[user.pk]:
+                        educations[user.pk].append(education)
+                    changed[id(education)] = education
+            Education.objects.bulk_create([e for e in changed.values() if not e.pk])
+            Education.objects.bulk_update([e for e in changed.values() if e.pk],
+                                          ['school', 'major', 'degree', 'graduation_year'],
+                                          batch_size=IMPORT_BULK_BATCH_SIZE)
+
+        # memberships
+        membs = dict((id(memb), memb) for idata, user, profile, memb, action_info in imported)
+        new_membs = [memb for memb in membs.values() if not memb.pk]
+        for memb in membs.values():
+            memb.guid = memb.guid or uuid.uuid4().hex
+            memb.update_dt = now
+            memb.is_active = self.is_active(memb)
+        MembershipDefault.objects.bulk_create(new_membs)
+        # set_member_number needs the ids of the new memberships
+        self.set_member_numbers([memb for memb in membs.values() if not memb.member_number])
+        new_ids = set(id(memb) for memb in new_membs)
+        MembershipDefault.objects.bulk_update([memb for memb in membs.values() if id(memb) not in new_ids],
+                                              get_update_fields(MembershipDefault),
+                                              batch_size=IMPORT_BULK_BATCH_SIZE)
+
+        # profiles
+        for idata, user, profile, memb, action_info in imported:
+            self.sync_member_number(profile, memb)
+        use_account_id = get_setting('module', 'users', 'useaccountid')
+        next_account_id = None
+        new_profiles = []
+        for profile in profiles.values():
+            profile.update_dt = now
+            if not profile.pk:
+                profile.guid = str(uuid.uuid4())
+                new_profiles.append(profile)
+            profile.set_derived_fields()
+            if use_account_id and not profile.account_id and profile.is_active:
+                if next_account_id is None:
+                    next_account_id = profile.get_next_account_id()
+                profile.account_id = next_account_id
+                next_account_id += 1
+        Profile.objects.bulk_create(new_profiles)
+        new_ids = set(id(profile) for profile in new_profiles)
+        Profile.objects.bulk_update([p for p in profiles.values() if id(p) not in new_ids],
+                                    get_update_fields(Profile), batch_size=IMPORT_BULK_BATCH_SIZE)
+
+        # not sent by bulk_create; the contributions of the new
+        # memberships, for one, are created on it
+        for memb in new_membs:
+            post_save.send(sender=MembershipDefault, instance=memb, created=True,
+                           update_fields=None, raw=False, using=DEFAULT_DB_ALIAS)
 
         # add to group only for the active memberships
-        if memb.is_active:
-            # group associated to membership type
-            params = {'creator_id': self.request_user.pk,
-                      'creator_username': self.request_user.username,
-                      'owner_id': self.request_user.pk,
-                      'owner_username': self.request_user.username}
-            memb.membership_type.group.add_user(memb.user, **params)
+        GroupMembership.objects.bulk_create([GroupMembership(
+                    group_id=memb.membership_type.group_id,
+                    member_id=memb.user_id,
+                    creator_id=self.request_user.pk,
+                    creator_username=self.request_user.username,
+                    owner_id=self.request_user.pk,
+                    owner_username=self.request_user.username,
+                    status=True,
+                    status_detail='active')
+                for memb in membs.values() if memb.is_active and memb.membership_type.group_id],
+                ignore_conflicts=True)
+
+        MembershipImportData.objects.bulk_update(idata_list, ['action_taken', 'error'])
+
+        # the objects are indexed in bulk, not by their save signals
+        enqueue_items(User, user_ids)
+        enqueue_items(Profile, [profile.pk for profile in profiles.values()])
+        enqueue_items(MembershipDefault, [memb.pk for memb in membs.values()])
+
+    def make_usernames_unique(self, users):
+        """
+        make_username_unique for the usernames of users,
+        looking up the existing usernames with one query.
+        """
+        if not users:
+            return
+        lookups = [Q(username__startswith=user.username) for user in users]
+        taken = set(User.objects.filter(reduce(or_, lookups)).values_list('username', flat=True))
+        for user in users:
+            username = make_username_unique(user.username, taken)
+            taken.add(username)
+            user.username = username
+
+    def set_member_numbers(self, membs):
+        """
+        Sets the member numbers of the active memberships of membs, the
+        way set_member_number does, with a query for the chunk.
+        """
+        membs = [memb for memb in membs if self.is_active(memb)]
+        if not membs:
+            return
+        allow_multiple = MembershipApp.objects.filter(allow_multiple_membership=True).exists()
+        previous = {}
+        for user_id, membership_type_id, member_number in MembershipDefault.objects.filter(
+                    user_id__in=set(memb.user_id for memb in membs)).exclude(
+                    member_number__exact=u'').order_by('pk').values_list(
+                    'user_id', 'membership_type_id', 'member_number'):
+            previous[(user_id, membership_type_id if allow_multiple else None)] = member_number
+        base_number = get_setting('module', 'memberships', 'membernumberbasenumber')
+        if not isinstance(base_number, int):
+            # default to 5000 if not specified
+            base_number = 5000
+        for memb in membs:
+            memb.member_number = previous.get((memb.user_id,
+                                               memb.membership_type_id if allow_multiple else None), '')
+        # new member numbers - MemberNumberBaseNumber + id, unless taken
+        candidates = dict((str(base_number + memb.id), memb) for memb in membs if not memb.member_number)
+        taken = {}
+        for member_number, user_id in MembershipDefault.objects.filter(
+                    member_number__in=list(candidates)).values_list('member_number', 'user_id'):
+            taken.setdefault(member_number, set()).add(user_id)
+        for member_number, memb in candidates.items():
+            if taken.get(member_number, set()) - set([memb.user_id]):
+                # taken by another user
+                memb.member_number = memb.create_member_number()
+            else:
+                memb.member_number = member_number
 
     def is_active(self, memb):
         return all([memb.status,
@@ -1875,8 +2345,10 @@ class ImportMembDefault(object):
                 model = field.remote_field.parent_model()
             except AttributeError:
                 model = field.remote_field.model
-            [value] = model.objects.all()[:1] or [None]
-            return value
+            key = (model, 'default')
+            if key not in self.instance_cache:
+                [self.instance_cache[key]] = model.objects.all()[:1] or [None]
+            return self.instance_cache[key]
 
         return ''
 
@@ -1971,7 +2443,7 @@ class ImportMembDefault(object):
                     model = field.remote_field.parent_model()
                 except AttributeError:
                     model = field.remote_field.model
-                [value] = model.objects.filter(pk=value)[:1] or [None]
+                value = self.get_instance(model, value)
 
             # membership_type - look up by name in case
             # they entered name instead of id
@@ -1984,7 +2456,7 @@ class ImportMembDefault(object):
                     model = field.remote_field.parent_model()
                 except AttributeError:
                     model = field.remote_field.model
-                [value] = model.objects.all().order_by('id')[:1] or [None]
+                value = self.get_first_instance(model)
 
         return value
 
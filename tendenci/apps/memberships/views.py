@@ -51,7 +51,7 @@ from tendenci.apps.corporate_memberships.models import (CorpMembership,
                                                           CorpMembershipApp,
                                                           IndivEmailVerification)
 #from .reports import ReportNewMems
-from tendenci.apps.exports.utils import render_csv
+from tendenci.apps.exports.utils import render_csv, get_export_progress
 from tendenci.apps.perms.utils import get_notice_recipients
 
 from tendenci.apps.discounts.models import Discount, DiscountUse
@@ -973,6 +973,7 @@ def membership_default_export_status(request, identifier,
 
     context = {'identifier': identifier,
                'download_ready': download_ready,
+               'progress': get_export_progress(export_path),
                'corp_profile': corp_profile}
     return render_to_resp(request=request, template_name=template, context=context)
 
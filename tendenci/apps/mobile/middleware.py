@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
 
+from tendenci.apps.robots.utils import classify_user_agent
+
 mobile_agents = [
 #    'iPad',  # Removed on 2012-07-11
     'iPhone',
@@ -48,9 +50,8 @@ def is_mobile_cookie_on(request):
 
 def is_mobile_browser(request):
     if request.user_agent:
-        for ma in mobile_agents:
-            if ma.lower() in request.user_agent:
-                return True
+        # classified on the raw header to share the cache with the event logs
+        return classify_user_agent(request.META.get('HTTP_USER_AGENT', ''))[1]
     return False
 
 def show_mobile(request):
@@ -72,7 +72,7 @@ def search(request, release_year=None, template_name="news/search.html"):
             news = news.order_by('-order')
         else:
             filters = get_query_filters(request.user, 'news.view_news')
-            news = News.objects.filter(filters).distinct()
+            news = News.objects.filter(filters)
             news = news.order_by('-release_dt')
         if news_group:
             news = news.filter(groups__in=[news_group])
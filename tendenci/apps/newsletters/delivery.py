@@ -0,0 +1,331 @@
+"""
+Newsletter delivery.
+
+The recipients are read in batches along with their profiles and latest
+memberships, the merge tags of the newsletter are compiled once, and the
+rendered messages are sent by a pool of threads that each hold a
+persistent connection to the newsletter email provider. Every address a
+batch was sent to is recorded as a NewsletterDelivery, so a send that
+stops half way resumes instead of sending to everyone again.
+"""
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from smtplib import SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail.message import EmailMessage
+
+from tendenci.apps.base.utils import add_tendenci_footer, validate_email
+from tendenci.apps.email_blocks.models import EmailBlock
+from tendenci.apps.newsletters.utils import get_newsletter_connection
+
+logger = getLogger(__name__)
+
+MEMBERSHIP_TAGS = ('membership_link', 'directory_url', 'directory_edit_url',
+                   'membership_type', 'invoice_link')
+
+# The unsubscribe_url link should be something like <a href="[unsubscribe_url]">Unsubscribe</a>.
+# But it can be messed up sometimes. Let's prevent that from happening.
+UNSUBSCRIBE_HREF_RE = re.compile(r'(href=\")([^\"]*)(\[unsubscribe_url\])(\")')
+
+
+class BlockList(object):
+    """
+    The blocked emails and domains, loaded once.
+    Matches the way Email.is_blocked does.
+    """
+    def __init__(self):
+        self.emails = set()
+        self.domains = set()
+        for email, email_domain in EmailBlock.objects.values_list('email', 'email_domain'):
+            if email:
+                self.emails.add(email.lower())
+            if email_domain:
+                self.domains.add(email_domain.lower())
+
+    def is_blocked(self, email):
+        if not email or '@' not in email:
+            return False
+        email = email.lower()
+        email_domain = email.split('@')[1]
+        return (email in self.emails or
+                email_domain in self.domains or
+                email_domain.split('.')[-1] in self.domains)
+
+
+class MergeTemplate(object):
+    """
+    A text with [tag] placeholders, split once into its literal
+    parts and tags so that rendering it is a single join.
+    Tags without a value are left in place.
+    """
+    def __init__(self, text, tags):
+        self.tags = set()
+        if tags:
+            pattern = re.compile('(%s)' % '|'.join(re.escape('[%s]' % tag) for tag in tags))
+            self.parts = pattern.split(text)
+            self.tags = set(part[1:-1] for part in self.parts[1::2])
+        else:
+            self.parts = [text]
+
+    def has(self, *tags):
+        return bool(self.tags.intersection(tags))
+
+    def render(self, values):
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            parts[i] = values.get(parts[i][1:-1], parts[i])
+        return ''.join(parts)
+
+
+class RateLimiter(object):
+    """
+    Spaces the calls to wait() of all the threads to at most rate per second.
+    """
+    def __init__(self, rate=0):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class SenderPool(object):
+    """
+    A pool of threads that send email messages, each thread over
+    its own connection, opened once and reused for all its messages.
+    """
+    def __init__(self, workers, rate=0):
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self.limiter = RateLimiter(rate)
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def get_connection(self, reset=False):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None and reset:
+            try:
+                connection.close()
+            except Exception:
+                pass
+            connection = None
+        if connection is None:
+            connection = get_newsletter_connection()
+            connection.open()
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    def send_message(self, message):
+        self.limiter.wait()
+        try:
+            message.connection = self.get_connection()
+            return message.send()
+        except SMTPServerDisconnected:
+            # the provider closed the connection, reconnect once
+            message.connection = self.get_connection(reset=True)
+            return message.send()
+
+    def send_all(self, messages):
+        """
+        Sends the messages and waits for them.
+        Returns a list of (message, error), error is None when sent.
+        """
+        futures = [(message, self.executor.submit(self.send_message, message))
+                   for message in messages]
+        results = []
+        for message, future in futures:
+            try:
+                future.result()
+                results.append((message, None))
+            except Exception as e:
+                results.append((message, e))
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for connection in self.connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+class NewsletterDeliverer(object):
+    """
+    Sends a newsletter to its recipients.
+
+    send_key identifies this send of the newsletter: the addresses already
+    recorded for it are skipped, so running it again with the same key
+    resumes the send.
+    """
+    def __init__(self, newsletter, email, send_key, site_url,
+                 workers=None, rate=None, batch_size=None):
+        self.newsletter = newsletter
+        self.email = email
+        self.send_key = send_key
+        self.site_url = site_url
+        self.workers = workers or getattr(settings, 'NEWSLETTER_SEND_WORKERS', 4)
+        self.rate = rate if rate is not None else getattr(settings, 'NEWSLETTER_SEND_RATE', 0)
+        self.batch_size = batch_size or getattr(settings, 'NEWSLETTER_SEND_BATCH_SIZE', 200)
+
+        self.block_list = BlockList()
+
+        if newsletter.group and newsletter.group.membership_types.all().exists():
+            self.membership_type = newsletter.group.membership_types.all()[0]
+        else:
+            self.membership_type = None
+
+        self.subject = MergeTemplate(email.subject, ['firstname', 'lastname'])
+        body_tags = ['username', 'firstname', 'unsubscribe_url', 'browser_view_url']
+        if self.membership_type:
+            body_tags += MEMBERSHIP_TAGS
+        body = UNSUBSCRIBE_HREF_RE.sub(r'\1[unsubscribe_url]\4', email.body)
+        body = add_tendenci_footer(body, content_type=email.content_type)
+        self.body = MergeTemplate(body, body_tags)
+        self.browser_view_url = newsletter.get_browser_view_url()
+
+        self.headers = {}
+        if email.reply_to:
+            self.headers['Reply-To'] = email.reply_to
+        if email.sender_display:
+            # Add quotes around display name to prevent errors on sending
+            self.headers['From'] = '"%s" <%s>' % (email.sender_display, email.sender)
+        if email.priority and email.priority == 1:
+            self.headers['X-Priority'] = '1'
+            self.headers['X-MSMail-Priority'] = 'High'
+        self.is_html = email.content_type in ('html', email.CONTENT_TYPE_HTML)
+
+    def get_sent_emails(self):
+        from tendenci.apps.newsletters.models import NewsletterDelivery
+        return set(NewsletterDelivery.objects.filter(
+            newsletter=self.newsletter, send_key=self.send_key).values_list('email', flat=True))
+
+    def get_recipient_batches(self):
+        recipients = self.newsletter.get_recipients().select_related(
+            'member', 'member__profile', 'group')
+        batch = []
+        for recipient in recipients.iterator(chunk_size=self.batch_size):
+            batch.append(recipient)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def get_memberships(self, recipients):
+        """
+        The latest non archived membership of each recipient, by user id.
+        """
+        from tendenci.apps.memberships.models import MembershipDefault
+        if not self.membership_type or not self.body.has(*MEMBERSHIP_TAGS):
+            return {}
+        memberships = MembershipDefault.objects.filter(
+            user_id__in=[recipient.member_id for recipient in recipients]
+        ).exclude(status_detail='archive').order_by('user_id', '-create_dt').distinct(
+            'user_id').select_related('membership_type', 'directory', 'membership_set__invoice')
+        return dict((membership.user_id, membership) for membership in memberships)
+
+    def build_message(self, subject, body, recipient_email):
+        message = EmailMessage(subject.replace('\r', ' ').replace('\n', ' ').strip(),
+                               body,
+                               self.email.sender,
+                               [recipient_email],
+                               headers=dict(self.headers))
+        if self.is_html:
+            message.content_subtype = 'html'
+        return message
+
+    def build_messages(self, recipients, sent_emails):
+        memberships = self.get_memberships(recipients)
+        messages = []
+        for recipient in recipients:
+            member = recipient.member
+            profile = getattr(member, 'profile', None)
+
+            # Skip if Don't Send Email is on
+            if self.newsletter.enforce_direct_mail_flag:
+                if profile and not profile.direct_mail:
+                    continue
+
+            # skip if not a valid email address
+            if not validate_email(member.email):
+                continue
+
+            addresses = [member.email]
+            if self.newsletter.send_to_email2 and profile and validate_email(profile.email2):
+                addresses.append(profile.email2)
+            addresses = [address for address in addresses
+                         if address not in sent_emails and not self.block_list.is_blocked(address)]
+            if not addresses:
+                continue
+
+            subject = self.subject.render({'firstname': member.first_name,
+                                           'lastname': member.last_name})
+            values = {'username': member.username,
+                      'firstname': member.first_name,
+                      'browser_view_url': self.browser_view_url}
+            if self.body.has('unsubscribe_url'):
+                values['unsubscribe_url'] = recipient.noninteractive_unsubscribe_url
+            membership = memberships.get(member.pk)
+            if membership:
+                values.update(membership.get_common_urls(site_url=self.site_url))
+            body = self.body.render(values)
+
+            for address in addresses:
+                # the same address is never sent twice
+                sent_emails.add(address)
+                messages.append(self.build_message(subject, body, address))
+        return messages
+
+    def send(self, verbosity=1):
+        """
+        Sends the newsletter to the recipients it was not sent to yet.
+        Returns the number of emails sent for send_key.
+        """
+        from tendenci.apps.newsletters.models import NewsletterDelivery
+
+        sent_emails = self.get_sent_emails()
+        counter = len(sent_emails)
+        if counter and verbosity:
+            print("Resuming, %s emails were already sent." % counter)
+
+        pool = SenderPool(self.workers, self.rate)
+        try:
+            for recipients in self.get_recipient_batches():
+                messages = self.build_messages(recipients, sent_emails)
+                if not messages:
+                    continue
+                deliveries = []
+                for message, error in pool.send_all(messages):
+                    if error:
+                        # not recorded, so it is retried when the send resumes
+                        sent_emails.discard(message.to[0])
+                        logger.error('Error sending newsletter %s to %s: %s' % (
+                            self.newsletter.pk, message.to[0], error))
+                        print(u"Failed to send to {}: {}".format(message.to[0], error))
+                        continue
+                    deliveries.append(NewsletterDelivery(newsletter=self.newsletter,
+                                                         send_key=self.send_key,
+                                                         email=message.to[0]))
+                NewsletterDelivery.objects.bulk_create(deliveries, ignore_conflicts=True)
+                counter += len(deliveries)
+                if verbosity:
+                    print(u"Newsletter sent to {} emails".format(counter))
+        finally:
+            pool.close()
+
+        return counter
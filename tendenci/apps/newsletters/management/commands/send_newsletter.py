@@ -1,8 +1,8 @@
 
-from builtins import str
 import datetime
 import traceback
 import re
+import uuid
 from logging import getLogger
 from django.core.management.base import BaseCommand, CommandError
 from django.core.cache import cache
@@ -20,10 +20,19 @@ class Command(BaseCommand):
 
         example:
         python manage.py send_newsletter 1
+        python manage.py send_newsletter 1 --workers 8 --rate 50
 
     """
     def add_arguments(self, parser):
         parser.add_argument('newsletter_id', type=int)
+        parser.add_argument('--workers', type=int, default=None,
+            help='Number of sending threads (default to settings.NEWSLETTER_SEND_WORKERS)')
+        parser.add_argument('--rate', type=float, default=None,
+            help='Maximum emails per second (default to settings.NEWSLETTER_SEND_RATE)')
+        parser.add_argument('--batch-size', type=int, default=None, dest='batch_size',
+            help='Recipients prepared at a time (default to settings.NEWSLETTER_SEND_BATCH_SIZE)')
+        parser.add_argument('--restart', action='store_true', default=False,
+            help='Send to everyone instead of resuming an interrupted send')
 
     def move_style_to_header(self, email):
         """
@@ -56,7 +65,8 @@ class Command(BaseCommand):
 
     def send_newsletter(self, newsletter_id, **kwargs):
         from tendenci.apps.emails.models import Email
-        from tendenci.apps.newsletters.models import Newsletter, NewsletterRecurringData
+        from tendenci.apps.newsletters.models import Newsletter, NewsletterRecurringData, NewsletterDelivery
+        from tendenci.apps.newsletters.delivery import NewsletterDeliverer
         from tendenci.apps.site_settings.utils import get_setting
         from tendenci.apps.base.utils import validate_email
 
@@ -85,6 +95,16 @@ class Command(BaseCommand):
         if not validate_email(newsletter.email.sender):
             raise CommandError('"{}" is not a valid sender email address.'.format(newsletter.email.sender))
 
+        # a send that started but didn't finish still has its send_key,
+        # pick it up where it stopped; any other send gets a new key
+        resuming = (newsletter.send_status in ('sending', 'resending')
+                    and bool(newsletter.send_key) and not kwargs.get('restart'))
+        if resuming:
+            send_key = newsletter.send_key
+        else:
+            send_key = uuid.uuid4().hex
+        newsletter.send_key = send_key
+
         if newsletter.send_status == 'queued':
             newsletter.send_status = 'sending'
 
@@ -97,98 +117,33 @@ class Command(BaseCommand):
         newsletter.save()
 
         if newsletter.schedule:
-            # save start_dt and status for the recurring
-            nr_data = NewsletterRecurringData(
-                        newsletter=newsletter,
-                        start_dt=datetime.datetime.now(),
-                        send_status=newsletter.send_status)
-            nr_data.save()
+            nr_data = None
+            if resuming:
+                nr_data = newsletter.recurring_data.filter(
+                    finish_dt__isnull=True).order_by('-start_dt').first()
+            if not nr_data:
+                # save start_dt and status for the recurring
+                nr_data = NewsletterRecurringData(
+                            newsletter=newsletter,
+                            start_dt=datetime.datetime.now(),
+                            send_status=newsletter.send_status)
+                nr_data.save()
             newsletter.nr_data = nr_data
 
-        recipients = newsletter.get_recipients()
         email = self.move_style_to_header(newsletter.email)
         # replace relative to absolute urls
         self.site_url = get_setting('site', 'global', 'siteurl')
         email.body = email.body.replace("src=\"/", "src=\"%s/" % self.site_url)
         email.body = email.body.replace("href=\"/", "href=\"%s/" % self.site_url)
 
-        if newsletter.group and newsletter.group.membership_types.all().exists():
-            membership_type = newsletter.group.membership_types.all()[0]
-        else:
-            membership_type = None
-
-        counter = 0
-        for i, recipient in enumerate(recipients):
-            try:
-                if hasattr(recipient.member, 'profile'):
-                    profile = recipient.member.profile
-                else:
-                    profile = None
-            except KeyError:
-                continue
-
-            # Skip if Don't Send Email is on
-            if newsletter.enforce_direct_mail_flag:
-                if profile and not profile.direct_mail:
-                    continue
-
-            # skip if not a valid email address
-            if not validate_email(recipient.member.email):
-                continue
-
-            subject = email.subject
-            body = email.body
-
-            if '[firstname]' in subject:
-                subject = subject.replace('[firstname]', recipient.member.first_name)
-
-            if '[lastname]' in subject:
-                subject = subject.replace('[lastname]', recipient.member.last_name)
-
-            if '[username]' in body:
-                body = body.replace('[username]', recipient.member.username)
-
-            if '[firstname]' in body:
-                body = body.replace('[firstname]', recipient.member.first_name)
-
-            if '[unsubscribe_url]' in body:
-                #body = body.replace('[unsubscribe_url]', recipient.noninteractive_unsubscribe_url)
-                # The unsubscribe_url link should be something like <a href="[unsubscribe_url]">Unsubscribe</a>.
-                # But it can be messed up sometimes. Let's prevent that from happening.
-                p = r'(href=\")([^\"]*)(\[unsubscribe_url\])(\")'
-                body = re.sub(p, r'\1' + recipient.noninteractive_unsubscribe_url + r'\4', body)
-
-            if '[browser_view_url]' in body:
-                body = body.replace('[browser_view_url]', newsletter.get_browser_view_url())
-
-            if membership_type:
-                [membership] = recipient.member.membershipdefault_set.exclude(
-                        status_detail='archive').order_by('-create_dt')[:1] or [None]
-                if membership:
-                    # do find and replace
-                    urls_dict = membership.get_common_urls(site_url=self.site_url)
-                    for key in urls_dict.keys():
-                        body = body.replace('[%s]' % key, urls_dict[key])
-
-            email_to_send = Email(
-                    subject=subject,
-                    body=body,
-                    sender=email.sender,
-                    sender_display=email.sender_display,
-                    reply_to=email.reply_to,
-                    recipient=recipient.member.email
-                    )
-            print(i, u"Sending to {}".format(str(recipient.member.email)))
-            email_to_send.send(connection=connection)
-            counter += 1
-            print(u"Newsletter sent to {}".format(str(recipient.member.email)))
-
-            if newsletter.send_to_email2 and hasattr(recipient.member, 'profile') \
-                and validate_email(recipient.member.profile.email2):
-                email_to_send.recipient = recipient.member.profile.email2
-                email_to_send.send(connection=connection)
-                counter += 1
-                print(u"Newsletter sent to {}".format(str(recipient.member.profile.email2)))
+        deliverer = NewsletterDeliverer(newsletter, email, send_key, self.site_url,
+                                        workers=kwargs.get('workers'),
+                                        rate=kwargs.get('rate'),
+                                        batch_size=kwargs.get('batch_size'))
+        counter = deliverer.send()
+
+        # only the last send is kept
+        NewsletterDelivery.objects.filter(newsletter=newsletter).exclude(send_key=send_key).delete()
 
         if newsletter.send_status == 'sending':
             newsletter.send_status = 'sent'
@@ -202,6 +157,7 @@ class Command(BaseCommand):
             newsletter.resend_count += 1
 
         newsletter.email_sent_count = counter
+        newsletter.send_key = ''
 
         newsletter.save()
         if newsletter.schedule and newsletter.nr_data:
@@ -246,7 +202,11 @@ class Command(BaseCommand):
         newsletter_id = options['newsletter_id']
 
         try:
-            self.send_newsletter(newsletter_id)
+            self.send_newsletter(newsletter_id,
+                                 workers=options['workers'],
+                                 rate=options['rate'],
+                                 batch_size=options['batch_size'],
+                                 restart=options['restart'])
         except:
             print(traceback.format_exc())
             newsletter_url = '%s%s' % (get_setting('site', 'global', 'siteurl'),
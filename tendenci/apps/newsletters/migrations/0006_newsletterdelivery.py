@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletters', '0005_alter_newsletter_enforce_direct_mail_flag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewsletterDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('send_key', models.CharField(db_index=True, max_length=50)),
+                ('email', models.CharField(max_length=255)),
+                ('sent_dt', models.DateTimeField(auto_now_add=True)),
+                ('newsletter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='newsletters.newsletter')),
+            ],
+            options={
+                'unique_together': {('newsletter', 'send_key', 'email')},
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletters', '0006_newsletterdelivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='send_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50),
+        ),
+    ]
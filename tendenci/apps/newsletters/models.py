@@ -223,6 +223,10 @@ class Newsletter(models.Model):
     # resend_count
     resend_count = models.IntegerField(null=True, blank=True, default=0)
 
+    # the send_key of the send (or resend) in progress, blank once it
+    # finished; a send interrupted half way resumes with it
+    send_key = models.CharField(max_length=50, blank=True, default='', editable=False)
+
     # security_key will allow any user to view this newsletter from the browser
     # without logging in.
     security_key = models.CharField(max_length=50, null=True, blank=True)
@@ -280,6 +284,7 @@ class Newsletter(models.Model):
             'email_sent_count',
             'resend_count',
             'security_key',
+            'send_key',
             'article'
         ]
         field_names = [field.name
@@ -543,3 +548,19 @@ class NewsletterRecurringData(models.Model):
     # number of emails sent
     email_sent_count = models.IntegerField(null=True, blank=True, default=0)
     send_status = models.CharField(max_length=30, default='queued')
+
+
+class NewsletterDelivery(models.Model):
+    """
+    An address a newsletter was sent to, recorded as the send goes so
+    that a send that stopped half way resumes where it left off.
+    send_key identifies one send (or resend) of the newsletter.
+    """
+    newsletter = models.ForeignKey(Newsletter, related_name="deliveries", on_delete=models.CASCADE)
+    send_key = models.CharField(max_length=50, db_index=True)
+    email = models.CharField(max_length=255)
+    sent_dt = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        app_label = 'newsletters'
+        unique_together = ('newsletter', 'send_key', 'email')
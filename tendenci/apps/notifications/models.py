@@ -328,14 +328,15 @@ def get_formatted_messages(formats, label, context):
     return format_templates
 
 
-def send_emails(emails, label, extra_context=None, on_site=True):
+def send_emails(emails, label, extra_context=None, on_site=True, connection=None):
     """
     This method accepts a list of email addresses
     as opposed to a list of users. This is a custom method
     as opposed to send(), send_now(), and queue()
 
     Just send the notice to a list of emails immediately.
-    No new notice created here
+    No new notice created here.
+    Pass an open connection to send many notices over the same one.
     notification.send_emails(email_list, 'friends_invite_sent', {
         'spam': 'eggs',
         'foo': 'bar',
@@ -439,10 +440,12 @@ def send_emails(emails, label, extra_context=None, on_site=True):
 
             if recipient_bcc:
                 email = EmailMessage(subject, body, sender,
-                                     recipients, recipient_bcc, headers=headers)
+                                     recipients, recipient_bcc, headers=headers,
+                                     connection=connection)
             else:
                 email = EmailMessage(subject, body, sender,
-                                     recipients, headers=headers)
+                                     recipients, headers=headers,
+                                     connection=connection)
             email.content_subtype = content_type
     
             try:
@@ -1,10 +1,7 @@
-from builtins import str
-from django.db.models.fields.related import ManyToManyField, ForeignKey
-from django.contrib.contenttypes.fields import GenericRelation
+from time import time
 import celery
-from tendenci.apps.exports.utils import render_csv
+from tendenci.apps.exports.utils import ExportPlan, save_csv, export_result
 from tendenci.apps.pages.models import Page
-from tendenci.apps.base.utils import escape_csv
 
 class PagesExportTask(celery.Task):
     """Export Task for Celery
@@ -43,36 +40,10 @@ class PagesExportTask(celery.Task):
         ]
 
         file_name = 'pages.csv'
+        identifier = kwargs.get('identifier', None) or int(time())
 
         pages = Page.objects.active()
-        data_row_list = []
-        for page in pages:
-            # get the available fields from the model's meta
-            opts = page._meta
-            d = {}
-            for f in opts.get_fields() + opts.many_to_many:
-                if f.name in fields: # include specified fields only
-                    if isinstance(f, ManyToManyField):
-                        value = ["%s" % obj for obj in f.value_from_object(page)]
-                    if isinstance(f, ForeignKey):
-                        value = getattr(page, f.name)
-                    if isinstance(f, GenericRelation):
-                        generics = f.value_from_object(page).all()
-                        value = ["%s" % obj for obj in generics]
-                        value = ', '.join(value)
-                    else:
-                        value = f.value_from_object(page)
-                    d[f.name] = value
+        plan = ExportPlan(Page, fields)
+        file_path = save_csv('export/pages/%s_%s' % (identifier, file_name), fields, plan.rows(pages))
 
-            # append the accumulated values as a data row
-            # keep in mind the ordering of the fields
-            data_row = []
-            for field in fields:
-                # clean the derived values into unicode
-                value = str(d[field]).rstrip()
-                value = escape_csv(value)
-                data_row.append(value)
-
-            data_row_list.append(data_row)
-
-        return render_csv(file_name, fields, data_row_list)
+        return export_result(file_path, file_name)
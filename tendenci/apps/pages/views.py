@@ -98,7 +98,7 @@ def search(request, template_name="pages/search.html"):
     query = request.GET.get('q')
 
     filters = get_query_filters(request.user, 'pages.view_page')
-    pages = Page.objects.filter(filters).distinct()
+    pages = Page.objects.filter(filters)
     if query:
         if "category:" in query or "sub_category:" in query:
             # handle category and sub_category
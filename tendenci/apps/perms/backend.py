@@ -4,7 +4,7 @@ from django.db.models.base import Model
 from django.contrib.auth.backends import ModelBackend
 
 from tendenci.apps.perms.object_perms import ObjectPermission
-from tendenci.apps.perms.utils import can_view
+from tendenci.apps.perms.utils import get_object_perm_map, get_visibility_context
 
 
 class ObjectPermBackend(ModelBackend):
@@ -71,41 +71,35 @@ class ObjectPermBackend(ModelBackend):
     def get_group_object_permissions(self, user_obj, obj):
         if not obj.pk:
             return []
-        app_label = obj._meta.app_label
-        user_obj_attr = '_%s_%d_group_object_perm_cache' % (
-            app_label,
-            obj.pk
-        )
-        if not hasattr(user_obj, user_obj_attr):
+        perm_cache = user_obj.__dict__.setdefault('_group_object_perm_cache', {})
+        key = (obj._meta.label, obj.pk)
+        if key not in perm_cache:
             content_type = ContentType.objects.get_for_model(obj)
             filters = {
                'group__members': user_obj,
                'content_type': content_type,
                'object_id': obj.pk
             }
-            group_object_perms = ObjectPermission.objects.filter(**filters)
-            user_obj._group_object_perm_cache = set([u"%s.%s.%s" % (p.object_id, p.content_type.app_label, p.codename) for p in group_object_perms])
-        return user_obj._group_object_perm_cache
+            codenames = ObjectPermission.objects.filter(**filters).values_list('codename', flat=True)
+            perm_cache[key] = set([u"%s.%s.%s" % (obj.pk, content_type.app_label, codename) for codename in codenames])
+        return perm_cache[key]
 
     def get_all_object_permissions(self, user_obj, obj):
         if not obj.pk:
             return []
-        app_label = obj._meta.app_label
-        user_obj_attr = '_%s_%d_object_perm_cache' % (
-            app_label,
-            obj.pk
-        )
-        if not hasattr(user_obj, user_obj_attr):
+        perm_cache = user_obj.__dict__.setdefault('_object_perm_cache', {})
+        key = (obj._meta.label, obj.pk)
+        if key not in perm_cache:
             content_type = ContentType.objects.get_for_model(obj)
             filters = {
                 'content_type': content_type,
                 'object_id': obj.pk,
                 'user': user_obj
             }
-            perms = ObjectPermission.objects.filter(**filters)
-            user_obj._object_perm_cache = set([u"%s.%s.%s" % (p.object_id, p.content_type.app_label, p.codename) for p in perms])
-            user_obj._object_perm_cache.update(self.get_group_object_permissions(user_obj, obj))
-        return user_obj._object_perm_cache
+            codenames = ObjectPermission.objects.filter(**filters).values_list('codename', flat=True)
+            perm_cache[key] = set([u"%s.%s.%s" % (obj.pk, content_type.app_label, codename) for codename in codenames])
+            perm_cache[key].update(self.get_group_object_permissions(user_obj, obj))
+        return perm_cache[key]
 
     def has_perm(self, user, perm, obj=None):
         # check codename, return false if its a malformed codename
@@ -168,20 +162,11 @@ class ObjectPermBackend(ModelBackend):
         if not isinstance(obj, Model):
             return False
 
-        # lets check the search index for view permissions
-        # before we ever hit the database, faster
-        if 'view' in perm:
-            try:  # test for an index and make the query
-                from haystack import connections
-                site = connections['default'].unified_index()
-
-                site.get_index(obj.__class__)
-                if can_view(user, obj):
-                    return True
-            except AssertionError:
-                raise
-            except:
-                pass
+        # view and change rights are denormalized in the object's
+        # permission map, which can_view_many may have loaded already
+        if perm_type in ('view', 'change'):
+            perm_map = get_object_perm_map(user, obj)
+            return bool(perm_map and perm_map.allows(perm_type, user.pk, get_visibility_context(user).group_ids))
 
         # check the permissions on the object level of groups or user
         perm = '%s.%s' % (obj.pk, perm)
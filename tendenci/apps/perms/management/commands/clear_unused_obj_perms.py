@@ -4,8 +4,28 @@ from django.core.management.base import BaseCommand
 class Command(BaseCommand):
     """
     For performance reason, clear all non-group perms from objectpermission.
+
+    The ObjectPermissionMap rows of the objects these perms were on
+    are rebuilt, so they no longer grant the removed rights.
+
+    Usage: python manage.py clear_unused_obj_perms
     """
     def handle(self, *args, **options):
-        from tendenci.apps.perms.object_perms import ObjectPermission
+        from django.contrib.contenttypes.models import ContentType
+        from django.db import transaction
+        from tendenci.apps.perms.object_perms import ObjectPermission, ObjectPermissionMap
+
+        perms = ObjectPermission.objects.filter(group__isnull=True)
+        object_ids = {}
+        for content_type_id, object_id in perms.values_list('content_type_id', 'object_id').distinct():
+            object_ids.setdefault(content_type_id, []).append(object_id)
+
+        with transaction.atomic():
+            deleted, _ = perms.delete()
+            for content_type_id, ids in object_ids.items():
+                content_type = ContentType.objects.get_for_id(content_type_id)
+                for i in range(0, len(ids), 500):
+                    ObjectPermissionMap.objects.refresh(content_type, ids[i:i + 500])
 
-        ObjectPermission.objects.filter(group__isnull=True).delete()
+        print('Deleted %d perms, refreshed the maps of %d objects.' % (
+            deleted, sum(len(ids) for ids in object_ids.values())))
@@ -2,7 +2,7 @@ from builtins import str
 from haystack.query import SearchQuerySet
 from haystack.backends import SQ
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models.query import QuerySet
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
@@ -77,6 +77,131 @@ class ObjectPermissionManager(models.Manager):
         else:
             return []
 
+    def _as_list(self, obj_or_objs):
+        if isinstance(obj_or_objs, (list, tuple, QuerySet)):
+            return list(obj_or_objs)
+        return [obj_or_objs]
+
+    def _codenames(self, content_type, object, perms=None):
+        """
+        Returns the codenames of perms (e.g. ['view', 'change']) on the
+        model of object, or of all the model permissions if perms is empty.
+        Raises Permission.DoesNotExist for an unknown perm.
+        """
+        permissions = Permission.objects.filter(content_type=content_type)
+        if not perms:
+            return list(permissions.values_list('codename', flat=True))
+
+        codenames = ['%s_%s' % (perm, object._meta.object_name.lower()) for perm in perms]
+        found = set(permissions.filter(codename__in=codenames).values_list('codename', flat=True))
+        missing = [codename for codename in codenames if codename not in found]
+        if missing:
+            raise Permission.DoesNotExist('Permission %s does not exist.' % ', '.join(missing))
+        return codenames
+
+    def _group_ids(self, groups):
+        """
+        Returns the ids of a list of groups, group ids or
+        digit strings, skipping the ones that do not exist.
+        """
+        from tendenci.apps.user_groups.models import Group
+        ids = set()
+        lookups = set()
+        for group in groups:
+            if isinstance(group, str):
+                if group.isdigit():
+                    lookups.add(int(group))
+            elif isinstance(group, int):
+                lookups.add(group)
+            elif group is not None:
+                ids.add(group.pk)
+        if lookups:
+            ids.update(Group.objects.filter(pk__in=lookups).values_list('pk', flat=True))
+        return ids
+
+    def apply_rows(self, content_type, object_ids, rows, replace=None):
+        """
+        Brings the permissions of the objects of a content type in line
+        with rows, a set of (object_id, codename, group_id, user_id).
+
+        Only the rows that are missing are inserted. With replace, a dict of
+        filters (empty for all the permissions), the existing permissions of
+        the objects that match the filters and are not in rows are deleted.
+        Everything runs in one transaction and the permission maps of the
+        objects are rebuilt.
+
+        Returns the number of permissions created and deleted.
+        """
+        object_ids = list(set(object_ids))
+        if not object_ids:
+            return 0, 0
+
+        with transaction.atomic():
+            existing = self.filter(content_type=content_type, object_id__in=object_ids)
+            keys = set()
+            for pk, object_id, codename, group_id, user_id in existing.values_list(
+                    'pk', 'object_id', 'codename', 'group_id', 'user_id'):
+                keys.add((object_id, codename, group_id, user_id))
+
+            deleted = 0
+            if replace is not None:
+                stale_ids = []
+                seen = set()
+                for pk, object_id, codename, group_id, user_id in existing.filter(**replace).values_list(
+                        'pk', 'object_id', 'codename', 'group_id', 'user_id'):
+                    key = (object_id, codename, group_id, user_id)
+                    # duplicates are removed too
+                    if key not in rows or key in seen:
+                        stale_ids.append(pk)
+                    seen.add(key)
+                if stale_ids:
+                    deleted, _ = self.filter(pk__in=stale_ids).delete()
+
+            new_perms = [self.model(content_type=content_type,
+                                    object_id=object_id,
+                                    codename=codename,
+                                    group_id=group_id,
+                                    user_id=user_id)
+                         for object_id, codename, group_id, user_id in rows
+                         if (object_id, codename, group_id, user_id) not in keys]
+            self.bulk_create(new_perms, batch_size=500)
+
+            map_model = self.model._meta.apps.get_model('perms', 'ObjectPermissionMap')
+            map_model.objects.refresh(content_type, object_ids)
+
+        return len(new_perms), deleted
+
+    def group_rows(self, group_or_groups, object, perms=None):
+        """
+        Returns the (object_id, codename, group_id, user_id) rows that
+        assign_group would give to the groups on object.
+        """
+        content_type = ContentType.objects.get_for_model(object)
+        groups = self._as_list(group_or_groups)
+
+        # treat the tuples differently. They are passed in as
+        # ((group,perm,),(group,perm,) ..... (group,perm.))
+        if isinstance(group_or_groups, tuple) and len(groups[0]) == 2:
+            group_ids = self._group_ids([group for group, perm in groups])
+            # raises for an unknown perm
+            self._codenames(content_type, object, list(set(perm for group, perm in groups)))
+            rows = set()
+            for group, perm in groups:
+                group_id = getattr(group, 'pk', group)
+                if isinstance(group_id, str) and group_id.isdigit():
+                    group_id = int(group_id)
+                if group_id in group_ids:
+                    codename = '%s_%s' % (perm, object._meta.object_name.lower())
+                    rows.add((object.pk, codename, group_id, None))
+            return rows
+
+        if not isinstance(perms, list):
+            perms = None
+        codenames = self._codenames(content_type, object, perms)
+        return set((object.pk, codename, group_id, None)
+                   for group_id in self._group_ids(groups)
+                   for codename in codenames)
+
     def assign_group(self, group_or_groups, object, perms=None):
         """
         Assigns permissions to group or multiple groups
@@ -93,106 +218,11 @@ class ObjectPermissionManager(models.Manager):
            leave blank for all permissions.
            Note: If you are using the tuple/perm approach this does nothing.
         """
-        multi_group = False
-        group_with_perms = False
-
         # nobody to give permissions too
         if not group_or_groups:
             return
-        # check perms
-        if not isinstance(perms, list):
-            perms = None
-        # check for multi_groups
-        if isinstance(group_or_groups, list):
-            multi_group = True
-        if isinstance(group_or_groups, QuerySet):
-            multi_group = True
-        if isinstance(group_or_groups, tuple):
-            multi_group = True
-            if len(group_or_groups[0]) == 2:
-                group_with_perms = True
-
-        # treat the tuples differently. They are passed in as
-        # ((group,perm,),(group,perm,) ..... (group,perm.))
-        if group_with_perms:
-            from tendenci.apps.user_groups.models import Group
-            for group, perm in group_or_groups:
-                if isinstance(group, str):
-                    if group.isdigit():
-                        try:
-                            group = Group.objects.get(pk=group)
-                        except:
-                            group = None
-
-                codename = '%s_%s' % (perm, object._meta.object_name.lower())
-                content_type = ContentType.objects.get_for_model(object)
-
-                perm = Permission.objects.get(codename=codename,
-                                              content_type=content_type)
-
-                defaults = {
-                    "codename": codename,
-                    "object_id": object.pk,
-                    "content_type": perm.content_type,
-                    "group": group,
-                }
-                self.get_or_create(**defaults)
-            return  # get out
-
-        if multi_group:
-            for group in group_or_groups:
-                if perms:
-                    for perm in perms:
-                        codename = '%s_%s' % (perm, object._meta.object_name.lower())
-                        content_type = ContentType.objects.get_for_model(object)
-
-                        perm = Permission.objects.get(codename=codename,
-                                                      content_type=content_type)
-
-                        defaults = {
-                            "codename": codename,
-                            "object_id": object.pk,
-                            "content_type": perm.content_type,
-                            "group": group,
-                        }
-                        self.get_or_create(**defaults)
-                else:  # all default permissions
-                    content_type = ContentType.objects.get_for_model(object)
-                    perms = Permission.objects.filter(content_type=content_type)
-                    for perm in perms:
-                        defaults = {
-                            "codename": perm.codename,
-                            "object_id": object.pk,
-                            "content_type": content_type,
-                            "group": group,
-                        }
-                        self.get_or_create(**defaults)
-        else:  # not multi_group
-            if perms:
-                for perm in perms:
-                    codename = '%s_%s' % (perm, object._meta.object_name.lower())
-                    content_type = ContentType.objects.get_for_model(object)
-
-                    perm = Permission.objects.get(codename=codename,
-                                                  content_type=content_type)
-                    defaults = {
-                        "codename": codename,
-                        "object_id": object.pk,
-                        "content_type": perm.content_type,
-                        "group": group_or_groups,
-                    }
-                    self.get_or_create(**defaults)
-            else:  # all default permissions
-                content_type = ContentType.objects.get_for_model(object)
-                perms = Permission.objects.filter(content_type=content_type)
-                for perm in perms:
-                    defaults = {
-                        "codename": perm.codename,
-                        "object_id": object.pk,
-                        "content_type": content_type,
-                        "group": group_or_groups,
-                    }
-                    self.get_or_create(**defaults)
+        content_type = ContentType.objects.get_for_model(object)
+        self.apply_rows(content_type, [object.pk], self.group_rows(group_or_groups, object, perms))
 
     def assign(self, user_or_users, object, perms=None):
         """
@@ -207,91 +237,31 @@ class ObjectPermissionManager(models.Manager):
         -- perms: a list of individual permissions to assign to each user
            leave blank for all permissions.
         """
-        multi_user = False
-
         # nobody to give permissions too
         if not user_or_users:
             return
         # check perms
         if not isinstance(perms, list):
             perms = None
-        # check for multi_users
-        if isinstance(user_or_users, list):
-            multi_user = True
-        if isinstance(user_or_users, QuerySet):
-            multi_user = True
-        if isinstance(user_or_users, tuple):
-            multi_user = True
-
-        if multi_user:
-            for user in user_or_users:
-                if perms:
-                    for perm in perms:
-                        codename = '%s_%s' % (perm, object._meta.object_name.lower())
-                        content_type = ContentType.objects.get_for_model(object)
-
-                        perm = Permission.objects.get(codename=codename,
-                                                      content_type=content_type)
-
-                        defaults = {
-                            "codename": codename,
-                            "object_id": object.pk,
-                            "content_type": perm.content_type,
-                            "user": user,
-                        }
-                        try:
-                            self.get_or_create(**defaults)
-                        except self.model.MultipleObjectsReturned:
-                            pass
-
-                else:  # all default permissions
-                    content_type = ContentType.objects.get_for_model(object)
-                    perms = Permission.objects.filter(content_type=content_type)
-                    for perm in perms:
-                        defaults = {
-                            "codename": perm.codename,
-                            "object_id": object.pk,
-                            "content_type": content_type,
-                            "user": user,
-                        }
-                        try:
-                            self.get_or_create(**defaults)
-                        except self.model.MultipleObjectsReturned:
-                            pass
-
-        else:  # not muli_user
-            if perms:
-                for perm in perms:
-                    codename = '%s_%s' % (perm, object._meta.object_name.lower())
-                    content_type = ContentType.objects.get_for_model(object)
-
-                    perm = Permission.objects.get(codename=codename,
-                                                  content_type=content_type)
-                    defaults = {
-                        "codename": codename,
-                        "object_id": object.pk,
-                        "content_type": perm.content_type,
-                        "user": user_or_users,
-                    }
-                    try:
-                        self.get_or_create(**defaults)
-                    except self.model.MultipleObjectsReturned:
-                        pass
-
-            else:  # all default permissions
-                content_type = ContentType.objects.get_for_model(object)
-                perms = Permission.objects.filter(content_type=content_type)
-                for perm in perms:
-                    defaults = {
-                        "codename": perm.codename,
-                        "object_id": object.pk,
-                        "content_type": content_type,
-                        "user": user_or_users,
-                    }
-                    try:
-                        self.get_or_create(**defaults)
-                    except self.model.MultipleObjectsReturned:
-                        pass
+
+        content_type = ContentType.objects.get_for_model(object)
+        codenames = self._codenames(content_type, object, perms)
+        rows = set((object.pk, codename, None, user.pk)
+                   for user in self._as_list(user_or_users)
+                   for codename in codenames)
+        self.apply_rows(content_type, [object.pk], rows)
+
+    def set_group_perms(self, group_or_groups, object, perms=None):
+        """
+        Replaces all the permissions on object with the ones assign_group
+        would give to the groups. Permissions that are already in place
+        are kept as they are.
+        """
+        content_type = ContentType.objects.get_for_model(object)
+        rows = set()
+        if group_or_groups:
+            rows = self.group_rows(group_or_groups, object, perms)
+        return self.apply_rows(content_type, [object.pk], rows, replace={})
 
     def list_all(self, object):
         """
@@ -309,10 +279,68 @@ class ObjectPermissionManager(models.Manager):
             Remove all permissions on object (instance)
         """
         content_type = ContentType.objects.get_for_model(object)
-        perms = self.filter(content_type=content_type,
-                            object_id=object.pk)
-        for perm in perms:
-            perm.delete()
+        self.apply_rows(content_type, [object.pk], set(), replace={})
+
+    def refresh_map(self, object_or_objects):
+        """
+        Rebuilds the ObjectPermissionMap of an object or a list of
+        objects of the same model.
+        """
+        objects = object_or_objects
+        if not isinstance(objects, (list, tuple, QuerySet)):
+            objects = [objects]
+        objects = [obj for obj in objects if obj.pk]
+        if not objects:
+            return
+        content_type = ContentType.objects.get_for_model(objects[0])
+        map_model = self.model._meta.apps.get_model('perms', 'ObjectPermissionMap')
+        map_model.objects.refresh(content_type, [obj.pk for obj in objects])
+
+
+class ObjectPermissionMapManager(models.Manager):
+    def refresh(self, content_type, object_ids):
+        """
+        Rebuilds the maps of the objects of a content type
+        from their ObjectPermission rows. Only the view and change
+        permissions of the content type's own model are mapped.
+        """
+        ObjectPermission = self.model._meta.apps.get_model('perms', 'ObjectPermission')
+
+        perm_types = dict(('%s_%s' % (perm_type, content_type.model), perm_type)
+                          for perm_type in ('view', 'change'))
+        maps = {}
+        perms = ObjectPermission.objects.filter(content_type=content_type, object_id__in=object_ids,
+                                                codename__in=list(perm_types))
+        for object_id, codename, group_id, user_id in perms.values_list(
+                'object_id', 'codename', 'group_id', 'user_id'):
+            perm_type = perm_types[codename]
+            perm_map = maps.setdefault(object_id, self.model(content_type=content_type, object_id=object_id))
+            if group_id and group_id not in getattr(perm_map, '%s_groups' % perm_type):
+                getattr(perm_map, '%s_groups' % perm_type).append(group_id)
+            if user_id and user_id not in getattr(perm_map, '%s_users' % perm_type):
+                getattr(perm_map, '%s_users' % perm_type).append(user_id)
+
+        with transaction.atomic():
+            self.filter(content_type=content_type, object_id__in=object_ids).delete()
+            self.bulk_create(maps.values())
+
+    def for_objects(self, objects):
+        """
+        Returns the maps of a list of objects, of any models, in a single
+        query as a dict keyed by (content_type_id, object_id).
+        """
+        q = None
+        ids_by_ct = {}
+        for obj in objects:
+            if obj.pk:
+                content_type = ContentType.objects.get_for_model(obj)
+                ids_by_ct.setdefault(content_type.pk, set()).add(obj.pk)
+        for content_type_id, ids in ids_by_ct.items():
+            ct_q = models.Q(content_type_id=content_type_id, object_id__in=ids)
+            q = ct_q if q is None else q | ct_q
+        if q is None:
+            return {}
+        return dict(((m.content_type_id, m.object_id), m) for m in self.filter(q))
 
 
 class TendenciBaseManager(models.Manager):
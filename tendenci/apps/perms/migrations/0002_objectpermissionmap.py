@@ -0,0 +1,61 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_maps(apps, schema_editor):
+    """
+    Builds the permission maps of the objects that have view or change
+    permissions, reading the permissions in object order.
+    """
+    ObjectPermission = apps.get_model('perms', 'ObjectPermission')
+    ObjectPermissionMap = apps.get_model('perms', 'ObjectPermissionMap')
+
+    perms = ObjectPermission.objects.order_by('content_type_id', 'object_id').values_list(
+        'content_type_id', 'object_id', 'codename', 'group_id', 'user_id')
+    maps = []
+    current = None
+    for content_type_id, object_id, codename, group_id, user_id in perms.iterator(chunk_size=5000):
+        perm_type = codename.split('_')[0]
+        if perm_type not in ('view', 'change'):
+            continue
+        if current is None or (current.content_type_id, current.object_id) != (content_type_id, object_id):
+            current = ObjectPermissionMap(content_type_id=content_type_id, object_id=object_id,
+                                          view_groups=[], change_groups=[], view_users=[], change_users=[])
+            maps.append(current)
+        if group_id and group_id not in getattr(current, '%s_groups' % perm_type):
+            getattr(current, '%s_groups' % perm_type).append(group_id)
+        if user_id and user_id not in getattr(current, '%s_users' % perm_type):
+            getattr(current, '%s_users' % perm_type).append(user_id)
+        if len(maps) >= 5000:
+            # keep the current map, it may get more permissions
+            ObjectPermissionMap.objects.bulk_create(maps[:-1])
+            maps = maps[-1:]
+    ObjectPermissionMap.objects.bulk_create(maps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('perms', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectPermissionMap',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.IntegerField()),
+                ('view_groups', models.JSONField(default=list)),
+                ('change_groups', models.JSONField(default=list)),
+                ('view_users', models.JSONField(default=list)),
+                ('change_users', models.JSONField(default=list)),
+                ('update_dt', models.DateTimeField(auto_now=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('content_type', 'object_id')},
+            },
+        ),
+        migrations.RunPython(build_maps, migrations.RunPython.noop),
+    ]
@@ -3,7 +3,7 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
 
-from tendenci.apps.perms.managers import ObjectPermissionManager
+from tendenci.apps.perms.managers import ObjectPermissionManager, ObjectPermissionMapManager
 from tendenci.apps.user_groups.models import Group
 
 
@@ -27,3 +27,35 @@ class ObjectPermission(models.Model):
 
     class Meta:
         app_label = 'perms'
+
+
+class ObjectPermissionMap(models.Model):
+    """
+    The ObjectPermission rows of an object, flattened into the ids of the
+    groups and users that can view or change it, so the rights on many
+    objects can be read in a single query.
+
+    Rebuilt by ObjectPermissionManager whenever permissions are assigned
+    to or removed from the object.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.IntegerField()
+    view_groups = models.JSONField(default=list)
+    change_groups = models.JSONField(default=list)
+    view_users = models.JSONField(default=list)
+    change_users = models.JSONField(default=list)
+    update_dt = models.DateTimeField(auto_now=True)
+
+    objects = ObjectPermissionMapManager()
+
+    class Meta:
+        app_label = 'perms'
+        unique_together = ('content_type', 'object_id')
+
+    def allows(self, perm_type, user_id, group_ids):
+        """
+        perm_type is 'view' or 'change'
+        """
+        if user_id in getattr(self, '%s_users' % perm_type):
+            return True
+        return not set(group_ids).isdisjoint(getattr(self, '%s_groups' % perm_type))
@@ -4,9 +4,11 @@ from haystack.backends import SQ
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, Exists, OuterRef
 
-from tendenci.apps.perms.object_perms import ObjectPermission
+from tendenci.apps.perms.object_perms import ObjectPermission, ObjectPermissionMap
 
 
 PUBLIC_FILTER = {'status':True,'status_detail':"active",'allow_anonymous_view':True}
@@ -57,22 +59,16 @@ def update_perms_and_save(request, form, instance, **kwargs):
         if hasattr(instance, 'owner_username'):
             instance.owner_username = request.user.username
 
-    # save the instance because we need the primary key
-    if instance.pk:
-        ObjectPermission.objects.remove_all(instance)
+    group_perms = form.cleaned_data.get('group_perms')
+    if not instance.pk:
+        # the permissions need the primary key
+        instance.save(**kwargs)
+        ObjectPermission.objects.set_group_perms(group_perms, instance)
     else:
-        try:
-            instance.save()
-        except Exception as e:
-            print('boom! in update_perms_and_save()', e)
-
-    # assign permissions for selected groups
-    if 'group_perms' in form.cleaned_data:
-        ObjectPermission.objects.assign_group(form.cleaned_data['group_perms'], instance)
-
-    # save again for indexing purposes
-    # TODO: find a better solution, saving twice kinda sux
-    instance.save(**kwargs)
+        # the permissions are in place before the save, so the
+        # search index picks them up without saving twice
+        ObjectPermission.objects.set_group_perms(group_perms, instance)
+        instance.save(**kwargs)
 
     # assign the permission to the medial files
     assign_files_perms(instance)
@@ -115,26 +111,20 @@ def assign_files_perms(instance, **kwargs):
         if hasattr(instance, attr):
             perm_attrs.append(attr)
 
+    # get all instance permissions [for copying], once for all the files
+    instance_perms = ObjectPermission.objects.filter(
+        content_type=content_type, object_id=instance.pk, group__isnull=False
+    ).values_list('codename', 'group_id')
+    instance_perms = set((codename.split('_')[0], group_id) for codename, group_id in instance_perms)
+
+    rows = set()
     for file in files:  # loop through media files and update
         if not file.object_id:  # pick up orphans
             file.object_id = instance.pk
 
-        # remove all group permissions on file
-        ObjectPermission.objects.filter(
-            content_type=file_ct, object_id=file.pk, group__isnull=False).delete()
-
-        # get all instance permissions [for copying]
-        instance_perms = ObjectPermission.objects.filter(
-            content_type=content_type, object_id=instance.pk, group__isnull=False
-        )
-
         # copy instance group permissions to file
-        for file_perm in instance_perms:
-            file_perm.pk = None
-            file_perm.content_type = file_ct
-            file_perm.object_id = file.pk
-            file_perm.codename = '%s_%s' % (file_perm.codename.split('_')[0], 'file')
-            file_perm.save()
+        for perm_type, group_id in instance_perms:
+            rows.add((file.pk, '%s_%s' % (perm_type, 'file'), group_id, None))
 
         # copy permission attributes
         for attr in perm_attrs:
@@ -152,6 +142,10 @@ def assign_files_perms(instance, **kwargs):
 
             file.save()
 
+    # replace the group permissions on the files with the instance ones
+    ObjectPermission.objects.apply_rows(file_ct, [file.pk for file in files], rows,
+                                        replace={'group__isnull': False})
+
 def has_perm(user, perm, obj=None):
     """
         A simple wrapper around the user.has_perm
@@ -189,6 +183,98 @@ def has_view_perm(user, perm, obj=None):
     return False
 
 
+class VisibilityContext(object):
+    """
+    What get_query_filters needs to know about a user: the superuser and
+    member flags and the ids of the groups the user belongs to.
+    """
+    def __init__(self, user, group_ids):
+        self.user = user
+        self.is_superuser = user.profile.is_superuser
+        self.is_member = user.profile.is_member
+        self.group_ids = tuple(group_ids)
+
+
+def get_visibility_cache_key(user_id):
+    return '.'.join([settings.CACHE_PRE_KEY, 'perms', 'visibility', str(user_id)])
+
+
+def delete_visibility_cache(user_id):
+    cache.delete(get_visibility_cache_key(user_id))
+
+
+def delete_visibility_caches(user_ids):
+    cache.delete_many([get_visibility_cache_key(user_id) for user_id in user_ids])
+
+
+def get_visibility_context(user):
+    """
+    Returns the VisibilityContext of a user. It is computed once per
+    request (kept on the user object) and the group ids are cached per
+    user until the user's group memberships change.
+    """
+    context = getattr(user, '_visibility_context', None)
+    if context is None:
+        key = get_visibility_cache_key(user.pk)
+        group_ids = cache.get(key)
+        if group_ids is None:
+            group_ids = list(user.group_member.values_list('group_id', flat=True))
+            cache.set(key, group_ids, getattr(settings, 'PERMS_VISIBILITY_CACHE_TIMEOUT', 60*5))
+        context = VisibilityContext(user, group_ids)
+        user._visibility_context = context
+    return context
+
+
+_perm_content_type_ids = {}
+
+
+def get_perm_content_type_id(perm):
+    """
+    Returns the id of the content type of a permission such as
+    'articles.view_article', or None if its app label and codename
+    don't name an installed model.
+    """
+    if perm not in _perm_content_type_ids:
+        app_label, codename = perm.split('.', 1)
+        model = codename.split('_', 1)[-1]
+        try:
+            content_type_id = ContentType.objects.get_by_natural_key(app_label, model).pk
+        except ContentType.DoesNotExist:
+            content_type_id = None
+        _perm_content_type_ids[perm] = content_type_id
+    return _perm_content_type_ids[perm]
+
+
+def object_perm_exists(perm=None, group_ids=None):
+    """
+    Returns an EXISTS condition on the object permissions of the filtered
+    rows, for the codename of perm and, optionally, a list of groups.
+    Unlike a join through the perms relation, it never duplicates rows,
+    so no distinct() is needed.
+
+    The object permissions of a row can only be told apart from those of
+    other models with the content type of perm; without one (no perm, or
+    one whose content type can't be resolved) the condition is the join
+    through the perms relation of the filtered model, as it always was.
+    """
+    codename = perm.split('.')[-1] if perm and '.' in perm else None
+    content_type_id = get_perm_content_type_id(perm) if codename else None
+    if content_type_id is None:
+        join_filters = {}
+        if codename:
+            join_filters['perms__codename'] = codename
+        if group_ids is not None:
+            join_filters['perms__group__in'] = group_ids
+        return Q(**join_filters)
+
+    object_perms = ObjectPermission.objects.filter(object_id=OuterRef('pk'),
+                                                   content_type_id=content_type_id,
+                                                   codename=codename)
+    if group_ids is not None:
+        object_perms = object_perms.filter(group_id__in=group_ids)
+    return Q(Exists(object_perms))
+
+
 def get_query_filters(user, perm, **kwargs):
     """
     Method to generate search query filters for different user types.
@@ -198,58 +284,100 @@ def get_query_filters(user, perm, **kwargs):
     perms_field = kwargs.get('perms_field', True)
     #super_perm = kwargs.get('super_perm', False)
 
-    group_perm = Q()
-    group_q = Q()
-
     if not isinstance(user, User) or user.is_anonymous:
         anon_q = Q(allow_anonymous_view=True)
         status_q = Q(status=True)
         status_detail_q = Q(status_detail__in=['active', 'published'])
         anon_filter = (anon_q & status_q & status_detail_q)
         return anon_filter
-    else:
-        if user.profile.is_superuser:
-            return Q(status=True)
-        else:
 
-            if '.' in perm and perms_field:
-                group_perm = Q(perms__codename=perm.split(".")[-1])
+    context = get_visibility_context(user)
+    if context.is_superuser:
+        return Q(status=True)
 
-            # skip checking the allow_xxx_view for profiles 'cause those fields are not editable in profiles
-            if perm == 'profiles.view_profile':
-                return (Q(status=True) & group_perm & Q(status_detail='active')) | (Q(creator=user) | Q(owner=user))
+    has_codename = '.' in perm and perms_field
 
-            if user.profile.is_member:
-                anon_q = Q(allow_anonymous_view=True)
-                user_q = Q(allow_user_view=True)
-                member_q = Q(allow_member_view=True)
-                status_q = Q(status=True)
-                status_detail_q = Q(status_detail__in=['active', 'published'])
+    # skip checking the allow_xxx_view for profiles 'cause those fields are not editable in profiles
+    if perm == 'profiles.view_profile':
+        group_perm = object_perm_exists(perm) if has_codename else Q()
+        return (Q(status=True) & group_perm & Q(status_detail='active')) | (Q(creator=user) | Q(owner=user))
 
-                if perms_field:
-                    group_ids = [int(g.group.id) for g in user.group_member.select_related('group')]
-                    group_q = Q(perms__group__in=group_ids)
+    anon_q = Q(allow_anonymous_view=True)
+    user_q = Q(allow_user_view=True)
+    status_q = Q(status=True)
+    status_detail_q = Q(status_detail__in=['active', 'published'])
+    creator_perm_q = Q(creator=user)
+    owner_perm_q = Q(owner=user)
 
-                creator_perm_q = Q(creator=user)
-                owner_perm_q = Q(owner=user)
-                member_filter = (status_q & (((anon_q | user_q | member_q | (group_q & group_perm)) & status_detail_q) | (creator_perm_q | owner_perm_q)))
+    view_q = anon_q | user_q
+    if context.is_member:
+        view_q |= Q(allow_member_view=True)
+    if perms_field and context.group_ids:
+        view_q |= object_perm_exists(perm if has_codename else None, context.group_ids)
+
+    return (status_q & ((view_q & status_detail_q) | (creator_perm_q | owner_perm_q)))
+
+
+def get_object_perm_map(user, obj):
+    """
+    Returns the ObjectPermissionMap of obj (None if it has no view or
+    change permissions), memoized on the user object for the request.
+    """
+    content_type = ContentType.objects.get_for_model(obj)
+    key = (content_type.pk, obj.pk)
+    perm_map_cache = user.__dict__.setdefault('_object_perm_map_cache', {})
+    if key not in perm_map_cache:
+        perm_map_cache[key] = ObjectPermissionMap.objects.filter(
+            content_type=content_type, object_id=obj.pk).first()
+    return perm_map_cache[key]
 
-                return member_filter
-            else:
-                anon_q = Q(allow_anonymous_view=True)
-                user_q = Q(allow_user_view=True)
-                status_q = Q(status=True)
-                status_detail_q = Q(status_detail__in=['active', 'published'])
 
-                if perms_field:
-                    group_ids = [int(g.group.id) for g in user.group_member.select_related('group')]
-                    group_q = Q(perms__group__in=group_ids)
+def can_view_many(user, objects, perm=None):
+    """
+    Checks the view permission of a user on a list of objects, such as
+    a page of search results, with at most one query for the object
+    permissions of all of them. Returns a dict of object -> bool.
 
-                creator_perm_q = Q(creator=user)
-                owner_perm_q = Q(owner=user)
-                user_filter = (status_q & (((anon_q | user_q | (group_q & group_perm)) & status_detail_q) | (creator_perm_q | owner_perm_q)))
+    perm defaults to the view permission of each object's model.
+    The object permission maps are memoized on the user, so later
+    has_perm calls for these objects don't query them again.
+    """
+    objects = list(objects)
+    anonymous = not isinstance(user, User) or user.is_anonymous
+    if not anonymous and user.profile.is_superuser:
+        return dict.fromkeys(objects, True)
+
+    context = None if anonymous else get_visibility_context(user)
+    module_perms = set() if anonymous else user.get_all_permissions()
+    results = {}
+    pending = []
+    for obj in objects:
+        obj_perm = perm or '%s.view_%s' % (obj._meta.app_label, obj._meta.model_name)
+        if obj_perm in module_perms:
+            results[obj] = True
+        elif hasattr(obj, 'status') and not obj.status:
+            results[obj] = False
+        elif getattr(obj, 'status_detail', None) in ('active', 'published') and (
+                getattr(obj, 'allow_anonymous_view', False) or
+                (not anonymous and getattr(obj, 'allow_user_view', False)) or
+                (not anonymous and context.is_member and getattr(obj, 'allow_member_view', False))):
+            results[obj] = True
+        elif anonymous:
+            results[obj] = False
+        elif getattr(obj, 'creator_id', None) == user.pk or getattr(obj, 'owner_id', None) == user.pk:
+            results[obj] = True
+        else:
+            pending.append(obj)
 
-                return user_filter
+    if pending:
+        maps = ObjectPermissionMap.objects.for_objects(pending)
+        perm_map_cache = user.__dict__.setdefault('_object_perm_map_cache', {})
+        for obj in pending:
+            key = (ContentType.objects.get_for_model(obj).pk, obj.pk)
+            perm_map = maps.get(key)
+            perm_map_cache[key] = perm_map
+            results[obj] = bool(perm_map and perm_map.allows('view', user.pk, context.group_ids))
+    return results
 
 
 def get_groups_query_filters(user, **kwargs):
@@ -272,7 +400,7 @@ def get_groups_query_filters(user, **kwargs):
             group_q = Q()
             perm = 'change_group'
             # groups user is member of
-            group_ids = [int(g.group.id) for g in user.group_member.select_related('group')]
+            group_ids = list(get_visibility_context(user).group_ids)
 
             content_type = ContentType.objects.get(
                     app_label=Group._meta.app_label, model=Group._meta.model_name)
@@ -0,0 +1,83 @@
+from io import BytesIO
+from time import time
+
+from django.core.management.base import BaseCommand
+
+# the sizes of the cache_photos command
+SIZES = [((422, 700), False, True), ((102, 78), True, False), ((640, 640), False, True)]
+
+
+class Command(BaseCommand):
+    """
+    Measure how many resized photos per second are rendered from a sample
+    of the photos: decoding the full photo (how they used to be rendered),
+    with the reduced JPEG decoding in the request, and in the worker pool.
+    Nothing is written to the storage.
+
+    Usage: ./manage.py benchmark_photo_sizes
+    Example: ./manage.py benchmark_photo_sizes --count=100 --workers=4
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--count',
+            dest='count',
+            type=int,
+            default=50,
+            help='The number of photos in the sample')
+        parser.add_argument('--workers',
+            dest='workers',
+            type=int,
+            default=None,
+            help='The number of worker processes (IMAGE_DERIVATIVE_WORKERS by default)')
+
+    def handle(self, *args, **options):
+        from concurrent.futures import ProcessPoolExecutor
+        from PIL import Image as PILImage
+        from tendenci.apps.base.utils import apply_orientation, image_rescale
+        from tendenci.apps.files.derivatives import get_source, get_workers, open_source, render_derivative
+        from tendenci.apps.files.utils import aspect_ratio
+        from tendenci.apps.photos.models import Image
+
+        jobs = []
+        for photo in Image.objects.exclude(image='').order_by('-pk')[:options['count']]:
+            try:
+                source = get_source(photo.image)
+                dimensions = photo.image_dimensions()
+            except Exception:
+                continue
+            for size, crop, constrain in SIZES:
+                jobs.append((source, aspect_ratio(dimensions, size, constrain), crop))
+        if not jobs:
+            print('No photos to render')
+            return
+        print('Rendering %d sizes of %d photos' % (len(jobs), len(jobs) // len(SIZES)))
+
+        def full_decode(source, size, crop):
+            image = apply_orientation(open_source(source)).convert('RGB')
+            if crop:
+                image = image_rescale(image, size)
+            else:
+                image = image.resize(tuple(size), PILImage.LANCZOS)
+            image.save(BytesIO(), 'JPEG', quality=90)
+
+        def report(label, seconds):
+            print('%s: %.1fs, %.1f images/s' % (label, seconds, len(jobs) / seconds))
+
+        start = time()
+        for source, size, crop in jobs:
+            full_decode(source, size, crop)
+        report('Full decode', time() - start)
+
+        start = time()
+        for source, size, crop in jobs:
+            render_derivative(source, size, crop=crop, format='JPEG')
+        report('Reduced decode', time() - start)
+
+        workers = options['workers'] or get_workers()
+        if workers:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                start = time()
+                futures = [pool.submit(render_derivative, source, size, crop, 90, 'JPEG')
+                           for source, size, crop in jobs]
+                for future in futures:
+                    future.result()
+                report('Reduced decode, %d workers' % workers, time() - start)
@@ -1,22 +1,21 @@
-
 from django.core.management.base import BaseCommand
 
 
 class Command(BaseCommand):
     help = ('Loops through all of the photos to create a cached version.')
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+            type=int,
+            dest='workers',
+            default=1,
+            help='Number of worker processes')
+
     def handle(self, *args, **options):
         from tendenci.apps.photos.models import Image
-        from tendenci.apps.photos.utils.caching import cache_photo_size
-
-        for photo in Image.objects.all().order_by('-pk'):
-
-            cache_kwargs_list = []
-            cache_kwargs_list.append({"id": photo.pk, "size": "422x700", "constrain": True})
-            cache_kwargs_list.append({"id": photo.pk, "size": "102x78", "crop": True})
-            cache_kwargs_list.append({"id": photo.pk, "size": "640x640", "constrain": True})
-
-            for cache_kwargs in cache_kwargs_list:
-                cache_photo_size(**cache_kwargs)
+        from tendenci.apps.photos.utils.rendering import enqueue_photos, run_render_workers
 
-            print(photo.pk)
+        queued = enqueue_photos(Image.objects.order_by('-pk').values_list('pk', flat=True),
+                                batch_size=1000)
+        result = run_render_workers(workers=options['workers'])
+        print('Cached %d of %d photos in %.1fs' % (result['processed'], queued, result['seconds']))
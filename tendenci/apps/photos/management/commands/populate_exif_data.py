@@ -1,18 +1,27 @@
 from django.core.management.base import BaseCommand
-from django.core.files.storage import default_storage
+from django.db.models import Q
 
 class Command(BaseCommand):
     """
     Populate the exif_data field in Image table.
+
+    The photos are rendered by the render queue, which reads the EXIF
+    data and creates the missing sizes from the same decode.
+
+    Usage: ./manage.py populate_exif_data --workers 4
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+            type=int,
+            dest='workers',
+            default=1,
+            help='Number of worker processes')
+
     def handle(self, *args, **options):
         from tendenci.apps.photos.models import Image
+        from tendenci.apps.photos.utils.rendering import enqueue_photos, run_render_workers
 
-        images = Image.objects.all()
-        for image in images:
-            if not image.exif_data:
-                if default_storage.exists(image.image.name):
-                    exif_exists = image.get_exif_data()
-                    if exif_exists:
-                        image.save()
+        images = Image.objects.filter(Q(exif_data__isnull=True) | Q(exif_data='')).exclude(image='')
+        enqueue_photos(images.values_list('pk', flat=True))
+        run_render_workers(workers=options['workers'])
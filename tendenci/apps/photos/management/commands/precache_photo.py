@@ -7,12 +7,8 @@ class Command(BaseCommand):
         parser.add_argument('photo_id', type=int)
 
     def handle(self, photo_id, **options):
-        from tendenci.apps.photos.utils.caching import cache_photo_size
+        from tendenci.apps.photos.models import Image
+        from tendenci.apps.photos.utils.rendering import render_photo
 
-        cache_kwargs_list = []
-        cache_kwargs_list.append({"id": photo_id, "size": "422x700", "constrain": True})
-        cache_kwargs_list.append({"id": photo_id, "size": "102x78", "crop": True})
-        cache_kwargs_list.append({"id": photo_id, "size": "640x640", "constrain": True})
-
-        for cache_kwargs in cache_kwargs_list:
-            cache_photo_size(**cache_kwargs)
+        for photo in Image.objects.filter(pk=photo_id):
+            render_photo(photo)
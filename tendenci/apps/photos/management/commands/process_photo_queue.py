@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Renders the photos queued in PhotoRenderItem: the EXIF data, the
+    pre-cached photo sizes and the sizes of the photo set pages, decoding
+    each original once. Workers claim batches of queued photos, so several
+    can run at once. They stop when the queue is empty.
+
+    Usage:
+        python manage.py process_photo_queue
+
+        with 4 worker processes:
+        python manage.py process_photo_queue --workers 4 --batch-size 20
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+            type=int,
+            dest='workers',
+            default=1,
+            help='Number of worker processes')
+        parser.add_argument('--batch-size',
+            type=int,
+            dest='batch_size',
+            default=20,
+            help='Number of queued photos claimed at once')
+        parser.add_argument('--release-lock',
+            action='store_true',
+            dest='release_lock',
+            default=False,
+            help='Release the worker lock taken by the batch upload when done')
+
+    def handle(self, **options):
+        from tendenci.apps.photos.utils.rendering import release_render_worker, run_render_workers
+        verbosity = int(options.get('verbosity', 1))
+
+        processed = seconds = 0
+        while True:
+            result = run_render_workers(workers=options['workers'], batch_size=options['batch_size'])
+            processed += result['processed']
+            seconds += result['seconds']
+            # photos queued while the lock was held have no worker of their own
+            if not options['release_lock'] or not release_render_worker():
+                break
+
+        if verbosity > 0:
+            print('Rendered %d photos with %d worker(s) in %.1fs' % (
+                processed, max(options['workers'], 1), seconds))
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0008_alter_photocategory_slug'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoRenderItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('create_dt', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='photos.image')),
+                ('photoset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='photos.photoset')),
+            ],
+        ),
+    ]
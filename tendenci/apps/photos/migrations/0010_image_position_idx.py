@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0009_photorenderitem'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['position', 'id'], name='photos_image_position_idx'),
+        ),
+    ]
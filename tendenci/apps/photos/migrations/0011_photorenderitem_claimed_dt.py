@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0010_image_position_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photorenderitem',
+            name='claimed_dt',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -12,6 +12,7 @@ from io import BytesIO
 from urllib.parse import urlencode
 
 from django.db import models
+from django.db.models import F, Func, Q, Subquery
 from django.urls import reverse
 from django.db.models.signals import post_init
 from django.contrib.auth.models import User, AnonymousUser
@@ -118,6 +119,10 @@ class ImageModel(models.Model):
                                on_delete=models.SET_NULL,
                                related_name="%(class)s_related", verbose_name=_('effect'))
 
+    # set to leave the photo sizes and the EXIF data to the render queue
+    # (see photos.utils.rendering) instead of creating them on save
+    render_later = False
+
     class Meta:
         abstract = True
 
@@ -268,19 +273,27 @@ class ImageModel(models.Model):
             im = im.resize(new_dimensions, PILImage.LANCZOS)
         return im
 
-    def create_size(self, photosize):
+    def create_size(self, photosize, im=None):
+        """
+        Creates the photosize version of the image. im is the
+        original image, when the caller has already opened it.
+        """
         if self.size_exists(photosize):
             return
 
-        try:
-            with default_storage.open(str(self.image)) as f:
-                content = f.read()
-                im = PILImage.open(BytesIO(content))
-        except IOError as e:
-            print(e)
-            return
-
-        im_format = im.format
+        if im is None:
+            try:
+                with default_storage.open(str(self.image)) as f:
+                    content = f.read()
+                    im = PILImage.open(BytesIO(content))
+            except IOError as e:
+                print(e)
+                return
+            im_format = im.format
+        else:
+            # effects and watermarks can change the image in place
+            im_format = im.format
+            im = im.copy()
 
         # Apply effect if found
         if hasattr(self, 'effect') and self.effect is not None:
@@ -326,11 +339,11 @@ class ImageModel(models.Model):
             self.remove_size(photosize, False)
         self.remove_cache_dirs()
 
-    def pre_cache(self):
+    def pre_cache(self, im=None):
         cache = PhotoSizeCache()
         for photosize in cache.sizes.values():
             if photosize.pre_cache:
-                self.create_size(photosize)
+                self.create_size(photosize, im=im)
 
     def remove_cache_dirs(self):
         try:
@@ -355,7 +368,8 @@ class ImageModel(models.Model):
         if self._get_pk_val():
             self.clear_cache()
         super(ImageModel, self).save(*args, **kwargs)
-        self.pre_cache()
+        if not self.render_later:
+            self.pre_cache()
 
     def delete(self):
         assert self._get_pk_val() is not None, "%s object can't be deleted because its %s attribute is set to None." % (self._meta.object_name, self._meta.pk.attname)
@@ -771,6 +785,10 @@ class Image(OrderingBaseModel, ImageModel, TendenciBaseModel):
     class Meta:
 #         permissions = (("view_image", "Can view image"),)
         app_label = 'photos'
+        indexes = [
+            # photo navigation (get_navigation)
+            models.Index(fields=['position', 'id'], name='photos_image_position_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.id:
@@ -778,7 +796,7 @@ class Image(OrderingBaseModel, ImageModel, TendenciBaseModel):
         if not self.group:
             self.group_id = get_default_group()
             
-        if not self.id:
+        if not self.id and not self.render_later:
             try:
                 exif_exists = self.get_exif_data()
             except AttributeError:
@@ -835,12 +853,14 @@ class Image(OrderingBaseModel, ImageModel, TendenciBaseModel):
             return reverse("photo", args=[self.pk])
         return reverse('photo', args=[self.pk, photo_set.pk])
 
-    def get_exif_data(self):
+    def get_exif_data(self, img=None):
         """
         Extract EXIF data from image and store in the field exif_data.
+        img is the opened image, when the caller has already opened it.
         """
         try:
-            img = PILImage.open(default_storage.open(self.image.name))
+            if img is None:
+                img = PILImage.open(default_storage.open(self.image.name))
             exif = img._getexif()
         except (AttributeError, IOError):
             return False
@@ -930,57 +950,73 @@ class Image(OrderingBaseModel, ImageModel, TendenciBaseModel):
             return True
         return False
 
-    def get_next(self, set=None):
-        # decide which set to pull from
+    def get_set_images(self, set=None):
+        # the images the navigation goes through, in navigation order
         if set:
-            images = Image.objects.filter(photoset=set, position__gt=self.position)
+            images = Image.objects.filter(photoset=set)
         else:
-            images = Image.objects.filter(position__gt=self.position)
-        images = images.values_list("position", flat=True)
-        images = images.order_by('-position')
-        if set and images:
-            [ image ] = Image.objects.filter(photoset=set, position=min(images))[:1] or [None]
-            return image
-        return None
+            images = Image.objects.all()
+        return images.order_by('position', 'pk')
+
+    def get_after_q(self):
+        # the images after this one in navigation order, which
+        # breaks the ties between equal positions with the id
+        return Q(position__gt=self.position) | Q(position=self.position, pk__gt=self.pk)
+
+    def get_before_q(self):
+        return Q(position__lt=self.position) | Q(position=self.position, pk__lt=self.pk)
+
+    def get_next(self, set=None):
+        if not set or self.position is None:
+            return None
+        return self.get_set_images(set).filter(self.get_after_q()).first()
 
     def get_prev(self, set=None):
-        # decide which set to pull from
-        if set:
-            images = Image.objects.filter(photoset=set, position__lt=self.position)
-        else:
-            images = Image.objects.filter(position__lt=self.position)
-        images = images.values_list("position", flat=True)
-        images = images.order_by('-position')
-        if set:
-            try:
-                return Image.objects.get(photoset=set, position=max(images))
-            except (ValueError, Image.MultipleObjectsReturned):
-                return None
-        return None
+        if not set or self.position is None:
+            return None
+        return self.get_set_images(set).filter(self.get_before_q()).last()
 
     def get_first(self, set=None):
-        # decide which set to pull from
-        if set:
-            images = Image.objects.filter(photoset=set)
-        else:
+        if not set:
             return None
-        images = images.values_list("position", flat=True)
-        images = images.order_by('-position')
-        if set:
-            try:
-                return Image.objects.get(photoset=set, position=min(images))
-            except (ValueError, Image.MultipleObjectsReturned):
-                return None
-        return None
+        return self.get_set_images(set).first()
 
     def get_position(self, set=None):
-        # decide which set to pull from
+        if self.position is None:
+            return 0
+        return self.get_set_images(set).filter(self.get_before_q() | Q(pk=self.pk)).count()
+
+    def get_navigation(self, set=None):
+        """
+        The ids of the previous, next and first images and the position
+        of this image, in the set, with a single query.
+
+        Example:
+            navigation = photo.get_navigation(set=set_id)
+            navigation['prev_id'], navigation['position']
+        """
+        navigation = {'prev_id': None, 'next_id': None, 'first_id': None, 'position': 0}
+        if self.position is None:
+            if set:
+                navigation['first_id'] = getattr(self.get_first(set), 'pk', None)
+            return navigation
+
+        images = self.get_set_images(set)
+        annotations = {
+            'position_count': Subquery(images.filter(self.get_before_q() | Q(pk=self.pk)).order_by().annotate(
+                count=Func(F('pk'), function='COUNT')).values('count')),
+        }
         if set:
-            images = Image.objects.filter(photoset=set, position__lte=self.position)
-        else:
-            images = Image.objects.filter(position__lte=self.position)
-        position = images.count()
-        return position
+            annotations.update({
+                'prev_id': Subquery(images.filter(self.get_before_q()).reverse().values('pk')[:1]),
+                'next_id': Subquery(images.filter(self.get_after_q()).values('pk')[:1]),
+                'first_id': Subquery(images.values('pk')[:1]),
+            })
+        row = Image.objects.filter(pk=self.pk).annotate(**annotations).values(*annotations).first()
+        if row:
+            navigation.update(row)
+            navigation['position'] = navigation.pop('position_count') or 0
+        return navigation
 
     def is_public_photo(self):
         return all([self.is_public,
@@ -1065,6 +1101,21 @@ class Pool(models.Model):
         verbose_name_plural = _('pools')
         app_label = 'photos'
 
+class PhotoRenderItem(models.Model):
+    """
+    A photo waiting for its sizes and EXIF data to be
+    rendered by the render queue (see photos.utils.rendering).
+    """
+    image = models.ForeignKey(Image, on_delete=models.CASCADE)
+    photoset = models.ForeignKey(PhotoSet, null=True, blank=True, on_delete=models.CASCADE)
+    create_dt = models.DateTimeField(auto_now_add=True)
+    # set when a worker claims the photo, which stays queued until rendered
+    claimed_dt = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'photos'
+
+
 class AlbumCover(models.Model):
     """
     model to mark a photo set's album cover
@@ -52,6 +52,8 @@ urlpatterns = [
     re_path(r'^%s/batch-add/$' % urlpath, views.photos_batch_add, name='photos_batch_add'),
     # /photos/batch-add/36/
     re_path(r'^%s/batch-add/(?P<photoset_id>\d+)$' % urlpath, views.photos_batch_add, name='photos_batch_add'),
+    # /photos/batch-add/36/progress/
+    re_path(r'^%s/batch-add/(?P<photoset_id>\d+)/progress/$' % urlpath, views.photos_render_progress, name='photos_render_progress'),
     # /photos/batch-edit/
     re_path(r'^%s/batch-edit/$' % urlpath, views.photos_batch_edit, name='photos.views.photos_batch_edit'),
     # /photos/batch-edit/36
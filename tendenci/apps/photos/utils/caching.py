@@ -1,20 +1,22 @@
 from builtins import str
 
-from django.http import HttpResponse
 from django.conf import settings
 from django.core.cache import cache
 from django.urls import reverse
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.shortcuts import Http404
 
-from tendenci.apps.files.utils import get_image, aspect_ratio, generate_image_cache_key
+from tendenci.apps.files.derivatives import get_derivative
+from tendenci.apps.files.utils import aspect_ratio, generate_image_cache_key, validate_image_size
 
 from tendenci.apps.photos.cache import PHOTO_PRE_KEY
 from tendenci.apps.photos.models import Image
 
 
-def cache_photo_size(id, size, crop=False, quality=90, download=False, constrain=False):
+def cache_photo_size(id, size, crop=False, quality=90, download=False, constrain=False,
+                     photo=None, dimensions=None):
     """
+    Renders a size of the photo and caches its url. photo and dimensions
+    (of the original image) spare the queries when the caller has them.
     """
     if isinstance(quality, str) and quality.isdigit():
         quality = int(quality)
@@ -24,10 +26,11 @@ def cache_photo_size(id, size, crop=False, quality=90, download=False, constrain
     if cached_image:
         return cached_image
 
-    try:
-        photo = Image.objects.get(id=id)
-    except:
-        return ""
+    if photo is None:
+        try:
+            photo = Image.objects.get(id=id)
+        except:
+            return ""
 
     args = [id, size]
     if crop:
@@ -39,37 +42,29 @@ def cache_photo_size(id, size, crop=False, quality=90, download=False, constrain
     request_path = reverse('photo.size', args=args)
 
     size = [int(s) for s in size.split('x')]
-    size = aspect_ratio(photo.image_dimensions(), size, constrain)
-
-    # gets resized image from cache or rebuild
-    image = get_image(photo.image, size, PHOTO_PRE_KEY, crop=crop, quality=quality, unique_key=str(photo.pk), constrain=constrain)
+    size = aspect_ratio(dimensions or photo.image_dimensions(), size, constrain)
 
-    # if image not rendered; quit
-    if not image:
+    # only public photos have their resized images in the derivative store,
+    # the view keeps those of private ones in the cache
+    if not (photo.is_public_photo() and photo.is_public_photoset()):
         return request_path
-    
-    if image.mode in ("RGBA", "P"):
-        image = image.convert('RGB')
 
-    response = HttpResponse(content_type='image/jpeg')
-    response['Content-Disposition'] = ' filename="%s"' % photo.image_filename()
-    image.save(response, "JPEG", quality=quality)
-    image.close()
+    try:
+        derivative = get_derivative(photo.image, validate_image_size(size), crop=crop,
+                                    quality=quality, constrain=constrain, format='JPEG')
+    except Http404:
+        # if image not rendered; quit
+        return request_path
 
-    if photo.is_public_photo() and photo.is_public_photoset():
-        file_name = photo.image_filename()
-        file_path = 'cached%s%s' % (request_path, file_name)
-        default_storage.save(file_path, ContentFile(response.content))
-        full_file_path = "%s%s" % (settings.MEDIA_URL, file_path)
-        cache.set(cache_key, full_file_path)
-        cache_group_key = "photos_cache_set.%s" % photo.pk
-        cache_group_list = cache.get(cache_group_key)
+    full_file_path = "%s%s" % (settings.MEDIA_URL, derivative)
+    cache.set(cache_key, full_file_path)
+    cache_group_key = "photos_cache_set.%s" % photo.pk
+    cache_group_list = cache.get(cache_group_key)
 
-        if cache_group_list is None:
-            cache.set(cache_group_key, [cache_key])
-        else:
-            cache_group_list += [cache_key]
-            cache.set(cache_group_key, cache_group_list)
+    if cache_group_list is None:
+        cache.set(cache_group_key, [cache_key])
+    else:
+        cache_group_list += [cache_key]
+        cache.set(cache_group_key, cache_group_list)
 
-        return full_file_path
-    return request_path
+    return full_file_path
@@ -0,0 +1,216 @@
+"""
+Render queue of the uploaded photos.
+
+Uploaded photos are queued in PhotoRenderItem instead of being rendered in
+the upload request. Workers claim batches of queued photos in a short
+transaction (SELECT ... FOR UPDATE SKIP LOCKED), then render each one
+outside of it from a single decode of the original: the EXIF data, the
+pre-cached PhotoSize versions and the sizes shown on the photo set and
+batch edit pages.
+
+The batch upload starts one worker process for the queue when none is
+running, and polls the progress of the photo set with get_render_progress
+until its photos are done.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from subprocess import Popen
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Q
+
+from tendenci.apps.files.derivatives import (get_derivative_name, get_source, is_stored,
+                                             open_draft, render_image, store_derivative)
+from tendenci.apps.files.utils import aspect_ratio, validate_image_size
+from tendenci.apps.photos.models import Image, PhotoRenderItem, PhotoSizeCache
+from tendenci.apps.photos.utils.caching import cache_photo_size
+from tendenci.libs.utils import python_executable
+
+logger = logging.getLogger(__name__)
+
+# the sizes of the photo set and batch edit pages, as cache_photo_size kwargs
+PRERENDER_SIZES = [
+    {"size": "422x700", "constrain": True},
+    {"size": "102x78", "crop": True},
+    {"size": "640x640", "constrain": True},
+]
+
+WORKER_KEY = '.'.join([settings.CACHE_PRE_KEY, 'photos', 'render_worker'])
+
+
+def enqueue_photos(image_ids, photoset=None, batch_size=1000):
+    """
+    Queues photos for rendering. Returns the number of photos queued.
+    """
+    items = [PhotoRenderItem(image_id=image_id, photoset=photoset) for image_id in image_ids]
+    PhotoRenderItem.objects.bulk_create(items, batch_size=batch_size)
+    return len(items)
+
+
+def get_render_progress(photoset_id):
+    """
+    The number of photos of the photo set still waiting to be rendered,
+    and whether they are all done.
+    """
+    pending = PhotoRenderItem.objects.filter(photoset_id=photoset_id).count()
+    return {'pending': pending, 'done': not pending}
+
+
+def get_photosize_dimensions(original_size, photosize):
+    # a 0 width or height is scaled from the other one
+    width, height = photosize.size
+    if not width and height:
+        width = int(round(float(original_size[0]) * height / original_size[1]))
+    if not height and width:
+        height = int(round(float(original_size[1]) * width / original_size[0]))
+    return width or original_size[0], height or original_size[1]
+
+
+def render_photo(photo):
+    """
+    Renders the EXIF data and sizes of photo, decoding the original once.
+    The original is decoded at the smallest scale that still fits the
+    largest size (see files.derivatives.open_draft).
+    """
+    if not photo.image:
+        return
+    original_size = photo.image_dimensions()
+    # the derivative store is public, private photos are not prerendered into it
+    is_public = photo.is_public_photo() and photo.is_public_photoset()
+
+    derivatives = []
+    for kwargs in (PRERENDER_SIZES if is_public else []):
+        size = [int(s) for s in kwargs['size'].split('x')]
+        size = validate_image_size(aspect_ratio(original_size, size, kwargs.get('constrain', False)))
+        name = get_derivative_name(photo.image, size, kwargs.get('crop', False), 90,
+                                   kwargs.get('constrain', False), 'JPEG')
+        if not is_stored(name):
+            derivatives.append((name, size, kwargs.get('crop', False)))
+
+    photosizes = [photosize for photosize in PhotoSizeCache().sizes.values()
+                  if photosize.pre_cache and not photo.size_exists(photosize)]
+    draft_sizes = [size for name, size, crop in derivatives]
+    draft_sizes += [get_photosize_dimensions(original_size, photosize) for photosize in photosizes]
+
+    if derivatives or photosizes or not photo.exif_data:
+        crop = (any(crop for name, size, crop in derivatives) or
+                any(photosize.crop for photosize in photosizes))
+        image = open_draft(get_source(photo.image), draft_sizes or [original_size], crop=crop)
+        image.load()
+
+        if not photo.exif_data and photo.get_exif_data(img=image):
+            Image.objects.filter(pk=photo.pk).update(exif_data=photo.exif_data)
+
+        for photosize in photosizes:
+            photo.create_size(photosize, im=image)
+
+        for name, size, crop in derivatives:
+            store_derivative(name, render_image(image, size, crop=crop, quality=90, format='JPEG'))
+        image.close()
+
+    # the derivatives are stored, this only caches their urls
+    for kwargs in (PRERENDER_SIZES if is_public else []):
+        cache_photo_size(id=photo.pk, photo=photo, dimensions=original_size, **kwargs)
+
+
+def claim_render_batch(batch_size=20):
+    """
+    Claims up to batch_size queued photos in a short transaction and
+    returns their (pk, image_id). Photos claimed by another worker are
+    skipped, unless that claim is older than PHOTOS_RENDER_CLAIM_TIMEOUT.
+    """
+    timeout = getattr(settings, 'PHOTOS_RENDER_CLAIM_TIMEOUT', 60 * 10)
+    now = datetime.now()
+    with transaction.atomic():
+        claimed = list(PhotoRenderItem.objects.select_for_update(skip_locked=True)
+                                              .filter(Q(claimed_dt__isnull=True) |
+                                                      Q(claimed_dt__lt=now - timedelta(seconds=timeout)))
+                                              .order_by('create_dt')
+                                              .values_list('pk', 'image_id')[:batch_size])
+        PhotoRenderItem.objects.filter(pk__in=[pk for pk, image_id in claimed]).update(claimed_dt=now)
+    return claimed
+
+
+def process_render_batch(batch_size=20):
+    """
+    Claims up to batch_size queued photos, renders them and removes them
+    from the queue. The photos are rendered outside of the claiming
+    transaction, one by one, so several workers can run at once and a
+    failing photo doesn't hold up the others.
+
+    Returns the number of queued photos processed.
+    """
+    claimed = claim_render_batch(batch_size=batch_size)
+    if not claimed:
+        return 0
+    photos = Image.objects.in_bulk(set(image_id for pk, image_id in claimed))
+    for photo in photos.values():
+        try:
+            render_photo(photo)
+        except Exception as e:
+            # a broken original stays unrendered, like it would on upload
+            logger.error('Unable to render photo %s: %s' % (photo.pk, e))
+    PhotoRenderItem.objects.filter(pk__in=[pk for pk, image_id in claimed]).delete()
+    return len(claimed)
+
+
+def process_render_queue(batch_size=20):
+    """
+    Renders the queued photos batch by batch until the queue is empty.
+
+    Returns a dict with the number of photos processed and the elapsed time.
+    """
+    start = time.monotonic()
+    processed = 0
+    while True:
+        count = process_render_batch(batch_size=batch_size)
+        if not count:
+            break
+        processed += count
+    return {'processed': processed, 'seconds': time.monotonic() - start}
+
+
+def _work(batch_size):
+    # each worker process opens its own database connection
+    connections.close_all()
+    return process_render_queue(batch_size=batch_size)
+
+
+def run_render_workers(workers=1, batch_size=20):
+    """
+    Renders the queue with a pool of worker processes.
+
+    Returns a dict with the number of photos processed and the elapsed time.
+    """
+    workers = max(workers, 1)
+    if workers == 1:
+        return process_render_queue(batch_size=batch_size)
+    connections.close_all()
+    with get_context('fork').Pool(workers) as pool:
+        results = pool.map(_work, [batch_size] * workers)
+    return {'processed': sum(result['processed'] for result in results),
+            'seconds': max(result['seconds'] for result in results)}
+
+
+def start_render_worker():
+    """
+    Starts a process rendering the queue, unless one is running.
+    """
+    if cache.add(WORKER_KEY, True, getattr(settings, 'PHOTOS_RENDER_WORKER_TIMEOUT', 60 * 60)):
+        Popen([python_executable(), "manage.py", "process_photo_queue", "--release-lock"])
+
+
+def release_render_worker():
+    """
+    Lets the next upload start a worker. Returns whether photos were
+    queued meanwhile, in which case the worker holds the lock again
+    and should keep going.
+    """
+    cache.delete(WORKER_KEY)
+    if PhotoRenderItem.objects.exists():
+        return cache.add(WORKER_KEY, True, getattr(settings, 'PHOTOS_RENDER_WORKER_TIMEOUT', 60 * 60))
+    return False
@@ -5,7 +5,6 @@ import re
 import io
 from PIL import Image as PILImage
 
-from subprocess import Popen
 
 from django.shortcuts import get_object_or_404, redirect
 from django.http import HttpResponseRedirect, HttpResponse, Http404
@@ -20,12 +19,10 @@ from django.urls import reverse
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.storage import default_storage
 from django.forms.models import modelformset_factory
-from django.core.files.base import ContentFile
 from django.db.models import Q
 from django.middleware.csrf import get_token as csrf_get_token
 from django.views.decorators.csrf import csrf_exempt
 
-from tendenci.libs.utils import python_executable
 from tendenci.apps.theme.shortcuts import themed_response as render_to_resp
 from tendenci.apps.base.http import Http403
 from tendenci.apps.base.utils import checklist_update, is_ajax
@@ -33,7 +30,8 @@ from tendenci.apps.perms.decorators import is_enabled
 from tendenci.apps.perms.utils import has_perm, update_perms_and_save, assign_files_perms, get_query_filters, has_view_perm
 from tendenci.apps.site_settings.utils import get_setting
 from tendenci.apps.event_logs.models import EventLog
-from tendenci.apps.files.utils import get_image, aspect_ratio, generate_image_cache_key, get_image_from_path
+from tendenci.apps.files.derivatives import get_derivative, get_derivative_binary, read_derivative
+from tendenci.apps.files.utils import aspect_ratio, generate_image_cache_key, get_image_from_path, validate_image_size
 from tendenci.apps.user_groups.models import Group
 # from djcelery.models import TaskMeta
 
@@ -44,6 +42,7 @@ from tendenci.apps.photos.forms import (
     PhotoEditForm, PhotoSetForm, PhotoBatchEditForm,
     PhotoForm, PhotoBaseFormSet,PhotoSetSearchForm)
 from tendenci.apps.photos.utils import get_privacy_settings
+from tendenci.apps.photos.utils.rendering import enqueue_photos, get_render_progress, start_render_worker
 from tendenci.apps.photos.tasks import ZipPhotoSetTask
 from tendenci.apps.base.utils import apply_orientation
 
@@ -168,14 +167,12 @@ def photo(request, id, set_id=0, partial=False, template_name="photos/details.ht
 
     if set_id:
         photo_set = get_object_or_404(PhotoSet, id=set_id)
-        photo_prev = photo.get_prev(set=set_id)
-        photo_next = photo.get_next(set=set_id)
-        photo_first = photo.get_first(set=set_id)
-        photo_position = photo.get_position(set=set_id)
+        navigation = photo.get_navigation(set=set_id)
+        photo_position = navigation['position']
 
-        if photo_prev: photo_prev_url = reverse("photo", args=[photo_prev.id, set_id])
-        if photo_next: photo_next_url = reverse("photo", args=[photo_next.id, set_id])
-        if photo_first: photo_first_url = reverse("photo", args=[photo_first.id, set_id])
+        if navigation['prev_id']: photo_prev_url = reverse("photo", args=[navigation['prev_id'], set_id])
+        if navigation['next_id']: photo_next_url = reverse("photo", args=[navigation['next_id'], set_id])
+        if navigation['first_id']: photo_first_url = reverse("photo", args=[navigation['first_id'], set_id])
 
         photo_sets = list(photo.photoset.all())
         if photo_set in photo_sets:
@@ -184,12 +181,11 @@ def photo(request, id, set_id=0, partial=False, template_name="photos/details.ht
         else:
             set_id = 0
     else:
-        photo_prev = photo.get_prev()
-        photo_next = photo.get_next()
-        photo_position = photo.get_position()
+        navigation = photo.get_navigation()
+        photo_position = navigation['position']
 
-        if photo_prev: photo_prev_url = reverse("photo", args=[photo_prev.id])
-        if photo_next: photo_next_url = reverse("photo", args=[photo_next.id])
+        if navigation['prev_id']: photo_prev_url = reverse("photo", args=[navigation['prev_id']])
+        if navigation['next_id']: photo_next_url = reverse("photo", args=[navigation['next_id']])
 
         photo_sets = photo.photoset.all()
         if photo_sets:
@@ -258,32 +254,25 @@ def photo_size(request, id, size, crop=False, quality=90, download=False, constr
         raise Http404
 
     # At this point, we didn't get the image from the cache.
-    # Check if this particular thumbnail already exists on file system.
-    # If it's there, no need to rebuild it from the original image!
-    file_name = photo.image_filename()
-    file_path = 'cached%s%s' % (request.path, file_name)
-    if default_storage.exists(file_path):
-        image = PILImage.open(default_storage.open(file_path))
+    # The resized image is rendered once, into the derivative store if
+    # the photo is public and into the cache if not; later requests read it from there.
+    is_public = photo.is_public_photo() and photo.is_public_photoset()
+    if is_public:
+        derivative = get_derivative(photo.image, validate_image_size(size), crop=crop,
+                                    quality=quality, constrain=constrain, format='JPEG')
+        binary = read_derivative(derivative)
     else:
-        # gets resized image from cache or rebuild
-        image = get_image(photo.image, size, PHOTO_PRE_KEY, crop=crop, quality=quality, unique_key=str(photo.pk), constrain=constrain)
+        binary = get_derivative_binary(photo.image, validate_image_size(size), crop=crop,
+                                       quality=quality, constrain=constrain, format='JPEG')
 
-    # if image not rendered; quit
-    if not image:
-        raise Http404
-
-    response = HttpResponse(content_type='image/jpeg')
+    response = HttpResponse(binary, content_type='image/jpeg')
     response['Content-Disposition'] = '%s filename="%s"' % (attachment, photo.image_filename())
-    image.convert('RGB').save(response, "JPEG", quality=quality)
-    image.close()
 
-    if photo.is_public_photo() and photo.is_public_photoset():
-        if not default_storage.exists(file_path):
-            default_storage.save(file_path, ContentFile(response.content))
+    if is_public:
         if settings.USE_S3_STORAGE:
-            cache.set(cache_key, file_path)
+            cache.set(cache_key, derivative)
         else:
-            full_file_path = "%s%s" % (settings.MEDIA_URL, file_path)
+            full_file_path = "%s%s" % (settings.MEDIA_URL, derivative)
             cache.set(cache_key, full_file_path)
         cache_group_key = "photos_cache_set.%s" % photo.pk
         cache_group_list = cache.get(cache_group_key)
@@ -609,6 +598,8 @@ def handle_uploaded_photo(request, photoset_id, file_path):
     from tendenci.apps.perms.object_perms import ObjectPermission
 
     photo = Image()
+    # the sizes and EXIF data are rendered by the render queue
+    photo.render_later = True
 
     # use file name to create title; remove extension
     filename, extension = os.path.splitext(os.path.basename(file_path))
@@ -677,7 +668,8 @@ def handle_uploaded_photo(request, photoset_id, file_path):
     # serialize queryset
     #data = serializers.serialize("json", Image.objects.filter(id=photo.id))
 
-    Popen([python_executable(), "manage.py", "precache_photo", str(photo.pk)])
+    enqueue_photos([photo.pk], photoset=photo_set)
+    start_render_worker()
 
 
 @is_enabled('photos')
@@ -721,6 +713,20 @@ def photos_batch_add(request, photoset_id=0):
              })
 
 
+@is_enabled('photos')
+@login_required
+def photos_render_progress(request, photoset_id):
+    """
+    Returns the number of uploaded photos of the photo set
+    still waiting to be rendered, for the batch upload page.
+    """
+    photo_set = get_object_or_404(PhotoSet, id=photoset_id)
+    if not has_perm(request.user, 'photos.add_photoset'):
+        raise Http403
+
+    return HttpResponse(json.dumps(get_render_progress(photo_set.pk)), content_type='application/json')
+
+
 @is_enabled('photos')
 @login_required
 def photos_batch_edit(request, photoset_id=0, template_name="photos/batch-edit.html"):
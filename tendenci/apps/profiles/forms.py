@@ -1,6 +1,5 @@
 import datetime
 import re
-import chardet
 
 from django import forms
 from django.contrib import auth
@@ -11,13 +10,12 @@ from django.utils.safestring import mark_safe
 from django.db.models import Q
 
 from tendenci.apps.base.fields import EmailVerificationField, CountrySelectField, StateSelectField
-from tendenci.apps.base.utils import normalize_field_names
 from tendenci.apps.perms.forms import TendenciBaseForm
 from tendenci.apps.site_settings.utils import get_setting
 from tendenci.apps.user_groups.models import Group, GroupMembership
 from tendenci.apps.memberships.models import MembershipDefault
 from tendenci.apps.event_logs.models import EventLog
-from tendenci.apps.profiles.models import Profile, UserImport
+from tendenci.apps.profiles.models import Profile
 from tendenci.apps.profiles.utils import update_user
 from tendenci.apps.base.utils import get_languages_with_local_name
 from tendenci.apps.perms.utils import get_query_filters
@@ -80,6 +78,8 @@ class ProfileSearchForm(FormControlWidgetMixin, forms.Form):
     search_text = forms.CharField(max_length=100, required=False)
 #     search_method = forms.ChoiceField(choices=SEARCH_METHOD_CHOICES,
 #                                         required=False)
+    near = forms.CharField(label=_('Near'), max_length=100, required=False)
+    radius = forms.IntegerField(label=_('Within (miles)'), min_value=1, required=False)
 
     def __init__(self, *args, **kwargs):
         mts = kwargs.pop('mts')
@@ -895,84 +895,6 @@ class ExportForm(forms.Form):
     export_fields = forms.ChoiceField(choices=EXPORT_FIELD_CHOICES)
 
 
-class UserUploadForm(forms.ModelForm):
-    KEY_CHOICES = (('email', _('Email')),
-               ('first_name,last_name,email', _('First Name and Last Name and Email')),
-               ('first_name,last_name,phone', _('First Name and Last Name and Phone')),
-               ('first_name,last_name,company', _('First Name and Last Name and Company')),
-               ('username', 'Username'),)
-
-    interactive = forms.BooleanField(widget=forms.RadioSelect(
-                                    choices=UserImport.INTERACTIVE_CHOICES),
-                                    initial=False, required=False)
-    key = forms.ChoiceField(label="Key",
-                            choices=KEY_CHOICES)
-    group_id = forms.ChoiceField(label=_("Add Users to Group"),
-                            required=False)
-    clear_group_membership = forms.BooleanField(initial=False, required=False)
-
-    class Meta:
-        model = UserImport
-        fields = (
-                'key',
-                'override',
-                'interactive',
-                'exclude_is_active',
-                'group_id',
-                'clear_group_membership',
-                'upload_file',
-                  )
-
-    def __init__(self, *args, **kwargs):
-        super(UserUploadForm, self).__init__(*args, **kwargs)
-        self.fields['upload_file'].validators = [FileValidator(allowed_extensions=['.csv'], allowed_mimetypes=['text/csv', 'text/plain', 'application/csv'])]
-        self.fields['key'].initial = 'email'
-        # move the choices down here to fix the error
-        #  django.db.utils.ProgrammingError: relation "user_groups_group" does not exist
-        GROUP_CHOICES = [(0, _('Select One'))] + [(group.id, group.name) for group in
-                     Group.objects.filter(status=True, status_detail='active'
-                                          ).exclude(type__in=['membership', 'system_generated'])]
-        self.fields['group_id'].choices = GROUP_CHOICES
-
-    def clean_upload_file(self):
-        key = self.cleaned_data['key']
-        upload_file = self.cleaned_data['upload_file']
-        if not key:
-            raise forms.ValidationError(_('Please specify the key to identify duplicates'))
-
-        upload_file.seek(0)
-        file_content = upload_file.read()
-        # decode from bytes to string
-        char_det = chardet.detect(file_content)
-        encoding = char_det["encoding"]
-        confidence = char_det["confidence"]
-        if confidence < 0.6:
-            encoding = 'utf-8'
-        if encoding:
-            file_content = file_content.decode(encoding)
-        upload_file.seek(0)
-        header_line_index = file_content.find('\n')
-        header_list = ((file_content[:header_line_index]
-                            ).strip('\r')).split(',')
-        header_list = [name.strip('"') for name in header_list]
-        header_list = normalize_field_names(header_list)
-        key_list = []
-        for key in key.split(','):
-            key_list.append(key)
-        missing_columns = []
-        for item in key_list:
-            if item not in header_list:
-                missing_columns.append(item)
-        if missing_columns:
-            raise forms.ValidationError(_(
-                        """
-                        'Field(s) %(fields)s used to identify the duplicates
-                        should be included in the .csv file.'
-                        """ % {'fields' : ', '.join(missing_columns)}))
-
-        return upload_file
-
-
 class ActivateForm(forms.Form):
     email = forms.CharField(max_length=75)
     username = forms.RegexField(regex=r'^[\w.@+-]+$',
@@ -381,16 +381,11 @@ class Profile(Person):
         account_id_max = Profile.objects.all().aggregate(Max('account_id'))['account_id__max']
         return account_id_max and account_id_max + 1 or 0
 
-    def save(self, *args, **kwargs):
-        if not self.id:
-            self.guid = str(uuid.uuid4())
-
-        # check and assign account id
-        if not self.account_id and self.is_active:
-            if get_setting('module', 'users', 'useaccountid'):
-                self.account_id = self.get_next_account_id()
-                self.save()
-
+    def set_derived_fields(self):
+        """
+        Set the view permissions and the region, which follow from
+        the other fields and the site settings.
+        """
         # match allow_anonymous_view with opposite of hide_in_search
         if self.hide_in_search:
             self.allow_anonymous_view = False
@@ -414,6 +409,18 @@ class Profile(Person):
                 if self.region:
                     self.state = self.region.region_name
 
+    def save(self, *args, **kwargs):
+        if not self.id:
+            self.guid = str(uuid.uuid4())
+
+        # check and assign account id
+        if not self.account_id and self.is_active:
+            if get_setting('module', 'users', 'useaccountid'):
+                self.account_id = self.get_next_account_id()
+                self.save()
+
+        self.set_derived_fields()
+
         super(Profile, self).save(*args, **kwargs)
 
         if self.photo and self._original_photo:
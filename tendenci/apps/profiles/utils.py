@@ -28,6 +28,7 @@ from tendenci.apps.emails.models import Email
 from tendenci.apps.perms.utils import get_query_filters
 from tendenci.apps.site_settings.utils import get_setting
 from tendenci.apps.base.utils import escape_csv, Echo
+from tendenci.apps.exports.utils import ExportPlan, ExportProgress, write_csv
 
 
 def iter_users(users_queryset):
@@ -142,16 +143,21 @@ def update_user(user, **kwargs):
     user.save()
 
 
-def make_username_unique(un):
+def make_username_unique(un, usernames=None):
     """
     Requires a string parameter.
     Returns a unique username by appending
     a digit to the end of the username.
+
+    With usernames, the usernames taken are looked up
+    there instead of in the database.
     """
+    if usernames is None:
+        usernames = User.objects.filter(username__startswith=un).values_list('username', flat=True)
     others = []  # find similiar usernames
-    for u in User.objects.filter(username__startswith=un):
-        if u.username.replace(un, '0').isdigit():
-            others.append(int(u.username.replace(un, '0')))
+    for username in usernames:
+        if username.startswith(un) and username.replace(un, '0').isdigit():
+            others.append(int(username.replace(un, '0')))
 
     if others and 0 in others:
         # the appended digit will compromise the username length
@@ -176,7 +182,16 @@ def spawn_username(fn=u'', ln=u'', em=u''):
     with 10 digits which can later be replaced by the user primary key.
     Example user.3482938481
     """
+    un = spawn_username_base(fn=fn, ln=ln, em=em)
+    if un.startswith('user.') and not (fn or ln or em):
+        return un
+    return make_username_unique(un)
+
 
+def spawn_username_base(fn=u'', ln=u'', em=u''):
+    """
+    The username spawn_username makes unique.
+    """
     django_max_un_length = 150
     max_length = django_max_un_length - 3  # to account for appended numbers
 
@@ -188,17 +203,17 @@ def spawn_username(fn=u'', ln=u'', em=u''):
     em = re.sub(r'[^\w@+.-]', '', em)
     
     if em:
-        return make_username_unique(em[:max_length].lower())
+        return em[:max_length].lower()
 
     if fn and ln:
         un = '%s.%s' % (fn, ln)
-        return make_username_unique(un[:max_length].lower())
+        return un[:max_length].lower()
 
     if fn:
-        return make_username_unique(fn[:max_length].lower())
+        return fn[:max_length].lower()
 
     if ln:
-        return make_username_unique(ln[:max_length].lower())
+        return ln[:max_length].lower()
 
 
     int_string = ''.join([choice(digits) for x in range(10)])
@@ -316,6 +331,19 @@ def clean_username(username):
     return username
 
 
+def format_export_value(field_name, item):
+    if item:
+        if isinstance(item, datetime):
+            return item.strftime('%Y-%m-%d %H:%M:%S')
+        elif isinstance(item, date):
+            return item.strftime('%Y-%m-%d')
+        elif isinstance(item, time):
+            return item.strftime('%H:%M:%S')
+        elif isinstance(item, str):
+            return escape_csv(item)
+    return item
+
+
 def process_export(export_fields='all_fields', identifier=u'', user_id=0):
     from tendenci.apps.perms.models import TendenciBaseModel
 
@@ -379,36 +407,18 @@ def process_export(export_fields='all_fields', identifier=u'', user_id=0):
 
     identifier = identifier or int(ttime.time())
     file_name_temp = 'export/profiles/%s_temp.csv' % identifier
+    file_name = 'export/profiles/%s.csv' % identifier
+
+    profiles = Profile.objects.all()
+    plan = ExportPlan(Profile,
+                      ['user__%s' % name for name in user_field_list] + profile_field_list,
+                      formatter=format_export_value)
+    progress = ExportProgress(file_name, profiles.count())
 
     with default_storage.open(file_name_temp, 'w') as csvfile:
-        csv_writer = csv.DictWriter(csvfile, fieldnames=field_list)
-        csv_writer.writeheader()
-
-        profiles = Profile.objects.all()
-        for profile in profiles:
-            p_user = profile.user
-            row_dict = {}
-            for field_name in field_list:
-                if field_name in profile_field_list:
-                    item = getattr(profile, field_name)
-                elif field_name in user_field_list:
-                    item = getattr(p_user, field_name)
-                else:
-                    item = ''
-                if item:
-                    if isinstance(item, datetime):
-                        item = item.strftime('%Y-%m-%d %H:%M:%S')
-                    elif isinstance(item, date):
-                        item = item.strftime('%Y-%m-%d')
-                    elif isinstance(item, time):
-                        item = item.strftime('%H:%M:%S')
-                    elif isinstance(item, str):
-                        item = escape_csv(item)
-                row_dict[field_name] = item
-            csv_writer.writerow(row_dict)
+        write_csv(csvfile, field_list, plan.rows(profiles, progress=progress))
 
     # rename the file name
-    file_name = 'export/profiles/%s.csv' % identifier
     default_storage.save(file_name, default_storage.open(file_name_temp, 'rb'))
 
     # delete the temp file
@@ -45,7 +45,7 @@ from tendenci.apps.perms.utils import (has_perm, update_perms_and_save,
 from tendenci.apps.base.http import Http403
 from tendenci.apps.event_logs.models import EventLog
 from tendenci.apps.site_settings.utils import get_setting
-from tendenci.apps.exports.utils import render_csv
+from tendenci.apps.exports.utils import render_csv, get_export_progress
 
 # for group memberships
 from tendenci.apps.user_groups.models import GroupMembership, Group
@@ -54,7 +54,7 @@ from tendenci.apps.user_groups.forms import GroupMembershipEditForm
 from tendenci.apps.profiles.models import Profile, UserImport, UserImportData
 from tendenci.apps.profiles.forms import (ProfileForm, ExportForm,
 UserPermissionForm, UserGroupsForm, ValidatingPasswordChangeForm,
-UserMembershipForm, ProfileMergeForm, ProfileSearchForm, UserUploadForm,
+UserMembershipForm, ProfileMergeForm, ProfileSearchForm,
 ActivateForm, PhotoUploadForm)
 from tendenci.apps.profiles.utils import get_member_reminders, ImportUsers, get_corp_uc_invoices
 from tendenci.apps.events.models import Registrant
@@ -62,6 +62,7 @@ from tendenci.apps.memberships.models import MembershipType
 from tendenci.apps.memberships.forms import EducationForm
 from tendenci.apps.invoices.models import Invoice
 from tendenci.apps.events.models import Event
+from tendenci.apps.locations.geo import filter_by_radius
 
 try:
     from tendenci.apps.notifications import models as notification
@@ -375,6 +376,8 @@ def search(request, memberships_search=False, template_name="profiles/search.htm
         industry = form.cleaned_data.get('industry', False)
         if industry:
             industry = int(industry)
+        near = form.cleaned_data.get('near')
+        radius = form.cleaned_data.get('radius')
     else:
         first_name = None
         last_name = None
@@ -386,6 +389,8 @@ def search(request, memberships_search=False, template_name="profiles/search.htm
         member_only = False
         group = False
         industry = False
+        near = None
+        radius = None
 
     profiles = Profile.objects.filter(Q(status=True))
     if memberships_search:
@@ -474,6 +479,9 @@ def search(request, memberships_search=False, template_name="profiles/search.htm
     if industry:
         profiles = profiles.filter(industry_id=industry)
 
+    if near and radius:
+        profiles = filter_by_radius(profiles, 'zipcode', near, radius)
+
     profiles = profiles.order_by('user__last_name', 'user__first_name')
     base_template = 'profiles/base-wide.html'
     if memberships_search:
@@ -1452,7 +1460,8 @@ def profile_export_status(request, identifier, template_name="profiles/export_st
             raise Http404
 
     context = {'identifier': identifier,
-               'download_ready': download_ready}
+               'download_ready': download_ready,
+               'progress': get_export_progress(export_path)}
     return render_to_resp(request=request, template_name=template_name, context=context)
 
 
@@ -1476,26 +1485,14 @@ def profile_export_download(request, identifier):
 
 @login_required
 @password_required
-def user_import_upload(request, template_name='profiles/import/upload.html'):
-    """ Import users to the User and Profile. """
-
-    if not request.user.profile.is_superuser:
-        raise Http403
-
-    form = UserUploadForm(request.POST or None, request.FILES or None)
-
-    if request.method == 'POST':
-        if form.is_valid():
-            user_import = form.save(commit=False)
-            user_import.creator = request.user
-            user_import.save()
-
-            # redirect to preview page.
-            return redirect(reverse('profiles.user_import_preview', args=[user_import.id]))
-
-    return render_to_resp(request=request, template_name=template_name, context={
-        'form': form,
-    })
+def user_import_upload(request):
+    """
+    Retired in favor of the user import of the imports app, which
+    processes the file in resumable chunks (see imports.views).
+    The preview, process and status pages below are kept for the
+    imports uploaded here before.
+    """
+    return redirect(reverse('import.user_upload_add'))
 
 
 @login_required
@@ -1,3 +1,5 @@
+import time
+
 from django.core.cache import cache
 from django.conf import settings
 
@@ -13,3 +15,26 @@ def cache_all_robots():
 
     robots = Robot.objects.all()
     cache.set(key, robots)
+
+
+def get_robots_version_key():
+    return '.'.join([settings.CACHE_PRE_KEY, CACHE_PRE_KEY, 'version'])
+
+
+def get_robots_version():
+    """ Returns the version of the robot table kept in the cache """
+    key = get_robots_version_key()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time()), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_robots_version():
+    """ Marks the robot table as changed for every process """
+    key = get_robots_version_key()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time()), None)
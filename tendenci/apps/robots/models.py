@@ -2,6 +2,7 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 
 from tendenci.apps.robots.managers import RobotManager
+from tendenci.apps.robots.cache import bump_robots_version
 
 
 STATUS_CHOICES = (('active',_('Active')),('inactive',_('Inactive')),)
@@ -20,3 +21,11 @@ class Robot(models.Model):
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        super(Robot, self).save(*args, **kwargs)
+        bump_robots_version()
+
+    def delete(self, *args, **kwargs):
+        super(Robot, self).delete(*args, **kwargs)
+        bump_robots_version()
@@ -0,0 +1,30 @@
+from django.test import SimpleTestCase
+
+from tendenci.apps.robots.models import Robot
+from tendenci.apps.robots.utils import UserAgentClassifier
+
+
+class UserAgentClassifierTest(SimpleTestCase):
+    def setUp(self):
+        self.googlebot = Robot(name='Googlebot')
+        self.google = Robot(name='Google')
+        self.classifier = UserAgentClassifier(
+            [self.google, self.googlebot, Robot(name='')],
+            ['iPhone', 'Android'], cache_size=2)
+
+    def test_robot(self):
+        robot, is_mobile = self.classifier.classify(
+            'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)')
+        self.assertEqual(robot, self.googlebot)
+        self.assertFalse(is_mobile)
+
+    def test_mobile(self):
+        robot, is_mobile = self.classifier.classify(
+            'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)')
+        self.assertIsNone(robot)
+        self.assertTrue(is_mobile)
+
+    def test_cache_is_bounded(self):
+        for user_agent in ('a', 'b', 'c'):
+            self.classifier.classify(user_agent)
+        self.assertEqual(list(self.classifier._cache), ['b', 'c'])
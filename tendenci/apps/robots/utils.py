@@ -0,0 +1,108 @@
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+
+from tendenci.apps.robots.cache import get_robots_version
+
+
+class UserAgentClassifier(object):
+    """
+    Classifies user agent strings as (robot, is_mobile).
+
+    All robot names and mobile tokens are compiled into one regex each,
+    so a user agent is scanned once whatever the number of robots, and
+    the results for recently seen user agents are kept in an LRU cache.
+    A classifier is built for one version of the robot table.
+
+    When several robot names appear in a user agent, the leftmost one
+    wins, and the longest one among those starting at the same place.
+    """
+    def __init__(self, robots, mobile_tokens, version=None, cache_size=1000):
+        self.version = version
+        self.cache_size = cache_size
+        self._robots = {}
+        for robot in robots:
+            name = robot.name.strip().lower()
+            # an empty name would match every user agent
+            if name and name not in self._robots:
+                self._robots[name] = robot
+        self._robot_re = self._compile(self._robots)
+        self._mobile_re = self._compile([token.lower() for token in mobile_tokens])
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _compile(tokens):
+        tokens = sorted(tokens, key=len, reverse=True)
+        if not tokens:
+            return None
+        return re.compile('|'.join(re.escape(token) for token in tokens))
+
+    def classify(self, user_agent):
+        user_agent = user_agent or ''
+        with self._lock:
+            try:
+                self._cache.move_to_end(user_agent)
+                return self._cache[user_agent]
+            except KeyError:
+                pass
+
+        ua = user_agent.lower()
+        robot = None
+        if self._robot_re:
+            match = self._robot_re.search(ua)
+            if match:
+                robot = self._robots[match.group(0)]
+        is_mobile = bool(self._mobile_re and self._mobile_re.search(ua))
+        result = (robot, is_mobile)
+
+        with self._lock:
+            self._cache[user_agent] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+
+_classifier = [None]
+_classifier_checked = [0]
+_classifier_lock = Lock()
+
+
+def get_classifier():
+    """
+    Returns the UserAgentClassifier of the current robot table version,
+    checking the version at most every ROBOTS_VERSION_CHECK_INTERVAL seconds.
+    """
+    classifier = _classifier[0]
+    interval = getattr(settings, 'ROBOTS_VERSION_CHECK_INTERVAL', 60)
+    if classifier is not None and time.monotonic() - _classifier_checked[0] < interval:
+        return classifier
+
+    version = get_robots_version()
+    _classifier_checked[0] = time.monotonic()
+    if classifier is None or classifier.version != version:
+        with _classifier_lock:
+            classifier = _classifier[0]
+            if classifier is None or classifier.version != version:
+                from tendenci.apps.robots.models import Robot
+                from tendenci.apps.mobile.middleware import mobile_agents
+
+                classifier = UserAgentClassifier(Robot.objects.all(), mobile_agents, version=version,
+                                                 cache_size=getattr(settings, 'USER_AGENT_CACHE_SIZE', 1000))
+                _classifier[0] = classifier
+    return classifier
+
+
+def reset_classifier():
+    """ Makes the next classification rebuild the classifier """
+    _classifier[0] = None
+
+
+def classify_user_agent(user_agent):
+    """
+    Returns (robot, is_mobile) for a user agent string.
+    """
+    return get_classifier().classify(user_agent)
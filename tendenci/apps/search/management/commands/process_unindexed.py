@@ -1,44 +1,85 @@
 #process_unindexed.py
-from datetime import datetime
+from multiprocessing import get_context
 
 from django.core.management.base import BaseCommand
-from django.core.management import call_command
+from django.db import connections
+
+
+def _work(options):
+    # each worker process opens its own database connection
+    connections.close_all()
+    from tendenci.apps.search.utils import process_unindexed
+    return process_unindexed(batch_size=options['batch_size'],
+                             max_batches=options['max_batches'])
 
 
 class Command(BaseCommand):
     """
-    Command used to process unindexed items by querying per Model
-    and running update_index based on a calculated age
-    for models with unindexed items.
+    Indexes the items queued in UnindexedItem.
+
+    Workers claim batches of queued items (SELECT ... FOR UPDATE SKIP
+    LOCKED), load the objects of each model with one query and push only
+    those objects to the search index. They stop when the queue is empty.
+
+    Usage:
+        python manage.py process_unindexed
+
+        with 4 worker processes (not for whoosh, which allows one writer):
+        python manage.py process_unindexed --workers 4 --batch-size 200
+
+        to only show the backlog:
+        python manage.py process_unindexed --stats
     """
+    def add_arguments(self, parser):
+        parser.add_argument('--workers',
+            type=int,
+            dest='workers',
+            default=1,
+            help='Number of worker processes')
+        parser.add_argument('--batch-size',
+            type=int,
+            dest='batch_size',
+            default=100,
+            help='Number of queued items claimed at once')
+        parser.add_argument('--max-batches',
+            type=int,
+            dest='max_batches',
+            default=None,
+            help='Stop each worker after this many batches')
+        parser.add_argument('--stats',
+            action='store_true',
+            dest='stats',
+            default=False,
+            help='Only report the backlog')
 
     def handle(self, **options):
-        from tendenci.apps.search.models import UnindexedItem
-        items = []
-        ages = []
-        verbosity = int(options.get('verbosity', 0))
-
-        unindexed_items = UnindexedItem.objects.all().select_related('content_type').order_by('create_dt')
-        for ui in unindexed_items:
-            app = ui.content_type.app_label
-            if app not in items:
-                items.append(app)
-
-                age = datetime.now() - unindexed_items[0].create_dt
-                age = (int(age.days)*60*60*24) + age.seconds
-                age = (age / 3600) + 1
-                ages.append(int(age))
-
-        # If we have items, then we find the max age and run a single
-        # update_index command for those apps with the longest age.
-        if items and ages:
-            ages.sort()
-            ages.reverse()
-            max_age = ages[0]
-            # Remove is required because soft-deletes cannot be updated
-            # in the index as the index cannot query for them to update
-            # them.
-            params = {'age': max_age, 'batchsize': 25, 'remove': True, 'verbosity': verbosity}
-
-            call_command('update_index', *items, **params)
-            unindexed_items.delete()
+        from tendenci.apps.search.utils import get_unindexed_stats
+        verbosity = int(options.get('verbosity', 1))
+
+        stats = get_unindexed_stats()
+        if verbosity > 0 or options['stats']:
+            self.print_stats(stats)
+        if options['stats'] or not stats['backlog']:
+            return
+
+        workers = max(options['workers'], 1)
+        worker_options = {'batch_size': options['batch_size'],
+                          'max_batches': options['max_batches']}
+        if workers == 1:
+            results = [_work(worker_options)]
+        else:
+            connections.close_all()
+            with get_context('fork').Pool(workers) as pool:
+                results = pool.map(_work, [worker_options] * workers)
+
+        if verbosity > 0:
+            processed = sum(result['processed'] for result in results)
+            seconds = max(result['seconds'] for result in results) or 1
+            print('Processed %d items with %d worker(s) in %.1fs (%.1f items/s)' % (
+                processed, workers, seconds, processed / seconds))
+            self.print_stats(get_unindexed_stats())
+
+    def print_stats(self, stats):
+        print('Backlog: %d items, oldest queued %ds ago' % (stats['backlog'], stats['oldest_age']))
+        for app_label, count in sorted(stats['by_app'].items()):
+            print('    %s: %d' % (app_label, count))
@@ -1,6 +1,6 @@
 from django.contrib.contenttypes.models import ContentType
 from haystack import signals
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 
 from tendenci.apps.search.models import UnindexedItem
@@ -17,8 +17,11 @@ def save_unindexed_item(sender, **kwargs):
         'object_id': instance.pk
     }
 
-    if not UnindexedItem.objects.filter(**params).exists():
-        UnindexedItem.objects.create(**params)
+    # items claimed by an indexing worker are locked and skipped here, so a
+    # change made while the worker runs gets queued again
+    with transaction.atomic():
+        if not UnindexedItem.objects.filter(**params).select_for_update(skip_locked=True).exists():
+            UnindexedItem.objects.create(**params)
 
 
 class QueuedSignalProcessor(signals.BaseSignalProcessor):
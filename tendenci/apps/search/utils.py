@@ -0,0 +1,163 @@
+import time
+import logging
+from datetime import datetime
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, Min
+from haystack import connections, connection_router
+from haystack.exceptions import NotHandled
+
+from tendenci.apps.search.models import UnindexedItem
+
+logger = logging.getLogger(__name__)
+
+
+def index_items(items):
+    """
+    Updates the search index for a list of (content_type_id, object_id).
+
+    The objects of each model are loaded with one in_bulk query and pushed
+    to the index together. Objects that are no longer in the index queryset
+    (deleted, inactive...) are removed from the index.
+
+    Returns the number of objects updated and removed.
+    """
+    ids_by_ct = {}
+    for content_type_id, object_id in items:
+        ids_by_ct.setdefault(content_type_id, set()).add(object_id)
+
+    updated = removed = 0
+    for content_type_id, ids in ids_by_ct.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            continue
+
+        for using in connection_router.for_write(models=[model]):
+            unified_index = connections[using].get_unified_index()
+            try:
+                index = unified_index.get_index(model)
+            except NotHandled:
+                continue
+            backend = connections[using].get_backend()
+
+            queryset = index.index_queryset(using=using)
+            if queryset.query.is_sliced:
+                # e.g. HAYSTACK_INDEX_LIMITS
+                queryset = model._default_manager.all()
+
+            # a failing object shouldn't hold up the rest of the queue:
+            # the objects are indexed together in a savepoint, so a database
+            # error doesn't break the transaction of the batch, and one by
+            # one if that fails
+            try:
+                with transaction.atomic():
+                    batches = [_index_objects(model, index, backend, queryset, ids)]
+            except Exception:
+                batches = []
+                for pk in ids:
+                    try:
+                        with transaction.atomic():
+                            batches.append(_index_objects(model, index, backend, queryset, set([pk])))
+                    except Exception as e:
+                        logger.error('Unable to index %s %s: %s' % (model._meta.label, pk, e))
+            for batch_updated, batch_removed in batches:
+                updated += batch_updated
+                removed += batch_removed
+    return updated, removed
+
+
+def _index_objects(model, index, backend, queryset, ids):
+    objects = queryset.in_bulk(list(ids))
+    if objects:
+        backend.update(index, list(objects.values()))
+    for pk in ids.difference(objects):
+        backend.remove('%s.%s.%s' % (model._meta.app_label, model._meta.model_name, pk))
+    return len(objects), len(ids) - len(objects)
+
+
+def enqueue_items(model, object_ids, batch_size=1000):
+    """
+    Queues the objects of a model for indexing, the way saving them
+    would, for code that updates them with queryset.update() or
+    bulk_update() and so bypasses the post_save signal.
+
+    Returns the number of items queued.
+    """
+    # only the models with a search index are queued by the signal processor
+    if model not in connections['default'].get_unified_index().get_indexed_models():
+        return 0
+    content_type = ContentType.objects.get_for_model(model)
+    object_ids = list(set(object_ids))
+    queued = 0
+    for i in range(0, len(object_ids), batch_size):
+        ids = object_ids[i:i + batch_size]
+        with transaction.atomic():
+            # items claimed by an indexing worker are locked and skipped,
+            # so they get queued again like in save_unindexed_item
+            existing = set(UnindexedItem.objects.filter(content_type=content_type, object_id__in=ids)
+                                                .select_for_update(skip_locked=True)
+                                                .values_list('object_id', flat=True))
+            UnindexedItem.objects.bulk_create([
+                UnindexedItem(content_type=content_type, object_id=object_id)
+                for object_id in ids if object_id not in existing])
+        queued += len(ids) - len(existing)
+    return queued
+
+
+def process_unindexed_batch(batch_size=100):
+    """
+    Claims up to batch_size queued items with SELECT ... FOR UPDATE SKIP
+    LOCKED, indexes them and deletes them from the queue. Items claimed by
+    another worker are skipped, so several workers can run at once.
+
+    Returns the number of queued items processed.
+    """
+    with transaction.atomic():
+        claimed = list(UnindexedItem.objects.select_for_update(skip_locked=True)
+                                            .order_by('create_dt')
+                                            .values_list('pk', 'content_type_id', 'object_id')[:batch_size])
+        if not claimed:
+            return 0
+        index_items([(content_type_id, object_id) for pk, content_type_id, object_id in claimed])
+        # only the claimed rows; items queued meanwhile stay in the queue
+        UnindexedItem.objects.filter(pk__in=[item[0] for item in claimed]).delete()
+    return len(claimed)
+
+
+def process_unindexed(batch_size=100, max_batches=None):
+    """
+    Processes queued items batch by batch until the queue is empty
+    (or max_batches have been processed).
+
+    Returns a dict with the number of items processed and the elapsed time.
+    """
+    start = time.monotonic()
+    processed = batches = 0
+    while max_batches is None or batches < max_batches:
+        try:
+            count = process_unindexed_batch(batch_size=batch_size)
+        except Exception as e:
+            logger.error('Unable to process unindexed items: %s' % e)
+            break
+        if not count:
+            break
+        processed += count
+        batches += 1
+    return {'processed': processed, 'seconds': time.monotonic() - start}
+
+
+def get_unindexed_stats():
+    """
+    Returns the backlog of the indexing queue: the number of queued items,
+    the age in seconds of the oldest one and the number per app label.
+    """
+    oldest = UnindexedItem.objects.aggregate(oldest=Min('create_dt'))['oldest']
+    by_app = dict(UnindexedItem.objects.values_list('content_type__app_label')
+                                       .annotate(count=Count('pk'))
+                                       .order_by())
+    return {
+        'backlog': sum(by_app.values()),
+        'oldest_age': (datetime.now() - oldest).total_seconds() if oldest else 0,
+        'by_app': by_app,
+    }
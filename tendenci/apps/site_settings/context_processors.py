@@ -1,57 +1,24 @@
-from django.core.cache import cache
-from django.conf import settings as d_settings
 from django.template import engines, TemplateDoesNotExist
 from django.template.loader import get_template
 
-from tendenci import __version__ as version
-from tendenci.apps.site_settings.models import Setting
-from tendenci.apps.site_settings.cache import SETTING_PRE_KEY
+from tendenci.apps.site_settings.utils import get_settings_snapshot
 
 
 def settings(request):
     """Context processor for settings
     """
-
-    key = [d_settings.CACHE_PRE_KEY, SETTING_PRE_KEY, 'all']
-    key = '.'.join(key)
-
-    settings = cache.get(key)
-    if not settings or not hasattr(settings, '__iter__'):
-        settings = Setting.objects.all()
-        cache.set(key, settings)
-
-    contexts = {}
-    for setting in settings:
-        context_key = [setting.scope, setting.scope_category,
-                       setting.name]
-        context_key = '_'.join(context_key)
-
-        value = setting.get_value().strip()
-
-        if setting.data_type == 'boolean':
-            value = value[0].lower() == 't'
-        if setting.data_type == 'int':
-            if value.strip():
-                try: # catch possible errors when int() is called
-                    value = int(value.strip())
-                except ValueError:
-                    value = 0
-            else:
-                value = 0 # default to 0
-        # Handle context for the social_media addon's
-        # contact_message setting
-        if setting.name == 'contact_message':
-            page_url = request.build_absolute_uri()
-            message_context = {'page_url': page_url}
-            message_template = engines['django'].from_string(value)
-            value = message_template.render(message_context)
-
-        contexts[context_key.upper()] = value
-
-    contexts['TENDENCI_VERSION'] = version
-
-    contexts['USE_I18N'] = d_settings.USE_I18N
-    contexts['LOGIN_URL'] = d_settings.LOGIN_URL
+    snapshot = get_settings_snapshot()
+    if not snapshot.contact_message_keys:
+        return snapshot.context
+
+    contexts = dict(snapshot.context)
+    # Handle context for the social_media addon's
+    # contact_message setting
+    page_url = request.build_absolute_uri()
+    message_context = {'page_url': page_url}
+    for context_key in snapshot.contact_message_keys:
+        message_template = engines['django'].from_string(contexts[context_key])
+        contexts[context_key] = message_template.render(message_context)
 
     return contexts
 
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+
+class Command(BaseCommand):
+    """
+    Measures the time the settings context processor takes per request.
+
+        cold - the settings snapshot is rebuilt for every request, which is
+               about what every request paid before snapshots (load all
+               the settings, decrypt and convert each one)
+        warm - the snapshot is current, so a request only checks the
+               settings version
+
+    Usage:
+        python manage.py benchmark_settings_context --requests 1000
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--requests',
+            type=int,
+            dest='requests',
+            default=1000,
+            help='Number of simulated requests per run')
+
+    def handle(self, *args, **options):
+        from django.core.signals import request_started, request_finished
+        from tendenci.apps.site_settings.context_processors import settings as settings_context
+        from tendenci.apps.site_settings.utils import _snapshot
+
+        requests = options['requests']
+        request = RequestFactory().get('/')
+
+        def run(cold):
+            start = time.perf_counter()
+            for i in range(requests):
+                request_started.send(sender=self.__class__)
+                if cold:
+                    _snapshot[0] = None
+                settings_context(request)
+                request_finished.send(sender=self.__class__)
+            return time.perf_counter() - start
+
+        # build the snapshot before timing the warm run
+        settings_context(request)
+        for name, cold in (('cold', True), ('warm', False)):
+            elapsed = run(cold)
+            self.stdout.write('%-6s %8.3fs total %10.1f us/request' % (
+                name, elapsed, elapsed * 1000000 / requests))
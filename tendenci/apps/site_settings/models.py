@@ -114,6 +114,18 @@ class Setting(models.Model):
             # delete and set cache for single key and save the value in the database
             delete_setting_cache(self.scope, self.scope_category, self.name)
             cache_setting(self.scope, self.scope_category, self.name, self)
+        else:
+            from tendenci.apps.site_settings.utils import bump_settings_version
+
+            # new settings and changes to anything but the value
+            # still have to reach the settings snapshots
+            bump_settings_version()
+
+    def delete(self, *args, **kwargs):
+        from tendenci.apps.site_settings.utils import bump_settings_version
+
+        super(Setting, self).delete(*args, **kwargs)
+        bump_settings_version()
 
     def update_site_domain(self, site_url):
         """
@@ -1,8 +1,14 @@
-from decimal import Decimal
+import time
+from decimal import Decimal, InvalidOperation
+from threading import local, Lock
+from types import MappingProxyType
 import django
 from django.core.cache import cache
+from django.core.signals import request_started, request_finished
 from django.conf import settings as d_settings
 
+from tendenci import __version__ as version
+
 from tendenci.apps.site_settings.models import Setting
 from tendenci.apps.site_settings.cache import SETTING_PRE_KEY
 
@@ -22,6 +28,7 @@ def get_setting_key(items=[]):
 def delete_all_settings_cache():
     key = get_setting_key(['all'])
     cache.delete(key)
+    bump_settings_version()
 
 
 def cache_setting(scope, scope_category, name, value):
@@ -55,6 +62,7 @@ def delete_setting_cache(scope, scope_category, name):
     """
     key = get_setting_key([scope, scope_category, name])
     cache.delete(key)
+    bump_settings_version()
 
 
 def delete_settings_cache(scope, scope_category):
@@ -70,6 +78,154 @@ def delete_settings_cache(scope, scope_category):
     for setting in settings:
         key = get_setting_key([setting.scope, setting.scope_category, setting.name])
         cache.delete(key)
+    bump_settings_version()
+
+
+def get_settings_version_key():
+    return get_setting_key(['version'])
+
+
+# used when the cache doesn't keep values (e.g. the dummy cache)
+_local_version = [1]
+
+
+def get_settings_version():
+    """
+    Returns the global settings version kept in the cache.
+    """
+    key = get_settings_version_key()
+    settings_version = cache.get(key)
+    if settings_version is None:
+        # start from the time rather than 1 so that a version evicted from
+        # the cache doesn't come back matching a stale snapshot
+        cache.add(key, int(time.time()), None)
+        settings_version = cache.get(key)
+    if settings_version is None:
+        settings_version = _local_version[0]
+    return settings_version
+
+
+def bump_settings_version():
+    """
+    Invalidates the settings snapshot of every process.
+    """
+    _local_version[0] += 1
+    _thread_locals.version = None
+    key = get_settings_version_key()
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the key is missing
+        cache.set(key, int(time.time()), None)
+
+
+class SettingsSnapshot(object):
+    """
+    Immutable, typed and decrypted copy of all the settings at
+    a given settings version.
+
+    values holds the setting values keyed by (scope, scope_category, name)
+    as returned by get_setting; context holds the template context built
+    by the settings context processor.
+    """
+    def __init__(self, settings_version, settings):
+        self.version = settings_version
+        values = {}
+        context = {}
+        contact_message_keys = []
+        for setting in settings:
+            value = setting.get_value() or ''
+            value = value.strip()
+
+            context_key = '_'.join([setting.scope, setting.scope_category, setting.name]).upper()
+            values[(setting.scope, setting.scope_category, setting.name)] = (
+                setting.data_type, self.typed_value(setting.data_type, value))
+            context[context_key] = self.typed_context_value(setting.data_type, value)
+            # Handle context for the social_media addon's
+            # contact_message setting
+            if setting.name == 'contact_message':
+                contact_message_keys.append(context_key)
+
+        context['TENDENCI_VERSION'] = version
+        context['USE_I18N'] = d_settings.USE_I18N
+        context['LOGIN_URL'] = d_settings.LOGIN_URL
+
+        self.values = MappingProxyType(values)
+        self.context = MappingProxyType(context)
+        self.contact_message_keys = tuple(contact_message_keys)
+
+    @staticmethod
+    def typed_value(data_type, value):
+        if data_type == 'boolean':
+            return value[:1].lower() == 't'
+        if data_type == 'decimal':
+            try:
+                return Decimal(value) if value else 0
+            except InvalidOperation:
+                return 0
+        if data_type == 'int':
+            try:
+                return int(value) if value else 0
+            except ValueError:
+                return 0
+        # file settings hold the pk of the file, looked up in get_setting
+        return value
+
+    @staticmethod
+    def typed_context_value(data_type, value):
+        if data_type == 'boolean':
+            return value[:1].lower() == 't'
+        if data_type == 'int':
+            try:
+                return int(value) if value else 0
+            except ValueError:
+                return 0
+        return value
+
+
+_snapshot = [None]
+_snapshot_lock = Lock()
+_thread_locals = local()
+
+
+def _start_request(**kwargs):
+    # check the settings version once per request
+    _thread_locals.in_request = True
+    _thread_locals.version = None
+
+
+def _finish_request(**kwargs):
+    _thread_locals.in_request = False
+    _thread_locals.version = None
+
+
+request_started.connect(_start_request, dispatch_uid='site_settings_start_request')
+request_finished.connect(_finish_request, dispatch_uid='site_settings_finish_request')
+
+
+def get_settings_snapshot():
+    """
+    Returns the SettingsSnapshot of the current settings version.
+
+    The snapshot is built once per process and settings version. Within
+    a request the version is only checked once; outside of requests
+    (e.g. in management commands) it is checked on every call.
+    """
+    in_request = getattr(_thread_locals, 'in_request', False)
+    settings_version = getattr(_thread_locals, 'version', None) if in_request else None
+    if settings_version is None:
+        settings_version = get_settings_version()
+        if in_request:
+            _thread_locals.version = settings_version
+
+    snapshot = _snapshot[0]
+    if snapshot is None or snapshot.version != settings_version:
+        with _snapshot_lock:
+            snapshot = _snapshot[0]
+            if snapshot is None or snapshot.version != settings_version:
+                snapshot = SettingsSnapshot(settings_version, Setting.objects.all())
+                _snapshot[0] = snapshot
+    return snapshot
 
 
 def get_setting(scope, scope_category, name):
@@ -79,57 +235,22 @@ def get_setting(scope, scope_category, name):
         Returns the value of the setting if it exists
         otherwise it returns an empty string
     """
-    key = get_setting_key([scope, scope_category, name])
+    if not django.apps.apps.models_ready:
+        return u''
 
-    if django.apps.apps.models_ready:
-        setting = cache.get(key)
-    else:
-        setting = None
+    try:
+        data_type, value = get_settings_snapshot().values[(scope, scope_category, name)]
+    except Exception:
+        # missing setting, or the settings table isn't there yet
+        return u''
 
-    if setting is None:
-        #setting is not in the cache
+    if data_type == 'file':
+        from tendenci.apps.files.models import File as TFile
         try:
-            #try to get the setting and cache it
-            filters = {
-                'scope': scope,
-                'scope_category': scope_category,
-                'name': name
-            }
-            setting = Setting.objects.get(**filters)
-            cache_setting(setting.scope, setting.scope_category, setting.name, setting)
-        except Exception:
-            setting = None
-
-    #check if the setting has been set and evaluate the value
-    if setting is not None:
-        try:
-            # test is get_value will work
-            value = setting.get_value().strip()
-        except AttributeError:
-            return u''
-        # convert data types
-        if setting.data_type == 'boolean':
-            value = value[0].lower() == 't'
-        if setting.data_type == 'decimal':
-            if value:
-                value = Decimal(value)
-            else:
-                value = 0
-        if setting.data_type == 'int':
-            if value.strip():
-                value = int(value.strip())
-            else:
-                value = 0  # default to 0
-        if setting.data_type == 'file':
-            from tendenci.apps.files.models import File as TFile
-            try:
-                tfile = TFile.objects.get(pk=value)
-            except TFile.DoesNotExist:
-                tfile = None
-            value = tfile
-        return value
-
-    return u''
+            value = TFile.objects.get(pk=value)
+        except (TFile.DoesNotExist, ValueError):
+            value = None
+    return value
 
 
 def get_global_setting(name):
@@ -141,28 +262,7 @@ def get_module_setting(scope_category, name):
 
 
 def check_setting(scope, scope_category, name):
-    #check cache first
-    key = get_setting_key([scope, scope_category, name])
-    setting = cache.get(key)
-    if setting is not None:
-        return True
-
-    missing_key = get_setting_key([scope, scope_category, name, "missing"])
-
-    missing = cache.get(missing_key)
-    if missing is None:
-        #check the db if it is not in the cache
-        exists = Setting.objects.filter(scope=scope,
-            scope_category=scope_category, name=name).exists()
-
-        #cache that it does not exist
-        if not exists:
-            #set to True to signify that it is missing so we do not
-            #come back into this if statement and query db again
-            cache.set(missing_key, True)
-
-        return exists
-    return False
+    return (scope, scope_category, name) in get_settings_snapshot().values
 
 
 def get_form_list(user):
@@ -1,4 +1,4 @@
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import gettext_noop as _
 from tendenci.apps.notifications import models as notification
 
@@ -25,3 +25,13 @@ def init_signals():
             auth_group.delete()
 
     post_delete.connect(delete_auth_group, sender=Group, weak=False)
+
+    from tendenci.apps.user_groups.models import GroupMembership
+    from tendenci.apps.perms.utils import delete_visibility_cache
+
+    def reset_visibility(sender, **kwargs):
+        # the groups a user belongs to are cached for get_query_filters
+        delete_visibility_cache(kwargs['instance'].member_id)
+
+    post_save.connect(reset_visibility, sender=GroupMembership, weak=False)
+    post_delete.connect(reset_visibility, sender=GroupMembership, weak=False)
@@ -80,6 +80,7 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'tendenci.apps.event_logs.middleware.EventLogMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.common.CommonMiddleware',
     'dj_pagination.middleware.PaginationMiddleware',
@@ -349,6 +350,14 @@ except ImportError:
 # The number of days that Event Log entries should be kept for.  Set to 0 to keep all log entries indefinitely.
 KEEP_EVENT_LOG_FOR_DAYS = 0
 
+# Event logs are buffered in-process and written with bulk_create at the end
+# of each request, when the buffer holds EVENT_LOG_BUFFER_SIZE rows, or after
+# EVENT_LOG_FLUSH_INTERVAL seconds. Set EVENT_LOG_DEFER_WRITES to False to
+# write each event log as it is logged.
+EVENT_LOG_DEFER_WRITES = True
+EVENT_LOG_BUFFER_SIZE = 100
+EVENT_LOG_FLUSH_INTERVAL = 5
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -567,10 +576,43 @@ ALLOW_MP3_UPLOAD = False
 
 # Photos App
 PHOTOS_MAXBLOCK = 2 ** 20  # prevents 'IOError: encoder error -2'
+# Seconds a batch upload waits before starting another render queue worker,
+# in case the running one died without releasing its lock.
+PHOTOS_RENDER_WORKER_TIMEOUT = 60*60
+
+# Seconds after which a queued photo claimed by a render worker is claimed
+# again, in case that worker died before rendering it.
+PHOTOS_RENDER_CLAIM_TIMEOUT = 60*10
+
+# Resized images of photos and files (see files/derivatives.py)
+# Number of worker processes rendering them, 0 renders them in the request.
+IMAGE_DERIVATIVE_WORKERS = 2
+# Seconds a request waits for another process rendering the same image.
+IMAGE_DERIVATIVE_LOCK_TIMEOUT = 60
+# Seconds the presence of a rendered image is cached.
+IMAGE_DERIVATIVE_CACHE_TIMEOUT = 60*60*24*30
 
 # Events
 # Turn on/off the Gratuity feature - per Ed, allow it to be adjusted in conf/settings.py rather than site settings
 EVENTS_GRATUITY_ENABLED = False
+# Seconds the events of the month, week and day views are cached
+# (saving an event clears them).
+EVENTS_CALENDAR_CACHE_TIMEOUT = 60*5
+# Seconds the VEVENT of an event is cached for the ics feeds (the cached
+# VEVENT is replaced when the event is updated).
+EVENTS_ICS_CACHE_TIMEOUT = 60*60*24
+# Number of registrants per page of the registrant roster.
+EVENTS_ROSTER_PER_PAGE = 500
+
+# Locations
+# Number of locations listed by the nearest locations search.
+LOCATIONS_NEAREST_LIMIT = 100
+
+# Imports
+# Number of rows of a user import looked up and saved at once.
+IMPORTS_USER_CHUNK_SIZE = 500
+# Number of rows of a membership import looked up and saved at once.
+MEMBERSHIPS_IMPORT_CHUNK_SIZE = 500
 
 # EMail Settings for Newsletters
 NEWSLETTER_EMAIL_HOST = None
@@ -582,6 +624,14 @@ NEWSLETTER_EMAIL_BACKEND = 'tendenci.apps.emails.backends.NewsletterEmailBackend
 
 NEWSLETTER_SCHEDULE_ENABLED = False
 
+# Number of threads that deliver a newsletter, each one holding its
+# own connection to the newsletter email provider.
+NEWSLETTER_SEND_WORKERS = 4
+# Maximum number of newsletter emails sent per second (0 for no limit).
+NEWSLETTER_SEND_RATE = 0
+# Number of recipients prepared and recorded as sent at a time.
+NEWSLETTER_SEND_BATCH_SIZE = 200
+
 # If True, it allows members to send emails to corporate membership reps
 # (default to False).
 # Why here not in site settings? Because we don't want this feature to be 